@@ -0,0 +1,95 @@
+import logging
+import os
+import shutil
+import threading
+
+from collections import OrderedDict
+
+from typing import List
+
+from .grader_service import NB_GID
+from .grader_service import NB_UID
+from .grader_service import grader_course_dir
+from .metrics import ASSIGNMENT_DIRS
+
+
+logger = logging.getLogger(__name__)
+
+# assignment source directories remembered as existing by each worker, the least recently used are forgotten
+ASSIGNMENT_DIR_CACHE_SIZE = int(os.environ.get('GRADER_SETUP_ASSIGNMENT_DIR_CACHE_SIZE') or '10000')
+
+
+def validate_assignment_name(assignment_name: str):
+    """
+    Raises ValueError if the assignment name is not a single directory name
+    """
+    if not assignment_name or assignment_name in ('.', '..') or '/' in assignment_name or '\0' in assignment_name:
+        raise ValueError(f'Invalid assignment name: {assignment_name!r}')
+
+
+class AssignmentDirectories:
+    """
+    Creates the assignment source directories (<course_dir>/source/<assignment_name>) owned by the grader user.
+    Every LTI launch of an assignment asks for its directory, so the directories known to exist are kept in
+    a presence cache and skipped without touching the shared volume. The directories are created without
+    the kubernetes client, the grader's course directory path only depends on the org and course names.
+    """
+
+    def __init__(self, max_size: int = None):
+        self.max_size = max_size or ASSIGNMENT_DIR_CACHE_SIZE
+        self._present = OrderedDict()
+        self._lock = threading.Lock()
+
+    def ensure(self, org_name: str, course_id: str, assignment_names: List[str]) -> List[str]:
+        """
+        Creates the missing assignment source directories of a course
+
+        Args:
+            org_name: the organization name
+            course_id: the normalized course name
+            assignment_names: the normalized assignment names
+
+        Returns:
+            The names of the assignments whose directory was created
+
+        Raises:
+            ValueError: an assignment name is not a single directory name, no directory is created
+        """
+        for assignment_name in assignment_names:
+            validate_assignment_name(assignment_name)
+        source_dir = grader_course_dir(org_name, course_id).joinpath('source')
+        created = []
+        for assignment_name in dict.fromkeys(assignment_names):
+            assignment_dir = source_dir.joinpath(assignment_name)
+            key = str(assignment_dir)
+            if self._cached(key):
+                ASSIGNMENT_DIRS.labels(result='cached').inc()
+                continue
+            if assignment_dir.is_dir():
+                ASSIGNMENT_DIRS.labels(result='existing').inc()
+            else:
+                logger.info(f'Creating source dir {assignment_dir} for the assignment {assignment_name}')
+                assignment_dir.mkdir(parents=True, exist_ok=True)
+                shutil.chown(str(source_dir), user=NB_UID, group=NB_GID)
+                shutil.chown(key, user=NB_UID, group=NB_GID)
+                created.append(assignment_name)
+                ASSIGNMENT_DIRS.labels(result='created').inc()
+            self._remember(key)
+        return created
+
+    def _cached(self, key: str) -> bool:
+        with self._lock:
+            if key not in self._present:
+                return False
+            self._present.move_to_end(key)
+            return True
+
+    def _remember(self, key: str):
+        with self._lock:
+            self._present[key] = True
+            self._present.move_to_end(key)
+            while len(self._present) > self.max_size:
+                self._present.popitem(last=False)
+
+
+assignment_directories = AssignmentDirectories()
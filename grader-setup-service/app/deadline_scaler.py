@@ -0,0 +1,274 @@
+"""
+Raises the resources of the graders ahead of their assignments' due dates, the autograding load spikes right
+after a deadline, and returns them to the baseline (GRADER_RESOURCES) once the deadline window is over. The
+due dates are read from the nbgrader gradebook of each course.
+
+Usage (the deadline-scaler container of the grader-setup-service pod runs it every GRADER_DEADLINE_INTERVAL):
+```
+python -m app.deadline_scaler <org_name> --dry-run
+python -m app.deadline_scaler <org_name> --interval 300
+```
+"""
+import argparse
+import logging
+import os
+import time
+
+from datetime import datetime
+from datetime import timedelta
+
+from typing import Dict
+from typing import List
+from typing import Optional
+
+from kubernetes import client
+from kubernetes.client.rest import ApiException
+from kubernetes.utils import parse_quantity
+
+from sqlalchemy import DateTime
+from sqlalchemy import column
+from sqlalchemy import create_engine
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.pool import NullPool
+
+from .grader_service import GRADER_RESOURCES
+from .grader_service import GraderServiceLauncher
+from .grader_service import K8S_REQUEST_TIMEOUT
+from .grader_service import NAMESPACE
+from .grader_service import kubernetes_request
+from .metrics import GRADER_DEADLINE_SCALING
+from .models import db
+from .models import GraderService
+from .models import PackedCourse
+
+
+logger = logging.getLogger(__name__)
+
+# seconds before a due date the grader resources are raised, so the grader is restarted before the submissions
+DEADLINE_LEAD = float(os.environ.get('GRADER_DEADLINE_LEAD') or '1800')
+# seconds after a due date the grader keeps the raised resources, while the late submissions are autograded
+DEADLINE_WINDOW = float(os.environ.get('GRADER_DEADLINE_WINDOW') or '7200')
+# seconds between the runs of the scaler with --interval
+DEADLINE_INTERVAL = float(os.environ.get('GRADER_DEADLINE_INTERVAL') or '300')
+# resources of the graders within a deadline window
+DEADLINE_RESOURCES = {
+    'requests': {
+        'cpu': os.environ.get('GRADER_DEADLINE_CPU_REQUEST') or '500m',
+        'memory': os.environ.get('GRADER_DEADLINE_MEMORY_REQUEST') or '500Mi',
+    },
+    'limits': {
+        'cpu': os.environ.get('GRADER_DEADLINE_CPU_LIMIT') or '2',
+        'memory': os.environ.get('GRADER_DEADLINE_MEMORY_LIMIT') or '2Gi',
+    },
+}
+# seconds to connect to a course's gradebook
+GRADEBOOK_CONNECT_TIMEOUT = 5
+
+# annotation with the end of the deadline window of a boosted grader
+BOOSTED_UNTIL_ANNOTATION = 'illumidesk.com/deadline-boosted-until'
+# annotation of the graders scaled from zero replicas for a deadline, scaled back to zero after it
+PRESTARTED_ANNOTATION = 'illumidesk.com/deadline-prestarted'
+
+RESULT_BOOSTED = 'boosted'
+RESULT_RESTORED = 'restored'
+RESULT_UNCHANGED = 'unchanged'
+RESULT_SKIPPED = 'skipped'
+RESULT_FAILED = 'failed'
+
+
+def canonical_resources(resources: Dict[str, Dict[str, str]]) -> Dict[str, Dict[str, object]]:
+    """
+    Returns the resources with their quantities parsed, so that equal quantities written differently (e.g. 2 and
+    2000m CPUs, or 1Gi and 1024Mi, as the API server may return them) compare equal. The invalid quantities are
+    kept as written.
+
+    Args:
+        resources: the requests and limits of a container
+
+    Returns:
+        The requests and limits with the parsed quantities
+    """
+    canonical = {}
+    for kind, quantities in resources.items():
+        canonical[kind] = {}
+        for name, quantity in (quantities or {}).items():
+            try:
+                canonical[kind][name] = parse_quantity(quantity)
+            except ValueError:
+                canonical[kind][name] = quantity
+    return canonical
+
+
+class DeadlineScaler:
+    """
+    Sets the resources of every dedicated grader from its course's due dates: the graders with a due date
+    between now - `window` and now + `lead` get DEADLINE_RESOURCES (and are scaled to one replica if they were
+    scaled to zero), the others GRADER_RESOURCES. Only the graders whose live resources differ are patched, so
+    a grader reset by a fleet rollout within its window is boosted again by the next run.
+
+    The packed courses are skipped, changing a container of a grader pool restarts all the courses of the pool.
+
+    Args:
+        org_name: the organization name used to create the graders
+        lead: seconds before a due date the resources are raised
+        window: seconds after a due date the resources are kept raised
+    """
+
+    def __init__(self, org_name: str, lead: float = None, window: float = None):
+        self.org_name = org_name
+        self.lead = timedelta(seconds=DEADLINE_LEAD if lead is None else lead)
+        self.window = timedelta(seconds=DEADLINE_WINDOW if window is None else window)
+        self.apps_v1 = None
+
+    def deadline_window_end(self, launcher: GraderServiceLauncher, now: datetime) -> Optional[datetime]:
+        """
+        Returns the end of the deadline window the course is in, None if no due date is close
+
+        Args:
+            launcher: the course's launcher, with the gradebook url
+            now: the current utc time, nbgrader saves the due dates in utc
+        """
+        engine = create_engine(
+            launcher.gradebook_url, poolclass=NullPool, connect_args={'connect_timeout': GRADEBOOK_CONNECT_TIMEOUT}
+        )
+        try:
+            with engine.connect() as connection:
+                query = text(
+                    'SELECT max(duedate) AS duedate FROM assignment WHERE duedate BETWEEN :start AND :end'
+                ).columns(column('duedate', DateTime))
+                duedate = connection.execute(query, {'start': now - self.window, 'end': now + self.lead}).scalar()
+        except SQLAlchemyError as e:
+            # the gradebook is created by nbgrader when the course's first assignment is created
+            logger.debug(f'Unable to read the due dates of {launcher.course_id}: {e}')
+            return None
+        finally:
+            engine.dispose()
+        return duedate + self.window if duedate else None
+
+    def reconcile(self, dry_run: bool = False) -> Dict[str, List[str]]:
+        """
+        Boosts the graders entering a deadline window and restores the ones leaving it
+
+        Args:
+            dry_run: only returns the graders to boost and to restore
+
+        Returns:
+            The grader names by result
+        """
+        now = datetime.utcnow()
+        result = {RESULT_BOOSTED: [], RESULT_RESTORED: [], RESULT_UNCHANGED: [], RESULT_SKIPPED: [], RESULT_FAILED: []}
+        packed_courses = {packed.course_id for packed in PackedCourse.query.all()}
+        live = None
+        for service in GraderService.query.all():
+            launcher = GraderServiceLauncher(org_name=self.org_name, course_id=service.course_id)
+            if service.course_id in packed_courses:
+                result[RESULT_SKIPPED].append(launcher.grader_name)
+                continue
+            if live is None:
+                self.apps_v1 = launcher.apps_v1
+                live = self._live_deployments()
+            deployment = live.get(launcher.grader_name)
+            if deployment is None:
+                result[RESULT_SKIPPED].append(launcher.grader_name)
+                continue
+            window_end = self.deadline_window_end(launcher, now)
+            patch = self._patch(deployment, window_end)
+            if patch is None:
+                result[RESULT_UNCHANGED].append(launcher.grader_name)
+                continue
+            name = RESULT_BOOSTED if window_end else RESULT_RESTORED
+            if not dry_run:
+                try:
+                    with kubernetes_request('patch_namespaced_deployment'):
+                        self.apps_v1.patch_namespaced_deployment(
+                            name=launcher.grader_name,
+                            namespace=NAMESPACE,
+                            body=patch,
+                            _request_timeout=K8S_REQUEST_TIMEOUT,
+                        )
+                    logger.info(f'Grader {launcher.grader_name} {name}, deadline window until: {window_end}')
+                except ApiException as e:
+                    logger.error(f'Unable to scale {launcher.grader_name}: {e}')
+                    name = RESULT_FAILED
+                GRADER_DEADLINE_SCALING.labels(result=name).inc()
+            result[name].append(launcher.grader_name)
+        return result
+
+    def run_forever(self, interval: float = None):
+        """
+        Reconciles the graders every `interval` seconds
+        """
+        interval = interval or DEADLINE_INTERVAL
+        while True:
+            started = time.monotonic()
+            try:
+                result = self.reconcile()
+                logger.info(f'Deadline scaling: { {name: len(graders) for name, graders in result.items()} }')
+            except Exception as e:
+                logger.error(f'The deadline scaling failed: {e}')
+            finally:
+                # the next run reads the graders registered since this one
+                db.session.remove()
+            time.sleep(max(0, interval - (time.monotonic() - started)))
+
+    def _live_deployments(self) -> Dict[str, client.V1Deployment]:
+        with kubernetes_request('list_namespaced_deployment'):
+            deployments = self.apps_v1.list_namespaced_deployment(
+                namespace=NAMESPACE, _request_timeout=K8S_REQUEST_TIMEOUT
+            )
+        return {deployment.metadata.name: deployment for deployment in deployments.items}
+
+    def _patch(self, deployment: client.V1Deployment, window_end: Optional[datetime]) -> Optional[dict]:
+        """
+        Returns the strategic merge patch that sets the grader resources, replicas and annotations for the
+        deadline window, None if the deployment is up to date
+        """
+        containers = deployment.spec.template.spec.containers
+        container = next((container for container in containers if container.name == 'grader-notebook'), None)
+        if container is None:
+            return None
+        live_annotations = deployment.metadata.annotations or {}
+        annotations = {BOOSTED_UNTIL_ANNOTATION: window_end.isoformat() if window_end else None}
+        spec = {}
+        if window_end and not deployment.spec.replicas:
+            spec['replicas'] = 1
+            annotations[PRESTARTED_ANNOTATION] = 'true'
+        elif not window_end and live_annotations.get(PRESTARTED_ANNOTATION):
+            spec['replicas'] = 0
+            annotations[PRESTARTED_ANNOTATION] = None
+        resources = DEADLINE_RESOURCES if window_end else GRADER_RESOURCES
+        live_resources = {
+            'requests': (container.resources and container.resources.requests) or {},
+            'limits': (container.resources and container.resources.limits) or {},
+        }
+        if canonical_resources(live_resources) != canonical_resources(resources):
+            # the resources change restarts the grader, the annotations and replicas don't
+            spec['template'] = {'spec': {'containers': [{'name': container.name, 'resources': resources}]}}
+        annotations = {name: value for name, value in annotations.items() if live_annotations.get(name) != value}
+        if not spec and not annotations:
+            return None
+        return {'metadata': {'annotations': annotations}, 'spec': spec}
+
+
+def main():
+    from . import create_app
+
+    parser = argparse.ArgumentParser(description='Raises the grader resources around the assignments due dates')
+    parser.add_argument('org_name', help='the organization name used to create the graders')
+    parser.add_argument('--dry-run', action='store_true', help='only print the graders to boost and to restore')
+    parser.add_argument('--interval', type=float, default=None, help='run every interval seconds')
+    args = parser.parse_args()
+    create_app()
+    scaler = DeadlineScaler(args.org_name)
+    if args.interval:
+        scaler.run_forever(args.interval)
+    result = scaler.reconcile(dry_run=args.dry_run)
+    for name, graders in result.items():
+        print(f'{name}: {len(graders)}')
+        for grader_name in graders:
+            print(f'  {grader_name}')
+
+
+if __name__ == '__main__':
+    main()
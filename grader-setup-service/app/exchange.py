@@ -0,0 +1,178 @@
+"""
+Listing index of the courses' nbgrader exchange. Listing the released assignments, the submissions or the
+feedback of a course walks its exchange directories on the shared volume, with hundreds of entries in the
+inbound directory after a deadline. The index keeps these entries in a json file per course, rebuilt only for
+the exchange directories whose mtime changed (an entry was added or removed) since it was written.
+
+Usage (within the grader-setup-service pod, to rebuild the indexes):
+```
+python -m app.exchange <org_name> <course_id> <course_id> ...
+python -m app.exchange <org_name> --registered
+```
+"""
+import argparse
+import json
+import logging
+import os
+import threading
+
+from datetime import datetime
+
+from pathlib import Path
+
+from typing import Dict
+from typing import List
+from typing import Optional
+
+from .grader_service import EXCHANGE_MNT_ROOT
+from .provisioning import PathSpec
+from .provisioning import TreeProvisioner
+
+
+logger = logging.getLogger(__name__)
+
+# the index kinds and the nbgrader exchange directories they list
+EXCHANGE_DIRECTORIES = {
+    'released': 'outbound',
+    'submitted': 'inbound',
+    'feedback': 'feedback',
+}
+
+INDEX_VERSION = 1
+
+
+def exchange_index_path(org_name: str, course_id: str) -> Path:
+    """
+    Returns the path of the course's index, out of the exchange so the nbgrader operations don't list it
+    """
+    return Path(EXCHANGE_MNT_ROOT, org_name, 'exchange-index', f'{course_id}.json')
+
+
+def parse_entry(kind: str, entry: os.DirEntry) -> Dict[str, str]:
+    """
+    Returns the index entry of an exchange directory entry, the submissions are named
+    <student_id>+<assignment_id>+<timestamp>[+<random>] by nbgrader
+    """
+    item = {'name': entry.name, 'modified': datetime.utcfromtimestamp(entry.stat().st_mtime).isoformat()}
+    if kind == 'released':
+        item['assignment_id'] = entry.name
+    elif kind == 'submitted':
+        parts = entry.name.split('+')
+        if len(parts) >= 3:
+            item.update(student_id=parts[0], assignment_id=parts[1], timestamp=parts[2])
+    return item
+
+
+class ExchangeIndex:
+    """
+    The listing index of a course's exchange
+
+    Args:
+        org_name: the organization name
+        course_id: the normalized course name
+    """
+
+    # the refreshes of the same index are serialized within a worker
+    _locks: Dict[str, threading.Lock] = {}
+    _locks_lock = threading.Lock()
+
+    def __init__(self, org_name: str, course_id: str):
+        self.org_name = org_name
+        self.course_id = course_id
+        self.course_exchange_dir = Path(EXCHANGE_MNT_ROOT, org_name, 'exchange', course_id)
+        self.index_path = exchange_index_path(org_name, course_id)
+
+    def read(self, kind: str = None) -> Dict:
+        """
+        Returns the index, refreshed for the exchange directories that changed
+
+        Args:
+            kind: only returns the entries of a kind (released, submitted or feedback)
+
+        Raises:
+            ValueError: the kind is unknown
+        """
+        if kind is not None and kind not in EXCHANGE_DIRECTORIES:
+            raise ValueError(f'Unknown exchange index kind: {kind}')
+        index = self.refresh()
+        if kind is not None:
+            index['entries'] = {kind: index['entries'][kind]}
+        return index
+
+    def refresh(self, force: bool = False) -> Dict:
+        """
+        Lists again the exchange directories whose mtime differs from the one saved in the index, and saves
+        the index if one of them changed
+
+        Args:
+            force: lists all the exchange directories
+        """
+        with self._lock():
+            saved = None if force else self._load()
+            index = {
+                'version': INDEX_VERSION,
+                'course_id': self.course_id,
+                'mtimes': {},
+                'entries': {},
+            }
+            changed = saved is None
+            for kind, directory in EXCHANGE_DIRECTORIES.items():
+                mtime = self._mtime(self.course_exchange_dir.joinpath(directory))
+                index['mtimes'][kind] = mtime
+                if saved is not None and saved['mtimes'].get(kind) == mtime:
+                    index['entries'][kind] = saved['entries'][kind]
+                    continue
+                index['entries'][kind] = self._list(kind, self.course_exchange_dir.joinpath(directory))
+                changed = True
+            if changed:
+                TreeProvisioner(max_workers=1).apply([PathSpec(self.index_path, content=json.dumps(index))])
+            return index
+
+    def _lock(self) -> threading.Lock:
+        key = str(self.index_path)
+        with self._locks_lock:
+            return self._locks.setdefault(key, threading.Lock())
+
+    def _load(self) -> Optional[Dict]:
+        try:
+            index = json.loads(self.index_path.read_text())
+        except (FileNotFoundError, ValueError):
+            return None
+        return index if index.get('version') == INDEX_VERSION else None
+
+    def _mtime(self, path: Path) -> Optional[int]:
+        try:
+            return os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def _list(self, kind: str, path: Path) -> List[Dict[str, str]]:
+        try:
+            with os.scandir(path) as entries:
+                items = [parse_entry(kind, entry) for entry in entries if not entry.name.startswith('.')]
+        except FileNotFoundError:
+            return []
+        return sorted(items, key=lambda item: item['name'])
+
+
+def main():
+    from . import create_app
+    from .models import GraderService
+
+    parser = argparse.ArgumentParser(description='Rebuilds the exchange listing index of courses')
+    parser.add_argument('org_name', help='the organization name used to create the graders')
+    parser.add_argument('course_ids', nargs='*', help='the courses to index')
+    parser.add_argument('--registered', action='store_true', help='index all the registered courses')
+    args = parser.parse_args()
+    course_ids: List[str] = list(args.course_ids)
+    if args.registered:
+        create_app()
+        course_ids.extend(service.course_id for service in GraderService.query.all())
+    for course_id in dict.fromkeys(course_ids):
+        index = ExchangeIndex(args.org_name, course_id).refresh(force=True)
+        counts = {kind: len(entries) for kind, entries in index['entries'].items()}
+        print(f'{course_id}: {counts}')
+
+
+if __name__ == '__main__':
+    main()
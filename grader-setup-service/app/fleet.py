@@ -0,0 +1,297 @@
+"""
+Rolls out the current grader deployment spec (GRADER_IMAGE_NAME, resources, env vars, volumes) to the graders
+created with an older one.
+
+Usage (within the grader-setup-service pod):
+```
+python -m app.fleet <org_name> --dry-run
+python -m app.fleet <org_name> --parallelism 20 --pause 10
+```
+"""
+import argparse
+import logging
+import os
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Union
+
+from kubernetes import client
+
+from .grader_service import GraderServiceLauncher
+from .grader_service import K8S_REQUEST_TIMEOUT
+from .grader_service import NAMESPACE
+from .grader_service import SPEC_HASH_ANNOTATION
+from .grader_service import deployment_is_available
+from .grader_service import kubernetes_request
+from .metrics import GRADER_FLEET_ROLLOUTS
+from .metrics import track_provisioning
+from .models import GraderService
+from .models import PackedCourse
+from .packing import GraderPacker
+
+
+logger = logging.getLogger(__name__)
+
+# graders rolled out at the same time, the next batch starts when the whole batch is healthy
+FLEET_PARALLELISM = int(os.environ.get('GRADER_FLEET_PARALLELISM') or '10')
+# seconds to wait between the batches
+FLEET_PAUSE = float(os.environ.get('GRADER_FLEET_PAUSE') or '0')
+# seconds a rolled out grader has to become available before it's counted as failed
+FLEET_HEALTH_TIMEOUT = float(os.environ.get('GRADER_FLEET_HEALTH_TIMEOUT') or '300')
+# failed graders that halt the rollout, the remaining batches are not rolled out
+FLEET_MAX_FAILURES = int(os.environ.get('GRADER_FLEET_MAX_FAILURES') or '3')
+# pods (or percentage of the replicas, e.g. 25%) a rolled out grader can run above and below its replicas while
+# it's replaced, the deployment's rolling update defaults are kept when they are not set
+FLEET_MAX_SURGE = os.environ.get('GRADER_FLEET_MAX_SURGE')
+FLEET_MAX_UNAVAILABLE = os.environ.get('GRADER_FLEET_MAX_UNAVAILABLE')
+# seconds between the checks of the rolled out graders' status
+FLEET_HEALTH_INTERVAL = 2
+
+RESULT_UPDATED = 'updated'
+RESULT_UNCHANGED = 'unchanged'
+RESULT_MISSING = 'missing'
+RESULT_FAILED = 'failed'
+RESULT_SKIPPED = 'skipped'
+
+
+def parse_rollout_quantity(value: Optional[str]) -> Optional[Union[int, str]]:
+    """
+    Returns the number of pods or the percentage (e.g. 25%) of a rolling update's maxSurge or maxUnavailable
+
+    Raises:
+        ValueError: the value is not a number of pods or a percentage
+    """
+    if value is None or value == '':
+        return None
+    if value.endswith('%') and value[:-1].isdigit():
+        return value
+    if value.isdigit():
+        return int(value)
+    raise ValueError(f'Invalid number of pods or percentage: {value!r}')
+
+
+class FleetReconciler:
+    """
+    Computes the desired deployment of every registered grader and rolls it out to the graders whose live
+    deployment was created with a different spec. The live deployments are compared by the hash of their
+    spec (SPEC_HASH_ANNOTATION), the graders created before the annotation was added are rolled out once.
+
+    The graders are rolled out in batches of `parallelism` deployments. Each batch is gated on the health of
+    its graders: the next batch starts when all the graders of the batch are available (or timed out) and
+    after `pause` seconds. The rollout halts when `max_failures` graders failed. With `max_surge` and
+    `max_unavailable` the rolled out deployments are replaced with these rolling update settings, e.g. a surge
+    of 1 and no unavailable pod start the new grader before the old one is stopped.
+
+    Args:
+        org_name: the organization name used to create the graders
+        parallelism: graders rolled out at the same time
+        pause: seconds to wait between the batches
+        health_timeout: seconds a grader has to become available
+        max_failures: failed graders that halt the rollout
+        max_surge: pods (or percentage) started above the replicas while a grader is replaced
+        max_unavailable: pods (or percentage) of the replicas that can be unavailable while a grader is replaced
+    """
+
+    def __init__(
+        self,
+        org_name: str,
+        parallelism: int = None,
+        pause: float = None,
+        health_timeout: float = None,
+        max_failures: int = None,
+        max_surge: str = None,
+        max_unavailable: str = None,
+    ):
+        self.org_name = org_name
+        self.parallelism = max(1, parallelism or FLEET_PARALLELISM)
+        self.pause = FLEET_PAUSE if pause is None else pause
+        self.health_timeout = health_timeout or FLEET_HEALTH_TIMEOUT
+        self.max_failures = max_failures or FLEET_MAX_FAILURES
+        self.max_surge = parse_rollout_quantity(FLEET_MAX_SURGE if max_surge is None else max_surge)
+        self.max_unavailable = parse_rollout_quantity(
+            FLEET_MAX_UNAVAILABLE if max_unavailable is None else max_unavailable
+        )
+        if self.max_surge in (0, '0%') and self.max_unavailable in (0, '0%'):
+            raise ValueError('The max surge and the max unavailable pods can not be both zero')
+        self.apps_v1 = None
+
+    def plan(self) -> Dict[str, List[str]]:
+        """
+        Returns the registered graders by result: the graders to roll out (updated), the graders with the
+        current spec (unchanged) and the graders without a live deployment (missing)
+        """
+        return self._plan(self._desired_deployments(), self._live_deployments())
+
+    def rollout(self, dry_run: bool = False) -> Dict[str, List[str]]:
+        """
+        Rolls out the changed graders
+
+        Args:
+            dry_run: only returns the plan
+
+        Returns:
+            The graders by result, the graders that failed or that were skipped after the rollout halted
+            are moved from updated to failed and skipped
+        """
+        desired = self._desired_deployments()
+        live = self._live_deployments()
+        plan = self._plan(desired, live)
+        if dry_run:
+            return plan
+        to_update = plan[RESULT_UPDATED]
+        plan.update({RESULT_UPDATED: [], RESULT_FAILED: [], RESULT_SKIPPED: []})
+        logger.info(f'Rolling out {len(to_update)} graders in batches of {self.parallelism}')
+        with ThreadPoolExecutor(max_workers=self.parallelism) as executor:
+            for start in range(0, len(to_update), self.parallelism):
+                if len(plan[RESULT_FAILED]) >= self.max_failures:
+                    plan[RESULT_SKIPPED].extend(to_update[start:])
+                    logger.error(f'Rollout halted after {len(plan[RESULT_FAILED])} failed graders')
+                    break
+                if start and self.pause:
+                    time.sleep(self.pause)
+                batch = to_update[start:start + self.parallelism]
+                results = executor.map(lambda name: self._rollout_grader(desired[name], live[name]), batch)
+                for name, healthy in zip(batch, results):
+                    plan[RESULT_UPDATED if healthy else RESULT_FAILED].append(name)
+        for result in (RESULT_UPDATED, RESULT_FAILED, RESULT_SKIPPED):
+            GRADER_FLEET_ROLLOUTS.labels(result=result).inc(len(plan[result]))
+        logger.info(f'Rollout finished: { {result: len(names) for result, names in plan.items()} }')
+        return plan
+
+    def _plan(
+        self, desired: Dict[str, client.V1Deployment], live: Dict[str, client.V1Deployment]
+    ) -> Dict[str, List[str]]:
+        plan = {RESULT_UPDATED: [], RESULT_UNCHANGED: [], RESULT_MISSING: []}
+        for name, deployment in desired.items():
+            if name not in live:
+                plan[RESULT_MISSING].append(name)
+            elif self._hash(live[name]) != self._hash(deployment):
+                plan[RESULT_UPDATED].append(name)
+            else:
+                plan[RESULT_UNCHANGED].append(name)
+        return plan
+
+    def _hash(self, deployment: client.V1Deployment) -> Optional[str]:
+        return (deployment.metadata.annotations or {}).get(SPEC_HASH_ANNOTATION)
+
+    def _desired_deployments(self) -> Dict[str, client.V1Deployment]:
+        # the packed courses are rolled out with their grader pool
+        packed_courses = {packed.course_id for packed in PackedCourse.query.all()}
+        desired = {}
+        for service in GraderService.query.all():
+            if service.course_id in packed_courses:
+                continue
+            launcher = GraderServiceLauncher(org_name=self.org_name, course_id=service.course_id)
+            # the grader keeps the token registered in the hub
+            launcher.grader_token = service.api_token
+            desired[launcher.grader_name] = launcher._create_deployment_object()
+            self.apps_v1 = launcher.apps_v1
+        if packed_courses:
+            packer = GraderPacker(self.org_name)
+            desired.update(packer.desired_pool_deployments())
+            self.apps_v1 = packer.apps_v1
+        return desired
+
+    def _live_deployments(self) -> Dict[str, client.V1Deployment]:
+        if self.apps_v1 is None:
+            return {}
+        with kubernetes_request('list_namespaced_deployment'):
+            deployments = self.apps_v1.list_namespaced_deployment(
+                namespace=NAMESPACE, _request_timeout=K8S_REQUEST_TIMEOUT
+            )
+        return {deployment.metadata.name: deployment for deployment in deployments.items}
+
+    def _rollout_grader(self, desired: client.V1Deployment, live: client.V1Deployment) -> bool:
+        """
+        Replaces the grader deployment with the desired one and waits until it's available
+
+        Returns:
+            False if the deployment couldn't be replaced or it wasn't available within the health timeout
+        """
+        name = desired.metadata.name
+        # the live annotations (the deployment revision) are kept and the replacement fails if the deployment
+        # changed since it was listed
+        desired.metadata.annotations = dict(live.metadata.annotations or {}, **desired.metadata.annotations)
+        desired.metadata.resource_version = live.metadata.resource_version
+        self._set_rolling_update(desired)
+        try:
+            with track_provisioning('rollout_grader'):
+                with kubernetes_request('replace_namespaced_deployment'):
+                    self.apps_v1.replace_namespaced_deployment(
+                        name=name, namespace=NAMESPACE, body=desired, _request_timeout=K8S_REQUEST_TIMEOUT
+                    )
+                return self._wait_until_available(name)
+        except Exception as e:
+            logger.error(f'Unable to roll out {name}: {e}')
+            return False
+
+    def _set_rolling_update(self, deployment: client.V1Deployment):
+        """
+        Sets the surge settings on the rolling update strategy of the deployment
+        """
+        if self.max_surge is None and self.max_unavailable is None:
+            return
+        strategy = deployment.spec.strategy
+        if strategy is not None and strategy.type == 'Recreate':
+            return
+        deployment.spec.strategy = client.V1DeploymentStrategy(
+            type='RollingUpdate',
+            rolling_update=client.V1RollingUpdateDeployment(
+                max_surge=self.max_surge, max_unavailable=self.max_unavailable
+            ),
+        )
+
+    def _wait_until_available(self, name: str) -> bool:
+        deadline = time.monotonic() + self.health_timeout
+        while True:
+            with kubernetes_request('read_namespaced_deployment'):
+                deployment = self.apps_v1.read_namespaced_deployment(
+                    name=name, namespace=NAMESPACE, _request_timeout=K8S_REQUEST_TIMEOUT
+                )
+            if deployment_is_available(deployment):
+                logger.info(f'Grader {name} rolled out')
+                return True
+            if time.monotonic() >= deadline:
+                logger.error(f'Grader {name} was not available after {self.health_timeout}s')
+                return False
+            time.sleep(FLEET_HEALTH_INTERVAL)
+
+
+def main():
+    from . import create_app
+
+    parser = argparse.ArgumentParser(description='Rolls out the current grader spec to the registered graders')
+    parser.add_argument('org_name', help='the organization name used to create the graders')
+    parser.add_argument('--dry-run', action='store_true', help='only print the graders to roll out')
+    parser.add_argument('--parallelism', type=int, default=None, help='graders rolled out at the same time')
+    parser.add_argument('--pause', type=float, default=None, help='seconds to wait between the batches')
+    parser.add_argument('--health-timeout', type=float, default=None, help='seconds a grader has to be available')
+    parser.add_argument('--max-failures', type=int, default=None, help='failed graders that halt the rollout')
+    parser.add_argument('--max-surge', default=None, help='pods (or percentage) started above the replicas')
+    parser.add_argument('--max-unavailable', default=None, help='pods (or percentage) that can be unavailable')
+    args = parser.parse_args()
+    create_app()
+    reconciler = FleetReconciler(
+        args.org_name,
+        parallelism=args.parallelism,
+        pause=args.pause,
+        health_timeout=args.health_timeout,
+        max_failures=args.max_failures,
+        max_surge=args.max_surge,
+        max_unavailable=args.max_unavailable,
+    )
+    plan = reconciler.rollout(dry_run=args.dry_run)
+    for result, names in plan.items():
+        print(f'{result}: {len(names)}')
+        for name in names:
+            print(f'  {name}')
+    return 1 if plan.get(RESULT_FAILED) or plan.get(RESULT_SKIPPED) else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,246 @@
+"""
+Single entry point for the grader notebooks. With GRADER_GATEWAY the graders don't get a Service each, the
+hub services point to the gateway, which dispatches the requests by their /services/<course_id>/ prefix to
+the ready grader pods. The routes are taken from a watch on the grader pods.
+
+Usage (in the grader-gateway deployment):
+```
+python -m app.gateway
+```
+"""
+import logging
+import os
+import sys
+import threading
+import time
+
+from typing import Dict
+from typing import Optional
+
+from kubernetes import client
+from kubernetes import watch
+from kubernetes.client.rest import ApiException
+
+from tornado import httpclient
+from tornado import ioloop
+from tornado import web
+from tornado import websocket
+
+from .grader_service import NAMESPACE
+from .grader_service import load_kubernetes_config
+
+
+logging.basicConfig(stream=sys.stdout, level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+GATEWAY_PORT = int(os.environ.get('GRADER_GATEWAY_PORT') or '8000')
+# seconds a proxied request waits for the grader's response
+GATEWAY_REQUEST_TIMEOUT = float(os.environ.get('GRADER_GATEWAY_REQUEST_TIMEOUT') or '300')
+# seconds the watch is kept open before the pods are listed again
+WATCH_TIMEOUT = 300
+# labels of the grader pods (dedicated and pools)
+GRADER_POD_SELECTOR = 'app=illumidesk'
+
+# hop-by-hop headers, not forwarded by the proxy
+HOP_BY_HOP_HEADERS = {
+    'connection',
+    'keep-alive',
+    'proxy-authenticate',
+    'proxy-authorization',
+    'te',
+    'trailers',
+    'transfer-encoding',
+    'upgrade',
+}
+
+
+def pod_routes(pod: client.V1Pod) -> Dict[str, str]:
+    """
+    Returns the address (ip:port) of the grader notebooks served by a ready pod, by course id. The course
+    of a container is its JUPYTERHUB_SERVICE_NAME env var.
+    """
+    if not pod.status or not pod.status.pod_ip or pod.metadata.deletion_timestamp:
+        return {}
+    ready = any(
+        condition.type == 'Ready' and condition.status == 'True' for condition in pod.status.conditions or []
+    )
+    if not ready:
+        return {}
+    routes = {}
+    for container in pod.spec.containers:
+        env = {var.name: var.value for var in container.env or []}
+        course_id = env.get('JUPYTERHUB_SERVICE_NAME')
+        if course_id and container.ports:
+            routes[course_id] = f'{pod.status.pod_ip}:{container.ports[0].container_port}'
+    return routes
+
+
+class GraderRoutes:
+    """
+    The grader notebooks' addresses by course id, kept up to date by a watch on the grader pods running in a
+    daemon thread
+    """
+
+    def __init__(self):
+        self._pods: Dict[str, Dict[str, str]] = {}
+        self.routes: Dict[str, str] = {}
+
+    def get(self, course_id: str) -> Optional[str]:
+        return self.routes.get(course_id)
+
+    def start(self):
+        load_kubernetes_config()
+        thread = threading.Thread(target=self._watch_forever, name='grader-routes', daemon=True)
+        thread.start()
+
+    def _update(self, pod: client.V1Pod, deleted: bool = False):
+        if deleted:
+            self._pods.pop(pod.metadata.name, None)
+        else:
+            self._pods[pod.metadata.name] = pod_routes(pod)
+        # the dict is replaced, so the proxy handlers never see it half updated
+        self.routes = {course_id: address for routes in self._pods.values() for course_id, address in routes.items()}
+
+    def _watch_forever(self):
+        core_v1 = client.CoreV1Api()
+        while True:
+            try:
+                pods = core_v1.list_namespaced_pod(NAMESPACE, label_selector=GRADER_POD_SELECTOR)
+                self._pods = {}
+                for pod in pods.items:
+                    self._update(pod)
+                logger.info(f'Routing {len(self.routes)} graders')
+                stream = watch.Watch().stream(
+                    core_v1.list_namespaced_pod,
+                    NAMESPACE,
+                    label_selector=GRADER_POD_SELECTOR,
+                    resource_version=pods.metadata.resource_version,
+                    timeout_seconds=WATCH_TIMEOUT,
+                )
+                for event in stream:
+                    self._update(event['object'], deleted=event['type'] == 'DELETED')
+            except ApiException as e:
+                # 410 when the resource version is too old, the pods are listed again
+                if e.status != 410:
+                    logger.error(f'The grader pods watch failed: {e}')
+                    time.sleep(1)
+            except Exception as e:
+                logger.error(f'The grader pods watch failed: {e}')
+                time.sleep(1)
+
+
+class GraderProxyHandler(websocket.WebSocketHandler):
+    """
+    Proxies the http and websocket (kernels) requests to the grader notebook of the course in the path
+    """
+
+    def initialize(self, routes: GraderRoutes):
+        self.routes = routes
+        self.upstream = None
+
+    def _upstream_url(self, course_id: str, scheme: str) -> str:
+        address = self.routes.get(course_id)
+        if address is None:
+            raise web.HTTPError(503, f'The grader of the course {course_id} is not ready')
+        return f'{scheme}://{address}{self.request.uri}'
+
+    async def get(self, course_id: str):
+        if self.request.headers.get('Upgrade', '').lower() == 'websocket':
+            return await super().get(course_id=course_id)
+        await self.proxy(course_id)
+
+    async def proxy(self, course_id: str):
+        url = self._upstream_url(course_id, 'http')
+        headers = {
+            name: value for name, value in self.request.headers.get_all() if name.lower() not in HOP_BY_HOP_HEADERS
+        }
+        headers['X-Forwarded-For'] = self.request.remote_ip
+        body = self.request.body if self.request.method in ('POST', 'PUT', 'PATCH') else None
+        request = httpclient.HTTPRequest(
+            url,
+            method=self.request.method,
+            headers=headers,
+            body=body,
+            follow_redirects=False,
+            decompress_response=False,
+            allow_nonstandard_methods=True,
+            request_timeout=GATEWAY_REQUEST_TIMEOUT,
+        )
+        response = await httpclient.AsyncHTTPClient().fetch(request, raise_error=False)
+        if response.code == 599:
+            raise web.HTTPError(502, f'The grader of the course {course_id} did not respond: {response.error}')
+        self.clear()
+        self.set_status(response.code, response.reason)
+        forwarded = set()
+        for name, value in response.headers.get_all():
+            if name.lower() in HOP_BY_HOP_HEADERS or name.lower() == 'content-length':
+                continue
+            # the repeated headers (Set-Cookie) are added, the first one replaces the default header
+            if name in forwarded:
+                self.add_header(name, value)
+            else:
+                self.set_header(name, value)
+                forwarded.add(name)
+        if response.body:
+            self.write(response.body)
+
+    post = put = patch = delete = head = options = proxy
+
+    async def open(self, course_id: str):
+        url = self._upstream_url(course_id, 'ws')
+        headers = {
+            name: value
+            for name, value in self.request.headers.get_all()
+            if name.lower() not in HOP_BY_HOP_HEADERS and not name.lower().startswith('sec-websocket')
+        }
+        self.upstream = await websocket.websocket_connect(
+            httpclient.HTTPRequest(url, headers=headers), on_message_callback=self._on_upstream_message
+        )
+
+    def _on_upstream_message(self, message):
+        if message is None:
+            # the grader closed the connection
+            self.close()
+        else:
+            self.write_message(message, binary=isinstance(message, bytes))
+
+    async def on_message(self, message):
+        if self.upstream is not None:
+            await self.upstream.write_message(message, binary=isinstance(message, bytes))
+
+    def on_close(self):
+        if self.upstream is not None:
+            self.upstream.close()
+
+    def check_origin(self, origin: str) -> bool:
+        # the grader notebook checks the origin
+        return True
+
+
+class HealthHandler(web.RequestHandler):
+    def initialize(self, routes: GraderRoutes):
+        self.routes = routes
+
+    def get(self):
+        self.write({'success': True, 'routes': len(self.routes.routes)})
+
+
+def make_app(routes: GraderRoutes) -> web.Application:
+    return web.Application(
+        [
+            (r'/healthcheck', HealthHandler, {'routes': routes}),
+            (r'/services/(?P<course_id>[^/]+)(?:/.*)?', GraderProxyHandler, {'routes': routes}),
+        ]
+    )
+
+
+def main():
+    routes = GraderRoutes()
+    routes.start()
+    make_app(routes).listen(GATEWAY_PORT, xheaders=True)
+    logger.info(f'Grader gateway listening on {GATEWAY_PORT}')
+    ioloop.IOLoop.current().start()
+
+
+if __name__ == '__main__':
+    main()
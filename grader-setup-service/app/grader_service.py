@@ -1,18 +1,27 @@
+import hashlib
+import json
 import logging
 import os
-import shutil
 import sys
 
+from contextlib import contextmanager
 from datetime import datetime
 
 from kubernetes import client
 from kubernetes import config
+from kubernetes.client.rest import ApiException
 from kubernetes.config import ConfigException
 
 from pathlib import Path
 from secrets import token_hex
+from typing import List
+from typing import Optional
 from .constants import NBGRADER_HOME_CONFIG_TEMPLATE
 from .constants import NBGRADER_COURSE_CONFIG_TEMPLATE
+from .metrics import track_kubernetes_request
+from .provisioning import PathSpec
+from .provisioning import TreeProvisioner
+from .tracing import start_span
 
 
 logging.basicConfig(stream=sys.stdout, level=logging.DEBUG)
@@ -28,6 +37,39 @@ MNT_ROOT = os.environ.get('ILLUMIDESK_MNT_ROOT', '/illumidesk-courses')
 EXCHANGE_MNT_ROOT = os.environ.get('ILLUMIDESK_NB_EXCHANGE_MNT_ROOT', '/illumidesk-nb-exchange')
 GRADER_PVC = os.environ.get('GRADER_PVC', 'grader-setup-pvc')
 GRADER_EXCHANGE_SHARED_PVC = os.environ.get('GRADER_SHARED_PVC', 'exchange-shared-volume')
+# mount only the course's directory of the org exchange in each grader (<exchange>/<course_id>) instead of the
+# whole exchange, the exchange operations of a grader don't see the other courses
+EXCHANGE_SHARDING = (os.environ.get('GRADER_EXCHANGE_SHARDING') or 'false').lower() in ('true', '1')
+# emptyDir mounted as the exchange root (/srv/nbgrader/exchange) of the sharded graders, the kubelet creates it
+# writable by all the users (0777) as nbgrader expects, the course's exchange directory is mounted within it
+EXCHANGE_ROOT_VOLUME = 'exchange-root'
+# seconds to connect to and to wait for a response from the Kubernetes API, so a slow API server fails the request
+# instead of holding the worker
+K8S_REQUEST_TIMEOUT = (
+    float(os.environ.get('ILLUMIDESK_K8S_CONNECT_TIMEOUT') or '5'),
+    float(os.environ.get('ILLUMIDESK_K8S_READ_TIMEOUT') or '30'),
+)
+
+# seconds the grader notebook has to start serving before its container is restarted
+GRADER_STARTUP_TIMEOUT = int(os.environ.get('GRADER_STARTUP_TIMEOUT') or '300')
+# seconds between the grader readiness checks, the hub shows the pending page until the grader is ready
+GRADER_PROBE_PERIOD = int(os.environ.get('GRADER_PROBE_PERIOD') or '5')
+
+# the graders are reached through the grader gateway (app.gateway) when it's true, otherwise each grader has its
+# own Service
+GATEWAY_ENABLED = (os.environ.get('GRADER_GATEWAY') or 'false').lower() in ('true', '1')
+# url of the grader gateway Service, used as the hub services url of the graders
+GATEWAY_URL = os.environ.get('GRADER_GATEWAY_URL') or 'http://grader-gateway:8000'
+
+# cpu and memory requests and limits of the grader notebook containers, raised around the assignments' due
+# dates by app.deadline_scaler
+GRADER_RESOURCES = {
+    'requests': {'cpu': '100m', 'memory': '200Mi'},
+    'limits': {'cpu': '500m', 'memory': '500Mi'},
+}
+
+# annotation with the hash of the grader deployment spec, used to find the graders created with an older spec
+SPEC_HASH_ANNOTATION = 'illumidesk.com/grader-spec-hash'
 
 # user UI and GID to use within the grader container
 NB_UID = 10001
@@ -40,6 +82,96 @@ nbgrader_db_password = os.environ.get('POSTGRES_NBGRADER_PASSWORD')
 nbgrader_db_user = os.environ.get('POSTGRES_NBGRADER_USER')
 
 
+def spec_hash(spec) -> str:
+    """
+    Returns a hash of a kubernetes object spec, the same spec always has the same hash
+    """
+    spec_dict = client.ApiClient().sanitize_for_serialization(spec)
+    return hashlib.sha256(json.dumps(spec_dict, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def deployment_is_available(deployment: client.V1Deployment) -> bool:
+    """
+    Whether the deployment controller rolled out the deployment's last spec and all its replicas are available
+    """
+    status = deployment.status
+    replicas = deployment.spec.replicas or 0
+    return (
+        (status.observed_generation or 0) >= (deployment.metadata.generation or 0)
+        and (status.updated_replicas or 0) >= replicas
+        and (status.available_replicas or 0) >= replicas
+        and not status.unavailable_replicas
+    )
+
+
+def grader_course_dir(org_name: str, course_id: str) -> Path:
+    """
+    Returns the nbgrader course directory within the grader home
+    """
+    return Path(f'{MNT_ROOT}/{org_name}/home/grader-{course_id}/{course_id}')
+
+
+def gradebook_url(org_name: str, course_id: str) -> str:
+    """
+    Returns the url of the course's nbgrader database
+    """
+    return f'postgresql://{nbgrader_db_user}:{nbgrader_db_password}@{nbgrader_db_host}:5432/{org_name}_{course_id}'
+
+
+def grader_tree(org_name: str, course_id: str) -> List[PathSpec]:
+    """
+    Returns the directories and nbgrader config files of a course's grader:
+    - the org exchange directory, writable by all the users
+    - with GRADER_EXCHANGE_SHARDING, the course's exchange directory owned by the grader (nbgrader checks it)
+    - grader_root: /<org-name>/home/grader-<course-id>, with its .jupyter/nbgrader_config.py
+    - course_root: /<org-name>/home/grader-<course-id>/<course-id>, with its nbgrader_config.py
+    """
+    course_dir = grader_course_dir(org_name, course_id)
+    grader_name = f'grader-{course_id}'
+    jupyter_dir = course_dir.parent.joinpath('.jupyter')
+    exchange_dir = Path(EXCHANGE_MNT_ROOT, org_name, 'exchange')
+    exchange_specs = [PathSpec(exchange_dir, mode=0o777)]
+    if EXCHANGE_SHARDING:
+        exchange_specs.append(PathSpec(exchange_dir.joinpath(course_id), uid=NB_UID, gid=NB_GID))
+    return exchange_specs + [
+        PathSpec(course_dir.parent, uid=NB_UID, gid=NB_GID),
+        PathSpec(course_dir, uid=NB_UID, gid=NB_GID),
+        PathSpec(jupyter_dir, uid=NB_UID, gid=NB_GID),
+        PathSpec(
+            jupyter_dir.joinpath('nbgrader_config.py'),
+            content=NBGRADER_HOME_CONFIG_TEMPLATE.format(
+                grader_name=grader_name, course_id=course_id, db_url=gradebook_url(org_name, course_id)
+            ),
+        ),
+        PathSpec(
+            course_dir.joinpath('nbgrader_config.py'),
+            content=NBGRADER_COURSE_CONFIG_TEMPLATE.format(course_id=course_id),
+        ),
+    ]
+
+
+def load_kubernetes_config():
+    """
+    Loads the cluster credentials, or the KUBECONFIG credentials outside of the cluster
+    """
+    try:
+        # try to load the cluster credentials
+        # Configs can be set in Configuration class directly or using helper utility
+        config.load_incluster_config()
+    except ConfigException:
+        # next method uses the KUBECONFIG env var by default
+        config.load_kube_config()
+
+
+@contextmanager
+def kubernetes_request(method: str):
+    """
+    Traces a Kubernetes API request (as a child of the request span) and observes its duration
+    """
+    with start_span(f'kubernetes.{method}', **{'k8s.namespace': NAMESPACE}), track_kubernetes_request(method):
+        yield
+
+
 class GraderServiceLauncher:
     def __init__(self, org_name: str, course_id: str):
         """
@@ -48,13 +180,7 @@ class GraderServiceLauncher:
         Args:
             org_name: 
         """
-        try:
-            # try to load the cluster credentials
-            # Configs can be set in Configuration class directly or using helper utility
-            config.load_incluster_config()
-        except ConfigException:
-            # next method uses the KUBECONFIG env var by default
-            config.load_kube_config()
+        load_kubernetes_config()
         # Uncomment the following lines to enable debug logging
         # c = client.Configuration()
         # c.debug = True
@@ -66,19 +192,23 @@ class GraderServiceLauncher:
         self.grader_name = f'grader-{self.course_id}'
         self.grader_token = token_hex(32)
         # Course home directory, its parent should be the grader name
-        self.course_dir = Path(f'{MNT_ROOT}/{self.org_name}/home/grader-{self.course_id}/{self.course_id}')
+        self.course_dir = grader_course_dir(self.org_name, self.course_id)
         # set the exchange directory path
         self.exchange_dir = Path(EXCHANGE_MNT_ROOT, self.org_name, 'exchange')
+        # the course's exchange directory (the root of its nbgrader exchange operations)
+        self.course_exchange_dir = self.exchange_dir.joinpath(self.course_id)
 
     def grader_deployment_exists(self) -> bool:
         """
         Check if there is a deployment for the grader service name
         """
         # Filter deployments by the current namespace and a specific name (metadata collection)
-        deployment_list = self.apps_v1.list_namespaced_deployment(
-            namespace=NAMESPACE,
-            field_selector=f'metadata.name={self.grader_name}'
-        )
+        with kubernetes_request('list_namespaced_deployment'):
+            deployment_list = self.apps_v1.list_namespaced_deployment(
+                namespace=NAMESPACE,
+                field_selector=f'metadata.name={self.grader_name}',
+                _request_timeout=K8S_REQUEST_TIMEOUT,
+            )
         if deployment_list and deployment_list.items:            
             return True
         
@@ -89,79 +219,85 @@ class GraderServiceLauncher:
         Check if the grader service exists
         """
         # Filter deployments by the current namespace and a specific name (metadata collection)
-        service_list = self.coreV1Api.list_namespaced_service(
-            namespace=NAMESPACE,
-            field_selector=f'metadata.name={self.grader_name}'
-        )
+        with kubernetes_request('list_namespaced_service'):
+            service_list = self.coreV1Api.list_namespaced_service(
+                namespace=NAMESPACE,
+                field_selector=f'metadata.name={self.grader_name}',
+                _request_timeout=K8S_REQUEST_TIMEOUT,
+            )
         if service_list and service_list.items:            
             return True
         
         return False
 
+    def grader_deployment_ready(self, deployment_name: str = None) -> Optional[bool]:
+        """
+        Check if the grader deployment is available, its readiness probe passes when the notebook serves
+
+        Args:
+            deployment_name: the deployment serving the course, the grader service name by default
+
+        Returns:
+            None if there is no deployment for the grader service name
+        """
+        try:
+            # the deployment includes its status, the deployments/status subresource isn't granted by the role
+            with kubernetes_request('read_namespaced_deployment'):
+                deployment = self.apps_v1.read_namespaced_deployment(
+                    name=deployment_name or self.grader_name, namespace=NAMESPACE, _request_timeout=K8S_REQUEST_TIMEOUT
+                )
+        except ApiException as e:
+            if e.status == 404:
+                return None
+            raise
+        return deployment_is_available(deployment)
+
     def create_grader_deployment(self):
         # first create the home directories for grader/course
-        try:
-            self._create_exchange_directory()
-            self._create_grader_directories()
-            self._create_nbgrader_files()
-        except Exception as e:
-            msg = 'An error occurred trying to create directories and files for nbgrader.'
-            logger.error(f'{msg}{e}')
-            raise Exception(msg)
-            
+        self.create_grader_files()
         # Create grader deployement
         deployment = self._create_deployment_object()
-        api_response = self.apps_v1.create_namespaced_deployment(body=deployment, namespace=NAMESPACE)
+        with kubernetes_request('create_namespaced_deployment'):
+            api_response = self.apps_v1.create_namespaced_deployment(
+                body=deployment, namespace=NAMESPACE, _request_timeout=K8S_REQUEST_TIMEOUT
+            )
         logger.info(f'Deployment created. Status="{str(api_response.status)}"')
+        if GATEWAY_ENABLED:
+            # the grader gateway routes to the grader pods
+            return
         # Create grader service
         service = self._create_service_object()
-        self.coreV1Api.create_namespaced_service(namespace=NAMESPACE, body=service)
+        with kubernetes_request('create_namespaced_service'):
+            self.coreV1Api.create_namespaced_service(
+                namespace=NAMESPACE, body=service, _request_timeout=K8S_REQUEST_TIMEOUT
+            )
 
-    def _create_exchange_directory(self):
-        
-        logger.info(f'Creating exchange directory {self.exchange_dir}')
-        self.exchange_dir.mkdir(parents=True, exist_ok=True)
-        self.exchange_dir.chmod(0o777)
+    def create_grader_files(self):
+        """
+        Creates the exchange, grader and course directories and the nbgrader config files
+        """
+        try:
+            TreeProvisioner().apply(grader_tree(self.org_name, self.course_id))
+        except Exception as e:
+            msg = 'An error occurred trying to create directories and files for nbgrader.'
+            logger.error(f'{msg}{e}')
+            raise Exception(msg)
 
-    def _create_grader_directories(self):
+    @property
+    def gradebook_url(self) -> str:
         """
-        Creates home directories with specific permissions
-        Directories to create:
-        - grader_root: /<org-name>/home/grader-<course-id>
-        - course_root: /<org-name>/home/grader-<course-id>/<course-id>
+        The url of the course's nbgrader database
         """
-        logger.debug(
-            f'Create course directory "{self.course_dir}" with special permissions {NB_UID}:{NB_GID}'
-        )
-        self.course_dir.mkdir(parents=True, exist_ok=True)
-        # change the course directory owner
-        shutil.chown(str(self.course_dir), user=NB_UID, group=NB_GID)
-        # change the grader-home directory owner
-        shutil.chown(str(self.course_dir.parent), user=NB_UID, group=NB_GID)
-    
-    def _create_nbgrader_files(self):
-        # create the .jupyter directory (a child of grader_root)
-        jupyter_dir = self.course_dir.parent.joinpath('.jupyter')
-        jupyter_dir.mkdir(parents=True, exist_ok=True)
-        shutil.chown(str(jupyter_dir), user=NB_UID, group=NB_GID)
-        # Write the nbgrader_config.py file at grader home directory
-        grader_nbconfig_path = jupyter_dir.joinpath('nbgrader_config.py')
-        logger.info(f'Writing the nbgrader_config.py file at jupyter directory (within the grader home): {grader_nbconfig_path}')
-        # write the file
-        grader_home_nbconfig_content = NBGRADER_HOME_CONFIG_TEMPLATE.format(
-            grader_name=self.grader_name,
-            course_id=self.course_id,
-            db_url=f'postgresql://{nbgrader_db_user}:{nbgrader_db_password}@{nbgrader_db_host}:5432/{self.org_name}_{self.course_id}'
-        )
-        grader_nbconfig_path.write_text(grader_home_nbconfig_content)
-        # Write the nbgrader_config.py file at grader home directory
-        course_nbconfig_path = self.course_dir.joinpath('nbgrader_config.py')
-        logger.info(f'Writing the nbgrader_config.py file at course home directory: {course_nbconfig_path}')
-        # write the second file
-        course_home_nbconfig_content = NBGRADER_COURSE_CONFIG_TEMPLATE.format(
-            course_id=self.course_id
-        )
-        course_nbconfig_path.write_text(course_home_nbconfig_content)
+        return gradebook_url(self.org_name, self.course_id)
+
+    @property
+    def service_url(self) -> str:
+        """
+        The url of the grader notebook registered as a hub service
+        """
+        if GATEWAY_ENABLED:
+            return GATEWAY_URL
+        return f'http://{self.grader_name}:8888'
 
     def _create_service_object(self):
         service = client.V1Service(
@@ -175,22 +311,55 @@ class GraderServiceLauncher:
         )
         return service
 
-    def _create_deployment_object(self):        
-        # Configureate Pod template container
+    def _create_container_object(self, name: str = 'grader-notebook', port: int = 8888):
+        """
+        Returns the grader notebook container of the course
+
+        Args:
+            name: the container name, the course's containers in a packed grader pod are named after the grader
+            port: the notebook port, each course in a packed grader pod listens on its own port
+        """
         # Volumes to mount as subPaths of PV
         sub_path_grader_home = str(self.course_dir.parent).strip('/')
-        sub_path_exchange = str(self.exchange_dir.relative_to(EXCHANGE_MNT_ROOT))
+        exchange_root_mounts = []
+        if EXCHANGE_SHARDING:
+            exchange_mount_path = f'/srv/nbgrader/exchange/{self.course_id}'
+            sub_path_exchange = str(self.course_exchange_dir.relative_to(EXCHANGE_MNT_ROOT))
+            # the parent of the course's mount would be a root owned 0755 directory of the image, nbgrader
+            # checks that the exchange root is writable
+            exchange_root_mounts.append(
+                client.V1VolumeMount(mount_path='/srv/nbgrader/exchange', name=EXCHANGE_ROOT_VOLUME)
+            )
+        else:
+            exchange_mount_path = '/srv/nbgrader/exchange'
+            sub_path_exchange = str(self.exchange_dir.relative_to(EXCHANGE_MNT_ROOT))
+        command = ['start-notebook.sh', f'--group=formgrade-{self.course_id}']
+        if port != 8888:
+            command.append(f'--port={port}')
+        # the notebook serves its api (without authentication) under the service prefix
+        probe_action = client.V1HTTPGetAction(path=f'/services/{self.course_id}/api', port=port)
         # define the container to launch
-        container = client.V1Container(
-            name='grader-notebook',
+        return client.V1Container(
+            name=name,
             image=GRADER_IMAGE_NAME,
-            command=['start-notebook.sh', f'--group=formgrade-{self.course_id}'],
-            ports=[client.V1ContainerPort(container_port=8888)],
+            command=command,
+            ports=[client.V1ContainerPort(container_port=port)],
             working_dir=f'/home/{self.grader_name}',
             resources=client.V1ResourceRequirements(
-                requests={"cpu": "100m", "memory": "200Mi"}, limits={"cpu": "500m", "memory": "500Mi"}
+                requests=dict(GRADER_RESOURCES['requests']), limits=dict(GRADER_RESOURCES['limits'])
             ),
             security_context=client.V1SecurityContext(allow_privilege_escalation=False),
+            startup_probe=client.V1Probe(
+                http_get=probe_action,
+                period_seconds=GRADER_PROBE_PERIOD,
+                failure_threshold=max(1, GRADER_STARTUP_TIMEOUT // GRADER_PROBE_PERIOD),
+            ),
+            readiness_probe=client.V1Probe(
+                http_get=probe_action, period_seconds=GRADER_PROBE_PERIOD, failure_threshold=3
+            ),
+            liveness_probe=client.V1Probe(
+                http_get=probe_action, period_seconds=30, timeout_seconds=5, failure_threshold=5
+            ),
             env=[
                 client.V1EnvVar(name='JUPYTERHUB_SERVICE_NAME', value=self.course_id),
                 client.V1EnvVar(name='JUPYTERHUB_API_TOKEN', value=self.grader_token),
@@ -213,13 +382,37 @@ class GraderServiceLauncher:
                     name=GRADER_PVC,
                     sub_path=sub_path_grader_home
                 ),
+                *exchange_root_mounts,
                 client.V1VolumeMount(
-                    mount_path='/srv/nbgrader/exchange',
+                    mount_path=exchange_mount_path,
                     name=GRADER_EXCHANGE_SHARED_PVC,
                     sub_path=sub_path_exchange
                 )
             ]
         )
+
+    def _create_volume_objects(self):
+        """
+        Returns the volumes mounted (as subPaths) by the grader containers, with the exchange root of the
+        sharded graders
+        """
+        volumes = [
+            client.V1Volume(
+                name=GRADER_PVC,
+                persistent_volume_claim=client.V1PersistentVolumeClaimVolumeSource(claim_name=GRADER_PVC)
+            ),
+            client.V1Volume(
+                name=GRADER_EXCHANGE_SHARED_PVC,
+                persistent_volume_claim=client.V1PersistentVolumeClaimVolumeSource(claim_name=GRADER_EXCHANGE_SHARED_PVC)
+            ),
+        ]
+        if EXCHANGE_SHARDING:
+            volumes.append(client.V1Volume(name=EXCHANGE_ROOT_VOLUME, empty_dir=client.V1EmptyDirVolumeSource()))
+        return volumes
+
+    def _create_deployment_object(self):
+        # Configureate Pod template container
+        container = self._create_container_object()
         # Create and configurate a spec section
         template = client.V1PodTemplateSpec(
             metadata=client.V1ObjectMeta(
@@ -230,17 +423,7 @@ class GraderServiceLauncher:
             spec=client.V1PodSpec(
                 containers=[container],
                 security_context=client.V1PodSecurityContext(run_as_user=0),
-                volumes=[
-                    client.V1Volume(
-                        name=GRADER_PVC,
-                        persistent_volume_claim=client.V1PersistentVolumeClaimVolumeSource(claim_name=GRADER_PVC)
-                    ),
-                    client.V1Volume(
-                        name=GRADER_EXCHANGE_SHARED_PVC,
-                        persistent_volume_claim=client.V1PersistentVolumeClaimVolumeSource(claim_name=GRADER_EXCHANGE_SHARED_PVC)
-                    ),
-                    
-                ]
+                volumes=self._create_volume_objects()
             )
         )
         # Create the specification of deployment
@@ -249,7 +432,12 @@ class GraderServiceLauncher:
         )
         # Instantiate the deployment object
         deployment = client.V1Deployment(
-            api_version="apps/v1", kind="Deployment", metadata=client.V1ObjectMeta(name=self.grader_name), spec=spec
+            api_version="apps/v1",
+            kind="Deployment",
+            metadata=client.V1ObjectMeta(
+                name=self.grader_name, annotations={SPEC_HASH_ANNOTATION: spec_hash(spec)}
+            ),
+            spec=spec
         )
 
         return deployment
@@ -257,19 +445,27 @@ class GraderServiceLauncher:
     def delete_grader_deployment(self):
         # first delete the service
         if self.grader_service_exists():
-            self.coreV1Api.delete_namespaced_service(name=self.grader_name, namespace=NAMESPACE)
+            with kubernetes_request('delete_namespaced_service'):
+                self.coreV1Api.delete_namespaced_service(
+                    name=self.grader_name, namespace=NAMESPACE, _request_timeout=K8S_REQUEST_TIMEOUT
+                )
         # then delete the deployment
         if self.grader_deployment_exists():
-            self.apps_v1.delete_namespaced_deployment(name=self.grader_name, namespace=NAMESPACE)
+            with kubernetes_request('delete_namespaced_deployment'):
+                self.apps_v1.delete_namespaced_deployment(
+                    name=self.grader_name, namespace=NAMESPACE, _request_timeout=K8S_REQUEST_TIMEOUT
+                )
 
     def update_jhub_deployment(self):
         """
         Executes a patch in the jhub deployment. With this the jhub will be replaced with a new pod
         """
-        jhub_deployments = self.apps_v1.list_namespaced_deployment(
-            namespace=NAMESPACE,
-            label_selector='component=hub'
-        )
+        with kubernetes_request('list_namespaced_deployment'):
+            jhub_deployments = self.apps_v1.list_namespaced_deployment(
+                namespace=NAMESPACE,
+                label_selector='component=hub',
+                _request_timeout=K8S_REQUEST_TIMEOUT,
+            )
         if jhub_deployments.items:
             # add new label with the current datetime (only used to the replacement occurs)
             for deployment in jhub_deployments.items:
@@ -281,9 +477,11 @@ class GraderServiceLauncher:
                 current_metadata.labels = current_labels
                 # update the deployment object
                 deployment.spec.template.metatada = current_metadata
-                api_response = self.apps_v1.patch_namespaced_deployment(
-                    name='hub',
-                    namespace=NAMESPACE,
-                    body=deployment
-                )
+                with kubernetes_request('patch_namespaced_deployment'):
+                    api_response = self.apps_v1.patch_namespaced_deployment(
+                        name='hub',
+                        namespace=NAMESPACE,
+                        body=deployment,
+                        _request_timeout=K8S_REQUEST_TIMEOUT,
+                    )
                 logger.info(f'Jhub patch response:{api_response}')
@@ -1,54 +1,115 @@
 import logging
 import os
-import shutil
 import sys
+import threading
+import time
 
 from flask import Flask
+from flask import Response
 from flask import jsonify
+from flask import request
 
-from pathlib import Path
+from kubernetes.client.rest import ApiException
+
+from sqlalchemy.exc import IntegrityError
 
 from . import create_app
 from .models import db
 from .models import GraderService
 from .grader_service import GraderServiceLauncher
-from .grader_service import NB_UID
-from .grader_service import NB_GID
+from .fleet import FleetReconciler
+from .packing import GraderPacker
+from .packing import PACKING_ENABLED
+from .packing import PLACE_ATTEMPTS
+from .assignments import assignment_directories
+from .exchange import ExchangeIndex
+from .metrics import generate_metrics
+from .metrics import track_provisioning
+from .snapshot import LONG_POLL_INTERVAL
+from .snapshot import LONG_POLL_TIMEOUT
+from .snapshot import bump_registry_version
+from .snapshot import services_snapshot
+from .tracing import init_tracer
 
 
 logging.basicConfig(stream=sys.stdout, level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
-app = create_app()
+# the app is preloaded by the gunicorn master, each worker creates its tracer after the fork (post_fork)
+app = create_app(with_tracer=False)
+
+# maximum seconds a GET /services/<org_name>/<course_id>/ready request waits for the grader
+READY_WAIT_MAX = float(os.environ.get('GRADER_SETUP_READY_WAIT_MAX') or '30')
+# seconds between the checks of the grader deployment while a ready request waits
+READY_WAIT_INTERVAL = 1
+# ready requests of a worker waiting at the same time, the next ones respond without waiting so the pending
+# pages don't hold all the worker's threads
+READY_MAX_WAITERS = int(os.environ.get('GRADER_SETUP_READY_MAX_WAITERS') or '2')
+ready_waiters = threading.BoundedSemaphore(READY_MAX_WAITERS)
+# GET /services?since=<version> requests of a worker waiting at the same time, the next ones are answered right
+# away so the long polls don't hold all the worker's threads
+LONG_POLL_MAX_WAITERS = int(os.environ.get('GRADER_SETUP_LONG_POLL_MAX_WAITERS') or '2')
+long_poll_waiters = threading.BoundedSemaphore(LONG_POLL_MAX_WAITERS)
 
 
 @app.route('/services/<org_name>/<course_id>', methods=['POST'])
 def launch(org_name: str, course_id: str):
     """
-    Creates a new grader-notebook pod if not exists
+    Creates a new grader-notebook pod if not exists, with GRADER_PACKING the course is added to a grader pool pod.
+    A course whose pool slot was taken by another worker at the same time is placed again, the 409 is only
+    returned when the course is already registered.
     """
     launcher = GraderServiceLauncher(org_name=org_name, course_id=course_id)
-    if not launcher.grader_deployment_exists():
+    if GraderPacker.packed_course(course_id) is not None or launcher.grader_deployment_exists():
+        return jsonify(success=False, message=f'A grader service already exists for this course_id:{course_id}'), 409
+    packer = GraderPacker(org_name) if PACKING_ENABLED else None
+    for attempt in range(PLACE_ATTEMPTS if packer else 1):
         try:
-            launcher.create_grader_deployment()
-            # Register the new service to local database
-            new_service = GraderService(
-                name=course_id,
-                course_id=course_id,
-                url=f'http://{launcher.grader_name}:8888',
-                api_token=launcher.grader_token
-            )
-            db.session.add(new_service)
-            db.session.commit()
-            # then do patch for jhub deployment
-            # with this the jhub pod will be restarted and get/load new services
-            launcher.update_jhub_deployment()
+            with track_provisioning('create_grader'):
+                if packer:
+                    packed = packer.add_course(launcher)
+                    url = packer.service_url(packed)
+                else:
+                    launcher.create_grader_deployment()
+                    url = launcher.service_url
+                # Register the new service to local database
+                new_service = GraderService(
+                    name=course_id,
+                    course_id=course_id,
+                    url=url,
+                    api_token=launcher.grader_token
+                )
+                db.session.add(new_service)
+                bump_registry_version()
+                db.session.commit()
+                services_snapshot.notify_change()
+                if packer:
+                    packer.apply_pool(packed.pool_name)
+                # then do patch for jhub deployment
+                # with this the jhub pod will be restarted and get/load new services
+                launcher.update_jhub_deployment()
+        except IntegrityError as e:
+            db.session.rollback()
+            # another worker provisioned the course at the same time
+            if GraderService.query.filter_by(course_id=course_id).first() is not None:
+                message = f'A grader service already exists for this course_id:{course_id}'
+                return jsonify(success=False, message=message), 409
+            # another worker packed a course in the same slot of the pool, the course is placed again
+            logger.info(f'The slot of the course {course_id} was taken (attempt {attempt + 1}): {e}')
+            error = e
+            continue
+        except ApiException as e:
+            db.session.rollback()
+            if e.status == 409:
+                message = f'A grader service already exists for this course_id:{course_id}'
+                return jsonify(success=False, message=message), 409
+            return jsonify(success=False, message=str(e)), 500
         except Exception as e:
+            db.session.rollback()
             return jsonify(success=False, message=str(e)), 500
 
         return jsonify(success=True)
-    else:
-        return jsonify(success=False, message=f'A grader service already exists for this course_id:{course_id}'), 409
+    return jsonify(success=False, message=f'No free grader slot for the course_id:{course_id}: {error}'), 500
 
 
 @app.route('/services', methods=['GET'])
@@ -56,6 +117,13 @@ def services():
     """
     Returns the grader-notebook list used as services in jhub
 
+    The document is rendered again only when a service is added or deleted. It's sent with the registry
+    version in the X-Services-Version header and as its ETag, so a request with a matching If-None-Match
+    header is answered with a 304. With `?since=<version>` the request waits (up to `timeout` seconds) until
+    the version is greater than the given one, and it's answered with a 304 if nothing changed. When
+    GRADER_SETUP_LONG_POLL_MAX_WAITERS requests of the worker are already waiting, it's answered without waiting,
+    with a Retry-After header.
+
     Response: json
     example:
     ```
@@ -65,55 +133,154 @@ def services():
     }
     ```
     """
-    services = GraderService.query.all()
-    # format a json
-    services_resp = []
-    groups_resp = {}
-    for s in services:
-        services_resp.append({
-            'name': s.name,
-            'url': s.url,
-            'oauth_no_confirm': s.oauth_no_confirm,
-            'admin': s.admin,
-            'api_token': s.api_token
-        })
-        # add the jhub user group
-        groups_resp.update({f'formgrade-{s.course_id}': [f'grader-{s.course_id}']})
-    return jsonify(services=services_resp, groups=groups_resp)
+    since = request.args.get('since', type=int)
+    waiting = since is not None and long_poll_waiters.acquire(blocking=False)
+    try:
+        if waiting:
+            timeout = min(request.args.get('timeout', LONG_POLL_TIMEOUT, type=float), LONG_POLL_TIMEOUT)
+            services_snapshot.wait_for_change(since, timeout)
+    finally:
+        if waiting:
+            long_poll_waiters.release()
+    version, body = services_snapshot.current()
+    resp = Response(body, mimetype='application/json')
+    resp.set_etag(str(version))
+    resp.headers['X-Services-Version'] = str(version)
+    if since is not None and not waiting:
+        # the client polls again later instead of right away
+        resp.headers['Retry-After'] = str(max(1, int(LONG_POLL_INTERVAL)))
+    if since is not None and version <= since:
+        resp.status_code = 304
+        resp.set_data(b'')
+        return resp
+    return resp.make_conditional(request)
+
+
+@app.route('/services/<org_name>/<course_id>/ready', methods=['GET'])
+def service_ready(org_name: str, course_id: str):
+    """
+    Returns whether the grader-notebook serves requests (its deployment is available). With `?wait=<seconds>`
+    the request waits until the grader is ready or the seconds passed (up to GRADER_SETUP_READY_WAIT_MAX).
+    When GRADER_SETUP_READY_MAX_WAITERS requests of the worker are already waiting, it responds without waiting.
+
+    Response: json
+    example:
+    ```
+    {"success": true, "ready": false}
+    ```
+    """
+    launcher = GraderServiceLauncher(org_name=org_name, course_id=course_id)
+    packed = GraderPacker.packed_course(course_id)
+    wait = min(request.args.get('wait', 0, type=float), READY_WAIT_MAX)
+    waiting = wait > 0 and ready_waiters.acquire(blocking=False)
+    deadline = time.monotonic() + (wait if waiting else 0)
+    try:
+        while True:
+            ready = launcher.grader_deployment_ready(packed.pool_name if packed else None)
+            if ready is None:
+                message = f'There is not a grader service for the course_id:{course_id}'
+                return jsonify(success=False, message=message), 404
+            if ready or time.monotonic() >= deadline:
+                return jsonify(success=True, ready=ready)
+            time.sleep(READY_WAIT_INTERVAL)
+    except Exception as e:
+        return jsonify(success=False, error=str(e)), 500
+    finally:
+        if waiting:
+            ready_waiters.release()
 
 
 @app.route("/services/<org_name>/<course_id>", methods=['DELETE'])
 def services_deletion(org_name: str, course_id: str):
     launcher = GraderServiceLauncher(org_name=org_name, course_id=course_id)
     try:
-        launcher.delete_grader_deployment()
-        service_saved = GraderService.query.filter_by(course_id=course_id).first()
-        if service_saved:
-            db.session.delete(service_saved)
+        with track_provisioning('delete_grader'):
+            packed = GraderPacker.packed_course(course_id)
+            pool_name = packed.pool_name if packed else None
+            if packed:
+                db.session.delete(packed)
+            else:
+                launcher.delete_grader_deployment()
+            service_saved = GraderService.query.filter_by(course_id=course_id).first()
+            if service_saved:
+                db.session.delete(service_saved)
+                bump_registry_version()
             db.session.commit()
+            services_snapshot.notify_change()
+            if pool_name:
+                # the pool is applied without the course, or deleted if it was its last course
+                GraderPacker(org_name).apply_pool(pool_name)
         return jsonify(success=True)
     except Exception as e:
+        db.session.rollback()
         return jsonify(success=False, error=str(e)), 500
     
 
 @app.route("/courses/<org_name>/<course_id>/<assignment_name>", methods=['POST'])
 def assignment_dir_creation(org_name: str, course_id: str, assignment_name):
-    launcher = GraderServiceLauncher(org_name=org_name, course_id=course_id)
-    assignment_dir = os.path.abspath(Path(launcher.course_dir, 'source', assignment_name))
-    if not os.path.isdir(assignment_dir):
-        logger.info('Creating source dir %s for the assignment %s' % (assignment_dir, assignment_name))
-        os.makedirs(assignment_dir)
-    logger.info('Fixing folder permissions for %s' % assignment_dir)
-    shutil.chown(str(Path(assignment_dir).parent), user=NB_UID, group=NB_GID)
-    shutil.chown(str(assignment_dir), user=NB_UID, group=NB_GID)
-    
+    try:
+        with track_provisioning('assignment_dir'):
+            assignment_directories.ensure(org_name, course_id, [assignment_name])
+    except ValueError as e:
+        return jsonify(success=False, error=str(e)), 400
     return jsonify(success=True)
 
 
+@app.route("/courses/<org_name>/<course_id>", methods=['POST'])
+def assignment_dirs_creation(org_name: str, course_id: str):
+    """
+    Creates the source directories of several assignments of a course, with the assignment names in
+    the body: {"assignments": ["<assignment-name>", ...]}
+    """
+    assignment_names = (request.get_json(silent=True) or {}).get('assignments')
+    if not isinstance(assignment_names, list) or not all(isinstance(name, str) for name in assignment_names):
+        return jsonify(success=False, error='assignments must be a list of assignment names'), 400
+    try:
+        with track_provisioning('assignment_dir'):
+            created = assignment_directories.ensure(org_name, course_id, assignment_names)
+    except ValueError as e:
+        return jsonify(success=False, error=str(e)), 400
+    return jsonify(success=True, created=created)
+
+
+@app.route("/exchange/<org_name>/<course_id>", methods=['GET'])
+def exchange_index(org_name: str, course_id: str):
+    """
+    Returns the released assignments, submissions and feedback of the course's exchange from its index, with
+    `?kind=<released|submitted|feedback>` only the entries of a kind
+    """
+    try:
+        index = ExchangeIndex(org_name, course_id).read(kind=request.args.get('kind'))
+    except ValueError as e:
+        return jsonify(success=False, error=str(e)), 400
+    return jsonify(success=True, entries=index['entries'])
+
+
+@app.route("/fleet/<org_name>", methods=['GET'])
+def fleet_plan(org_name: str):
+    """
+    Returns the graders whose deployment would be replaced by a fleet rollout (python -m app.fleet <org_name>)
+    """
+    try:
+        return jsonify(success=True, **FleetReconciler(org_name).plan())
+    except Exception as e:
+        return jsonify(success=False, error=str(e)), 500
+
+
+@app.route("/metrics")
+def metrics():
+    """
+    Prometheus metrics: provisioning durations and Kubernetes API latency
+    """
+    data, content_type = generate_metrics()
+    return Response(data, mimetype=content_type)
+
+
 @app.route("/healthcheck")
 def healthcheck():
     return jsonify(success=True)
 
 
 if __name__ == "__main__":
+    init_tracer()
     app.run(host='0.0.0.0')
@@ -0,0 +1,113 @@
+import os
+import time
+
+from contextlib import contextmanager
+
+from kubernetes.client.rest import ApiException
+
+from prometheus_client import CONTENT_TYPE_LATEST
+from prometheus_client import CollectorRegistry
+from prometheus_client import Counter
+from prometheus_client import Histogram
+from prometheus_client import REGISTRY
+from prometheus_client import generate_latest
+from prometheus_client import multiprocess
+
+
+PROVISIONING_DURATION_SECONDS = Histogram(
+    'grader_setup_provisioning_duration_seconds',
+    'Time spent provisioning the courses, by operation (create_grader, delete_grader, assignment_dir)',
+    ['operation'],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, float('inf')),
+)
+
+PROVISIONING_ERRORS = Counter(
+    'grader_setup_provisioning_errors_total',
+    'Failed provisioning operations',
+    ['operation'],
+)
+
+KUBERNETES_REQUEST_DURATION_SECONDS = Histogram(
+    'grader_setup_kubernetes_request_duration_seconds',
+    'Time spent in the Kubernetes API requests, by API method',
+    ['method'],
+)
+
+KUBERNETES_REQUEST_ERRORS = Counter(
+    'grader_setup_kubernetes_request_errors_total',
+    'Failed Kubernetes API requests, by API method and http status (or error when there is no response)',
+    ['method', 'status'],
+)
+
+SERVICES_SNAPSHOT_REQUESTS = Counter(
+    'grader_setup_services_snapshot_requests_total',
+    'GET /services requests, by result (rendered when the registry changed, cached otherwise)',
+    ['result'],
+)
+
+GRADER_FLEET_ROLLOUTS = Counter(
+    'grader_setup_fleet_rollouts_total',
+    'Graders processed by the fleet rollouts, by result (updated, failed or skipped after the rollout halted)',
+    ['result'],
+)
+
+ASSIGNMENT_DIRS = Counter(
+    'grader_setup_assignment_dirs_total',
+    'Assignment source directories requested, by result (cached, existing or created)',
+    ['result'],
+)
+
+GRADER_DEADLINE_SCALING = Counter(
+    'grader_setup_deadline_scaling_total',
+    'Graders processed by the deadline scaler, by result (boosted, restored or failed)',
+    ['result'],
+)
+
+
+@contextmanager
+def track_provisioning(operation: str):
+    """
+    Observes the duration of a provisioning operation and counts it as an error if it raises
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        PROVISIONING_ERRORS.labels(operation=operation).inc()
+        raise
+    finally:
+        PROVISIONING_DURATION_SECONDS.labels(operation=operation).observe(time.perf_counter() - started)
+
+
+@contextmanager
+def track_kubernetes_request(method: str):
+    """
+    Observes the duration of a Kubernetes API request and counts it as an error if it raises
+
+    Args:
+        method: the API client method, e.g. create_namespaced_deployment
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    except ApiException as e:
+        KUBERNETES_REQUEST_ERRORS.labels(method=method, status=str(e.status)).inc()
+        raise
+    except Exception:
+        KUBERNETES_REQUEST_ERRORS.labels(method=method, status='error').inc()
+        raise
+    finally:
+        KUBERNETES_REQUEST_DURATION_SECONDS.labels(method=method).observe(time.perf_counter() - started)
+
+
+def generate_metrics():
+    """
+    Returns the metrics in the prometheus text format and its content type. When the service runs with
+    many gunicorn workers the prometheus_multiproc_dir env var must be set, so the metrics of all the
+    workers are collected from the files they write in that directory.
+    """
+    registry = REGISTRY
+    if os.environ.get('prometheus_multiproc_dir'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return generate_latest(registry), CONTENT_TYPE_LATEST
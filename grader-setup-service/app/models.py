@@ -7,7 +7,7 @@ class GraderService(db.Model):
     __tablename__ = 'grader_services'
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(60), unique=True, nullable=False)
-    course_id = db.Column(db.String(50), nullable=False)
+    course_id = db.Column(db.String(50), nullable=False, index=True)
     url = db.Column(db.String(100), nullable=False)
     oauth_no_confirm = db.Column(db.Boolean, default=True)
     admin = db.Column(db.Boolean, default=True)
@@ -15,3 +15,43 @@ class GraderService(db.Model):
 
     def __repr__(self):
         return "<Service name: {} at {}>".format(self.name, self.url)
+
+
+class PackedCourse(db.Model):
+    """
+    A course served by a packed grader pod, with the notebook port (slot) of its container
+    """
+    __tablename__ = 'packed_courses'
+    __table_args__ = (db.UniqueConstraint('pool_name', 'slot'),)
+    id = db.Column(db.Integer, primary_key=True)
+    course_id = db.Column(db.String(50), unique=True, nullable=False)
+    pool_name = db.Column(db.String(60), nullable=False, index=True)
+    slot = db.Column(db.Integer, nullable=False)
+
+    def __repr__(self):
+        return "<Packed course: {} in {}:{}>".format(self.course_id, self.pool_name, self.slot)
+
+
+class RegistryVersion(db.Model):
+    """
+    Single row with the version of the grader services registry, incremented in the transactions that
+    add or delete a service so all the workers see the same version
+    """
+    __tablename__ = 'registry_version'
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return "<Registry version: {}>".format(self.version)
+
+
+def create_indexes():
+    """
+    Creates the indexes missing in a database created before they were added to the models, create_all
+    only creates them with new tables
+    """
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            columns = ', '.join(column.name for column in index.columns)
+            db.session.execute(db.text(f'CREATE INDEX IF NOT EXISTS {index.name} ON {table.name} ({columns})'))
+    db.session.commit()
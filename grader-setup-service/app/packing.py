@@ -0,0 +1,388 @@
+"""
+Packs several small courses in one grader pod. Each course runs its own grader notebook container (with its
+own nbgrader course directory, token and hub service) listening on its own port of the pod, and the pod's
+Service exposes the ports of all its courses.
+
+When a course grows, the rebalance moves it to a dedicated grader once its container uses more CPU than
+GRADER_PACKING_DEDICATED_CPU.
+
+Usage (within the grader-setup-service pod):
+```
+python -m app.packing <org_name> --dry-run
+python -m app.packing <org_name>
+```
+"""
+import argparse
+import logging
+import os
+
+from secrets import token_hex
+
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+from kubernetes import client
+from kubernetes.client.rest import ApiException
+
+from .grader_service import GATEWAY_ENABLED
+from .grader_service import GATEWAY_URL
+from .grader_service import GRADER_RESOURCES
+from .grader_service import GraderServiceLauncher
+from .grader_service import K8S_REQUEST_TIMEOUT
+from .grader_service import NAMESPACE
+from .grader_service import SPEC_HASH_ANNOTATION
+from .grader_service import kubernetes_request
+from .grader_service import load_kubernetes_config
+from .grader_service import spec_hash
+from .metrics import track_provisioning
+from .models import db
+from .models import GraderService
+from .models import PackedCourse
+from .snapshot import bump_registry_version
+from .snapshot import services_snapshot
+
+
+logger = logging.getLogger(__name__)
+
+# the new courses are packed in the grader pools when it's true, otherwise each course gets its own grader pod
+PACKING_ENABLED = (os.environ.get('GRADER_PACKING') or 'false').lower() in ('true', '1')
+# courses served by a grader pool pod
+POOL_SIZE = int(os.environ.get('GRADER_PACKING_POOL_SIZE') or '8')
+# CPU (millicores) used by a pool above which it doesn't receive new courses
+POOL_MAX_CPU = float(os.environ.get('GRADER_PACKING_POOL_MAX_CPU') or '1000')
+# CPU (millicores) used by a course above which the rebalance moves it to a dedicated grader
+DEDICATED_CPU = float(os.environ.get('GRADER_PACKING_DEDICATED_CPU') or '300')
+# resources of each course's container in a pool. The containers request less than a dedicated grader, a pool of
+# POOL_SIZE courses requests about as much as two dedicated graders, and keep its limits so a busy course can burst.
+# The rebalance moves the courses that keep using more than DEDICATED_CPU to dedicated graders.
+PACKED_RESOURCES = {
+    'requests': {
+        'cpu': os.environ.get('GRADER_PACKING_CPU_REQUEST') or '25m',
+        'memory': os.environ.get('GRADER_PACKING_MEMORY_REQUEST') or '100Mi',
+    },
+    'limits': dict(GRADER_RESOURCES['limits']),
+}
+# port of the first course of a pool, the course in the slot n listens on BASE_PORT + n
+BASE_PORT = 8888
+# attempts to apply a pool changed at the same time by other workers
+APPLY_ATTEMPTS = 3
+# attempts to place a new course whose slot was taken at the same time by another worker
+PLACE_ATTEMPTS = 5
+# label of the grader pool pods
+POOL_LABEL = 'illumidesk.com/grader-pool'
+
+RESULT_MIGRATED = 'migrated'
+RESULT_PACKED = 'packed'
+
+
+def parse_cpu(quantity: str) -> float:
+    """
+    Returns the millicores of a kubernetes CPU quantity (e.g. 250m, 1, 12345678n)
+    """
+    suffixes = {'n': 1e-6, 'u': 1e-3, 'm': 1}
+    if quantity and quantity[-1] in suffixes:
+        return float(quantity[:-1]) * suffixes[quantity[-1]]
+    return float(quantity or 0) * 1000
+
+
+class GraderPacker:
+    """
+    Places the courses in the grader pools and keeps the pools' deployments and services in sync with the
+    packed courses. The pools are balanced by the CPU used by their pods (read from the metrics.k8s.io API
+    served by metrics-server), by the number of courses when the metrics are not available.
+
+    A pool's pod is replaced when a course is added or removed, so the other courses of the pool are
+    unavailable while it restarts (the hub shows the pending page).
+
+    Args:
+        org_name: the organization name used to create the graders
+    """
+
+    def __init__(self, org_name: str):
+        self.org_name = org_name
+        load_kubernetes_config()
+        self.apps_v1 = client.AppsV1Api()
+        self.coreV1Api = client.CoreV1Api()
+        self.custom_objects = client.CustomObjectsApi()
+
+    @staticmethod
+    def packed_course(course_id: str) -> Optional[PackedCourse]:
+        """
+        Returns the pool and slot of a packed course, None if the course has a dedicated grader
+        """
+        return PackedCourse.query.filter_by(course_id=course_id).first()
+
+    @staticmethod
+    def service_url(packed: PackedCourse) -> str:
+        if GATEWAY_ENABLED:
+            return GATEWAY_URL
+        return f'http://{packed.pool_name}:{BASE_PORT + packed.slot}'
+
+    def measure_load(self) -> Dict[str, Dict[str, float]]:
+        """
+        Returns the CPU (millicores) used by the containers of the grader pools, by pool and container name.
+        An empty dict is returned when the metrics API is not available.
+        """
+        try:
+            with kubernetes_request('list_pod_metrics'):
+                pod_metrics = self.custom_objects.list_namespaced_custom_object(
+                    'metrics.k8s.io',
+                    'v1beta1',
+                    NAMESPACE,
+                    'pods',
+                    label_selector=POOL_LABEL,
+                    _request_timeout=K8S_REQUEST_TIMEOUT,
+                )
+        except Exception as e:
+            logger.warning(f'The grader pools load is not available, they are balanced by courses: {e}')
+            return {}
+        load = {}
+        for item in pod_metrics.get('items', []):
+            labels = item['metadata'].get('labels') or {}
+            # the pod name is <deployment>-<replicaset hash>-<suffix>
+            pool_name = labels.get(POOL_LABEL) or item['metadata']['name'].rsplit('-', 2)[0]
+            containers = load.setdefault(pool_name, {})
+            for container in item.get('containers', []):
+                containers[container['name']] = parse_cpu(container.get('usage', {}).get('cpu'))
+        return load
+
+    def place(self, load: Dict[str, Dict[str, float]] = None) -> Tuple[str, int]:
+        """
+        Returns the pool and slot for a new course: the least loaded pool with a free slot and below
+        GRADER_PACKING_POOL_MAX_CPU, or a new pool
+        """
+        load = self.measure_load() if load is None else load
+        slots: Dict[str, List[int]] = {}
+        for packed in PackedCourse.query.all():
+            slots.setdefault(packed.pool_name, []).append(packed.slot)
+        candidates = [
+            pool_name
+            for pool_name, used in slots.items()
+            if len(used) < POOL_SIZE and sum(load.get(pool_name, {}).values()) < POOL_MAX_CPU
+        ]
+        if not candidates:
+            return f'grader-pool-{token_hex(4)}', 0
+        pool_name = min(candidates, key=lambda name: (sum(load.get(name, {}).values()), len(slots[name])))
+        return pool_name, min(set(range(POOL_SIZE)) - set(slots[pool_name]))
+
+    def add_course(self, launcher: GraderServiceLauncher) -> PackedCourse:
+        """
+        Creates the course's grader files and adds the course to a pool in the current db session. The pool's
+        deployment is updated with apply_pool after the session is committed.
+        """
+        launcher.create_grader_files()
+        pool_name, slot = self.place()
+        packed = PackedCourse(course_id=launcher.course_id, pool_name=pool_name, slot=slot)
+        db.session.add(packed)
+        logger.info(f'Packing the course {launcher.course_id} in {pool_name} (slot {slot})')
+        return packed
+
+    def apply_pool(self, pool_name: str):
+        """
+        Creates, replaces or deletes the pool's deployment and service to serve the pool's packed courses
+        """
+        with track_provisioning('apply_grader_pool'):
+            for attempt in range(APPLY_ATTEMPTS):
+                members = PackedCourse.query.filter_by(pool_name=pool_name).order_by(PackedCourse.slot).all()
+                if not members:
+                    self._delete_pool(pool_name)
+                    return
+                try:
+                    self._apply(
+                        pool_name,
+                        self._create_pool_deployment(pool_name, members),
+                        self._create_pool_service(pool_name, members),
+                    )
+                    return
+                except ApiException as e:
+                    # another worker changed the pool since it was read, it's applied again with the courses
+                    # committed by both
+                    if e.status != 409 or attempt == APPLY_ATTEMPTS - 1:
+                        raise
+                    db.session.expire_all()
+
+    def desired_pool_deployments(self) -> Dict[str, client.V1Deployment]:
+        """
+        Returns the deployments of all the pools, used by the fleet rollouts
+        """
+        pools: Dict[str, List[PackedCourse]] = {}
+        for packed in PackedCourse.query.order_by(PackedCourse.slot).all():
+            pools.setdefault(packed.pool_name, []).append(packed)
+        return {name: self._create_pool_deployment(name, members) for name, members in pools.items()}
+
+    def rebalance(self, dry_run: bool = False) -> Dict[str, List[str]]:
+        """
+        Moves the packed courses using more than GRADER_PACKING_DEDICATED_CPU to a dedicated grader
+
+        Returns:
+            The migrated courses and the courses that stay packed
+        """
+        load = self.measure_load()
+        result = {RESULT_MIGRATED: [], RESULT_PACKED: []}
+        changed_pools = set()
+        for packed in PackedCourse.query.all():
+            usage = load.get(packed.pool_name, {}).get(f'grader-{packed.course_id}', 0)
+            if usage < DEDICATED_CPU:
+                result[RESULT_PACKED].append(packed.course_id)
+                continue
+            result[RESULT_MIGRATED].append(packed.course_id)
+            if not dry_run:
+                logger.info(f'Moving the course {packed.course_id} ({usage:.0f}m CPU) to a dedicated grader')
+                self._migrate(packed)
+                changed_pools.add(packed.pool_name)
+        for pool_name in changed_pools:
+            self.apply_pool(pool_name)
+        if changed_pools:
+            # the hub loads the new service urls when it's restarted
+            launcher = GraderServiceLauncher(org_name=self.org_name, course_id=result[RESULT_MIGRATED][0])
+            launcher.update_jhub_deployment()
+        return result
+
+    def _migrate(self, packed: PackedCourse):
+        with track_provisioning('migrate_grader'):
+            service = GraderService.query.filter_by(course_id=packed.course_id).first()
+            launcher = GraderServiceLauncher(org_name=self.org_name, course_id=packed.course_id)
+            # the grader keeps the token registered in the hub
+            launcher.grader_token = service.api_token
+            if not launcher.grader_deployment_exists():
+                launcher.create_grader_deployment()
+            service.url = launcher.service_url
+            db.session.delete(packed)
+            bump_registry_version()
+            db.session.commit()
+            services_snapshot.notify_change()
+
+    def _create_pool_deployment(self, pool_name: str, members: List[PackedCourse]) -> client.V1Deployment:
+        tokens = {
+            service.course_id: service.api_token
+            for service in GraderService.query.filter(
+                GraderService.course_id.in_([packed.course_id for packed in members])
+            )
+        }
+        containers = []
+        volumes = None
+        for packed in members:
+            launcher = GraderServiceLauncher(org_name=self.org_name, course_id=packed.course_id)
+            launcher.grader_token = tokens.get(packed.course_id)
+            container = launcher._create_container_object(name=launcher.grader_name, port=BASE_PORT + packed.slot)
+            container.resources = client.V1ResourceRequirements(
+                requests=dict(PACKED_RESOURCES['requests']), limits=dict(PACKED_RESOURCES['limits'])
+            )
+            containers.append(container)
+            volumes = launcher._create_volume_objects()
+        template = client.V1PodTemplateSpec(
+            metadata=client.V1ObjectMeta(
+                labels={'component': pool_name, 'app': 'illumidesk', POOL_LABEL: pool_name}
+            ),
+            spec=client.V1PodSpec(
+                containers=containers,
+                security_context=client.V1PodSecurityContext(run_as_user=0),
+                volumes=volumes,
+            ),
+        )
+        spec = client.V1DeploymentSpec(
+            replicas=1,
+            template=template,
+            selector={'matchLabels': {'component': pool_name}},
+            # the new pod starts next to the old one, which keeps serving the pool's courses until all the
+            # containers of the new pod are ready. A change needs room for a second pod of the pool for a while.
+            strategy=client.V1DeploymentStrategy(
+                type='RollingUpdate',
+                rolling_update=client.V1RollingUpdateDeployment(max_surge=1, max_unavailable=0),
+            ),
+        )
+        return client.V1Deployment(
+            api_version='apps/v1',
+            kind='Deployment',
+            metadata=client.V1ObjectMeta(name=pool_name, annotations={SPEC_HASH_ANNOTATION: spec_hash(spec)}),
+            spec=spec,
+        )
+
+    def _create_pool_service(self, pool_name: str, members: List[PackedCourse]) -> client.V1Service:
+        return client.V1Service(
+            kind='Service',
+            metadata=client.V1ObjectMeta(name=pool_name),
+            spec=client.V1ServiceSpec(
+                type='ClusterIP',
+                ports=[
+                    client.V1ServicePort(
+                        name=f'slot-{packed.slot}',
+                        port=BASE_PORT + packed.slot,
+                        target_port=BASE_PORT + packed.slot,
+                        protocol='TCP',
+                    )
+                    for packed in members
+                ],
+                selector={'component': pool_name},
+            ),
+        )
+
+    def _apply(self, pool_name: str, deployment: client.V1Deployment, service: client.V1Service):
+        try:
+            with kubernetes_request('read_namespaced_deployment'):
+                live = self.apps_v1.read_namespaced_deployment(
+                    name=pool_name, namespace=NAMESPACE, _request_timeout=K8S_REQUEST_TIMEOUT
+                )
+        except ApiException as e:
+            if e.status != 404:
+                raise
+            with kubernetes_request('create_namespaced_deployment'):
+                self.apps_v1.create_namespaced_deployment(
+                    namespace=NAMESPACE, body=deployment, _request_timeout=K8S_REQUEST_TIMEOUT
+                )
+            if GATEWAY_ENABLED:
+                # the grader gateway routes to the pool's containers
+                return
+            with kubernetes_request('create_namespaced_service'):
+                self.coreV1Api.create_namespaced_service(
+                    namespace=NAMESPACE, body=service, _request_timeout=K8S_REQUEST_TIMEOUT
+                )
+            return
+        # the replacement fails if another worker changed the pool since it was read
+        deployment.metadata.resource_version = live.metadata.resource_version
+        with kubernetes_request('replace_namespaced_deployment'):
+            self.apps_v1.replace_namespaced_deployment(
+                name=pool_name, namespace=NAMESPACE, body=deployment, _request_timeout=K8S_REQUEST_TIMEOUT
+            )
+        if GATEWAY_ENABLED:
+            return
+        with kubernetes_request('patch_namespaced_service'):
+            self.coreV1Api.patch_namespaced_service(
+                name=pool_name,
+                namespace=NAMESPACE,
+                body={'spec': {'ports': service.spec.ports}},
+                _request_timeout=K8S_REQUEST_TIMEOUT,
+            )
+
+    def _delete_pool(self, pool_name: str):
+        for method, api in (
+            ('delete_namespaced_service', self.coreV1Api.delete_namespaced_service),
+            ('delete_namespaced_deployment', self.apps_v1.delete_namespaced_deployment),
+        ):
+            try:
+                with kubernetes_request(method):
+                    api(name=pool_name, namespace=NAMESPACE, _request_timeout=K8S_REQUEST_TIMEOUT)
+            except ApiException as e:
+                if e.status != 404:
+                    raise
+
+
+def main():
+    from . import create_app
+
+    parser = argparse.ArgumentParser(description='Moves the packed courses that grew to dedicated graders')
+    parser.add_argument('org_name', help='the organization name used to create the graders')
+    parser.add_argument('--dry-run', action='store_true', help='only print the courses to move')
+    args = parser.parse_args()
+    create_app()
+    result = GraderPacker(args.org_name).rebalance(dry_run=args.dry_run)
+    for name, courses in result.items():
+        print(f'{name}: {len(courses)}')
+        for course_id in courses:
+            print(f'  {course_id}')
+
+
+if __name__ == '__main__':
+    main()
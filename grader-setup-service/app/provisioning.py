@@ -0,0 +1,203 @@
+"""
+Applies declarative trees of directories and files (owner, mode and content) on the shared volumes. The paths
+already correct are skipped after a stat, the others are created or fixed by a bounded pool of threads, level
+by level so the parents exist before their children, and the files are written atomically.
+
+Usage (within the grader-setup-service pod, e.g. to provision the courses of a new term in bulk):
+```
+python -m app.provisioning <org_name> <course_id> <course_id> ...
+python -m app.provisioning <org_name> --registered
+```
+"""
+import argparse
+import logging
+import os
+import stat
+
+from concurrent.futures import ThreadPoolExecutor
+
+from itertools import groupby
+
+from pathlib import Path
+
+from secrets import token_hex
+
+from typing import Dict
+from typing import Iterable
+from typing import List
+from typing import Optional
+
+
+logger = logging.getLogger(__name__)
+
+# threads applying the paths of a tree level, the NFS round trips of the paths overlap
+PROVISIONING_WORKERS = int(os.environ.get('GRADER_SETUP_PROVISIONING_WORKERS') or '16')
+
+RESULT_CREATED = 'created'
+RESULT_UPDATED = 'updated'
+RESULT_UNCHANGED = 'unchanged'
+
+
+class PathSpec:
+    """
+    The desired state of a directory (without content) or of a file
+
+    Args:
+        path: the absolute path
+        content: the file content, None for a directory
+        uid: the owner user id, None to keep the owner of the process that creates it
+        gid: the owner group id, None to keep the process group
+        mode: the permission bits, None to keep the ones given by the umask
+    """
+
+    def __init__(
+        self, path: Path, content: str = None, uid: int = None, gid: int = None, mode: int = None,
+    ):
+        self.path = Path(path)
+        self.content = content
+        self.uid = uid
+        self.gid = gid
+        self.mode = mode
+
+    @property
+    def is_file(self) -> bool:
+        return self.content is not None
+
+    def __repr__(self):
+        return "<Path spec: {} ({})>".format(self.path, 'file' if self.is_file else 'directory')
+
+
+def path_depth(spec: PathSpec) -> int:
+    return len(spec.path.parts)
+
+
+class TreeProvisioner:
+    """
+    Applies path specs idempotently
+
+    Args:
+        max_workers: threads applying the paths of the same level
+    """
+
+    def __init__(self, max_workers: int = None):
+        self.max_workers = max(1, max_workers or PROVISIONING_WORKERS)
+
+    def apply(self, specs: Iterable[PathSpec]) -> Dict[str, int]:
+        """
+        Creates the missing paths and fixes the owner, mode and content of the existing ones
+
+        Args:
+            specs: the paths to apply, the specs of a path repeated by several trees (e.g. a shared exchange
+              directory) are applied once, the last one wins
+
+        Returns:
+            The number of paths by result (created, updated or unchanged)
+        """
+        unique = {spec.path: spec for spec in specs}
+        result = {RESULT_CREATED: 0, RESULT_UPDATED: 0, RESULT_UNCHANGED: 0}
+        levels = groupby(sorted(unique.values(), key=path_depth), path_depth)
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            for _, level in levels:
+                # the errors are raised by the iteration, the next levels are not applied
+                for path_result in executor.map(self._apply_path, list(level)):
+                    result[path_result] += 1
+        logger.info(f'Provisioned {len(unique)} paths: {result}')
+        return result
+
+    def _apply_path(self, spec: PathSpec) -> str:
+        current = self._stat(spec.path)
+        if current is None:
+            if spec.is_file:
+                self._write_atomically(spec)
+            else:
+                spec.path.mkdir(parents=True, exist_ok=True)
+                self._fix_metadata(spec, self._stat(spec.path))
+            return RESULT_CREATED
+        if spec.is_file and (not stat.S_ISREG(current.st_mode) or self._content_differs(spec, current)):
+            self._write_atomically(spec)
+            return RESULT_UPDATED
+        if not spec.is_file and not stat.S_ISDIR(current.st_mode):
+            raise NotADirectoryError(f'{spec.path} is not a directory')
+        return RESULT_UPDATED if self._fix_metadata(spec, current) else RESULT_UNCHANGED
+
+    def _stat(self, path: Path) -> Optional[os.stat_result]:
+        try:
+            return os.lstat(path)
+        except FileNotFoundError:
+            return None
+
+    def _content_differs(self, spec: PathSpec, current: os.stat_result) -> bool:
+        content = spec.content.encode()
+        # the size tells most changes apart without reading the file
+        if current.st_size != len(content):
+            return True
+        return spec.path.read_bytes() != content
+
+    def _fix_metadata(self, spec: PathSpec, current: os.stat_result) -> bool:
+        """
+        Changes the owner and the mode that differ from the spec
+
+        Returns:
+            Whether the path was changed
+        """
+        changed = False
+        uid = -1 if spec.uid is None or spec.uid == current.st_uid else spec.uid
+        gid = -1 if spec.gid is None or spec.gid == current.st_gid else spec.gid
+        if uid != -1 or gid != -1:
+            os.chown(spec.path, uid, gid)
+            changed = True
+        if spec.mode is not None and stat.S_IMODE(current.st_mode) != spec.mode:
+            os.chmod(spec.path, spec.mode)
+            changed = True
+        return changed
+
+    def _write_atomically(self, spec: PathSpec):
+        """
+        Writes the file to a temporary file of the same directory, with its owner and mode, and renames it,
+        the readers see the old or the new content but never a partial file
+        """
+        spec.path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = spec.path.with_name(f'.{spec.path.name}.{token_hex(4)}.tmp')
+        try:
+            with open(temp_path, 'w') as temp_file:
+                temp_file.write(spec.content)
+                temp_file.flush()
+                os.fsync(temp_file.fileno())
+                if spec.uid is not None or spec.gid is not None:
+                    uid = -1 if spec.uid is None else spec.uid
+                    gid = -1 if spec.gid is None else spec.gid
+                    os.fchown(temp_file.fileno(), uid, gid)
+                if spec.mode is not None:
+                    os.fchmod(temp_file.fileno(), spec.mode)
+            os.replace(temp_path, spec.path)
+        except BaseException:
+            try:
+                os.unlink(temp_path)
+            except FileNotFoundError:
+                pass
+            raise
+
+
+def main():
+    from . import create_app
+    from .grader_service import grader_tree
+    from .models import GraderService
+
+    parser = argparse.ArgumentParser(description='Creates the grader directories and nbgrader files of courses')
+    parser.add_argument('org_name', help='the organization name used to create the graders')
+    parser.add_argument('course_ids', nargs='*', help='the courses to provision')
+    parser.add_argument('--registered', action='store_true', help='provision all the registered courses')
+    parser.add_argument('--workers', type=int, default=None, help='threads applying the paths')
+    args = parser.parse_args()
+    course_ids: List[str] = list(args.course_ids)
+    if args.registered:
+        create_app()
+        course_ids.extend(service.course_id for service in GraderService.query.all())
+    specs = [spec for course_id in dict.fromkeys(course_ids) for spec in grader_tree(args.org_name, course_id)]
+    result = TreeProvisioner(max_workers=args.workers).apply(specs)
+    for name, count in result.items():
+        print(f'{name}: {count}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+import json
+import logging
+import os
+import threading
+import time
+
+from typing import Optional
+from typing import Tuple
+
+from .metrics import SERVICES_SNAPSHOT_REQUESTS
+from .models import db
+from .models import GraderService
+from .models import RegistryVersion
+
+
+logger = logging.getLogger(__name__)
+
+# seconds a GET /services?since=<version> request waits for a change before it's answered with a 304
+LONG_POLL_TIMEOUT = float(os.environ.get('GRADER_SETUP_LONG_POLL_TIMEOUT') or '30')
+# seconds between the checks of the version written by the other workers while a long-poll request waits
+LONG_POLL_INTERVAL = float(os.environ.get('GRADER_SETUP_LONG_POLL_INTERVAL') or '1')
+
+REGISTRY_VERSION_ID = 1
+
+
+def ensure_registry_version():
+    """
+    Creates the registry version row if it doesn't exist
+    """
+    if RegistryVersion.query.get(REGISTRY_VERSION_ID) is None:
+        db.session.add(RegistryVersion(id=REGISTRY_VERSION_ID, version=0))
+        db.session.commit()
+
+
+def bump_registry_version():
+    """
+    Increments the registry version within the current transaction, it must be called before committing
+    the addition or deletion of a grader service
+    """
+    RegistryVersion.query.filter_by(id=REGISTRY_VERSION_ID).update(
+        {RegistryVersion.version: RegistryVersion.version + 1}, synchronize_session=False
+    )
+
+
+def read_registry_version() -> int:
+    """
+    Returns the committed registry version, read outside of the request's session so a long-poll request
+    doesn't keep a transaction (and its snapshot of the database) open while it waits
+    """
+    table = RegistryVersion.__table__
+    with db.engine.connect() as connection:
+        version = connection.execute(
+            db.select([table.c.version]).where(table.c.id == REGISTRY_VERSION_ID)
+        ).scalar()
+    return version or 0
+
+
+class ServicesSnapshot:
+    """
+    The services and groups document served by GET /services, rendered again only when the registry
+    version changed. Each worker keeps its own copy and checks the version with a single row lookup.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._changed = threading.Condition()
+        self.version: Optional[int] = None
+        self.body: Optional[bytes] = None
+
+    def current(self) -> Tuple[int, bytes]:
+        """
+        Returns the registry version and the json document of the services registered with it
+        """
+        version = read_registry_version()
+        with self._lock:
+            if version != self.version:
+                self._render(version)
+            else:
+                SERVICES_SNAPSHOT_REQUESTS.labels(result='cached').inc()
+            return self.version, self.body
+
+    def _render(self, version: int):
+        while True:
+            services = GraderService.query.all()
+            # a service registered while the document was rendered belongs to the next version
+            latest = read_registry_version()
+            if latest == version:
+                break
+            version = latest
+        # format a json
+        services_resp = []
+        groups_resp = {}
+        for s in services:
+            services_resp.append({
+                'name': s.name,
+                'url': s.url,
+                'oauth_no_confirm': s.oauth_no_confirm,
+                'admin': s.admin,
+                'api_token': s.api_token
+            })
+            # add the jhub user group
+            groups_resp.update({f'formgrade-{s.course_id}': [f'grader-{s.course_id}']})
+        self.body = json.dumps({'services': services_resp, 'groups': groups_resp}).encode()
+        self.version = version
+        SERVICES_SNAPSHOT_REQUESTS.labels(result='rendered').inc()
+        logger.debug(f'Rendered the services registry version {version} with {len(services_resp)} services')
+
+    def wait_for_change(self, since: int, timeout: float) -> bool:
+        """
+        Waits until the registry version is greater than since. The writes of this worker wake the waiting
+        requests right away, the writes of the other workers are noticed every LONG_POLL_INTERVAL seconds.
+
+        Returns:
+            False if the version didn't change within the timeout
+        """
+        deadline = time.monotonic() + timeout
+        while read_registry_version() <= since:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            with self._changed:
+                self._changed.wait(min(remaining, LONG_POLL_INTERVAL))
+        return True
+
+    def notify_change(self):
+        """
+        Wakes the long-poll requests of this worker, called after a write is committed
+        """
+        with self._changed:
+            self._changed.notify_all()
+
+
+services_snapshot = ServicesSnapshot()
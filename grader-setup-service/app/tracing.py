@@ -0,0 +1,132 @@
+import logging
+import os
+
+from contextlib import contextmanager
+
+from flask import Flask
+from flask import request
+
+try:
+    from opentelemetry import context
+    from opentelemetry import propagate
+    from opentelemetry import trace
+except ImportError:  # tracing is optional
+    context = None
+    propagate = None
+    trace = None
+
+
+logger = logging.getLogger(__name__)
+
+# span exporter: otlp (sends the spans to the collector set with the standard OTEL_EXPORTER_OTLP_* env vars),
+# file (json lines written to ILLUMIDESK_TRACING_FILE) or console. Tracing is disabled if it's not set.
+TRACING_EXPORTER = os.environ.get('ILLUMIDESK_TRACING_EXPORTER', '').lower()
+TRACING_FILE = os.environ.get('ILLUMIDESK_TRACING_FILE') or '/tmp/grader-setup-service-traces.jsonl'
+TRACING_SERVICE_NAME = os.environ.get('OTEL_SERVICE_NAME') or 'grader-setup-service'
+
+_tracer = None
+
+
+def _create_tracer():
+    """
+    Creates the tracer with the exporter set in ILLUMIDESK_TRACING_EXPORTER, or returns None when tracing
+    is disabled or the opentelemetry packages are not installed
+    """
+    if not TRACING_EXPORTER:
+        return None
+    if trace is None:
+        logger.warning('Tracing is not available, the opentelemetry-sdk package is not installed')
+        return None
+    try:
+        from opentelemetry.sdk.resources import Resource
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import BatchSpanProcessor
+        from opentelemetry.sdk.trace.export import ConsoleSpanExporter
+
+        if TRACING_EXPORTER == 'otlp':
+            from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+
+            exporter = OTLPSpanExporter()
+        elif TRACING_EXPORTER == 'file':
+            exporter = ConsoleSpanExporter(
+                out=open(TRACING_FILE, 'a'), formatter=lambda span: span.to_json(indent=None) + os.linesep
+            )
+        elif TRACING_EXPORTER == 'console':
+            exporter = ConsoleSpanExporter()
+        else:
+            logger.error(f'Unknown tracing exporter: {TRACING_EXPORTER}')
+            return None
+    except ImportError as e:
+        logger.error(f'Tracing is disabled, the exporter {TRACING_EXPORTER} is not available: {e}')
+        return None
+    provider = TracerProvider(resource=Resource.create({'service.name': TRACING_SERVICE_NAME}))
+    provider.add_span_processor(BatchSpanProcessor(exporter))
+    logger.info(f'Tracing enabled with the {TRACING_EXPORTER} exporter')
+    return provider.get_tracer('grader-setup-service')
+
+
+def init_tracer() -> None:
+    """
+    Creates the tracer of the process. The gunicorn workers call it after the fork (post_fork), the app is
+    preloaded in the master and the span processor's export thread doesn't survive a fork.
+    """
+    global _tracer
+    _tracer = _create_tracer()
+
+
+def init_app(flask_app: Flask) -> None:
+    """
+    Runs every request within a server span that continues the trace sent by the hub in the traceparent
+    header, so the provisioning and Kubernetes spans are part of the launch trace. The requests are traced
+    once the process created its tracer with init_tracer.
+    """
+    if not TRACING_EXPORTER:
+        return
+
+    @flask_app.before_request
+    def start_request_span():
+        if _tracer is None:
+            return
+        parent = propagate.extract(dict(request.headers))
+        span = _tracer.start_span(
+            f'{request.method} {request.url_rule.rule if request.url_rule else request.path}',
+            context=parent,
+            kind=trace.SpanKind.SERVER,
+            attributes={'http.method': request.method, 'http.target': request.path},
+        )
+        # kept in the wsgi environ, g is shared by the requests because create_app pushes an app context
+        request.environ['illumidesk.tracing_span'] = span
+        request.environ['illumidesk.tracing_token'] = context.attach(trace.set_span_in_context(span, parent))
+
+    @flask_app.after_request
+    def record_response_status(response):
+        span = request.environ.get('illumidesk.tracing_span')
+        if span is not None:
+            span.set_attribute('http.status_code', response.status_code)
+            if response.status_code >= 500:
+                span.set_status(trace.Status(trace.StatusCode.ERROR))
+        return response
+
+    @flask_app.teardown_request
+    def end_request_span(error=None):
+        span = request.environ.pop('illumidesk.tracing_span', None)
+        if span is None:
+            return
+        if error is not None:
+            span.record_exception(error)
+            span.set_status(trace.Status(trace.StatusCode.ERROR, str(error)))
+        span.end()
+        context.detach(request.environ.pop('illumidesk.tracing_token'))
+
+
+@contextmanager
+def start_span(name: str, **attributes):
+    """
+    Starts a span as a child of the current span (the request span within a request). Yields None when
+    tracing is disabled.
+    """
+    if _tracer is None:
+        yield None
+        return
+    with _tracer.start_as_current_span(name, attributes=attributes) as span:
+        yield span
@@ -0,0 +1,51 @@
+"""
+Gunicorn settings for the grader-setup-service.
+
+The provisioning requests spend most of their time waiting for the Kubernetes API and the shared volume, so
+each worker process serves several requests at the same time with threads. The workers share the database
+(sqlite in WAL mode or the database set with GRADER_SETUP_DATABASE_URL) and the prometheus metrics directory.
+"""
+import multiprocessing
+import os
+import shutil
+
+from prometheus_client import multiprocess
+
+
+bind = os.environ.get('GRADER_SETUP_BIND') or '0.0.0.0:8000'
+# worker processes, the CPU count by default
+workers = int(os.environ.get('GRADER_SETUP_WORKERS') or multiprocessing.cpu_count())
+# threads by worker, the requests served at the same time are workers * threads
+worker_class = 'gthread'
+threads = int(os.environ.get('GRADER_SETUP_THREADS') or '8')
+# seconds a request can run before its worker is restarted, longer than the Kubernetes API timeouts
+timeout = int(os.environ.get('GRADER_SETUP_REQUEST_TIMEOUT') or '120')
+graceful_timeout = int(os.environ.get('GRADER_SETUP_GRACEFUL_TIMEOUT') or '30')
+keepalive = 5
+# the app (and the database tables) is created once in the master before the workers are forked, the workers
+# create their tracer after the fork
+preload_app = True
+accesslog = '-'
+
+
+def on_starting(server):
+    # the metrics of the previous run are discarded
+    metrics_dir = os.environ.get('prometheus_multiproc_dir')
+    if metrics_dir:
+        shutil.rmtree(metrics_dir, ignore_errors=True)
+        os.makedirs(metrics_dir, exist_ok=True)
+
+
+def post_fork(server, worker):
+    # the connections opened by the master can't be shared with the workers
+    from app.models import db
+    from app.tracing import init_tracer
+
+    db.engine.dispose()
+    # the span processor's export thread of a tracer created in the master doesn't survive the fork
+    init_tracer()
+
+
+def child_exit(server, worker):
+    if os.environ.get('prometheus_multiproc_dir'):
+        multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,77 @@
+import os
+import tempfile
+
+# the app reads its settings when it's imported, the tests use a sqlite database in a temporary directory
+os.environ.setdefault(
+    'GRADER_SETUP_DATABASE_URL', 'sqlite:///{}'.format(os.path.join(tempfile.mkdtemp(), 'gradersetup.sqlite3'))
+)
+
+import pytest  # noqa: E402
+
+from types import SimpleNamespace  # noqa: E402
+
+from unittest.mock import patch  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def kubernetes_api():
+    """
+    Mocks the kubernetes config and API clients, the tests never reach a cluster
+    """
+    with patch('kubernetes.config.load_incluster_config'), patch('kubernetes.config.load_kube_config'), patch(
+        'kubernetes.client.AppsV1Api'
+    ) as mock_apps_v1, patch('kubernetes.client.CoreV1Api') as mock_core_v1, patch(
+        'kubernetes.client.CustomObjectsApi'
+    ) as mock_custom_objects:
+        yield SimpleNamespace(
+            apps_v1=mock_apps_v1.return_value,
+            core_v1=mock_core_v1.return_value,
+            custom_objects=mock_custom_objects.return_value,
+        )
+
+
+@pytest.fixture(scope='session')
+def flask_app():
+    """
+    The service app, with the database tables created
+    """
+    from app.main import app
+
+    return app
+
+
+@pytest.fixture(scope='function')
+def db_session(flask_app):
+    """
+    Returns the database session, the registered courses are deleted after the test
+    """
+    from app.models import db
+    from app.models import GraderService
+    from app.models import PackedCourse
+    from app.models import RegistryVersion
+
+    yield db.session
+    db.session.rollback()
+    PackedCourse.query.delete()
+    GraderService.query.delete()
+    RegistryVersion.query.update({RegistryVersion.version: 0})
+    db.session.commit()
+
+
+@pytest.fixture(scope='function')
+def make_deployment():
+    """
+    Returns a function that builds a deployment like the ones listed by the kubernetes client
+    """
+
+    def _make_deployment(name: str, annotations: dict = None, replicas: int = 1, containers: list = None):
+        return SimpleNamespace(
+            metadata=SimpleNamespace(name=name, annotations=annotations, resource_version='1'),
+            spec=SimpleNamespace(
+                replicas=replicas,
+                strategy=None,
+                template=SimpleNamespace(spec=SimpleNamespace(containers=containers or [])),
+            ),
+        )
+
+    return _make_deployment
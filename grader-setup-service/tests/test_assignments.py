@@ -0,0 +1,54 @@
+import pytest
+
+from unittest.mock import patch
+
+from app import assignments
+from app.assignments import AssignmentDirectories
+
+
+@pytest.fixture(scope='function')
+def course_dir(tmp_path, monkeypatch):
+    """
+    Returns the grader course directory within a temporary directory, the owner changes are mocked
+    """
+    monkeypatch.setattr(assignments, 'grader_course_dir', lambda org_name, course_id: tmp_path / course_id)
+    with patch.object(assignments.shutil, 'chown'):
+        yield tmp_path / 'intro101'
+
+
+def test_ensure_creates_the_missing_directories_once(course_dir):
+    """
+    Are the missing directories created, and the directories already seen skipped without a stat?
+    """
+    course_dir.joinpath('source', 'lab2').mkdir(parents=True)
+    directories = AssignmentDirectories()
+
+    assert directories.ensure('test-org', 'intro101', ['lab1', 'lab2', 'lab1']) == ['lab1']
+    assert course_dir.joinpath('source', 'lab1').is_dir()
+
+    course_dir.joinpath('source', 'lab1').rmdir()
+    # the cached directory isn't checked again
+    assert directories.ensure('test-org', 'intro101', ['lab1']) == []
+    assert not course_dir.joinpath('source', 'lab1').exists()
+
+
+def test_ensure_forgets_the_least_recently_used_directories(course_dir):
+    """
+    Is a directory checked again once it was evicted from the cache?
+    """
+    directories = AssignmentDirectories(max_size=1)
+    directories.ensure('test-org', 'intro101', ['lab1', 'lab2'])
+    course_dir.joinpath('source', 'lab1').rmdir()
+
+    assert directories.ensure('test-org', 'intro101', ['lab1']) == ['lab1']
+
+
+@pytest.mark.parametrize('assignment_name', ['', '.', '..', 'lab1/../../etc', 'lab\0'])
+def test_ensure_rejects_invalid_names_before_creating_directories(course_dir, assignment_name):
+    """
+    Is an invalid assignment name rejected without creating the valid ones?
+    """
+    with pytest.raises(ValueError):
+        AssignmentDirectories().ensure('test-org', 'intro101', ['lab1', assignment_name])
+
+    assert not course_dir.exists()
@@ -0,0 +1,93 @@
+from datetime import datetime
+
+from types import SimpleNamespace
+
+import pytest
+
+from app.deadline_scaler import BOOSTED_UNTIL_ANNOTATION
+from app.deadline_scaler import DEADLINE_RESOURCES
+from app.deadline_scaler import DeadlineScaler
+from app.deadline_scaler import PRESTARTED_ANNOTATION
+from app.grader_service import GRADER_RESOURCES
+
+
+WINDOW_END = datetime(2020, 10, 1, 12, 0, 0)
+
+
+@pytest.fixture(scope='function')
+def make_grader(make_deployment):
+    """
+    Returns a function that builds a grader deployment with the resources of its notebook container
+    """
+
+    def _make_grader(resources: dict, annotations: dict = None, replicas: int = 1):
+        container = SimpleNamespace(
+            name='grader-notebook',
+            resources=SimpleNamespace(requests=resources['requests'], limits=resources['limits']),
+        )
+        return make_deployment('grader-intro101', annotations=annotations, replicas=replicas, containers=[container])
+
+    return _make_grader
+
+
+def test_patch_raises_the_resources_within_the_deadline_window(make_grader):
+    """
+    Does a grader with the default resources get the deadline resources and the window end?
+    """
+    patch = DeadlineScaler('test-org')._patch(make_grader(GRADER_RESOURCES), WINDOW_END)
+
+    assert patch['metadata']['annotations'] == {BOOSTED_UNTIL_ANNOTATION: WINDOW_END.isoformat()}
+    assert patch['spec'] == {
+        'template': {'spec': {'containers': [{'name': 'grader-notebook', 'resources': DEADLINE_RESOURCES}]}}
+    }
+
+
+def test_patch_returns_none_for_an_up_to_date_grader(make_grader):
+    """
+    Is a boosted grader within its window, or a grader with the default resources out of it, left as is?
+    """
+    scaler = DeadlineScaler('test-org')
+    boosted = make_grader(DEADLINE_RESOURCES, annotations={BOOSTED_UNTIL_ANNOTATION: WINDOW_END.isoformat()})
+
+    assert scaler._patch(boosted, WINDOW_END) is None
+    assert scaler._patch(make_grader(GRADER_RESOURCES), None) is None
+
+
+def test_patch_compares_the_resources_by_quantity(make_grader):
+    """
+    Is a boosted grader whose resources are returned in another notation (2000m, 2048Mi) left as is?
+    """
+    live_resources = {
+        'requests': {'cpu': '0.5', 'memory': '500Mi'},
+        'limits': {'cpu': '2000m', 'memory': '2048Mi'},
+    }
+    boosted = make_grader(live_resources, annotations={BOOSTED_UNTIL_ANNOTATION: WINDOW_END.isoformat()})
+
+    assert DeadlineScaler('test-org')._patch(boosted, WINDOW_END) is None
+    assert DeadlineScaler('test-org')._patch(boosted, None)['spec']['template']
+
+
+def test_patch_scales_a_stopped_grader_for_the_deadline_and_back(make_grader):
+    """
+    Is a grader scaled to zero started for the window, and scaled to zero again after it?
+    """
+    scaler = DeadlineScaler('test-org')
+
+    started = scaler._patch(make_grader(GRADER_RESOURCES, replicas=0), WINDOW_END)
+    assert started['spec']['replicas'] == 1
+    assert started['metadata']['annotations'][PRESTARTED_ANNOTATION] == 'true'
+
+    annotations = {BOOSTED_UNTIL_ANNOTATION: WINDOW_END.isoformat(), PRESTARTED_ANNOTATION: 'true'}
+    stopped = scaler._patch(make_grader(DEADLINE_RESOURCES, annotations=annotations), None)
+    assert stopped['spec']['replicas'] == 0
+    assert stopped['spec']['template']['spec']['containers'][0]['resources'] == GRADER_RESOURCES
+    assert stopped['metadata']['annotations'] == {BOOSTED_UNTIL_ANNOTATION: None, PRESTARTED_ANNOTATION: None}
+
+
+def test_patch_skips_the_deployments_without_a_grader_container(make_deployment):
+    """
+    Is a deployment without the grader-notebook container (e.g. a grader pool) skipped?
+    """
+    pool = make_deployment('grader-pool-abcd', containers=[SimpleNamespace(name='grader-intro101', resources=None)])
+
+    assert DeadlineScaler('test-org')._patch(pool, WINDOW_END) is None
@@ -0,0 +1,73 @@
+import os
+
+import pytest
+
+from app import exchange
+from app.exchange import ExchangeIndex
+from app.exchange import parse_entry
+
+
+@pytest.fixture(scope='function')
+def course_exchange(tmp_path, monkeypatch):
+    """
+    Returns the exchange directory of a course within a temporary exchange root
+    """
+    monkeypatch.setattr(exchange, 'EXCHANGE_MNT_ROOT', str(tmp_path))
+    course_exchange_dir = tmp_path / 'test-org' / 'exchange' / 'intro101'
+    for directory in ('outbound', 'inbound', 'feedback'):
+        course_exchange_dir.joinpath(directory).mkdir(parents=True)
+    return course_exchange_dir
+
+
+def test_parse_entry_splits_the_submission_names(tmp_path):
+    """
+    Are the student, assignment and timestamp read from the submission names?
+    """
+    tmp_path.joinpath('student1+lab1+2020-10-01 10:00:00.000000 UTC+abcd').mkdir()
+    tmp_path.joinpath('lab1').mkdir()
+    tmp_path.joinpath('unexpected').mkdir()
+    entries = {entry.name: entry for entry in os.scandir(tmp_path)}
+
+    submitted = parse_entry('submitted', entries['student1+lab1+2020-10-01 10:00:00.000000 UTC+abcd'])
+    released = parse_entry('released', entries['lab1'])
+
+    assert submitted['student_id'] == 'student1'
+    assert submitted['assignment_id'] == 'lab1'
+    assert submitted['timestamp'] == '2020-10-01 10:00:00.000000 UTC'
+    assert released['assignment_id'] == 'lab1'
+    assert 'student_id' not in parse_entry('submitted', entries['unexpected'])
+
+
+def test_refresh_lists_only_the_directories_that_changed(course_exchange):
+    """
+    Is the index saved and are the directories whose mtime didn't change taken from it?
+    """
+    course_exchange.joinpath('outbound', 'lab1').mkdir()
+    index = ExchangeIndex('test-org', 'intro101')
+
+    first = index.refresh()
+    assert index.index_path.exists()
+    assert [item['name'] for item in first['entries']['released']] == ['lab1']
+    assert first['entries']['submitted'] == []
+
+    course_exchange.joinpath('inbound', 'student1+lab1+2020-10-01 10:00:00.000000 UTC').mkdir()
+    # a saved entry of an unchanged directory is kept as is
+    saved = index._load()
+    saved['entries']['released'][0]['name'] = 'from-the-index'
+    index.index_path.write_text(exchange.json.dumps(saved))
+
+    second = index.refresh()
+    assert [item['name'] for item in second['entries']['released']] == ['from-the-index']
+    assert [item['student_id'] for item in second['entries']['submitted']] == ['student1']
+    assert [item['name'] for item in index.refresh(force=True)['entries']['released']] == ['lab1']
+
+
+def test_read_filters_the_entries_by_kind(course_exchange):
+    """
+    Are only the entries of the kind returned, and an unknown kind rejected?
+    """
+    index = ExchangeIndex('test-org', 'intro101')
+
+    assert list(index.read('feedback')['entries']) == ['feedback']
+    with pytest.raises(ValueError):
+        index.read('unknown')
@@ -0,0 +1,48 @@
+import pytest
+
+from app.fleet import FleetReconciler
+from app.fleet import RESULT_MISSING
+from app.fleet import RESULT_UNCHANGED
+from app.fleet import RESULT_UPDATED
+from app.fleet import parse_rollout_quantity
+from app.grader_service import SPEC_HASH_ANNOTATION
+
+
+def test_plan_compares_the_spec_hashes(make_deployment):
+    """
+    Are the graders sorted by the hash of their live deployment spec?
+    """
+    desired = {
+        name: make_deployment(name, annotations={SPEC_HASH_ANNOTATION: 'new'})
+        for name in ('grader-intro101', 'grader-intro102', 'grader-intro103', 'grader-intro104')
+    }
+    live = {
+        'grader-intro101': make_deployment('grader-intro101', annotations={SPEC_HASH_ANNOTATION: 'old'}),
+        'grader-intro102': make_deployment('grader-intro102', annotations={SPEC_HASH_ANNOTATION: 'new'}),
+        # created before the annotation was added
+        'grader-intro103': make_deployment('grader-intro103'),
+    }
+
+    assert FleetReconciler('test-org')._plan(desired, live) == {
+        RESULT_UPDATED: ['grader-intro101', 'grader-intro103'],
+        RESULT_UNCHANGED: ['grader-intro102'],
+        RESULT_MISSING: ['grader-intro104'],
+    }
+
+
+@pytest.mark.parametrize('value, quantity', [(None, None), ('', None), ('1', 1), ('25%', '25%')])
+def test_parse_rollout_quantity(value, quantity):
+    """
+    Are the surge settings read as a number of pods or a percentage?
+    """
+    assert parse_rollout_quantity(value) == quantity
+
+
+def test_reconciler_rejects_a_rollout_without_surge_or_unavailable_pods():
+    """
+    Is a rollout that can neither start nor stop a pod rejected?
+    """
+    with pytest.raises(ValueError):
+        parse_rollout_quantity('one')
+    with pytest.raises(ValueError):
+        FleetReconciler('test-org', max_surge='0', max_unavailable='0%')
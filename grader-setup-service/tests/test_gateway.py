@@ -0,0 +1,60 @@
+from types import SimpleNamespace
+
+import pytest
+
+from app.gateway import pod_routes
+
+
+@pytest.fixture(scope='function')
+def make_pod():
+    """
+    Returns a function that builds a grader pod with a notebook container per course
+    """
+
+    def _make_pod(course_ports: dict, ready: bool = True, pod_ip: str = '10.0.0.5', deleting: bool = False):
+        containers = [
+            SimpleNamespace(
+                name=f'grader-{course_id}',
+                env=[SimpleNamespace(name='JUPYTERHUB_SERVICE_NAME', value=course_id)],
+                ports=[SimpleNamespace(container_port=port)],
+            )
+            for course_id, port in course_ports.items()
+        ]
+        return SimpleNamespace(
+            metadata=SimpleNamespace(deletion_timestamp='2020-10-01T10:00:00Z' if deleting else None),
+            spec=SimpleNamespace(containers=containers),
+            status=SimpleNamespace(
+                pod_ip=pod_ip,
+                conditions=[SimpleNamespace(type='Ready', status='True' if ready else 'False')],
+            ),
+        )
+
+    return _make_pod
+
+
+def test_pod_routes_returns_the_address_of_each_course(make_pod):
+    """
+    Does a ready pool pod route each course to its container's port?
+    """
+    pod = make_pod({'intro101': 8888, 'intro102': 8889})
+
+    assert pod_routes(pod) == {'intro101': '10.0.0.5:8888', 'intro102': '10.0.0.5:8889'}
+
+
+@pytest.mark.parametrize('options', [{'ready': False}, {'pod_ip': None}, {'deleting': True}])
+def test_pod_routes_skips_the_pods_not_serving_requests(make_pod, options):
+    """
+    Are the pods not ready, without an ip or being deleted left out of the routes?
+    """
+    assert pod_routes(make_pod({'intro101': 8888}, **options)) == {}
+
+
+def test_pod_routes_skips_the_containers_without_a_service_name(make_pod):
+    """
+    Are the containers without the JUPYTERHUB_SERVICE_NAME env var or without ports skipped?
+    """
+    pod = make_pod({'intro101': 8888, 'intro102': 8889})
+    pod.spec.containers[0].env = None
+    pod.spec.containers[1].ports = []
+
+    assert pod_routes(pod) == {}
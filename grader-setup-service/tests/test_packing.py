@@ -0,0 +1,92 @@
+import pytest
+
+from app.grader_service import GRADER_RESOURCES
+from app.models import GraderService
+from app.models import PackedCourse
+from app.packing import GraderPacker
+from app.packing import PACKED_RESOURCES
+from app.packing import POOL_MAX_CPU
+from app.packing import POOL_SIZE
+from app.packing import parse_cpu
+
+
+@pytest.mark.parametrize('quantity, millicores', [('250m', 250), ('1', 1000), ('12345678n', 12.345678), (None, 0)])
+def test_parse_cpu_returns_the_millicores(quantity, millicores):
+    """
+    Are the kubernetes CPU quantities converted to millicores?
+    """
+    assert parse_cpu(quantity) == pytest.approx(millicores)
+
+
+def test_place_creates_a_pool_when_there_are_no_pools(db_session):
+    """
+    Is the first course placed in the first slot of a new pool?
+    """
+    pool_name, slot = GraderPacker('test-org').place(load={})
+
+    assert pool_name.startswith('grader-pool-')
+    assert slot == 0
+
+
+def test_place_picks_the_least_loaded_pool_and_its_first_free_slot(db_session):
+    """
+    Is the course placed in the free slot of the pool using less CPU?
+    """
+    db_session.add_all(
+        [
+            PackedCourse(course_id='intro101', pool_name='grader-pool-busy', slot=0),
+            PackedCourse(course_id='intro102', pool_name='grader-pool-idle', slot=0),
+            PackedCourse(course_id='intro103', pool_name='grader-pool-idle', slot=2),
+        ]
+    )
+    db_session.commit()
+    load = {'grader-pool-busy': {'grader-intro101': 400}, 'grader-pool-idle': {'grader-intro102': 50}}
+
+    assert GraderPacker('test-org').place(load=load) == ('grader-pool-idle', 1)
+
+
+def test_place_skips_the_full_and_the_overloaded_pools(db_session):
+    """
+    Is a new pool created when the pools are full or use more than the maximum CPU?
+    """
+    db_session.add_all(
+        [PackedCourse(course_id=f'full{slot}', pool_name='grader-pool-full', slot=slot) for slot in range(POOL_SIZE)]
+        + [PackedCourse(course_id='hot', pool_name='grader-pool-hot', slot=0)]
+    )
+    db_session.commit()
+
+    pool_name, slot = GraderPacker('test-org').place(load={'grader-pool-hot': {'grader-hot': POOL_MAX_CPU}})
+
+    assert pool_name not in ('grader-pool-full', 'grader-pool-hot')
+    assert slot == 0
+
+
+def test_pool_deployment_rolls_out_with_smaller_container_requests(db_session):
+    """
+    Is the pool replaced with a rolling update, and do its containers request less than a dedicated grader?
+    """
+    members = [PackedCourse(course_id=f'intro10{slot}', pool_name='grader-pool-test', slot=slot) for slot in range(2)]
+    db_session.add_all(
+        [
+            GraderService(
+                name=packed.course_id,
+                course_id=packed.course_id,
+                url=f'http://grader-pool-test:{8888 + packed.slot}',
+                api_token='token',
+            )
+            for packed in members
+        ]
+    )
+    db_session.commit()
+
+    deployment = GraderPacker('test-org')._create_pool_deployment('grader-pool-test', members)
+
+    strategy = deployment.spec.strategy
+    assert strategy.type == 'RollingUpdate'
+    assert (strategy.rolling_update.max_surge, strategy.rolling_update.max_unavailable) == (1, 0)
+    containers = deployment.spec.template.spec.containers
+    assert [container.ports[0].container_port for container in containers] == [8888, 8889]
+    for container in containers:
+        assert container.resources.requests == PACKED_RESOURCES['requests']
+        assert container.resources.requests != GRADER_RESOURCES['requests']
+        assert container.resources.limits == GRADER_RESOURCES['limits']
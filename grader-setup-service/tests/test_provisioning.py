@@ -0,0 +1,71 @@
+import os
+import stat
+
+import pytest
+
+from app.provisioning import PathSpec
+from app.provisioning import RESULT_CREATED
+from app.provisioning import RESULT_UNCHANGED
+from app.provisioning import RESULT_UPDATED
+from app.provisioning import TreeProvisioner
+
+
+def test_apply_creates_the_tree_and_skips_it_when_applied_again(tmp_path):
+    """
+    Are the missing paths created, parents first, and left unchanged by a second apply?
+    """
+    specs = [
+        PathSpec(tmp_path / 'course' / 'source' / 'nbgrader_config.py', content='c = get_config()\n', mode=0o644),
+        PathSpec(tmp_path / 'course' / 'source', mode=0o755),
+        PathSpec(tmp_path / 'course', mode=0o750),
+    ]
+    provisioner = TreeProvisioner(max_workers=2)
+
+    assert provisioner.apply(specs) == {RESULT_CREATED: 3, RESULT_UPDATED: 0, RESULT_UNCHANGED: 0}
+    assert (tmp_path / 'course' / 'source' / 'nbgrader_config.py').read_text() == 'c = get_config()\n'
+    assert stat.S_IMODE(os.stat(tmp_path / 'course').st_mode) == 0o750
+    assert provisioner.apply(specs) == {RESULT_CREATED: 0, RESULT_UPDATED: 0, RESULT_UNCHANGED: 3}
+
+
+def test_apply_fixes_the_mode_and_the_content_of_existing_paths(tmp_path):
+    """
+    Are the directories with another mode and the files with another content updated?
+    """
+    directory = tmp_path / 'exchange'
+    directory.mkdir(mode=0o700)
+    config = tmp_path / 'nbgrader_config.py'
+    config.write_text('old')
+
+    result = TreeProvisioner(max_workers=1).apply(
+        [PathSpec(directory, mode=0o777), PathSpec(config, content='new', mode=0o644)]
+    )
+
+    assert result == {RESULT_CREATED: 0, RESULT_UPDATED: 2, RESULT_UNCHANGED: 0}
+    assert stat.S_IMODE(os.stat(directory).st_mode) == 0o777
+    assert config.read_text() == 'new'
+    assert stat.S_IMODE(os.stat(config).st_mode) == 0o644
+    # the temporary files are renamed
+    assert sorted(path.name for path in tmp_path.iterdir()) == ['exchange', 'nbgrader_config.py']
+
+
+def test_apply_applies_the_last_spec_of_a_repeated_path(tmp_path):
+    """
+    Is a path repeated by several trees applied once with its last spec?
+    """
+    config = tmp_path / 'nbgrader_config.py'
+
+    result = TreeProvisioner(max_workers=1).apply([PathSpec(config, content='first'), PathSpec(config, content='last')])
+
+    assert result[RESULT_CREATED] == 1
+    assert config.read_text() == 'last'
+
+
+def test_apply_raises_when_a_directory_is_a_file(tmp_path):
+    """
+    Is a NotADirectoryError raised when a directory spec points to a file?
+    """
+    path = tmp_path / 'source'
+    path.write_text('not a directory')
+
+    with pytest.raises(NotADirectoryError):
+        TreeProvisioner(max_workers=1).apply([PathSpec(path)])
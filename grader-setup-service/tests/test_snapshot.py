@@ -0,0 +1,85 @@
+import json
+
+from unittest.mock import patch
+
+from app import main
+from app.models import GraderService
+from app.snapshot import bump_registry_version
+from app.snapshot import services_snapshot
+from app.snapshot import ServicesSnapshot
+
+
+def add_service(db_session, course_id: str):
+    db_session.add(GraderService(name=course_id, course_id=course_id, url=f'http://grader-{course_id}:8888'))
+    bump_registry_version()
+    db_session.commit()
+
+
+def test_current_renders_the_services_again_when_the_version_changes(db_session):
+    """
+    Is the document cached until a service is registered with a new version?
+    """
+    snapshot = ServicesSnapshot()
+    version, body = snapshot.current()
+
+    assert snapshot.current() == (version, body)
+    assert json.loads(body) == {'services': [], 'groups': {}}
+
+    add_service(db_session, 'intro101')
+    new_version, new_body = snapshot.current()
+
+    assert new_version == version + 1
+    assert [service['name'] for service in json.loads(new_body)['services']] == ['intro101']
+    assert json.loads(new_body)['groups'] == {'formgrade-intro101': ['grader-intro101']}
+
+
+def test_services_responds_with_a_304_for_a_matching_etag(flask_app, db_session):
+    """
+    Is a request with the current version as If-None-Match answered without a body?
+    """
+    add_service(db_session, 'intro101')
+    client = flask_app.test_client()
+
+    response = client.get('/services')
+    version = response.headers['X-Services-Version']
+    assert response.status_code == 200
+    assert response.headers['ETag'] == f'"{version}"'
+
+    cached = client.get('/services', headers={'If-None-Match': f'"{version}"'})
+    assert cached.status_code == 304
+    assert cached.data == b''
+
+
+def test_services_long_poll_responds_with_a_304_without_changes(flask_app, db_session):
+    """
+    Does a request since the current version respond with a 304 after the timeout, and with the services
+    once the version changed?
+    """
+    client = flask_app.test_client()
+    version, _ = services_snapshot.current()
+
+    assert client.get(f'/services?since={version}&timeout=0').status_code == 304
+
+    add_service(db_session, 'intro101')
+    response = client.get(f'/services?since={version}&timeout=0')
+    assert response.status_code == 200
+    assert int(response.headers['X-Services-Version']) == version + 1
+    assert [service['name'] for service in response.get_json()['services']] == ['intro101']
+
+
+def test_services_long_poll_responds_right_away_without_a_free_waiter(flask_app, db_session):
+    """
+    Is a long poll answered with a 304 without waiting when the worker's waiters are taken?
+    """
+    client = flask_app.test_client()
+    version, _ = services_snapshot.current()
+
+    with patch.object(main, 'long_poll_waiters') as mock_waiters:
+        mock_waiters.acquire.return_value = False
+        with patch.object(services_snapshot, 'wait_for_change') as mock_wait:
+            response = client.get(f'/services?since={version}')
+
+    assert response.status_code == 304
+    assert 'Retry-After' in response.headers
+    assert not mock_wait.called
+    assert not mock_waiters.release.called
@@ -0,0 +1,7 @@
+"""
+Micro-benchmarks of the per-request hot paths (pytest-benchmark).
+
+The benchmark modules are named ``bench_*.py`` so they are not collected with the test suite. Run them
+from the repository root with ``make benchmark-baseline`` (records the baseline of this machine, on the base
+branch) and ``make benchmark`` (compares against the baseline and fails on regressions).
+"""
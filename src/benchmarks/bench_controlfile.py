@@ -0,0 +1,61 @@
+import copy
+import pytest
+
+from illumidesk.grades.sender_controlfile import LTIGradesSenderControlFile
+
+from benchmarks.conftest import COURSE_SIZES
+
+
+OUTCOME_SERVICE_URL = 'https://lms.benchmark.example.com/api/lti/v1/tools/1/grade_passback'
+
+
+@pytest.fixture(scope='function')
+def control_file(tmp_path, monkeypatch):
+    """
+    Control file in a temporary course directory, the class-wide cache is restored after the benchmark
+    """
+    monkeypatch.setattr(LTIGradesSenderControlFile, 'FILE_LOADED', False)
+    monkeypatch.setattr(LTIGradesSenderControlFile, 'cache_sender_data', {})
+    monkeypatch.setattr(LTIGradesSenderControlFile, 'lock_file', str(tmp_path / 'grades-sender.lock'))
+    return LTIGradesSenderControlFile(str(tmp_path / 'intro101'))
+
+
+def _registered_students(students: int) -> dict:
+    return {
+        'assignment1': {
+            'lis_outcome_service_url': OUTCOME_SERVICE_URL,
+            'students': [
+                {'lms_user_id': f'user-{index}', 'lis_result_sourcedid': f'sourcedid-{index}'}
+                for index in range(students)
+            ],
+        }
+    }
+
+
+@pytest.mark.parametrize('students', COURSE_SIZES)
+def test_register_data_new_student(benchmark, control_file, students):
+    """
+    Registration of a student launching the assignment for the first time (the control file is saved)
+    """
+    registered = _registered_students(students)
+
+    def setup():
+        LTIGradesSenderControlFile.cache_sender_data = copy.deepcopy(registered)
+        return ('assignment1', OUTCOME_SERVICE_URL, 'new-user', 'new-sourcedid'), {}
+
+    benchmark.pedantic(control_file.register_data, setup=setup, rounds=20 if students > 1000 else 200)
+
+    assert len(LTIGradesSenderControlFile.cache_sender_data['assignment1']['students']) == students + 1
+
+
+@pytest.mark.parametrize('students', COURSE_SIZES)
+def test_register_data_registered_student(benchmark, control_file, students):
+    """
+    Registration of a student launching the assignment again (nothing is saved)
+    """
+    LTIGradesSenderControlFile.cache_sender_data = _registered_students(students)
+    last_student = f'user-{students - 1}'
+
+    benchmark(control_file.register_data, 'assignment1', OUTCOME_SERVICE_URL, last_student, 'sourcedid')
+
+    assert len(LTIGradesSenderControlFile.cache_sender_data['assignment1']['students']) == students
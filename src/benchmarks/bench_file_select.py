@@ -0,0 +1,35 @@
+import pytest
+
+from pathlib import Path
+
+from illumidesk.lti13.handlers import build_file_select_items
+
+from benchmarks.conftest import COURSE_SIZES
+
+
+@pytest.fixture(scope='module')
+def shared_folders(tmp_path_factory) -> dict:
+    """
+    Course shared folders with 10, 1k and 10k notebooks, in folders of 100 notebooks
+    """
+    folders = {}
+    for notebooks in COURSE_SIZES:
+        course_shared_folder = tmp_path_factory.mktemp(f'shared{notebooks}') / 'intro101'
+        for index in range(notebooks):
+            folder = course_shared_folder / f'module{index // 100}'
+            folder.mkdir(parents=True, exist_ok=True)
+            (folder / f'notebook{index}.ipynb').touch()
+        folders[notebooks] = course_shared_folder
+    return folders
+
+
+@pytest.mark.parametrize('notebooks', COURSE_SIZES)
+def test_build_file_select_items(benchmark, shared_folders, notebooks):
+    """
+    Catalog of the file select page (LTI 1.3 deep linking)
+    """
+    course_shared_folder: Path = shared_folders[notebooks]
+
+    items = benchmark(build_file_select_items, course_shared_folder, 'intro101', 'hub.benchmark.example.com')
+
+    assert len(items) == notebooks
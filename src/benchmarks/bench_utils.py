@@ -0,0 +1,35 @@
+import pytest
+
+from illumidesk.authenticators.utils import LTIUtils
+
+
+@pytest.mark.parametrize(
+    'name', ['intro101', 'Dev-IllumiDesk: Introduction to Data Science (Fall 2020) - Section 01'], ids=['short', 'long']
+)
+def test_normalize_string(benchmark, name):
+    """
+    Course label normalization, done with every launch
+    """
+    utils = LTIUtils()
+
+    assert benchmark(utils.normalize_string, name)
+
+
+def test_email_to_username(benchmark):
+    """
+    Username calculation from the email, done with every launch
+    """
+    utils = LTIUtils()
+
+    assert benchmark(utils.email_to_username, 'Foo.Bar+illumidesk(comment)@example.com') == 'foobar'
+
+
+def test_convert_request_to_dict(benchmark, lms, student):
+    """
+    Conversion of the launch request's body arguments to a dict
+    """
+    utils = LTIUtils()
+    launch_args = lms.lti11_launch_args(student, 'https://hub.benchmark.example.com/hub/lti/launch', 'assignment1')
+    arguments = {key: [value.encode()] for key, value in launch_args.items()}
+
+    assert benchmark(utils.convert_request_to_dict, arguments) == launch_args
@@ -0,0 +1,68 @@
+import asyncio
+import json
+import jwt
+import pytest
+import uuid
+
+from unittest.mock import Mock
+from unittest.mock import patch
+
+from illumidesk.authenticators.validator import LTI11LaunchValidator
+from illumidesk.authenticators.validator import LTI13LaunchValidator
+
+
+LAUNCH_URL = 'https://hub.benchmark.example.com/hub/lti/launch'
+HEADERS = {'Content-Type': 'application/x-www-form-urlencoded'}
+
+
+def test_lti11_validate_launch_request(benchmark, lms, student):
+    """
+    LTI 1.1 launch validation: required args, nonce/timestamp checks and the OAuth1 base string and HMAC-SHA1
+    """
+    validator = LTI11LaunchValidator(lms.consumers)
+
+    def setup():
+        # every launch needs a new nonce, the validator rejects the replays
+        return (LAUNCH_URL, HEADERS, lms.lti11_launch_args(student, LAUNCH_URL, 'assignment1')), {}
+
+    result = benchmark.pedantic(validator.validate_launch_request, setup=setup, rounds=2000, warmup_rounds=10)
+
+    assert result is True
+
+
+def test_lti13_validate_launch_request(benchmark, lms, student):
+    """
+    LTI 1.3 validation of the claims of a decoded resource link launch
+    """
+    validator = LTI13LaunchValidator()
+    jwt_decoded = jwt.decode(lms.lti13_id_token(student, 'assignment1', uuid.uuid4().hex), verify=False)
+
+    assert benchmark(validator.validate_launch_request, jwt_decoded) is True
+
+
+@pytest.mark.parametrize('verify', [False, True], ids=['unverified', 'verified'])
+def test_lti13_jwt_verify_and_decode(benchmark, lms, student, verify):
+    """
+    LTI 1.3 id_token decoding, the verified path includes the JWS parsing and the key lookup in the
+    platform's jwks (the jwks request is answered from memory)
+    """
+    validator = LTI13LaunchValidator()
+    id_token = lms.lti13_id_token(student, 'assignment1', uuid.uuid4().hex)
+    response = Mock(body=json.dumps(lms.jwks).encode())
+
+    async def fetch(*args, **kwargs):
+        return response
+
+    loop = asyncio.new_event_loop()
+
+    def decode():
+        return loop.run_until_complete(
+            validator.jwt_verify_and_decode(id_token, f'{lms.base_url}/jwks', verify, audience=lms.client_id)
+        )
+
+    with patch('illumidesk.authenticators.validator.AsyncHTTPClient', return_value=Mock(fetch=fetch)):
+        result = benchmark(decode)
+    loop.close()
+
+    assert result['sub'] == student.lms_user_id
+
@@ -0,0 +1,21 @@
+import pytest
+
+from simulators.lms import LMSSimulator
+from simulators.lms import SimulatedStudent
+
+
+# number of students/notebooks used by the benchmarks that depend on the course size
+COURSE_SIZES = [10, 1000, 10000]
+
+
+@pytest.fixture(scope='session')
+def lms() -> LMSSimulator:
+    """
+    The LMS simulator of the load tests, it signs the LTI 1.1 launches and issues the LTI 1.3 id_tokens
+    """
+    return LMSSimulator('https://lms.benchmark.example.com')
+
+
+@pytest.fixture(scope='session')
+def student() -> SimulatedStudent:
+    return SimulatedStudent(1, 'intro101')
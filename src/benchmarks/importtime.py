@@ -0,0 +1,92 @@
+"""
+Import time of the illumidesk modules loaded by the hub at startup, measured with ``python -X importtime``.
+
+The hub restarts every time a course is added, so the import time of the modules referenced by
+jupyterhub_config.py is part of the downtime seen by the users. The jupyterhub modules imported
+by the hub itself are imported first, so only the cost added by illumidesk (and the dependencies
+it loads) is reported.
+
+Usage:
+```
+python -m benchmarks.importtime --max-ms 250
+```
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+from typing import Dict
+from typing import List
+from typing import Tuple
+
+
+# modules imported by the hub before it loads its configuration
+HUB_MODULES = ['jupyterhub.app', 'jupyterhub.auth', 'jupyterhub.handlers']
+
+# modules referenced by jupyterhub_config.py
+ILLUMIDESK_MODULES = [
+    'illumidesk.authenticators.authenticator',
+    'illumidesk.grades.handlers',
+    'illumidesk.lti13.handlers',
+    'illumidesk.spawners.hooks',
+]
+
+# dependencies that must only be imported on first use
+LAZY_MODULES = ['nbgrader.api', 'lti', 'lxml', 'jwcrypto', 'Crypto', 'sqlalchemy_utils', 'josepy', 'pem']
+
+
+def measure(python: str = sys.executable) -> Tuple[Dict[str, int], List[str]]:
+    """
+    Imports the illumidesk modules in a new interpreter
+
+    Returns:
+        The cumulative import time in microseconds of each illumidesk module and the lazy modules that were loaded
+    """
+    code = (
+        f'import {", ".join(HUB_MODULES)}\n'
+        f'import {", ".join(ILLUMIDESK_MODULES)}\n'
+        'import sys\n'
+        f'print(",".join(name for name in {LAZY_MODULES!r} if name in sys.modules))\n'
+    )
+    src_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [src_dir, os.environ.get('PYTHONPATH')])))
+    result = subprocess.run(
+        [python, '-X', 'importtime', '-c', code], capture_output=True, text=True, env=env, check=True
+    )
+    timings = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        _, cumulative, name = line.split('|')
+        # top level imports only, the nested ones are included in their parent's cumulative time
+        if not name.startswith('  ') and name.strip() in ILLUMIDESK_MODULES:
+            timings[name.strip()] = int(cumulative)
+    loaded = [name for name in result.stdout.strip().split(',') if name]
+    return timings, loaded
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--max-ms', type=float, default=None, help='fail if the total import time exceeds it')
+    parser.add_argument('--rounds', type=int, default=5, help='the fastest round is reported')
+    args = parser.parse_args()
+
+    rounds = [measure() for _ in range(max(1, args.rounds))]
+    timings, loaded = min(rounds, key=lambda r: sum(r[0].values()))
+    for name in ILLUMIDESK_MODULES:
+        print(f'{name}: {timings.get(name, 0) / 1000:.1f} ms')
+    total = sum(timings.values()) / 1000
+    print(f'total: {total:.1f} ms')
+    failed = False
+    if loaded:
+        print(f'error: modules that should be imported on first use were loaded: {", ".join(loaded)}')
+        failed = True
+    if args.max_ms is not None and total > args.max_ms:
+        print(f'error: the import time exceeds {args.max_ms} ms')
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
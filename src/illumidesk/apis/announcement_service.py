@@ -2,6 +2,9 @@ import json
 import os
 from tornado.httpclient import AsyncHTTPClient
 
+from illumidesk.metrics import UPSTREAM_ANNOUNCEMENT
+from illumidesk.metrics import track_outbound_request
+
 jhub_base_url = os.environ.get('JUPYTERHUB_BASE_URL') or ''
 # Constants
 ANNOUNCEMENT_PORT = os.environ.get('ANNOUNCEMENT_SERVICE_PORT') or '8889'
@@ -33,4 +36,5 @@ class AnnouncementService:
         headers['Authorization'] = f'token {jupyterhub_api_token}'
         body_data = {'announcement': message}
         client = AsyncHTTPClient()
-        await client.fetch(ANNOUNCEMENT_INTERNAL_URL, headers=headers, body=json.dumps(body_data), method='POST')
+        with track_outbound_request(UPSTREAM_ANNOUNCEMENT):
+            await client.fetch(ANNOUNCEMENT_INTERNAL_URL, headers=headers, body=json.dumps(body_data), method='POST')
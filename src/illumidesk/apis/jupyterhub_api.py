@@ -9,6 +9,12 @@ from traitlets.config import LoggingConfigurable
 
 from typing import Any
 from typing import Awaitable
+from typing import List
+
+from illumidesk.metrics import UPSTREAM_JUPYTERHUB_API
+from illumidesk.metrics import track_outbound_request
+from illumidesk.tracing import inject_trace_headers
+from illumidesk.tracing import start_span
 
 
 class JupyterHubAPI(LoggingConfigurable):
@@ -52,7 +58,10 @@ class JupyterHubAPI(LoggingConfigurable):
         headers.update(self.default_headers)
         url = f'{self.api_root_url}/{endpoint}'
         self.log.debug(f'Creating request with url: {url}')
-        return await self.client.fetch(url, headers=headers, **kwargs)
+        method = kwargs.get('method', 'GET')
+        with start_span(f'JupyterHubAPI {method} {endpoint}', http__method=method, http__url=url):
+            with track_outbound_request(UPSTREAM_JUPYTERHUB_API):
+                return await self.client.fetch(url, headers=inject_trace_headers(headers), **kwargs)
 
     async def create_group(self, group_name: str) -> Awaitable['HTTPResponse']:
         """
@@ -143,6 +152,28 @@ class JupyterHubAPI(LoggingConfigurable):
             method='POST',
         )
 
+    async def add_group_members(self, group_name: str, usernames: List[str]) -> Awaitable['HTTPResponse']:
+        """
+        Adds a list of users to a group with a single request
+
+        Args:
+          group_name: the group name
+          usernames: the users' unique names, the users must exist
+
+        Returns:
+          Response from the endpoint
+        """
+        if not group_name:
+            raise ValueError('group_name missing')
+        if not usernames:
+            raise ValueError('usernames missing')
+        self.log.debug(f'Adding {len(usernames)} users to group {group_name}')
+        return await self._request(
+            f'groups/{group_name}/users',
+            body=json.dumps({'users': list(usernames)}),
+            method='POST',
+        )
+
     async def add_student_to_jupyterhub_group(self, course_id: str, student: str) -> Awaitable['HTTPResponse']:
         """
         Adds a student to the student course group.
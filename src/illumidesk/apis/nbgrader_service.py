@@ -3,6 +3,8 @@ import os
 from pathlib import Path
 import shutil
 
+from typing import Dict
+
 from illumidesk.authenticators.utils import LTIUtils
 
 from nbgrader.api import Assignment
@@ -10,9 +12,6 @@ from nbgrader.api import Course
 from nbgrader.api import Gradebook
 from nbgrader.api import InvalidEntry
 
-from sqlalchemy_utils import database_exists
-from sqlalchemy_utils import create_database
-
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
@@ -73,6 +72,9 @@ class NbGraderServiceHelper:
 
     def create_database_if_not_exists(self) -> None:
         """Creates a new database if it doesn't exist"""
+        from sqlalchemy_utils import create_database
+        from sqlalchemy_utils import database_exists
+
         conn_uri = nbgrader_format_db_url(self.course_id)
 
         if not database_exists(conn_uri):
@@ -101,6 +103,21 @@ class NbGraderServiceHelper:
             except InvalidEntry as e:
                 logger.debug('Error during adding student to gradebook: %s' % e)
 
+    def add_users_to_nbgrader_gradebook(self, users: Dict[str, str]) -> None:
+        """
+        Adds a list of users to the nbgrader gradebook database for the course within a single session.
+
+        Args:
+            users: The users' lms_user_id by username
+        """
+        with Gradebook(self.db_url, course_id=self.course_id) as gb:
+            for username, lms_user_id in users.items():
+                try:
+                    gb.update_or_create_student(username, lms_user_id=lms_user_id)
+                except InvalidEntry as e:
+                    logger.debug('Error during adding student %s to gradebook: %s' % (username, e))
+        logger.debug('Added %s users to gradebook %s' % (len(users), self.course_id))
+
     def update_course(self, **kwargs) -> None:
         """
         Updates the course in nbgrader database
@@ -1,12 +1,24 @@
+import asyncio
+import json
 import logging
 import os
 
 from tornado.httpclient import AsyncHTTPClient
 from tornado.httpclient import HTTPError
 
-import requests
 from traitlets.traitlets import Bool
 
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Set
+from typing import Tuple
+
+from illumidesk.metrics import UPSTREAM_GRADER_SETUP_SERVICE
+from illumidesk.metrics import track_outbound_request
+from illumidesk.tracing import inject_trace_headers
+from illumidesk.tracing import start_span
+
 
 # course setup service name
 INTENAL_SERVICE_NAME = os.environ.get('DOCKER_SETUP_COURSE_SERVICE_NAME') or 'grader-setup-service'
@@ -21,6 +33,13 @@ logger.setLevel(logging.DEBUG)
 SERVICE_BASE_URL = f'http://{INTENAL_SERVICE_NAME}:{SERVICE_PORT}'
 SERVICE_COMMON_HEADERS = {'Content-Type': 'application/json'}
 
+# assignment source directories (org_name, course_id, assignment_name) created by the setup-course service, the
+# next launches of these assignments don't call the service
+_created_assignment_dirs: Set[Tuple[str, str, str]] = set()
+# grader ready waits (org_name, course_id) sent to the setup-course service, the pending pages of a course share
+# the wait instead of holding a service thread each
+_grader_ready_waits: Dict[Tuple[str, str], asyncio.Future] = {}
+
 
 async def create_assignment_source_dir(org_name: str, course_id: str, assignment_name: str) -> Bool:
     """
@@ -28,15 +47,38 @@ async def create_assignment_source_dir(org_name: str, course_id: str, assignment
 
     returns: True when the service response is 200
     """
+    return await create_assignment_source_dirs(org_name, course_id, [assignment_name])
+
+
+async def create_assignment_source_dirs(org_name: str, course_id: str, assignment_names: List[str]) -> Bool:
+    """
+    Calls the grader setup service to create the source directories of several assignments with one request,
+    the directories already created by this hub are skipped
+    Args:
+        org_name: organization name
+        course_id: the normalized course name
+        assignment_names: the normalized assignment names
+    Returns: True when the directories exist (the service response is 200)
+
+    """
+    missing = [
+        name for name in dict.fromkeys(assignment_names) if (org_name, course_id, name) not in _created_assignment_dirs
+    ]
+    if not missing:
+        return True
     client = AsyncHTTPClient()
     try:
-        response = await client.fetch(
-            f'{SERVICE_BASE_URL}/courses/{org_name}/{course_id}/{assignment_name}',
-            headers=SERVICE_COMMON_HEADERS,
-            body='',
-            method='POST',
-        )
+        with start_span(
+            'create_assignment_source_dirs', org_name=org_name, course_id=course_id, assignments=len(missing)
+        ), track_outbound_request(UPSTREAM_GRADER_SETUP_SERVICE):
+            response = await client.fetch(
+                f'{SERVICE_BASE_URL}/courses/{org_name}/{course_id}',
+                headers=inject_trace_headers(dict(SERVICE_COMMON_HEADERS)),
+                body=json.dumps({'assignments': missing}),
+                method='POST',
+            )
         logger.debug(f'Grader-setup service response: {response.body}')
+        _created_assignment_dirs.update((org_name, course_id, name) for name in missing)
         return True
     except HTTPError as e:
         # HTTPError is raised for non-200 responses
@@ -55,12 +97,15 @@ async def register_new_service(org_name: str, course_id: str) -> Bool:
     """
     client = AsyncHTTPClient()
     try:
-        response = await client.fetch(
-            f'{SERVICE_BASE_URL}/services/{org_name}/{course_id}',
-            headers=SERVICE_COMMON_HEADERS,
-            body='',
-            method='POST',
-        )
+        with start_span('register_new_service', org_name=org_name, course_id=course_id), track_outbound_request(
+            UPSTREAM_GRADER_SETUP_SERVICE
+        ):
+            response = await client.fetch(
+                f'{SERVICE_BASE_URL}/services/{org_name}/{course_id}',
+                headers=inject_trace_headers(dict(SERVICE_COMMON_HEADERS)),
+                body='',
+                method='POST',
+            )
         logger.debug(f'Grader-setup service response: {response.body}')
         return True
     except HTTPError as e:
@@ -68,3 +113,44 @@ async def register_new_service(org_name: str, course_id: str) -> Bool:
         # the response can be found in e.response.
         logger.error(f'Grader-setup service returned an error: {e}')
         return False
+
+
+async def get_grader_ready(org_name: str, course_id: str, wait: float = 0) -> Optional[bool]:
+    """
+    Asks the setup-course service whether the course's grader notebook serves requests. The waits of the
+    same course are coalesced, a request sent while another one waits gets its response.
+    Args:
+        org_name: organization name
+        course_id: the normalized course name
+        wait: seconds the service waits for the grader to be ready before it responds
+    Returns: whether the grader is ready, None when the course doesn't have a grader service
+
+    """
+    if not wait:
+        return await _fetch_grader_ready(org_name, course_id, wait)
+    key = (org_name, course_id)
+    if key not in _grader_ready_waits:
+        future = asyncio.ensure_future(_fetch_grader_ready(org_name, course_id, wait))
+        _grader_ready_waits[key] = future
+        future.add_done_callback(lambda _: _grader_ready_waits.pop(key, None))
+    # a waiter that goes away doesn't cancel the wait of the others
+    return await asyncio.shield(_grader_ready_waits[key])
+
+
+async def _fetch_grader_ready(org_name: str, course_id: str, wait: float) -> Optional[bool]:
+    client = AsyncHTTPClient()
+    try:
+        with start_span('get_grader_ready', org_name=org_name, course_id=course_id), track_outbound_request(
+            UPSTREAM_GRADER_SETUP_SERVICE
+        ):
+            response = await client.fetch(
+                f'{SERVICE_BASE_URL}/services/{org_name}/{course_id}/ready?wait={wait}',
+                headers=inject_trace_headers(dict(SERVICE_COMMON_HEADERS)),
+                request_timeout=wait + 20,
+            )
+        return bool(json.loads(response.body).get('ready'))
+    except HTTPError as e:
+        if e.code == 404:
+            return None
+        logger.error(f'Grader-setup service returned an error: {e}')
+        return False
@@ -0,0 +1,211 @@
+import asyncio
+import logging
+import os
+
+from collections import OrderedDict
+from collections import deque
+
+from typing import Deque
+from typing import Dict
+
+from illumidesk.metrics import EXECUTOR_LAUNCH_ADMISSION
+from illumidesk.metrics import EXECUTOR_QUEUE_DEPTH
+from illumidesk.metrics import LAUNCH_ADMISSIONS
+
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+
+# maximum number of launches (authentication and setup_course_hook) processed at the same time, 0 disables
+# the admission control
+ADMISSION_MAX_CONCURRENCY = int(os.environ.get('ILLUMIDESK_ADMISSION_MAX_CONCURRENCY') or '0')
+# maximum number of launches waiting for a slot, the launches received when the queue is full are rejected
+ADMISSION_MAX_QUEUE = int(os.environ.get('ILLUMIDESK_ADMISSION_MAX_QUEUE') or '200')
+# seconds a launch waits for a slot before it's rejected. The LTI 1.1 launches are only valid for 30 seconds
+# and the waiting page sends them again, so it must be shorter than that.
+ADMISSION_QUEUE_TIMEOUT = float(os.environ.get('ILLUMIDESK_ADMISSION_QUEUE_TIMEOUT') or '10')
+# seconds sent in the Retry-After header (and used by the waiting page) with the rejected launches
+ADMISSION_RETRY_AFTER = int(os.environ.get('ILLUMIDESK_ADMISSION_RETRY_AFTER') or '5')
+
+RESULT_ADMITTED = 'admitted'
+RESULT_QUEUE_FULL = 'queue_full'
+RESULT_TIMEOUT = 'timeout'
+
+
+class LaunchRejectedError(Exception):
+    """
+    Raised when the hub is too busy to process a launch
+
+    Args:
+        reason: queue_full or timeout
+        retry_after: seconds the client should wait before sending the launch again
+    """
+
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(f'Launch rejected ({reason}), retry after {retry_after} seconds')
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """
+    Limits the launches processed at the same time, so a launch storm (a lecture clicking the LMS link at once)
+    doesn't flood the gradebook database, the JupyterHub API and the grader setup service.
+
+    The launches over the limit wait in a queue per course and the slots are handed out round-robin between
+    the courses, so a large section doesn't starve the others. Instructors have their own queue, served first.
+    The launches are rejected with LaunchRejectedError when the queue is full or when they wait longer than
+    the queue timeout.
+
+    Usage:
+    ```
+    async with AdmissionController.instance().admit(course_id, priority=is_instructor):
+        user = await handler.login_user()
+    ```
+
+    Args:
+        max_concurrency: maximum number of launches processed at the same time, 0 disables the admission control
+        max_queue: maximum number of launches waiting for a slot
+        queue_timeout: seconds a launch waits for a slot
+        retry_after: seconds the rejected clients should wait before sending the launch again
+    """
+
+    _instance = None
+
+    def __init__(
+        self,
+        max_concurrency: int = None,
+        max_queue: int = None,
+        queue_timeout: float = None,
+        retry_after: int = None,
+    ):
+        self.max_concurrency = ADMISSION_MAX_CONCURRENCY if max_concurrency is None else max_concurrency
+        self.max_queue = ADMISSION_MAX_QUEUE if max_queue is None else max_queue
+        self.queue_timeout = queue_timeout or ADMISSION_QUEUE_TIMEOUT
+        self.retry_after = retry_after or ADMISSION_RETRY_AFTER
+        self.active = 0
+        self.queued = 0
+        self._priority_waiters: Deque[asyncio.Future] = deque()
+        # waiters by course, the first course is the next one served
+        self._course_waiters: Dict[str, Deque[asyncio.Future]] = OrderedDict()
+
+    @classmethod
+    def instance(cls) -> 'AdmissionController':
+        """Returns the controller shared by the launch handlers"""
+        if cls._instance is None:
+            cls._instance = cls()
+        return cls._instance
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_concurrency > 0
+
+    def admit(self, course_id: str, priority: bool = False) -> 'AdmissionTicket':
+        """
+        Returns the async context manager that holds a slot while the launch is processed
+
+        Args:
+            course_id: the launch's course, the waiting launches are served round-robin by course
+            priority: whether the launch is served before the others (instructors)
+        """
+        return AdmissionTicket(self, course_id, priority)
+
+    async def acquire(self, course_id: str, priority: bool = False) -> None:
+        """
+        Waits for a slot
+
+        Raises:
+            LaunchRejectedError if the queue is full or the launch waited longer than the queue timeout
+        """
+        if not self.enabled:
+            return
+        if self.active < self.max_concurrency and not self.queued:
+            self.active += 1
+            LAUNCH_ADMISSIONS.labels(result=RESULT_ADMITTED).inc()
+            return
+        if self.queued >= self.max_queue:
+            LAUNCH_ADMISSIONS.labels(result=RESULT_QUEUE_FULL).inc()
+            logger.warning(f'Launch queue is full ({self.queued} launches), rejecting a launch for {course_id}')
+            raise LaunchRejectedError(RESULT_QUEUE_FULL, self.retry_after)
+
+        waiter = asyncio.get_event_loop().create_future()
+        if priority:
+            self._priority_waiters.append(waiter)
+        else:
+            self._course_waiters.setdefault(course_id, deque()).append(waiter)
+        self._queue_changed(1)
+        try:
+            # the waiter's result is set when a slot is handed over
+            await asyncio.wait_for(asyncio.shield(waiter), self.queue_timeout)
+        except asyncio.TimeoutError:
+            if waiter.done():
+                # the slot was handed over right when the wait timed out
+                LAUNCH_ADMISSIONS.labels(result=RESULT_ADMITTED).inc()
+                return
+            waiter.cancel()
+            self._queue_changed(-1)
+            LAUNCH_ADMISSIONS.labels(result=RESULT_TIMEOUT).inc()
+            logger.warning(f'A launch for {course_id} waited {self.queue_timeout}s for a slot, rejecting it')
+            raise LaunchRejectedError(RESULT_TIMEOUT, self.retry_after)
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self.release()
+            else:
+                waiter.cancel()
+                self._queue_changed(-1)
+            raise
+        LAUNCH_ADMISSIONS.labels(result=RESULT_ADMITTED).inc()
+
+    def release(self) -> None:
+        """Releases a slot, which is handed over to the next waiting launch if any"""
+        if not self.enabled:
+            return
+        waiter = self._next_waiter()
+        if waiter is None:
+            self.active -= 1
+            return
+        # the slot goes to the waiter, the number of active launches doesn't change
+        self._queue_changed(-1)
+        waiter.set_result(None)
+
+    def _next_waiter(self) -> asyncio.Future:
+        """Returns the next waiter: instructors first, then round-robin between the courses"""
+        while self._priority_waiters:
+            waiter = self._priority_waiters.popleft()
+            if not waiter.done():
+                return waiter
+        while self._course_waiters:
+            course_id, waiters = next(iter(self._course_waiters.items()))
+            waiter = None
+            while waiters and waiter is None:
+                candidate = waiters.popleft()
+                if not candidate.done():
+                    waiter = candidate
+            # move the course to the end of the rotation (or drop it when it has no waiters)
+            del self._course_waiters[course_id]
+            if waiters:
+                self._course_waiters[course_id] = waiters
+            if waiter is not None:
+                return waiter
+        return None
+
+    def _queue_changed(self, delta: int) -> None:
+        self.queued += delta
+        EXECUTOR_QUEUE_DEPTH.labels(executor=EXECUTOR_LAUNCH_ADMISSION).set(self.queued)
+
+
+class AdmissionTicket:
+    """Async context manager returned by AdmissionController.admit"""
+
+    def __init__(self, controller: AdmissionController, course_id: str, priority: bool):
+        self.controller = controller
+        self.course_id = course_id
+        self.priority = priority
+
+    async def __aenter__(self) -> 'AdmissionTicket':
+        await self.controller.acquire(self.course_id, self.priority)
+        return self
+
+    async def __aexit__(self, *args) -> None:
+        self.controller.release()
@@ -1,3 +1,4 @@
+import jwt
 import os
 import logging
 
@@ -19,7 +20,6 @@ from typing import Dict
 
 from illumidesk.apis.jupyterhub_api import JupyterHubAPI
 from illumidesk.apis.announcement_service import AnnouncementService
-from illumidesk.apis.nbgrader_service import NbGraderServiceHelper
 from illumidesk.apis.setup_course_service import register_new_service
 from illumidesk.apis.setup_course_service import create_assignment_source_dir
 
@@ -31,18 +31,68 @@ from illumidesk.authenticators.utils import user_is_a_student
 from illumidesk.authenticators.validator import LTI11LaunchValidator
 from illumidesk.authenticators.validator import LTI13LaunchValidator
 
-from illumidesk.grades.senders import LTIGradesSenderControlFile
+from illumidesk.grades.outbox import start_grades_dispatcher
+from illumidesk.grades.sender_controlfile import LTIGradesSenderControlFile
+
+from illumidesk.lti13.registry import PlatformRegistry
+
+from illumidesk.metrics import PHASE_GRADEBOOK
+from illumidesk.metrics import PHASE_GROUP_SYNC
+from illumidesk.metrics import PHASE_JWKS
+from illumidesk.metrics import PHASE_SETUP_COURSE
+from illumidesk.metrics import PHASE_VALIDATION
+from illumidesk.metrics import launch_phase
+
+from illumidesk.tasks.pipeline import BackgroundTaskPipeline
+
+from illumidesk.tracing import traced
 
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
 
 
-ORG_NAME = os.environ.get('ORGANIZATION_NAME')
-if not ORG_NAME:
-    raise EnvironmentError('ORGANIZATION_NAME env-var is not set')
+def get_org_name() -> str:
+    """
+    Returns the organization name set in the ORGANIZATION_NAME env-var. It's read on the first launch instead
+    of when the module is imported, which keeps the import cheap for the hub restarts.
+
+    Raises:
+      EnvironmentError if the ORGANIZATION_NAME env-var is not set
+    """
+    org_name = os.environ.get('ORGANIZATION_NAME')
+    if not org_name:
+        raise EnvironmentError('ORGANIZATION_NAME env-var is not set')
+    return org_name
+
+
+def add_user_to_gradebook(course_id: str, username: str, lms_user_id: str) -> None:
+    """
+    Registers the user in the course's nbgrader gradebook, run in the launch out of the event loop
+    """
+    # nbgrader (and its sqlalchemy models) is imported on the first launch to keep the hub startup fast
+    from illumidesk.apis.nbgrader_service import NbGraderServiceHelper
+
+    with launch_phase(PHASE_GRADEBOOK):
+        NbGraderServiceHelper(course_id).add_user_to_nbgrader_gradebook(username, lms_user_id)
+
 
+async def setup_course(course_id: str) -> None:
+    """
+    Launches the course's grader notebook as a service and announces the hub's rolling update when the course
+    is new, run in the background task pipeline
+    """
+    with launch_phase(PHASE_SETUP_COURSE):
+        setup_response = await register_new_service(org_name=get_org_name(), course_id=course_id)
 
+    # In case of new courses launched then execute a rolling update with jhub to reload our configuration file
+    if setup_response is True:
+        # notify the user the browser needs to be reload (when traefik redirects to a new jhub)
+        await AnnouncementService.add_announcement('A new service was detected, please reload this page...')
+        logger.debug('The current jupyterhub instance will be updated by setup-course service...')
+
+
+@traced('setup_course_hook')
 async def setup_course_hook(
     authenticator: Authenticator, handler: RequestHandler, authentication: Dict[str, str]
 ) -> Dict[str, str]:
@@ -55,6 +105,10 @@ async def setup_course_hook(
     This function requires `Authenticator.enable_auth_state = True` and is intended
     to be used as a post_auth_hook.
 
+    The gradebook registration runs in the launch (out of the event loop) and the course setup is queued
+    last in the BackgroundTaskPipeline, since a new course restarts the hub. The group membership is kept in
+    the launch since the spawner needs it.
+
     Args:
         authenticator: the JupyterHub Authenticator object
         handler: the JupyterHub handler object
@@ -66,30 +120,28 @@ async def setup_course_hook(
     """
     lti_utils = LTIUtils()
     jupyterhub_api = JupyterHubAPI()
+    pipeline = BackgroundTaskPipeline.instance()
+    # the course setup needs the org name, check it before registering the user
+    get_org_name()
 
     # normalize the name and course_id strings in authentication dictionary
     course_id = lti_utils.normalize_string(authentication['auth_state']['course_id'])
-    nb_service = NbGraderServiceHelper(course_id)
     username = lti_utils.normalize_string(authentication['name'])
     lms_user_id = authentication['auth_state']['lms_user_id']
     user_role = authentication['auth_state']['user_role']
     # register the user (it doesn't matter if it is a student or instructor) with her/his lms_user_id in nbgrader
-    nb_service.add_user_to_nbgrader_gradebook(username, lms_user_id)
+    await pipeline.run(add_user_to_gradebook, course_id, username, lms_user_id)
     # TODO: verify the logic to simplify groups creation and membership
-    if user_is_a_student(user_role):
-        # assign the user to 'nbgrader-<course_id>' group in jupyterhub and gradebook
-        await jupyterhub_api.add_student_to_jupyterhub_group(course_id, username)
-    elif user_is_an_instructor(user_role):
-        # assign the user in 'formgrade-<course_id>' group
-        await jupyterhub_api.add_instructor_to_jupyterhub_group(course_id, username)
-    # launch the new (?) grader-notebook as a service
-    setup_response = await register_new_service(org_name=ORG_NAME, course_id=course_id)
-
-    # In case of new courses launched then execute a rolling update with jhub to reload our configuration file
-    if setup_response is True:
-        # notify the user the browser needs to be reload (when traefik redirects to a new jhub)
-        await AnnouncementService.add_announcement('A new service was detected, please reload this page...')
-        logger.debug('The current jupyterhub instance will be updated by setup-course service...')
+    with launch_phase(PHASE_GROUP_SYNC):
+        if user_is_a_student(user_role):
+            # assign the user to 'nbgrader-<course_id>' group in jupyterhub and gradebook
+            await jupyterhub_api.add_student_to_jupyterhub_group(course_id, username)
+        elif user_is_an_instructor(user_role):
+            # assign the user in 'formgrade-<course_id>' group
+            await jupyterhub_api.add_instructor_to_jupyterhub_group(course_id, username)
+    # launch the new (?) grader-notebook as a service. A new course restarts the hub, so the task starts when
+    # the other queued tasks are done
+    await pipeline.submit_last_or_run(f'setup-course:{course_id}', setup_course, course_id)
 
     return authentication
 
@@ -105,9 +157,15 @@ class LTI11Authenticator(LTIAuthenticator):
     and shared secret k/v's to verify requests from their tool consumer.
     """
 
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        # send the grades left in the outbox by the previous hub
+        start_grades_dispatcher()
+
     def get_handlers(self, app: JupyterHub) -> BaseHandler:
         return [('/lti/launch', LTI11AuthenticateHandler)]
 
+    @traced('LTI11Authenticator.authenticate')
     async def authenticate(self, handler: BaseHandler, data: Dict[str, str] = None) -> Dict[str, str]:  # noqa: C901
         """
         LTI 1.1 authenticator which overrides authenticate function from base LTIAuthenticator.
@@ -147,7 +205,9 @@ class LTI11Authenticator(LTIAuthenticator):
         launch_url = f'{protocol}://{handler.request.host}{handler.request.uri}'
         self.log.debug('Launch url is: %s' % launch_url)
 
-        if validator.validate_launch_request(launch_url, handler.request.headers, args):
+        with launch_phase(PHASE_VALIDATION):
+            is_valid_launch = validator.validate_launch_request(launch_url, handler.request.headers, args)
+        if is_valid_launch:
             # get the lms vendor to implement optional logic for said vendor
             lms_vendor = ''
             if 'tool_consumer_info_product_family_code' in args and args['tool_consumer_info_product_family_code']:
@@ -246,16 +306,24 @@ class LTI11Authenticator(LTIAuthenticator):
             if 'lis_result_sourcedid' in args and args['lis_result_sourcedid']:
                 lis_result_sourcedid = args['lis_result_sourcedid']
             # only if both values exist we can register them to submit grades later
+            # the control file and the gradebook are updated in the launch (out of the event loop), the
+            # background queue is lost when the hub restarts and the grades depend on them
+            pipeline = BackgroundTaskPipeline.instance()
             if lis_outcome_service_url and lis_result_sourcedid:
                 control_file = LTIGradesSenderControlFile(f'/home/grader-{course_id}/{course_id}')
-                control_file.register_data(assignment_name, lis_outcome_service_url, lms_user_id, lis_result_sourcedid)
+                await pipeline.run(
+                    control_file.register_data,
+                    assignment_name,
+                    lis_outcome_service_url,
+                    lms_user_id,
+                    lis_result_sourcedid,
+                )
             # Assignment creation
             if assignment_name:
-                nbgrader_service = NbGraderServiceHelper(course_id, True)
                 self.log.debug(
                     'Creating a new assignment from the Authentication flow with title %s' % assignment_name
                 )
-                nbgrader_service.create_assignment_in_nbgrader(assignment_name)
+                await pipeline.run(create_assignment_in_gradebook, course_id, assignment_name)
             # ensure the user name is normalized
             username_normalized = lti_utils.normalize_string(username)
             self.log.debug('Assigned username is: %s' % username_normalized)
@@ -306,6 +374,12 @@ class LTI13Authenticator(OAuthenticator):
         initial login request.""",
     ).tag(config=True)
 
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        # send the grades left in the outbox by the previous hub
+        start_grades_dispatcher()
+
+    @traced('LTI13Authenticator.authenticate')
     async def authenticate(  # noqa: C901
         self, handler: LTI13LoginHandler, data: Dict[str, str] = None
     ) -> Dict[str, str]:
@@ -330,13 +404,35 @@ class LTI13Authenticator(OAuthenticator):
 
         # extract claims from jwt (id_token) sent by the platform. as tool use the jwks (public key)
         # to verify the jwt's signature.
-        jwt_decoded = await validator.jwt_verify_and_decode(id_token, self.endpoint, False, audience=self.client_id)
+        # the launches from the registered platforms are verified with the platform's (cached) key set, the
+        # other platforms are rejected. without registrations the launches are verified with the key set of
+        # the endpoint setting.
+        registry = PlatformRegistry.instance()
+        registration = registry.find_for_claims(jwt.decode(id_token, verify=False)) if len(registry) else None
+        if len(registry) and registration is None:
+            raise HTTPError(401, 'The platform or deployment of the launch is not registered')
+        with launch_phase(PHASE_JWKS):
+            try:
+                if registration is not None:
+                    jwt_decoded = await validator.jwt_verify_and_decode_with_registration(id_token, registration)
+                else:
+                    jwt_decoded = await validator.jwt_verify_and_decode(
+                        id_token, self.endpoint, True, audience=self.client_id or None
+                    )
+            except (jwt.exceptions.InvalidTokenError, ValueError) as e:
+                raise HTTPError(401, f'Invalid id_token: {e}')
         self.log.debug('Decoded JWT is %s' % jwt_decoded)
 
-        if validator.validate_launch_request(jwt_decoded):
+        with launch_phase(PHASE_VALIDATION):
+            is_valid_launch = validator.validate_launch_request(jwt_decoded)
+        if is_valid_launch:
             course_id = jwt_decoded['https://purl.imsglobal.org/spec/lti/claim/context']['label']
             course_id = lti_utils.normalize_string(course_id)
             self.log.debug('Normalized course label is %s' % course_id)
+            # the grades senders and the roster sync use the platform that launched the course, another
+            # platform with the same course label would otherwise take the course (and its groups) over
+            if registration is not None and not registry.register_course(course_id, registration):
+                raise HTTPError(403, f'The course {course_id} is registered with another platform')
             username = ''
             if 'email' in jwt_decoded and jwt_decoded['email']:
                 username = lti_utils.email_to_username(jwt_decoded['email'])
@@ -386,6 +482,10 @@ class LTI13Authenticator(OAuthenticator):
                 await process_resource_link(self.log, course_id, jwt_decoded)
 
             lms_user_id = jwt_decoded['sub'] if 'sub' in jwt_decoded else username
+            # the instructors' launches provision the course roster (NRPS) in background
+            from illumidesk.lti13.roster import NRPSRosterSync
+
+            NRPSRosterSync.instance().sync_on_launch(course_id, jwt_decoded, user_role)
 
             # ensure the user name is normalized
             username_normalized = lti_utils.normalize_string(username)
@@ -402,11 +502,50 @@ class LTI13Authenticator(OAuthenticator):
             }
 
 
+def create_assignment_in_gradebook(course_id: str, assignment_name: str) -> None:
+    """
+    Creates the assignment in the course's nbgrader gradebook (LTI 1.1), run in the launch out of the event loop
+    """
+    from illumidesk.apis.nbgrader_service import NbGraderServiceHelper
+
+    with launch_phase(PHASE_GRADEBOOK):
+        NbGraderServiceHelper(course_id, True).create_assignment_in_nbgrader(assignment_name)
+
+
+def update_course_lineitems(course_id: str, course_lineitems: str) -> None:
+    """
+    Saves the course's AGS lineitems endpoint in the nbgrader gradebook, run in the launch out of the event loop
+    """
+    from illumidesk.apis.nbgrader_service import NbGraderServiceHelper
+
+    with launch_phase(PHASE_GRADEBOOK):
+        NbGraderServiceHelper(course_id, True).update_course(lms_lineitems_endpoint=course_lineitems)
+
+
+def register_assignment_in_gradebook(course_id: str, assignment_name: str) -> None:
+    """
+    Registers the assignment in the course's nbgrader gradebook (LTI 1.3), run in the launch out of the event loop
+    """
+    from illumidesk.apis.nbgrader_service import NbGraderServiceHelper
+
+    with launch_phase(PHASE_GRADEBOOK):
+        NbGraderServiceHelper(course_id, True).register_assignment(assignment_name)
+
+
+async def create_assignment_dir(course_id: str, assignment_name: str) -> None:
+    """
+    Creates the assignment source directory with the grader setup service, run in the background task pipeline
+    """
+    with launch_phase(PHASE_SETUP_COURSE):
+        await create_assignment_source_dir(get_org_name(), course_id, assignment_name)
+
+
 async def process_resource_link(
     logger: Any, course_id: str, jwt_body_decoded: Dict[str, Any],
 ) -> None:
     """
-    Executes additional processes with the claims that come only with LtiResourceLinkRequest
+    Executes additional processes with the claims that come only with LtiResourceLinkRequest. The gradebook
+    and the assignment directory are updated in the BackgroundTaskPipeline.
     """
     # Values for send-grades functionality
     resource_link = jwt_body_decoded['https://purl.imsglobal.org/spec/lti/claim/resource_link']
@@ -417,12 +556,15 @@ async def process_resource_link(
         and 'lineitems' in jwt_body_decoded['https://purl.imsglobal.org/spec/lti-ags/claim/endpoint']
     ):
         course_lineitems = jwt_body_decoded['https://purl.imsglobal.org/spec/lti-ags/claim/endpoint']['lineitems']
-    nbgrader_service = NbGraderServiceHelper(course_id, True)
-    nbgrader_service.update_course(lms_lineitems_endpoint=course_lineitems)
+    pipeline = BackgroundTaskPipeline.instance()
+    # the gradebook writes the grades depend on run in the launch, the queue is lost when the hub restarts
+    await pipeline.run(update_course_lineitems, course_id, course_lineitems)
     if resource_link_title:
         assignment_name = LTIUtils().normalize_string(resource_link_title)
         logger.debug('Creating a new assignment from the Authentication flow with title %s' % assignment_name)
         # register the new assignment in nbgrader database
-        nbgrader_service.register_assignment(assignment_name)
+        await pipeline.run(register_assignment_in_gradebook, course_id, assignment_name)
         # create the assignment source directory by calling the grader-setup service
-        await create_assignment_source_dir(ORG_NAME, course_id, assignment_name)
+        await pipeline.submit_or_run(
+            f'assignment-dir:{course_id}:{assignment_name}', create_assignment_dir, course_id, assignment_name
+        )
@@ -1,5 +1,6 @@
 import logging
 import hashlib
+import jwt
 import os
 import re
 
@@ -15,20 +16,67 @@ from tornado.httputil import url_concat
 from tornado.web import HTTPError
 from tornado.web import RequestHandler
 
+from typing import Tuple
 from typing import cast
 from urllib.parse import quote
 from urllib.parse import unquote
 from urllib.parse import urlparse
 import uuid
 
+from illumidesk.authenticators.admission import AdmissionController
+from illumidesk.authenticators.admission import AdmissionTicket
+from illumidesk.authenticators.admission import LaunchRejectedError
 from illumidesk.authenticators.validator import LTI13LaunchValidator
 from illumidesk.authenticators.utils import LTIUtils
+from illumidesk.authenticators.utils import user_is_an_instructor
+from illumidesk.lti13.registry import PlatformRegistry
 
 
 logger = logging.getLogger(__name__)
 
 
-class LTI11AuthenticateHandler(BaseHandler):
+class LaunchAdmissionMixin:
+    """
+    Runs the launches (the authentication and the post_auth_hook) through the AdmissionController. The
+    launches rejected because the hub is too busy get a 503 response with a Retry-After header and a
+    waiting page that sends the launch again.
+    """
+
+    def get_launch_admission_key(self) -> Tuple[str, bool]:
+        """
+        Returns the launch's course and whether it's prioritized (instructors). The values are read before
+        the launch is validated, they are only used to order the waiting launches.
+        """
+        raise NotImplementedError()
+
+    def launch_admission(self) -> AdmissionTicket:
+        """
+        Returns the async context manager that holds an admission slot while the launch is processed,
+        it raises LaunchRejectedError if the hub is too busy to process the launch
+        """
+        controller = AdmissionController.instance()
+        if not controller.enabled:
+            return controller.admit('')
+        course_id, priority = self.get_launch_admission_key()
+        return controller.admit(course_id, priority=priority)
+
+    def write_launch_waiting_page(self, error: LaunchRejectedError) -> None:
+        """
+        Responds with the waiting page, which posts the launch arguments again after the Retry-After delay
+        """
+        self.log.info(f'Launch rejected by the admission control: {error}')
+        self.set_status(503)
+        self.set_header('Retry-After', str(error.retry_after))
+        html = self.render_template(
+            'launch_waiting.html',
+            action_url=self.request.uri,
+            arguments=LTIUtils().convert_request_to_dict(self.request.body_arguments),
+            retry_after=error.retry_after,
+        )
+        self.finish(html)
+
+
+class LTI11AuthenticateHandler(LaunchAdmissionMixin, BaseHandler):
     """
     LTI login handler obtained from jupyterhub/ltiauthenticator.
 
@@ -36,8 +84,17 @@ class LTI11AuthenticateHandler(BaseHandler):
     that URL after authentication. Else, will send them to /home.
     """
 
+    def get_launch_admission_key(self) -> Tuple[str, bool]:
+        course_id = self.get_body_argument('context_label', '')
+        user_role = self.get_body_argument('roles', '').split(',')[0]
+        return course_id, bool(user_role) and user_is_an_instructor(user_role)
+
     async def post(self):
-        user = await self.login_user()  # noqa: F841
+        try:
+            async with self.launch_admission():
+                user = await self.login_user()  # noqa: F841
+        except LaunchRejectedError as e:
+            return self.write_launch_waiting_page(e)
         self.redirect(self.get_body_argument('custom_next', self.get_next_url()))
 
 
@@ -47,6 +104,9 @@ class LTI13LoginHandler(OAuthLoginHandler):
     LTI 1.3 standard.
     """
 
+    # the registration of the platform that sent the login request, see PlatformRegistry
+    registration = None
+
     def authorize_redirect(
         self,
         client_id: str = None,
@@ -94,7 +154,8 @@ class LTI13LoginHandler(OAuthLoginHandler):
         if nonce is not None:
             extra_params['nonce'] = nonce
         args.update(extra_params)
-        url = os.environ.get('LTI13_AUTHORIZE_URL')
+        # the registered platform's authorization url, the LTI13_AUTHORIZE_URL env-var is used without it
+        url = self.registration.auth_login_url if self.registration else os.environ.get('LTI13_AUTHORIZE_URL')
         if not url:
             raise EnvironmentError('LTI13_AUTHORIZE_URL env var is not set')
         handler.redirect(url_concat(url, args))
@@ -157,6 +218,9 @@ class LTI13LoginHandler(OAuthLoginHandler):
             # and that they are within the time-based tolerance window
             nonce_raw = hashlib.sha256(state.encode())
             nonce = nonce_raw.hexdigest()
+            self.registration = PlatformRegistry.instance().find(
+                args.get('iss'), args.get('client_id'), args.get('lti_deployment_id')
+            )
             self.authorize_redirect(
                 client_id=client_id,
                 login_hint=login_hint,
@@ -167,17 +231,33 @@ class LTI13LoginHandler(OAuthLoginHandler):
             )
 
 
-class LTI13CallbackHandler(OAuthCallbackHandler):
+class LTI13CallbackHandler(LaunchAdmissionMixin, OAuthCallbackHandler):
     """
     LTI 1.3 call back handler
     """
 
+    def get_launch_admission_key(self) -> Tuple[str, bool]:
+        try:
+            # the id_token is verified by the authenticator once the launch is admitted
+            claims = jwt.decode(self.get_body_argument('id_token', ''), verify=False)
+        except jwt.exceptions.InvalidTokenError:
+            return '', False
+        context = claims.get('https://purl.imsglobal.org/spec/lti/claim/context') or {}
+        roles = claims.get('https://purl.imsglobal.org/spec/lti/claim/roles') or []
+        return context.get('label', ''), any(role.find('Instructor') >= 1 for role in roles)
+
     async def post(self):
         """
         Overrides the upstream get handler with it's standard implementation.
         """
-        self.check_state()
-        user = await self.login_user()
+        try:
+            # the launch is admitted before the state is checked (which clears the state cookie), so the
+            # waiting page can send it again
+            async with self.launch_admission():
+                self.check_state()
+                user = await self.login_user()
+        except LaunchRejectedError as e:
+            return self.write_launch_waiting_page(e)
         self.log.debug(f'user logged in: {user}')
         if user is None:
             raise HTTPError(403, 'User missing or null')
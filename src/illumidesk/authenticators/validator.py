@@ -4,9 +4,6 @@ import time
 
 from collections import OrderedDict
 
-from josepy.jws import JWS
-from josepy.jws import Header
-
 from oauthlib.oauth1.rfc5849 import signature
 
 from tornado.httpclient import AsyncHTTPClient
@@ -25,6 +22,10 @@ from .constants import LTI13_LOGIN_REQUEST_ARGS
 from .constants import LTI13_RESOURCE_LINK_REQUIRED_CLAIMS
 from .constants import LTI13_DEEP_LINKING_REQUIRED_CLAIMS
 
+from illumidesk.lti13.registry import PlatformRegistration
+from illumidesk.metrics import UPSTREAM_LMS_JWKS
+from illumidesk.metrics import track_outbound_request
+
 
 class LTI11LaunchValidator(LoggingConfigurable):
     """
@@ -148,7 +149,8 @@ class LTI13LaunchValidator(LoggingConfigurable):
           verify: if true, validate certificate
         """
         client = AsyncHTTPClient()
-        resp = await client.fetch(endpoint, validate_cert=verify)
+        with track_outbound_request(UPSTREAM_LMS_JWKS):
+            resp = await client.fetch(endpoint, validate_cert=verify)
         platform_jwks = json.loads(resp.body)
         self.log.debug('Retrieved jwks from lms platform %s' % platform_jwks)
 
@@ -173,30 +175,59 @@ class LTI13LaunchValidator(LoggingConfigurable):
     ) -> Dict[str, str]:
         """
         Decodes the JSON Web Token (JWT) sent from the platform. The JWT should contain claims
-        that represent properties associated with the request. This method implicitly verifies the JWT's
-        signature using the platform's public key.
+        that represent properties associated with the request. This method verifies the JWT's
+        signature (and its expiration) using the platform's public key.
 
         Args:
           id_token: JWT token issued by the platform
           jwks_endpoint: JSON web key (publick key) endpoint
           verify: verify whether or not to verify JWT when decoding. Defaults to True.
-          audience: the platform's OAuth2 Audience (aud). This value usually coincides with the
-            token endpoint for the platform (LMS) such as https://my.lms.domain/login/oauth2/token
+          audience: the tool's client id, the aud claim isn't checked without it
+
+        Raises:
+          jwt.exceptions.InvalidTokenError if the signature, the audience or the expiration aren't valid
         """
         if verify is False:
             self.log.debug('JWK verification is off, returning token %s' % jwt.decode(id_token, verify=False))
             return jwt.decode(id_token, verify=False)
 
-        jws = JWS.from_compact(id_token)
+        # josepy is only needed (and imported) when the tokens are verified
+        from josepy.jws import Header
+        from josepy.jws import JWS
+
+        jws = JWS.from_compact(id_token.encode() if isinstance(id_token, str) else id_token)
         self.log.debug('Retrieving matching jws %s' % jws)
         json_header = jws.signature.protected
         header = Header.json_loads(json_header)
         self.log.debug('Header from decoded jwt %s' % header)
 
-        key_from_jwks = await self._retrieve_matching_jwk(jwks_endpoint, verify, header.kid)
+        key_from_jwks = await self._retrieve_matching_jwk(jwks_endpoint, header.kid, verify)
         self.log.debug('Returning decoded jwt with token %s key %s and verify %s' % (id_token, key_from_jwks, verify))
 
-        return jwt.decode(id_token, key=key_from_jwks, verify=False, audience=audience)
+        return jwt.decode(
+            id_token,
+            key=key_from_jwks,
+            algorithms=['RS256'],
+            audience=audience,
+            options={'verify_aud': audience is not None},
+        )
+
+    async def jwt_verify_and_decode_with_registration(
+        self, id_token: str, registration: PlatformRegistration
+    ) -> Dict[str, Any]:
+        """
+        Verifies the JWT's signature with the registered platform's (cached) key set and decodes it.
+
+        Args:
+          id_token: JWT token issued by the platform
+          registration: the platform's registration found with the token's claims
+
+        Raises:
+          jwt.exceptions.InvalidTokenError if the signature, the audience or the expiration aren't valid
+        """
+        header = jwt.get_unverified_header(id_token)
+        key = await registration.get_jwk(header.get('kid'))
+        return jwt.decode(id_token, key=key, algorithms=['RS256'], audience=registration.client_id)
 
     def is_deep_link_launch(
         self,
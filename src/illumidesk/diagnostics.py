@@ -0,0 +1,169 @@
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+
+from collections import Counter
+
+from typing import Dict
+from typing import List
+from typing import Optional
+
+from illumidesk.metrics import EVENT_LOOP_STALLS
+from illumidesk.metrics import EVENT_LOOP_STALL_DURATION_SECONDS
+
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+# seconds a callback can block the hub's event loop before it's reported, the detector is disabled if it's not set
+LOOP_STALL_THRESHOLD = os.environ.get('ILLUMIDESK_LOOP_STALL_THRESHOLD')
+
+# directory that contains the illumidesk package, the call sites are reported relative to it
+PACKAGE_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PACKAGE_DIR = os.path.join(PACKAGE_ROOT, 'illumidesk')
+
+
+def find_call_site(stack: List[traceback.FrameSummary]) -> str:
+    """
+    Returns the call site of a stack sample: the innermost illumidesk frame, or the innermost frame when the
+    stack doesn't pass through illumidesk
+
+    Args:
+        stack: the stack sample, outermost frame first
+
+    Returns:
+        The call site with the format <path>:<line> <function>, the illumidesk paths are relative to the
+        package's parent directory
+    """
+    if not stack:
+        return 'unknown'
+    frame = next((f for f in reversed(stack) if f.filename.startswith(PACKAGE_DIR + os.sep)), stack[-1])
+    filename = frame.filename
+    if filename.startswith(PACKAGE_DIR + os.sep):
+        filename = os.path.relpath(filename, PACKAGE_ROOT)
+    return f'{filename}:{frame.lineno} {frame.name}'
+
+
+class LoopStallDetector:
+    """
+    Detects the callbacks that block the hub's event loop (blocking calls in coroutines such as the
+    gradebook updates, the file locks or the LTI 1.1 outcome requests).
+
+    A watchdog thread schedules a heartbeat in the loop. If the heartbeat doesn't run within the threshold
+    the thread samples the stack of the loop's thread, which is running the offending callback. The stalls
+    are counted by call site (the innermost illumidesk frame of the sample) in the
+    illumidesk_event_loop_stalls_total metric and logged, with the stack the first time a call site is seen.
+
+    Args:
+        threshold: seconds a callback can run before it's reported
+        loop: the event loop, the current loop by default
+        max_stack_depth: number of frames kept from the stack samples
+    """
+
+    def __init__(self, threshold: float = 0.25, loop: asyncio.AbstractEventLoop = None, max_stack_depth: int = 20):
+        if threshold <= 0:
+            raise ValueError('The stall threshold must be greater than 0')
+        self.threshold = threshold
+        self.loop = loop or asyncio.get_event_loop()
+        self.max_stack_depth = max_stack_depth
+        self.call_sites = Counter()
+        self._loop_thread_id = None
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self) -> None:
+        """
+        Starts the watchdog thread. It should be called from the thread that runs the loop, otherwise the
+        stalls that happen before the first heartbeat are reported without a stack sample.
+        """
+        if self._thread is not None:
+            return
+        self._loop_thread_id = threading.get_ident()
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._watch, name='illumidesk-loop-stall-detector', daemon=True)
+        self._thread.start()
+        logger.info(f'Event loop stall detector started with a threshold of {self.threshold}s')
+
+    def stop(self) -> None:
+        """Stops the watchdog thread"""
+        if self._thread is None:
+            return
+        self._stopped.set()
+        self._thread.join()
+        self._thread = None
+
+    def stats(self) -> Dict[str, int]:
+        """Returns the number of stalls by call site, the most frequent first"""
+        return dict(self.call_sites.most_common())
+
+    def _heartbeat(self, beat: threading.Event) -> None:
+        self._loop_thread_id = threading.get_ident()
+        beat.set()
+
+    def _watch(self) -> None:
+        while not self._stopped.is_set():
+            beat = threading.Event()
+            sent = time.perf_counter()
+            try:
+                self.loop.call_soon_threadsafe(self._heartbeat, beat)
+            except RuntimeError:
+                # the loop was closed
+                return
+            if beat.wait(self.threshold):
+                self._stopped.wait(self.threshold)
+                continue
+            stack = self._sample_loop_stack()
+            # wait for the callback to finish to measure the stall
+            while not beat.wait(self.threshold):
+                if self._stopped.is_set():
+                    return
+            self._record(stack, time.perf_counter() - sent)
+
+    def _sample_loop_stack(self) -> List[traceback.FrameSummary]:
+        frame = sys._current_frames().get(self._loop_thread_id)
+        if frame is None:
+            return []
+        return traceback.extract_stack(frame)[-self.max_stack_depth :]
+
+    def _record(self, stack: List[traceback.FrameSummary], duration: float) -> None:
+        call_site = find_call_site(stack)
+        self.call_sites[call_site] += 1
+        EVENT_LOOP_STALLS.labels(call_site=call_site).inc()
+        EVENT_LOOP_STALL_DURATION_SECONDS.observe(duration)
+        if self.call_sites[call_site] == 1:
+            logger.warning(
+                f'Event loop blocked for {duration:.3f}s at {call_site}:\n{"".join(traceback.format_list(stack))}'
+            )
+        else:
+            logger.warning(
+                f'Event loop blocked for {duration:.3f}s at {call_site} ({self.call_sites[call_site]} times)'
+            )
+
+
+def start_loop_stall_detector(loop: asyncio.AbstractEventLoop = None) -> Optional[LoopStallDetector]:
+    """
+    Starts the event loop stall detector if the ILLUMIDESK_LOOP_STALL_THRESHOLD env-var is set, it's meant
+    to be called from jupyterhub_config.py:
+
+    ```
+    from illumidesk.diagnostics import start_loop_stall_detector
+    start_loop_stall_detector()
+    ```
+
+    Returns:
+        The detector or None if it's disabled
+    """
+    if not LOOP_STALL_THRESHOLD:
+        return None
+    try:
+        threshold = float(LOOP_STALL_THRESHOLD)
+    except ValueError:
+        logger.error(f'Invalid ILLUMIDESK_LOOP_STALL_THRESHOLD value: {LOOP_STALL_THRESHOLD}')
+        return None
+    detector = LoopStallDetector(threshold=threshold, loop=loop)
+    detector.start()
+    return detector
@@ -0,0 +1,129 @@
+import asyncio
+import logging
+
+from typing import Any
+from typing import Callable
+from typing import Dict
+from typing import List
+
+from nbgrader.api import Gradebook
+
+from illumidesk.apis.nbgrader_service import NbGraderServiceHelper
+
+from .exceptions import AssignmentWithoutGradesError
+from .exceptions import GradesSenderCriticalError
+from .exceptions import GradesSenderMissingInfoError
+from .outbox import ALL_ASSIGNMENTS  # noqa: F401
+from .outbox import LTI11
+from .senders import LTI13GradeSender
+from .senders import LTIGradeSender
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+
+RESULT_SENT = 'sent'
+RESULT_NO_GRADES = 'no-grades'
+RESULT_MISSING_INFO = 'missing-info'
+RESULT_ERROR = 'error'
+
+
+class CourseGradesSender:
+    """
+    Publishes the grades of all (or a selected set of) the assignments of a course in a single job.
+
+    The assignments share one gradebook session and, with LTI 1.3, one access token and one line items
+    index. LTI 1.3 assignments are processed concurrently while the requests sent to the LMS are
+    limited by the LMSRateLimiter shared in the hub.
+
+    Args:
+        course_id: the normalized course id
+        lti_version: the LTI version used to send the grades (1.1 or 1.3)
+    """
+
+    def __init__(self, course_id: str, lti_version: str):
+        self.course_id = course_id
+        self.is_lti11 = lti_version == LTI11
+        self.nbgrader_helper = NbGraderServiceHelper(course_id)
+        self.progress_listeners = []
+
+    def add_progress_listener(self, listener: Callable[[Dict[str, Any]], None]) -> None:
+        """Registers a callable that receives the progress events of every assignment"""
+        self.progress_listeners.append(listener)
+
+    async def send_grades(
+        self, force: bool = False, assignments: List[str] = None, reconcile: bool = False
+    ) -> Dict[str, Any]:
+        """
+        Sends the grades of the assignments to the LMS.
+
+        Args:
+            force: resend all the scores instead of the scores that changed since the last sync
+            assignments: the assignment names to publish, all the assignments of the course by default
+            reconcile: compare the scores with the LMS results and send only the differences (LTI 1.3 only)
+
+        Returns:
+            A dict with the result by assignment name. The result is the drift report with reconcile.
+
+        Raises:
+            GradesSenderCriticalError if any assignment failed with an unexpected error, after processing
+            the rest of the assignments. Assignments with missing info are reported in the summary only.
+        """
+        with Gradebook(self.nbgrader_helper.db_url, course_id=self.course_id) as gb:
+            assignment_names = assignments or [assignment.name for assignment in gb.assignments]
+            logger.info(f'Publishing grades of {len(assignment_names)} assignments for course {self.course_id}')
+            senders = self._create_senders(assignment_names, gb)
+            if self.is_lti11:
+                # outcomes are sent with a blocking client, so there is no gain processing them concurrently
+                results = []
+                for sender in senders:
+                    results.append(await self._send_assignment_grades(sender, force=force))
+            else:
+                await self._share_lms_session(senders)
+                results = await asyncio.gather(
+                    *[self._send_assignment_grades(sender, force=force, reconcile=reconcile) for sender in senders]
+                )
+        summary = dict(zip(assignment_names, results))
+        logger.info(f'Course {self.course_id} grades publication summary: {summary}')
+        failed = [name for name, result in summary.items() if str(result).startswith(RESULT_ERROR)]
+        if failed:
+            raise GradesSenderCriticalError(f'Grades were not published for the assignments: {failed}')
+        return summary
+
+    def _create_senders(self, assignment_names: List[str], gb: Gradebook) -> List[LTIGradeSender]:
+        senders = []
+        course = None if self.is_lti11 else gb.check_course(self.course_id)
+        for assignment_name in assignment_names:
+            if self.is_lti11:
+                sender = LTIGradeSender(self.course_id, assignment_name)
+            else:
+                sender = LTI13GradeSender(self.course_id, assignment_name, course=course)
+            sender.gradebook = gb
+            for listener in self.progress_listeners:
+                sender.progress.add_listener(listener)
+            senders.append(sender)
+        return senders
+
+    async def _share_lms_session(self, senders: List[LTI13GradeSender]) -> None:
+        """Gets the access token and the line items once and shares them with all the senders"""
+        if not senders:
+            return
+        first_sender = senders[0]
+        await first_sender._set_access_token_header()
+        await first_sender._get_lineitems_from_url(first_sender.course.lms_lineitems_endpoint)
+        for sender in senders[1:]:
+            sender.headers = dict(first_sender.headers)
+            sender.all_lineitems = first_sender.all_lineitems
+
+    async def _send_assignment_grades(self, sender: LTIGradeSender, **options: Any) -> Any:
+        try:
+            report = await sender.send_grades(**options)
+            return report or RESULT_SENT
+        except AssignmentWithoutGradesError:
+            return RESULT_NO_GRADES
+        except GradesSenderMissingInfoError as e:
+            logger.error(f'Missing info to send grades for assignment {sender.assignment_name}: {e}')
+            return f'{RESULT_MISSING_INFO}: {e}'
+        except Exception as e:
+            logger.error(f'Error sending grades for assignment {sender.assignment_name}: {e}')
+            return f'{RESULT_ERROR}: {e}'
@@ -29,3 +29,12 @@ class GradesSenderMissingInfoError(GradesSenderError):
     """
 
     pass
+
+
+class GradesJobLeaseLostError(Exception):
+    """
+    Error to identify when the lease of a grades outbox job expired and the job was leased by another dispatcher,
+    the grades must not be sent twice
+    """
+
+    pass
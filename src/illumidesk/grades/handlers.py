@@ -1,14 +1,27 @@
+import asyncio
 import json
+import uuid
 
 
 from illumidesk.authenticators.authenticator import LTI11Authenticator
-from illumidesk.grades import exceptions
-from illumidesk.grades.senders import LTI13GradeSender
-from illumidesk.grades.senders import LTIGradeSender
+from illumidesk.grades.exceptions import GradesJobLeaseLostError
+from illumidesk.grades.outbox import ALL_ASSIGNMENTS
+from illumidesk.grades.outbox import GradesOutbox
+from illumidesk.grades.outbox import GradesOutboxDispatcher
+from illumidesk.grades.outbox import LTI11
+from illumidesk.grades.outbox import LEASE_SECONDS
+from illumidesk.grades.outbox import LTI13
+from illumidesk.grades.outbox import NON_RETRIABLE_ERRORS
+from illumidesk.grades.outbox import STATUS_FAILED
+from illumidesk.grades.outbox import create_grades_sender
+from illumidesk.grades.outbox import run_in_executor
+from illumidesk.grades.outbox import send_while_leased
+from illumidesk.metrics import GRADES_JOBS
 
 from jupyterhub.handlers import BaseHandler
 
 from tornado import web
+from tornado.iostream import StreamClosedError
 
 
 class SendGradesHandler(BaseHandler):
@@ -19,7 +32,8 @@ class SendGradesHandler(BaseHandler):
     async def post(self, course_id: str, assignment_name: str) -> None:
         """
         Receives a request with the course name and the assignment name as path parameters
-        which then uses the appropriate class to send grades to the platform based on the
+        which then registers a job in the grades outbox. The job is processed in background by the
+        outbox dispatcher, which uses the appropriate class to send grades to the platform based on the
         LTI authenticator version (1.1 or 1.3).
 
         Arguments:
@@ -27,28 +41,243 @@ class SendGradesHandler(BaseHandler):
             function.
           assignment_name: assignment name which should coincide with the assignment name within the LMS.
 
-        Raises:
-          GradesSenderCriticalError if there was a critical error when either extracting grades from the db
-            or sending grades to the tool consumer / platform.
-          AssignmentWithoutGradesError if the assignment does not have any grades associated to it.
-          GradesSenderMissingInfoError if ther is missing information when attempting to send grades.
+        The optional ``force`` argument (``?force=true``) resends all the scores, otherwise only the scores
+        that changed since the last successful sync are sent. With ``?mode=reconcile`` (LTI 1.3 only) the
+        scores are compared with the results in the LMS and only the differences are sent, the drift report
+        is saved as the job result. Both options are only available to the admins and the course's instructors.
+
+        The response contains the job id, which can be used with the GradesOutboxStatusHandler to check
+        the submission status.
         """
         self.log.debug(f'Data received to send grades-> course:{course_id}, assignment:{assignment_name}')
+        force = self.get_argument('force', 'false').lower() in ('true', '1')
+        mode = self.get_argument('mode', None)
+        if force or mode:
+            # a full resend or a reconciliation changes all the course's scores in the LMS
+            check_course_instructor(self, course_id)
+        options = get_reconcile_option(self, mode)
+        job_id = await enqueue_grades_job(self, course_id, assignment_name, force=force, **options)
+        self.set_status(202)
+        self.write(json.dumps({"success": True, "job_id": job_id}))
+
+
+class SendCourseGradesHandler(BaseHandler):
+    """
+    Defines a POST method to publish the grades of all the assignments of a course in a single job
+    """
+
+    @web.authenticated
+    async def post(self, course_id: str) -> None:
+        """
+        Registers a job in the grades outbox to publish the grades of the course's assignments, only
+        available to the admins and the course's instructors.
+
+        The optional json body selects the assignments and forces a full resend:
+        ```
+        {"assignments": ["lab1", "lab2"], "force": false, "mode": "reconcile"}
+        ```
+        All the assignments found in the gradebook are published when the assignments list is not set.
+
+        Arguments:
+          course_id: course name which has been previously normalized by the LTIUtils.normalize_string
+            function.
+        """
+        check_course_instructor(self, course_id)
+        self.log.debug(f'Data received to publish the course grades-> course:{course_id}')
+        try:
+            body = json.loads(self.request.body or '{}')
+        except json.JSONDecodeError:
+            raise web.HTTPError(400, 'The request body is not a valid json')
+        assignments = body.get('assignments') or None
+        if assignments is not None and not isinstance(assignments, list):
+            raise web.HTTPError(400, 'The assignments value must be a list of assignment names')
+        force = bool(body.get('force', False))
+        options = get_reconcile_option(self, body.get('mode'))
+        job_id = await enqueue_grades_job(
+            self, course_id, ALL_ASSIGNMENTS, force=force, assignments=assignments, **options
+        )
+        self.set_status(202)
+        self.write(json.dumps({"success": True, "job_id": job_id}))
+
+
+def get_lti_version(handler: BaseHandler) -> str:
+    """Returns the LTI version used by the hub's authenticator"""
+    if isinstance(handler.authenticator, LTI11Authenticator) or handler.authenticator is LTI11Authenticator:
+        return LTI11
+    return LTI13
+
+
+def get_reconcile_option(handler: BaseHandler, mode: str = None) -> dict:
+    """
+    Returns the sender options for the mode received in the request. Reconciliation uses the AGS results
+    service, so it's only available with LTI 1.3.
+    """
+    if not mode:
+        return {}
+    if mode != 'reconcile':
+        raise web.HTTPError(400, f'Unknown grades submission mode: {mode}')
+    if get_lti_version(handler) != LTI13:
+        raise web.HTTPError(400, 'The reconcile mode is only available with LTI 1.3')
+    return {'reconcile': True}
 
-        lti_grade_sender = None
 
-        # check lti version by the authenticator setting
-        if isinstance(self.authenticator, LTI11Authenticator) or self.authenticator is LTI11Authenticator:
-            lti_grade_sender = LTIGradeSender(course_id, assignment_name)
+async def enqueue_grades_job(handler: BaseHandler, course_id: str, assignment_name: str, **options) -> int:
+    """
+    Registers the grades job with the LTI version used by the hub's authenticator and makes sure
+    the outbox dispatcher is running in this hub.
+    """
+    lti_version = get_lti_version(handler)
+    job_id = await run_in_executor(GradesOutbox.instance().enqueue, course_id, assignment_name, lti_version, **options)
+    # let the dispatcher know about the new job
+    dispatcher = GradesOutboxDispatcher.instance()
+    dispatcher.start()
+    dispatcher.notify()
+    return job_id
+
+
+def check_course_instructor(handler: BaseHandler, course_id: str = None) -> None:
+    """
+    Raises a 403 unless the current user is an admin or an instructor of the course, a member of the
+    formgrade-<course_id> group. Only the admins are allowed without a course.
+    """
+    user = handler.current_user
+    if user is None:
+        raise web.HTTPError(403, 'Only the admins and the instructors of the course can manage its grades')
+    if user.admin:
+        return
+    if course_id and f'formgrade-{course_id}' in {group.name for group in getattr(user, 'groups', [])}:
+        return
+    raise web.HTTPError(403, 'Only the admins and the instructors of the course can manage its grades')
+
+
+class GradesOutboxStatusHandler(BaseHandler):
+    """
+    Returns the grades outbox status: the number of jobs by status and the failed jobs (dead letters).
+    Failed jobs can be moved back to the pending jobs with a POST request. The jobs of a course are
+    available to the admins and the course's instructors.
+    """
+
+    @web.authenticated
+    async def get(self, job_id: str = None) -> None:
+        """
+        Returns a single job when the job id is included in the path, otherwise the outbox summary
+        filtered by the ``course_id`` argument, which is only optional for the admins.
+        """
+        outbox = GradesOutbox.instance()
+        self.set_header('Content-Type', 'application/json')
+        if job_id:
+            job = await run_in_executor(outbox.get_job, int(job_id))
+            if job is None:
+                raise web.HTTPError(404, f'Grades job {job_id} not found')
+            check_course_instructor(self, job['course_id'])
+            self.write(json.dumps(job))
+            return
+        course_id = self.get_argument('course_id', None)
+        check_course_instructor(self, course_id)
+        status = await run_in_executor(outbox.status, course_id=course_id)
+        self.write(json.dumps(status))
+
+    @web.authenticated
+    async def post(self, job_id: str) -> None:
+        """
+        Retries a failed job
+        """
+        outbox = GradesOutbox.instance()
+        job = await run_in_executor(outbox.get_job, int(job_id))
+        if job is None:
+            raise web.HTTPError(404, f'Grades job {job_id} not found')
+        check_course_instructor(self, job['course_id'])
+        await run_in_executor(outbox.retry, int(job_id))
+        dispatcher = GradesOutboxDispatcher.instance()
+        dispatcher.start()
+        dispatcher.notify()
+        self.write(json.dumps({"success": True, "job_id": int(job_id)}))
+
+
+class StreamGradesHandler(BaseHandler):
+    """
+    Streaming variant of the grades submission. The grades are sent while the request is open and the
+    progress events are written as json lines (application/x-ndjson), one line per student outcome with
+    the counters and the throughput, so the instructor sees the results in real time and long submissions
+    don't hit the proxy's timeout waiting for the first byte.
+
+    The submission is registered as an outbox job leased by the request, so the dispatcher doesn't send the
+    same assignment's grades at the same time, and a submission that failed is retried by the dispatcher.
+    """
+
+    @web.authenticated
+    async def post(self, course_id: str, assignment_name: str) -> None:
+        """
+        Sends the grades of the assignment, or of all the course's assignments when the assignment name
+        is ``*``, and streams the progress events. The last line is a ``result`` event with the value
+        returned by the sender and the job id, or an ``error`` event. Responds with a 409 when the grades
+        of the assignment are being sent by another job.
+
+        Accepts the same ``force`` and ``mode`` arguments as the SendGradesHandler.
+        """
+        check_course_instructor(self, course_id)
+        self.log.debug(f'Data received to stream grades-> course:{course_id}, assignment:{assignment_name}')
+        force = self.get_argument('force', 'false').lower() in ('true', '1')
+        options = get_reconcile_option(self, self.get_argument('mode', None))
+        lti_version = get_lti_version(self)
+        outbox = GradesOutbox.instance()
+        owner = f'stream-{uuid.uuid4().hex[:12]}'
+        job = await run_in_executor(
+            outbox.enqueue_leased, course_id, assignment_name, lti_version, owner, force=force, **options
+        )
+        if job is None:
+            raise web.HTTPError(409, f'The grades of {course_id}/{assignment_name} are being sent by another job')
+        from illumidesk.grades.course_sender import CourseGradesSender
+
+        sender = create_grades_sender(lti_version, course_id, assignment_name)
+        events = asyncio.Queue()
+        if isinstance(sender, CourseGradesSender):
+            sender.add_progress_listener(events.put_nowait)
+        else:
+            sender.progress.add_listener(events.put_nowait)
+
+        self.set_header('Content-Type', 'application/x-ndjson')
+        self.set_header('Cache-Control', 'no-cache')
+        # disable the response buffering in nginx based proxies
+        self.set_header('X-Accel-Buffering', 'no')
+        task = asyncio.ensure_future(
+            send_while_leased(sender.send_grades(force=force, **options), outbox, job['id'], owner, LEASE_SECONDS)
+        )
+        while not task.done() or not events.empty():
+            next_event = asyncio.ensure_future(events.get())
+            done, _ = await asyncio.wait([next_event, task], return_when=asyncio.FIRST_COMPLETED)
+            if next_event in done:
+                await self._write_event(next_event.result())
+            else:
+                next_event.cancel()
+        try:
+            result = task.result()
+        except GradesJobLeaseLostError as e:
+            # the dispatcher that leased the job sends the grades and acknowledges it
+            self.log.warning(str(e))
+            GRADES_JOBS.labels(result='lost').inc()
+            await self._write_event({'event': 'error', 'success': False, 'error': str(e), 'job_id': job['id']})
+        except Exception as e:
+            self.log.error(f'Error sending grades for {course_id}/{assignment_name}: {e}')
+            error = f'{type(e).__name__}: {e}'
+            status = await run_in_executor(
+                outbox.nack, job['id'], owner, error, retriable=not isinstance(e, NON_RETRIABLE_ERRORS)
+            )
+            if status is not None:
+                GRADES_JOBS.labels(result='failed' if status == STATUS_FAILED else 'retry').inc()
+            await self._write_event({'event': 'error', 'success': False, 'error': error, 'job_id': job['id']})
         else:
-            lti_grade_sender = LTI13GradeSender(course_id, assignment_name)
+            if await run_in_executor(outbox.ack, job['id'], owner, result):
+                GRADES_JOBS.labels(result='done').inc()
+            await self._write_event({'event': 'result', 'success': True, 'result': result, 'job_id': job['id']})
+
+    async def _write_event(self, event: dict) -> None:
+        # the grades are still sent when the client goes away
+        if getattr(self, '_stream_closed', False):
+            return
         try:
-            await lti_grade_sender.send_grades()
-        except exceptions.GradesSenderCriticalError:
-            raise web.HTTPError(400, 'There was an critical error, please check logs.')
-        except exceptions.AssignmentWithoutGradesError:
-            raise web.HTTPError(400, 'There are no grades yet to submit')
-        except exceptions.GradesSenderMissingInfoError as e:
-            self.log.error(f'There are missing values.{e}')
-            raise web.HTTPError(400, f'Impossible to send grades. There are missing values, please check logs.{e}')
-        self.write(json.dumps({"success": True}))
+            self.write(json.dumps(event, default=str) + '\n')
+            await self.flush()
+        except StreamClosedError:
+            self.log.warning('The client closed the grades progress stream')
+            self._stream_closed = True
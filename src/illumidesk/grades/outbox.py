@@ -0,0 +1,632 @@
+import asyncio
+import functools
+import json
+import logging
+import os
+import threading
+import uuid
+
+from datetime import datetime
+from datetime import timedelta
+
+from sqlalchemy import Column
+from sqlalchemy import DateTime
+from sqlalchemy import Integer
+from sqlalchemy import String
+from sqlalchemy import Text
+from sqlalchemy import and_
+from sqlalchemy import create_engine
+from sqlalchemy import exists
+from sqlalchemy import func
+from sqlalchemy import or_
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import aliased
+from sqlalchemy.orm import sessionmaker
+
+from tornado.ioloop import IOLoop
+
+from typing import Any
+from typing import Awaitable
+from typing import Dict
+from typing import List
+from typing import Optional
+
+from illumidesk.grades import exceptions
+from illumidesk.metrics import EXECUTOR_GRADES_OUTBOX
+from illumidesk.metrics import EXECUTOR_QUEUE_DEPTH
+from illumidesk.metrics import GRADES_JOBS
+
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+# the hub's persistent directory (/srv/jupyterhub) survives pod restarts
+GRADES_OUTBOX_DB_URL = os.environ.get(
+    'ILLUMIDESK_GRADES_OUTBOX_DB_URL', 'sqlite:////srv/jupyterhub/illumidesk_grades_outbox.sqlite'
+)
+
+LTI11 = '1.1'
+LTI13 = '1.3'
+
+# assignment name used with the outbox jobs that publish the grades of the whole course
+ALL_ASSIGNMENTS = '*'
+
+STATUS_PENDING = 'pending'
+STATUS_LEASED = 'leased'
+STATUS_DONE = 'done'
+STATUS_FAILED = 'failed'
+
+# seconds a job stays leased without a renewal
+LEASE_SECONDS = 300
+# seconds before a lease renewal that failed (e.g. the database was locked) is tried again
+LEASE_RENEW_RETRY_SECONDS = 5
+
+# errors that will not go away by retrying the job
+NON_RETRIABLE_ERRORS = (exceptions.AssignmentWithoutGradesError, exceptions.GradesSenderMissingInfoError)
+
+
+Base = declarative_base()
+
+
+def live_lease_of(job: Any, now: datetime) -> Any:
+    """
+    Returns the filter of the jobs leased by a dispatcher or a request that is still processing them
+    """
+    return and_(job.status == STATUS_LEASED, job.lease_expires_at >= now)
+
+
+async def keep_lease(outbox: 'GradesOutbox', job_id: int, owner: str, lease_seconds: int = LEASE_SECONDS) -> None:
+    """
+    Renews the lease of a job until the task is cancelled, when the job is acknowledged. The renewal errors are
+    logged and the renewal is tried again. Returns when the lease was lost: it expired and the job was leased by
+    another dispatcher.
+    """
+    delay = lease_seconds / 3
+    while True:
+        await asyncio.sleep(delay)
+        try:
+            renewed = await run_in_executor(outbox.renew, job_id, owner, lease_seconds)
+        except Exception as e:
+            logger.warning(f'Unable to renew the lease of the grades job {job_id}: {e}')
+            delay = min(LEASE_RENEW_RETRY_SECONDS, lease_seconds / 3)
+            continue
+        if not renewed:
+            logger.warning(f'The lease of the grades job {job_id} owned by {owner} was lost')
+            return
+        delay = lease_seconds / 3
+
+
+async def send_while_leased(
+    sending: Awaitable, outbox: 'GradesOutbox', job_id: int, owner: str, lease_seconds: int = LEASE_SECONDS
+) -> Any:
+    """
+    Sends the grades of a job while its lease is renewed, the sending is cancelled when the lease is lost
+
+    Args:
+        sending: the sender's send_grades coroutine
+        outbox: the outbox with the leased job
+        job_id: the leased job id
+        owner: the owner of the lease
+
+    Returns:
+        The value returned by the sender
+
+    Raises:
+        GradesJobLeaseLostError: the lease was lost, the job is processed by another dispatcher
+    """
+    task = asyncio.ensure_future(sending)
+    heartbeat = asyncio.ensure_future(keep_lease(outbox, job_id, owner, lease_seconds))
+    try:
+        await asyncio.wait([task, heartbeat], return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        heartbeat.cancel()
+        lost = not task.done()
+        if lost:
+            task.cancel()
+    if lost:
+        raise exceptions.GradesJobLeaseLostError(f'The lease of the grades job {job_id} was lost by {owner}')
+    return task.result()
+
+
+async def run_in_executor(func: Any, *args: Any, **kwargs: Any) -> Any:
+    """
+    Runs a blocking outbox call (a sqlite query and commit) in the event loop's default executor, so the hub's
+    event loop keeps serving requests while the database is busy
+    """
+    loop = asyncio.get_event_loop()
+    return await loop.run_in_executor(None, functools.partial(func, *args, **kwargs))
+
+
+class GradesOutboxJob(Base):
+    """
+    A pending grades submission for an assignment. Jobs are leased by a dispatcher and acknowledged once the
+    grades were sent, so a job that was leased by a hub that crashed is processed again after its lease expires.
+    """
+
+    __tablename__ = 'grades_outbox'
+    id = Column(Integer, primary_key=True)
+    course_id = Column(String(50), nullable=False, index=True)
+    assignment_name = Column(String(255), nullable=False)
+    lti_version = Column(String(10), nullable=False)
+    options = Column(Text, nullable=False, default='{}')
+    status = Column(String(20), nullable=False, default=STATUS_PENDING, index=True)
+    attempts = Column(Integer, nullable=False, default=0)
+    available_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    lease_owner = Column(String(50), nullable=True)
+    lease_expires_at = Column(DateTime, nullable=True)
+    last_error = Column(Text, nullable=True)
+    # json value returned by the sender, e.g. the drift report of a reconciliation
+    result = Column(Text, nullable=True)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    updated_at = Column(DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'id': self.id,
+            'course_id': self.course_id,
+            'assignment_name': self.assignment_name,
+            'lti_version': self.lti_version,
+            'options': json.loads(self.options or '{}'),
+            'status': self.status,
+            'attempts': self.attempts,
+            'last_error': self.last_error,
+            'result': json.loads(self.result) if self.result else None,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None,
+        }
+
+
+class GradesOutbox:
+    """
+    Persistent outbox with the grades submissions pending to be sent to the LMS.
+
+    Args:
+        db_url: database url where the outbox table lives. Defaults to a sqlite file in the hub's data directory.
+        max_attempts: number of attempts before a job is moved to the failed jobs (dead letters)
+        retry_delay: seconds to wait before retrying a failed job, multiplied by the number of attempts
+    """
+
+    _instance = None
+
+    def __init__(self, db_url: str = None, max_attempts: int = 5, retry_delay: int = 30):
+        self.db_url = db_url or GRADES_OUTBOX_DB_URL
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.engine = create_engine(self.db_url)
+        Base.metadata.create_all(self.engine)
+        self.Session = sessionmaker(bind=self.engine, expire_on_commit=False)
+        # the check of the assignments' leases and the new lease are not interleaved by the hub's threads
+        self._lease_lock = threading.Lock()
+
+    @classmethod
+    def instance(cls) -> 'GradesOutbox':
+        """Returns the outbox shared by the hub's handlers and dispatcher"""
+        if cls._instance is None:
+            cls._instance = cls()
+            # the pending jobs are counted when the metrics are collected
+            EXECUTOR_QUEUE_DEPTH.labels(executor=EXECUTOR_GRADES_OUTBOX).set_function(cls._instance.pending_count)
+        return cls._instance
+
+    def pending_count(self) -> int:
+        """Returns the number of jobs waiting to be processed"""
+        session = self.Session()
+        try:
+            return session.query(func.count(GradesOutboxJob.id)).filter_by(status=STATUS_PENDING).scalar()
+        finally:
+            session.close()
+
+    def enqueue(self, course_id: str, assignment_name: str, lti_version: str, **options: Any) -> int:
+        """
+        Adds a grades submission to the outbox. If the same submission is already waiting in the outbox
+        then the existing job is returned instead of creating a new one.
+
+        Args:
+            course_id: normalized course id
+            assignment_name: the assignment name in nbgrader
+            lti_version: the LTI version used to send the grades (1.1 or 1.3)
+            options: keyword arguments passed to the sender's send_grades method
+
+        Returns:
+            The job id
+        """
+        if not course_id:
+            raise ValueError('course_id missing')
+        if not assignment_name:
+            raise ValueError('assignment_name missing')
+        options_json = json.dumps(options, sort_keys=True)
+        session = self.Session()
+        try:
+            job = (
+                session.query(GradesOutboxJob)
+                .filter_by(
+                    course_id=course_id,
+                    assignment_name=assignment_name,
+                    lti_version=lti_version,
+                    options=options_json,
+                    status=STATUS_PENDING,
+                )
+                .first()
+            )
+            if job is None:
+                job = GradesOutboxJob(
+                    course_id=course_id,
+                    assignment_name=assignment_name,
+                    lti_version=lti_version,
+                    options=options_json,
+                    status=STATUS_PENDING,
+                )
+                session.add(job)
+                session.commit()
+                logger.debug(f'Grades job {job.id} enqueued for {course_id}/{assignment_name}')
+            return job.id
+        finally:
+            session.close()
+
+    def lease(self, owner: str, lease_seconds: int = LEASE_SECONDS) -> Optional[Dict[str, Any]]:
+        """
+        Leases the next available job. Jobs leased by a dispatcher that did not acknowledge them before
+        the lease expired (for example when the hub was restarted) are available again, unless they reached
+        the maximum number of attempts, then they are moved to the failed jobs. The jobs of an assignment
+        whose grades are being sent by another leased job (e.g. a streamed submission) wait for its end.
+
+        Returns:
+            The leased job as a dict or None when there are not jobs to process
+        """
+        with self._lease_lock:
+            return self._lease_next(owner, lease_seconds)
+
+    def _lease_next(self, owner: str, lease_seconds: int) -> Optional[Dict[str, Any]]:
+        now = datetime.utcnow()
+        other = aliased(GradesOutboxJob)
+        session = self.Session()
+        try:
+            while True:
+                job = (
+                    session.query(GradesOutboxJob)
+                    .filter(
+                        or_(
+                            (GradesOutboxJob.status == STATUS_PENDING) & (GradesOutboxJob.available_at <= now),
+                            (GradesOutboxJob.status == STATUS_LEASED) & (GradesOutboxJob.lease_expires_at < now),
+                        ),
+                        ~exists().where(
+                            and_(
+                                other.id != GradesOutboxJob.id,
+                                live_lease_of(other, now),
+                                other.course_id == GradesOutboxJob.course_id,
+                                or_(
+                                    other.assignment_name == GradesOutboxJob.assignment_name,
+                                    other.assignment_name == ALL_ASSIGNMENTS,
+                                    GradesOutboxJob.assignment_name == ALL_ASSIGNMENTS,
+                                ),
+                            )
+                        ),
+                    )
+                    .order_by(GradesOutboxJob.available_at, GradesOutboxJob.id)
+                    .with_for_update(skip_locked=True)
+                    .first()
+                )
+                if job is None:
+                    return None
+                if job.status == STATUS_PENDING or job.attempts < self.max_attempts:
+                    break
+                # the job's attempts crashed or hung the hubs that leased it
+                job.status = STATUS_FAILED
+                job.last_error = f'The lease expired after {job.attempts} attempts'
+                job.lease_owner = None
+                job.lease_expires_at = None
+                session.commit()
+                logger.error(f'Grades job {job.id} moved to failed jobs: {job.last_error}')
+                GRADES_JOBS.labels(result='failed').inc()
+            job.status = STATUS_LEASED
+            job.lease_owner = owner
+            job.lease_expires_at = now + timedelta(seconds=lease_seconds)
+            job.attempts += 1
+            session.commit()
+            return job.to_dict()
+        finally:
+            session.close()
+
+    def enqueue_leased(
+        self,
+        course_id: str,
+        assignment_name: str,
+        lti_version: str,
+        owner: str,
+        lease_seconds: int = LEASE_SECONDS,
+        **options: Any,
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Adds a grades submission already leased by the owner, used to send the grades in the request that
+        asked for them. The submission is not added when the grades of the assignment (or of the whole
+        course) are being sent by another leased job.
+
+        Returns:
+            The leased job as a dict or None when the assignment's grades are being sent
+        """
+        now = datetime.utcnow()
+        assignments = [assignment_name, ALL_ASSIGNMENTS]
+        session = self.Session()
+        try:
+            with self._lease_lock:
+                query = session.query(GradesOutboxJob.id).filter(
+                    live_lease_of(GradesOutboxJob, now), GradesOutboxJob.course_id == course_id
+                )
+                if assignment_name != ALL_ASSIGNMENTS:
+                    query = query.filter(GradesOutboxJob.assignment_name.in_(assignments))
+                if query.first() is not None:
+                    return None
+                job = GradesOutboxJob(
+                    course_id=course_id,
+                    assignment_name=assignment_name,
+                    lti_version=lti_version,
+                    options=json.dumps(options, sort_keys=True),
+                    status=STATUS_LEASED,
+                    attempts=1,
+                    lease_owner=owner,
+                    lease_expires_at=now + timedelta(seconds=lease_seconds),
+                )
+                session.add(job)
+                session.commit()
+            logger.debug(f'Grades job {job.id} enqueued and leased by {owner} for {course_id}/{assignment_name}')
+            return job.to_dict()
+        finally:
+            session.close()
+
+    def renew(self, job_id: int, owner: str, lease_seconds: int = LEASE_SECONDS) -> bool:
+        """Extends the lease of a job that is still being processed"""
+        session = self.Session()
+        try:
+            updated = (
+                session.query(GradesOutboxJob)
+                .filter_by(id=job_id, lease_owner=owner, status=STATUS_LEASED)
+                .update({'lease_expires_at': datetime.utcnow() + timedelta(seconds=lease_seconds)})
+            )
+            session.commit()
+            return updated > 0
+        finally:
+            session.close()
+
+    def ack(self, job_id: int, owner: str, result: Any = None) -> bool:
+        """
+        Marks the job leased by the owner as done and saves the value returned by the sender
+
+        Returns:
+            False if the job is not leased by the owner anymore
+        """
+        session = self.Session()
+        try:
+            updated = (
+                session.query(GradesOutboxJob)
+                .filter_by(id=job_id, lease_owner=owner, status=STATUS_LEASED)
+                .update(
+                    {
+                        'status': STATUS_DONE,
+                        'lease_owner': None,
+                        'lease_expires_at': None,
+                        'last_error': None,
+                        'result': json.dumps(result, default=str) if result is not None else None,
+                    }
+                )
+            )
+            session.commit()
+        finally:
+            session.close()
+        if not updated:
+            logger.warning(f'Grades job {job_id} not acknowledged, it is not leased by {owner}')
+        return updated > 0
+
+    def nack(self, job_id: int, owner: str, error: str, retriable: bool = True) -> Optional[str]:
+        """
+        Registers a failed attempt of the job leased by the owner. The job is retried later or moved to the
+        failed jobs when it reached the maximum number of attempts or when the error is not retriable.
+
+        Returns:
+            The new job status, None if the job is not leased by the owner anymore
+        """
+        session = self.Session()
+        try:
+            job = (
+                session.query(GradesOutboxJob)
+                .filter_by(id=job_id, lease_owner=owner, status=STATUS_LEASED)
+                .with_for_update()
+                .first()
+            )
+            if job is None:
+                logger.warning(f'Grades job {job_id} failure not registered, it is not leased by {owner}: {error}')
+                return None
+            job.last_error = error
+            job.lease_owner = None
+            job.lease_expires_at = None
+            if not retriable or job.attempts >= self.max_attempts:
+                job.status = STATUS_FAILED
+                logger.error(f'Grades job {job_id} moved to failed jobs after {job.attempts} attempts: {error}')
+            else:
+                job.status = STATUS_PENDING
+                job.available_at = datetime.utcnow() + timedelta(seconds=self.retry_delay * job.attempts)
+            session.commit()
+            return job.status
+        finally:
+            session.close()
+
+    def retry(self, job_id: int) -> None:
+        """Moves a failed job back to the pending jobs"""
+        self._update(job_id, status=STATUS_PENDING, attempts=0, available_at=datetime.utcnow())
+
+    def get_job(self, job_id: int) -> Optional[Dict[str, Any]]:
+        session = self.Session()
+        try:
+            job = session.query(GradesOutboxJob).get(job_id)
+            return job.to_dict() if job else None
+        finally:
+            session.close()
+
+    def status(self, course_id: str = None, limit: int = 50) -> Dict[str, Any]:
+        """
+        Returns the number of jobs by status and the latest failed jobs
+
+        Args:
+            course_id: optional course id to filter the jobs
+            limit: maximum number of failed jobs to include
+        """
+        session = self.Session()
+        try:
+            counts_query = session.query(GradesOutboxJob.status, func.count(GradesOutboxJob.id))
+            failed_query = session.query(GradesOutboxJob).filter_by(status=STATUS_FAILED)
+            if course_id:
+                counts_query = counts_query.filter_by(course_id=course_id)
+                failed_query = failed_query.filter_by(course_id=course_id)
+            counts = {status: 0 for status in (STATUS_PENDING, STATUS_LEASED, STATUS_DONE, STATUS_FAILED)}
+            counts.update(dict(counts_query.group_by(GradesOutboxJob.status).all()))
+            failed = failed_query.order_by(GradesOutboxJob.updated_at.desc()).limit(limit).all()
+            return {'counts': counts, 'failed': [job.to_dict() for job in failed]}
+        finally:
+            session.close()
+
+    def _update(self, job_id: int, **values: Any) -> None:
+        session = self.Session()
+        try:
+            session.query(GradesOutboxJob).filter_by(id=job_id).update(values)
+            session.commit()
+        finally:
+            session.close()
+
+
+def create_grades_sender(lti_version: str, course_id: str, assignment_name: str) -> Any:
+    """
+    Creates the grades sender for the LTI version. Jobs registered for all the assignments of the
+    course (with the ALL_ASSIGNMENTS name) use the CourseGradesSender.
+    """
+    from illumidesk.grades.course_sender import CourseGradesSender
+    from illumidesk.grades.senders import LTI13GradeSender
+    from illumidesk.grades.senders import LTIGradeSender
+
+    if assignment_name == ALL_ASSIGNMENTS:
+        return CourseGradesSender(course_id, lti_version)
+    if lti_version == LTI11:
+        return LTIGradeSender(course_id, assignment_name)
+    return LTI13GradeSender(course_id, assignment_name)
+
+
+class GradesOutboxDispatcher:
+    """
+    Background task running in the hub that leases the jobs from the outbox and sends the grades.
+
+    Args:
+        outbox: the outbox with the pending jobs
+        poll_interval: seconds to wait when the outbox is empty
+        lease_seconds: seconds a job stays leased without a renewal
+    """
+
+    _instance = None
+
+    def __init__(self, outbox: GradesOutbox, poll_interval: float = 5, lease_seconds: int = LEASE_SECONDS):
+        self.outbox = outbox
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds
+        self.owner = f'hub-{uuid.uuid4().hex[:12]}'
+        self._task = None
+        self._wakeup = None
+
+    @classmethod
+    def instance(cls) -> 'GradesOutboxDispatcher':
+        """Returns the dispatcher shared in the hub process"""
+        if cls._instance is None:
+            cls._instance = cls(GradesOutbox.instance())
+        return cls._instance
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self) -> None:
+        """
+        Starts the dispatcher in the current event loop. It's safe to call this method many times, the
+        authenticators start it with start_grades_dispatcher when the hub starts and the grades handlers
+        when they enqueue a job.
+        """
+        if self.running:
+            return
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.ensure_future(self._run())
+        logger.info(f'Grades outbox dispatcher {self.owner} started')
+
+    def notify(self) -> None:
+        """Wakes up the dispatcher when a new job was enqueued"""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def stop(self) -> None:
+        if self.running:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                processed = await self.process_next()
+            except Exception as e:
+                logger.error(f'Unexpected error in the grades outbox dispatcher: {e}')
+                processed = False
+            if not processed:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def process_next(self) -> bool:
+        """
+        Leases and processes the next job
+
+        Returns:
+            True if a job was processed, False if the outbox was empty
+        """
+        job = await run_in_executor(self.outbox.lease, self.owner, self.lease_seconds)
+        if job is None:
+            return False
+        logger.info(f"Processing grades job {job['id']} for {job['course_id']}/{job['assignment_name']}")
+        try:
+            sender = create_grades_sender(job['lti_version'], job['course_id'], job['assignment_name'])
+            result = await send_while_leased(
+                sender.send_grades(**job['options']), self.outbox, job['id'], self.owner, self.lease_seconds
+            )
+        except exceptions.GradesJobLeaseLostError as e:
+            # the job's new owner sends the grades and acknowledges it
+            logger.warning(str(e))
+            GRADES_JOBS.labels(result='lost').inc()
+        except Exception as e:
+            status = await run_in_executor(
+                self.outbox.nack,
+                job['id'],
+                self.owner,
+                f'{type(e).__name__}: {e}',
+                retriable=not isinstance(e, NON_RETRIABLE_ERRORS),
+            )
+            if status is not None:
+                GRADES_JOBS.labels(result='failed' if status == STATUS_FAILED else 'retry').inc()
+        else:
+            if await run_in_executor(self.outbox.ack, job['id'], self.owner, result):
+                GRADES_JOBS.labels(result='done').inc()
+                logger.info(f"Grades job {job['id']} done")
+        return True
+
+
+def start_grades_dispatcher() -> None:
+    """
+    Starts the hub's dispatcher once the hub's event loop runs, so the jobs left by a previous hub are
+    processed right after a restart instead of waiting for the next enqueued job. The authenticators
+    call it when the hub creates them.
+    """
+    IOLoop.current().add_callback(_start_grades_dispatcher)
+
+
+def _start_grades_dispatcher() -> None:
+    try:
+        GradesOutboxDispatcher.instance().start()
+    except Exception as e:
+        # the jobs are dispatched when the next one is enqueued
+        logger.error(f'Unable to start the grades outbox dispatcher: {e}')
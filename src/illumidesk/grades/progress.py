@@ -0,0 +1,108 @@
+import logging
+import time
+
+from typing import Any
+from typing import Callable
+from typing import Dict
+from typing import List
+
+from illumidesk.metrics import GRADES_SCORES
+
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+
+EVENT_START = 'start'
+EVENT_SCORE = 'score'
+EVENT_DONE = 'done'
+
+STATUS_SENT = 'sent'
+STATUS_FAILED = 'failed'
+STATUS_SKIPPED = 'skipped'
+
+
+class GradesSendProgress:
+    """
+    Keeps the counters of a grades submission and emits progress events to the registered listeners.
+
+    Every event is a dict with the event name, the assignment name and the current counters (total, sent,
+    failed, skipped), the elapsed seconds and the throughput in scores per second. Score events also include
+    the student's lms_user_id, the status (sent, failed or skipped) and the error, if any.
+
+    Args:
+        assignment_name: the assignment name used on the nbgrader console
+    """
+
+    def __init__(self, assignment_name: str):
+        self.assignment_name = assignment_name
+        self.listeners: List[Callable[[Dict[str, Any]], None]] = []
+        self.total = 0
+        self.sent = 0
+        self.failed = 0
+        self.skipped = 0
+        self.started_at = time.monotonic()
+
+    def add_listener(self, listener: Callable[[Dict[str, Any]], None]) -> None:
+        """Registers a callable that receives every progress event"""
+        self.listeners.append(listener)
+
+    def start(self, total: int, skipped: int = 0) -> None:
+        """
+        Starts the counters
+
+        Args:
+            total: number of scores that will be sent
+            skipped: number of scores that do not need to be sent (e.g. unchanged scores)
+        """
+        self.total = total
+        self.sent = 0
+        self.failed = 0
+        self.skipped = skipped
+        self.started_at = time.monotonic()
+        if skipped:
+            GRADES_SCORES.labels(status=STATUS_SKIPPED).inc(skipped)
+        self._emit(EVENT_START)
+
+    def score_sent(self, lms_user_id: str) -> None:
+        self.sent += 1
+        GRADES_SCORES.labels(status=STATUS_SENT).inc()
+        self._emit(EVENT_SCORE, lms_user_id=lms_user_id, status=STATUS_SENT)
+
+    def score_failed(self, lms_user_id: str, error: str = None) -> None:
+        self.failed += 1
+        GRADES_SCORES.labels(status=STATUS_FAILED).inc()
+        self._emit(EVENT_SCORE, lms_user_id=lms_user_id, status=STATUS_FAILED, error=error)
+
+    def score_skipped(self, lms_user_id: str, reason: str = None) -> None:
+        self.skipped += 1
+        GRADES_SCORES.labels(status=STATUS_SKIPPED).inc()
+        self._emit(EVENT_SCORE, lms_user_id=lms_user_id, status=STATUS_SKIPPED, error=reason)
+
+    def finish(self) -> None:
+        self._emit(EVENT_DONE)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Returns the current counters"""
+        elapsed = time.monotonic() - self.started_at
+        processed = self.sent + self.failed
+        return {
+            'assignment': self.assignment_name,
+            'total': self.total,
+            'sent': self.sent,
+            'failed': self.failed,
+            'skipped': self.skipped,
+            'elapsed': round(elapsed, 3),
+            'rate': round(processed / elapsed, 2) if elapsed > 0 else 0.0,
+        }
+
+    def _emit(self, event: str, **data: Any) -> None:
+        if not self.listeners:
+            return
+        payload = {'event': event, **self.snapshot(), **data}
+        for listener in self.listeners:
+            try:
+                listener(payload)
+            except Exception as e:
+                # a broken listener must not stop the grades submission
+                logger.error(f'Error in grades progress listener: {e}')
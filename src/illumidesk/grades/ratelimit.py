@@ -0,0 +1,81 @@
+import asyncio
+import logging
+import os
+import time
+
+from typing import Dict
+from urllib.parse import urlparse
+
+from illumidesk.metrics import EXECUTOR_LMS_RATE_LIMITER
+from illumidesk.metrics import EXECUTOR_QUEUE_DEPTH
+
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+
+# maximum number of concurrent requests sent to the same LMS
+LMS_MAX_CONCURRENT_REQUESTS = int(os.environ.get('LMS_MAX_CONCURRENT_REQUESTS') or '8')
+# maximum number of requests per second sent to the same LMS
+LMS_MAX_REQUESTS_PER_SECOND = float(os.environ.get('LMS_MAX_REQUESTS_PER_SECOND') or '10')
+
+
+class LMSRateLimiter:
+    """
+    Limits the requests sent to an LMS: at most `max_concurrency` requests in flight and requests
+    spaced to keep the rate below `max_per_second`. Limiters are shared by host with `for_url`, so
+    all the grade senders running in the hub respect the same limit for the same LMS.
+
+    Usage:
+    ```
+    async with LMSRateLimiter.for_url(url):
+        await client.fetch(url)
+    ```
+
+    Args:
+        max_concurrency: maximum number of requests in flight
+        max_per_second: maximum number of requests started per second
+    """
+
+    _limiters: Dict[str, 'LMSRateLimiter'] = {}
+
+    def __init__(self, max_concurrency: int = None, max_per_second: float = None):
+        self.max_concurrency = max_concurrency or LMS_MAX_CONCURRENT_REQUESTS
+        self.max_per_second = max_per_second or LMS_MAX_REQUESTS_PER_SECOND
+        self._semaphore = None
+        self._lock = None
+        self._next_slot = 0.0
+
+    @classmethod
+    def for_url(cls, url: str) -> 'LMSRateLimiter':
+        """Returns the limiter shared by all the requests sent to the url's host"""
+        host = urlparse(url).netloc or url
+        if host not in cls._limiters:
+            cls._limiters[host] = cls()
+        return cls._limiters[host]
+
+    async def __aenter__(self) -> 'LMSRateLimiter':
+        # asyncio primitives are created lazily to bind them with the running loop
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            self._lock = asyncio.Lock()
+        queue_depth = EXECUTOR_QUEUE_DEPTH.labels(executor=EXECUTOR_LMS_RATE_LIMITER)
+        queue_depth.inc()
+        try:
+            await self._semaphore.acquire()
+            try:
+                async with self._lock:
+                    now = time.monotonic()
+                    wait = self._next_slot - now
+                    self._next_slot = max(now, self._next_slot) + 1.0 / self.max_per_second
+                if wait > 0:
+                    await asyncio.sleep(wait)
+            except BaseException:
+                self._semaphore.release()
+                raise
+        finally:
+            queue_depth.dec()
+        return self
+
+    async def __aexit__(self, *args) -> None:
+        self._semaphore.release()
@@ -5,6 +5,9 @@ import os
 from filelock import FileLock
 from pathlib import Path
 
+from illumidesk.metrics import CACHE_GRADES_CONTROL_FILE
+from illumidesk.metrics import record_cache_lookup
+
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
 
@@ -26,6 +29,7 @@ class LTIGradesSenderControlFile:
 
     def __init__(self, course_dir: str):
         self.config_path = course_dir
+        record_cache_lookup(CACHE_GRADES_CONTROL_FILE, LTIGradesSenderControlFile.FILE_LOADED)
         if not LTIGradesSenderControlFile.FILE_LOADED:
             logger.debug('The control file cache will be loaded from filesystem...')
             # try to read first time
@@ -106,8 +110,9 @@ class LTIGradesSenderControlFile:
     def _write_new_assignment_info(self, assignment_name: str, data: dict) -> None:
         # append new info
         LTIGradesSenderControlFile.cache_sender_data[assignment_name] = data
-        # save the file to disk
-        with Path(self.config_fullname).open('r+') as file:
+        # save the file to disk, the file may not exist yet when the cache was loaded from another course
+        Path(self.config_path).mkdir(parents=True, exist_ok=True)
+        with Path(self.config_fullname).open('w') as file:
             json.dump(LTIGradesSenderControlFile.cache_sender_data, file)
 
     def get_assignment_by_name(self, assignment_name: str) -> None:
@@ -0,0 +1,134 @@
+import json
+import logging
+import os
+
+from datetime import datetime
+
+from filelock import FileLock
+from pathlib import Path
+
+from typing import Any
+from typing import Dict
+from typing import List
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+
+class LTIGradesSenderSyncState:
+    """
+    Sync state file that records the last score successfully posted to the LMS for each student.
+    With this file the grade senders can skip the scores that did not change since the last sync (delta mode).
+
+    The file content has the format:
+    ```
+    {
+        "<assignment_name>": {
+            "<lms_user_id>": {"score": 8.0, "max_score": 10.0, "timestamp": "2020-10-10T10:10:10.000000"}
+        }
+    }
+    ```
+
+    Args:
+        course_dir (str): Course directory, normally where the gradebook is (/home/grader-<course-id>/<course-id>)
+    """
+
+    FILE_NAME = 'lti_grades_sender_sync_state.json'
+
+    def __init__(self, course_dir: str):
+        self.config_path = str(course_dir)
+        self.state = self._load_from_file()
+
+    @property
+    def config_fullname(self) -> str:
+        return os.path.join(self.config_path, LTIGradesSenderSyncState.FILE_NAME)
+
+    @property
+    def lock_file(self) -> str:
+        return f'{self.config_fullname}.lock'
+
+    def _load_from_file(self) -> Dict[str, Dict[str, Dict[str, Any]]]:
+        if not Path(self.config_fullname).exists() or Path(self.config_fullname).stat().st_size == 0:
+            return {}
+        with Path(self.config_fullname).open('r') as file:
+            try:
+                return json.load(file)
+            except json.JSONDecodeError as e:
+                # a broken state file only means that the next sync will send all the scores
+                logger.error(f'Sync state file with wrong format:{e}. It will be ignored')
+                return {}
+
+    def _save_to_file(self) -> None:
+        # write to a temporary file first so a crash never leaves a truncated state file
+        tmp_fullname = f'{self.config_fullname}.tmp'
+        with Path(tmp_fullname).open('w') as file:
+            json.dump(self.state, file)
+        os.replace(tmp_fullname, self.config_fullname)
+
+    @staticmethod
+    def _same_value(a: float, b: float) -> bool:
+        return abs(float(a) - float(b)) < 1e-9
+
+    def is_synced(self, assignment_name: str, lms_user_id: str, score: float, max_score: float) -> bool:
+        """
+        Checks if the score and max_score were already posted to the LMS for the student
+
+        Args:
+            assignment_name: the assignment name used in nbgrader
+            lms_user_id: the student id in the LMS
+            score: the score found in the gradebook
+            max_score: the maximum score for the assignment
+
+        Returns:
+            True if the last posted values are the same as the current ones, False otherwise
+        """
+        last_posted = self.state.get(assignment_name, {}).get(lms_user_id)
+        if not last_posted:
+            return False
+        return self._same_value(last_posted['score'], score) and self._same_value(last_posted['max_score'], max_score)
+
+    def filter_changed(self, assignment_name: str, max_score: float, grades: List[dict]) -> List[dict]:
+        """
+        Returns only the grades that are new or changed since the last successful sync
+
+        Args:
+            assignment_name: the assignment name used in nbgrader
+            max_score: the maximum score for the assignment
+            grades: list of dicts with the 'score' and 'lms_user_id' keys
+        """
+        changed = [
+            grade
+            for grade in grades
+            if not self.is_synced(assignment_name, grade['lms_user_id'], grade['score'], max_score)
+        ]
+        logger.info(
+            f'{len(grades) - len(changed)} of {len(grades)} scores are unchanged since the last sync '
+            f'for assignment: {assignment_name}'
+        )
+        return changed
+
+    def record_posted(self, assignment_name: str, posted_grades: List[dict], max_score: float) -> None:
+        """
+        Registers the grades successfully posted to the LMS and saves the file
+
+        Args:
+            assignment_name: the assignment name used in nbgrader
+            posted_grades: list of dicts with the 'score' and 'lms_user_id' keys
+            max_score: the maximum score for the assignment
+        """
+        if not posted_grades:
+            return
+        timestamp = datetime.now().isoformat()
+        Path(self.config_path).mkdir(parents=True, exist_ok=True)
+        with FileLock(self.lock_file):
+            # merge with the content saved by other processes before writing
+            self.state = self._load_from_file()
+            assignment_state = self.state.setdefault(assignment_name, {})
+            for grade in posted_grades:
+                assignment_state[grade['lms_user_id']] = {
+                    'score': float(grade['score']),
+                    'max_score': float(max_score),
+                    'timestamp': timestamp,
+                }
+            self._save_to_file()
+        logger.debug(f'Sync state updated with {len(posted_grades)} scores for assignment: {assignment_name}')
@@ -1,24 +1,39 @@
+import asyncio
 import json
 import logging
 import os
 import re
 import time
 from datetime import datetime
+from typing import Any, Dict, List, Tuple
+from urllib.parse import parse_qsl, urlencode, urlparse, urlunparse
 
-from lti.outcome_request import OutcomeRequest
-from nbgrader.api import Gradebook, MissingEntry
+from nbgrader.api import Course, Gradebook, MissingEntry
 from tornado.httpclient import AsyncHTTPClient
 
 from illumidesk.apis.nbgrader_service import NbGraderServiceHelper
 from illumidesk.authenticators.utils import LTIUtils
 from illumidesk.lti13.auth import get_lms_access_token
+from illumidesk.lti13.registry import PlatformRegistry
+from illumidesk.metrics import CACHE_LMS_ACCESS_TOKEN
+from illumidesk.metrics import CACHE_LMS_LINEITEMS
+from illumidesk.metrics import UPSTREAM_LMS_AGS
+from illumidesk.metrics import UPSTREAM_LMS_OUTCOMES
+from illumidesk.metrics import record_cache_lookup
+from illumidesk.metrics import track_outbound_request
 
 from .exceptions import AssignmentWithoutGradesError, GradesSenderCriticalError, GradesSenderMissingInfoError
+from .progress import GradesSendProgress
 from .sender_controlfile import LTIGradesSenderControlFile
+from .ratelimit import LMSRateLimiter
+from .sender_syncstate import LTIGradesSenderSyncState
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
 
+# media type of the AGS results service responses
+RESULT_CONTAINER_MEDIA_TYPE = 'application/vnd.ims.lis.v2.resultcontainer+json'
+
 
 class GradesBaseSender:
     """
@@ -36,8 +51,12 @@ class GradesBaseSender:
 
         # get nbgrader connection string from env vars
         self.nbgrader_helper = NbGraderServiceHelper(course_id)
+        # an open gradebook session can be shared by the senders of the same course
+        self.gradebook = None
+        # listeners registered with progress.add_listener receive the submission progress events
+        self.progress = GradesSendProgress(assignment_name)
 
-    async def send_grades(self):
+    async def send_grades(self, force: bool = False):
         raise NotImplementedError()
 
     @property
@@ -50,28 +69,65 @@ class GradesBaseSender:
 
     def _retrieve_grades_from_db(self):
         """Gets grades from the database"""
-        out = []
-        max_score = 0
+        if self.gradebook is not None:
+            return self._retrieve_grades_from_gradebook(self.gradebook)
         # Create the connection to the gradebook database
         with Gradebook(self.nbgrader_helper.db_url, course_id=self.course_id) as gb:
-            try:
-                # retrieve the assignment record
-                assignment_row = gb.find_assignment(self.assignment_name)
-                max_score = assignment_row.max_score
-                submissions = gb.assignment_submissions(self.assignment_name)
-                logger.info(f'Found {len(submissions)} submissions for assignment: {self.assignment_name}')
-            except MissingEntry as e:
-                logger.error('Assignment not found in database: %s' % e)
-                raise GradesSenderMissingInfoError
-
-            for submission in submissions:
-                # retrieve the student to use the lms id
-                student = gb.find_student(submission.student_id)
-                out.append({'score': submission.score, 'lms_user_id': student.lms_user_id})
+            return self._retrieve_grades_from_gradebook(gb)
+
+    def _retrieve_grades_from_gradebook(self, gb: Gradebook):
+        """Gets grades from an open gradebook session"""
+        out = []
+        max_score = 0
+        try:
+            # retrieve the assignment record
+            assignment_row = gb.find_assignment(self.assignment_name)
+            max_score = assignment_row.max_score
+            submissions = gb.assignment_submissions(self.assignment_name)
+            logger.info(f'Found {len(submissions)} submissions for assignment: {self.assignment_name}')
+        except MissingEntry as e:
+            logger.error('Assignment not found in database: %s' % e)
+            raise GradesSenderMissingInfoError
+
+        for submission in submissions:
+            # retrieve the student to use the lms id
+            student = gb.find_student(submission.student_id)
+            out.append({'score': submission.score, 'lms_user_id': student.lms_user_id})
         logger.info(f'Grades found: {out}')
         logger.info('Maximum score for this assignment %s' % max_score)
         return max_score, out
 
+    def _get_grades_to_send(self, force: bool = False):
+        """
+        Gets the grades from the database and, unless a full resend is forced, filters out the scores
+        that did not change since the last successful sync (delta mode).
+
+        Args:
+            force: if True all the grades found in the gradebook are returned
+
+        Returns:
+            A tuple with the maximum score and the grades list to send
+
+        Raises:
+            AssignmentWithoutGradesError if the assignment does not have any grades in the gradebook
+        """
+        max_score, nbgrader_grades = self._retrieve_grades_from_db()
+        if not nbgrader_grades:
+            raise AssignmentWithoutGradesError
+        if force:
+            logger.info(f'Full resend requested for assignment: {self.assignment_name}')
+            self.progress.start(total=len(nbgrader_grades))
+            return max_score, nbgrader_grades
+        changed_grades = self.sync_state.filter_changed(self.assignment_name, max_score, nbgrader_grades)
+        self.progress.start(total=len(changed_grades), skipped=len(nbgrader_grades) - len(changed_grades))
+        return max_score, changed_grades
+
+    @property
+    def sync_state(self) -> LTIGradesSenderSyncState:
+        if not hasattr(self, '_sync_state'):
+            self._sync_state = LTIGradesSenderSyncState(self.gradebook_dir)
+        return self._sync_state
+
 
 class LTIGradeSender(GradesBaseSender):
     """
@@ -81,16 +137,23 @@ class LTIGradeSender(GradesBaseSender):
     def _message_identifier(self):
         return '{:.0f}'.format(time.time())
 
-    async def send_grades(self) -> None:
+    async def send_grades(self, force: bool = False) -> None:
         """Sends grades to the tool consumer (LMS).
 
         A json control file is used to maintain the relationship between the assignment (resource) registered
         in the database and the tool conumer's (LMS) assignment records. The grades are sent to the endpoint registered
         with the ``lis_outcome_service_url`` and uses the ``lis_result_sourcedid`` as the assignment's unique identifier.
+
+        Only the scores that changed since the last successful sync are sent unless ``force`` is True.
         """
-        max_score, nbgrader_grades = self._retrieve_grades_from_db()
+        # lti loads lxml, it's only needed to send the LTI 1.1 outcomes
+        from lti.outcome_request import OutcomeRequest
+
+        max_score, nbgrader_grades = self._get_grades_to_send(force)
         if not nbgrader_grades:
-            raise AssignmentWithoutGradesError
+            logger.info(f'There are no new or changed scores to send for assignment: {self.assignment_name}')
+            self.progress.finish()
+            return
         msg_id = self._message_identifier()
         # create the consumers map {'consumer_key': {'secret': 'shared_secret'}}
         consumer_key = os.environ.get('LTI_CONSUMER_KEY')
@@ -105,6 +168,7 @@ class LTIGradeSender(GradesBaseSender):
             raise GradesSenderMissingInfoError
 
         url = assignment_info['lis_outcome_service_url']
+        posted_grades = []
         # for each grade in nbgrader db, use the info saved in control file to process each student submission
         for grade in nbgrader_grades:
             # get student lis_result_sourcedid
@@ -130,12 +194,22 @@ class LTIGradeSender(GradesBaseSender):
                 }
                 req = OutcomeRequest(outcome_args)
                 # send to lms through lti package (we used pylti before but some errors found with moodle)
-                outcome_result = req.post_replace_result(score)
+                with track_outbound_request(UPSTREAM_LMS_OUTCOMES):
+                    outcome_result = req.post_replace_result(score)
                 if outcome_result.is_success():
                     logger.info('Your score was submitted. Great job!')
+                    posted_grades.append(grade)
+                    self.progress.score_sent(grade['lms_user_id'])
                 else:
                     logger.error('An error occurred while sending your score to the LMS. Please try again.')
+                    self.progress.score_failed(grade['lms_user_id'], outcome_result.description)
+                    # keep track of the scores sent before the failure, so the next sync does not send them again
+                    self.sync_state.record_posted(self.assignment_name, posted_grades, max_score)
                     raise GradesSenderCriticalError
+            else:
+                self.progress.score_skipped(grade['lms_user_id'], 'student not found in the control file')
+        self.sync_state.record_posted(self.assignment_name, posted_grades, max_score)
+        self.progress.finish()
 
 
 class LTI13GradeSender(GradesBaseSender):
@@ -150,15 +224,22 @@ class LTI13GradeSender(GradesBaseSender):
         assignment_name: the asignment name used on the nbgrader console
     """
 
-    def __init__(self, course_id: str, assignment_name: str):
+    def __init__(self, course_id: str, assignment_name: str, course: Course = None):
         super(LTI13GradeSender, self).__init__(course_id, assignment_name)
 
-        self.private_key_path = os.environ.get('LTI13_PRIVATE_KEY')
-        self.lms_token_url = os.environ.get('LTI13_TOKEN_URL')
-        self.lms_client_id = os.environ.get('LTI13_CLIENT_ID')
-        # retrieve the course entity from nbgrader-gradebook
-        course = self.nbgrader_helper.get_course()
-        self.course = course
+        # the registered platform that launched the course, the LTI13_* env-vars are used without it
+        self.registration = PlatformRegistry.instance().for_course(course_id)
+        if self.registration is not None:
+            self.private_key_path = self.registration.private_key_path
+            self.lms_token_url = self.registration.auth_token_url
+            self.lms_client_id = self.registration.client_id
+        else:
+            self.private_key_path = os.environ.get('LTI13_PRIVATE_KEY')
+            self.lms_token_url = os.environ.get('LTI13_TOKEN_URL')
+            self.lms_client_id = os.environ.get('LTI13_CLIENT_ID')
+        # retrieve the course entity from nbgrader-gradebook (if it was not already retrieved)
+        self.course = course or self.nbgrader_helper.get_course()
+        # the access token headers and the line items can be shared by the senders of the same course
         self.all_lineitems = []
         self.headers = {}
 
@@ -187,7 +268,8 @@ class LTI13GradeSender(GradesBaseSender):
         if not url:
             return
         client = AsyncHTTPClient()
-        resp = await client.fetch(url, method='GET', headers=self.headers)
+        with track_outbound_request(UPSTREAM_LMS_AGS):
+            resp = await client.fetch(url, method='GET', headers=self.headers)
         items = json.loads(resp.body)
         if items:
             self.all_lineitems.extend(items)
@@ -198,7 +280,9 @@ class LTI13GradeSender(GradesBaseSender):
                 await self._get_lineitems_from_url(next_url)
 
     async def _get_line_item_info_by_assignment_name(self) -> str:
-        await self._get_lineitems_from_url(self.course.lms_lineitems_endpoint)
+        record_cache_lookup(CACHE_LMS_LINEITEMS, bool(self.all_lineitems))
+        if not self.all_lineitems:
+            await self._get_lineitems_from_url(self.course.lms_lineitems_endpoint)
         if not self.all_lineitems:
             raise GradesSenderMissingInfoError(f'No line-items were detected for this course: {self.course_id}')
         logger.debug(f'LineItems retrieved: {self.all_lineitems}')
@@ -216,14 +300,26 @@ class LTI13GradeSender(GradesBaseSender):
             raise GradesSenderMissingInfoError(f'No lineitem matched with the assignment name: {self.assignment_name}')
 
         client = AsyncHTTPClient()
-        resp = await client.fetch(lineitem_matched, headers=self.headers)
+        with track_outbound_request(UPSTREAM_LMS_AGS):
+            resp = await client.fetch(lineitem_matched, headers=self.headers)
         lineitem_info = json.loads(resp.body)
         logger.debug(f'Fetched lineitem info from lms {lineitem_info}')
 
         return lineitem_info
 
+    async def _ensure_access_token_header(self) -> None:
+        """Requests an access token unless the headers already have one (e.g. shared by the course sender)"""
+        has_token = 'Authorization' in self.headers
+        record_cache_lookup(CACHE_LMS_ACCESS_TOKEN, has_token)
+        if not has_token:
+            await self._set_access_token_header()
+
     async def _set_access_token_header(self):
-        token = await get_lms_access_token(self.lms_token_url, self.private_key_path, self.lms_client_id)
+        if self.registration is not None:
+            # the registration caches the platform's access token until it expires
+            token = await self.registration.get_access_token()
+        else:
+            token = await get_lms_access_token(self.lms_token_url, self.private_key_path, self.lms_client_id)
 
         if 'access_token' not in token:
             logger.info(f'response from {self.lms_token_url}: {token}')
@@ -235,33 +331,190 @@ class LTI13GradeSender(GradesBaseSender):
             'Content-Type': 'application/vnd.ims.lis.v2.lineitem+json',
         }
 
-    async def send_grades(self):
+    async def send_grades(self, force: bool = False, reconcile: bool = False):
+        """
+        Sends the scores to the platform (LMS) using the Assignment and Grade Services (AGS).
+
+        Only the scores that changed since the last successful sync are sent unless ``force`` is True.
+
+        With ``reconcile`` the scores are compared with the results the LMS already has instead of the
+        local sync state, see _reconcile_grades.
+        """
+        if reconcile:
+            return await self._reconcile_grades()
+        max_score, nbgrader_grades = self._get_grades_to_send(force)
+        if not nbgrader_grades:
+            logger.info(f'There are no new or changed scores to send for assignment: {self.assignment_name}')
+            self.progress.finish()
+            return
+
+        await self._ensure_access_token_header()
+
+        lineitem_info = await self._get_line_item_info_by_assignment_name()
+        self.headers.update({'Content-Type': 'application/vnd.ims.lis.v1.score+json'})
+        # the scores are posted concurrently within the limits set for the LMS
+        results = await asyncio.gather(*[self._post_score(lineitem_info, grade) for grade in nbgrader_grades])
+        posted_grades = [grade for grade, posted in zip(nbgrader_grades, results) if posted]
+        self.sync_state.record_posted(self.assignment_name, posted_grades, max_score)
+        self.progress.finish()
+
+    async def _post_score(self, lineitem_info: dict, grade: dict) -> bool:
+        """
+        Posts the student's score to the line item's scores endpoint
+
+        Returns:
+            True if the score was posted, False otherwise
+        """
+        try:
+            score = float(grade['score'])
+            data = {
+                'timestamp': datetime.now().isoformat(),
+                'userId': grade['lms_user_id'],
+                'scoreGiven': score,
+                'scoreMaximum': lineitem_info['scoreMaximum'],
+                'gradingProgress': 'FullyGraded',
+                'activityProgress': 'Completed',
+                'comment': '',
+            }
+            logger.info(f'data used to sent scores: {data}')
+
+            url = lineitem_info['id'] + '/scores'
+            logger.debug(f'URL for grades submission {url}')
+            client = AsyncHTTPClient()
+            async with LMSRateLimiter.for_url(url):
+                with track_outbound_request(UPSTREAM_LMS_AGS):
+                    await client.fetch(url, body=json.dumps(data), method='POST', headers=self.headers)
+            self.progress.score_sent(grade['lms_user_id'])
+            return True
+        except Exception as e:
+            logger.error(f"Something went wrong by sending grader for {grade['lms_user_id']}.{e}")
+            self.progress.score_failed(grade['lms_user_id'], str(e))
+            return False
+
+    async def _reconcile_grades(self) -> Dict[str, Any]:
+        """
+        Compares the nbgrader scores with the line item's results in the LMS (AGS results service) and
+        posts only the scores that are missing or differ in the LMS.
+
+        Returns:
+            A drift report with the students whose score is missing in the LMS, the students with a
+            different score, the students that only have a score in the LMS and the number of posted scores.
+        """
         max_score, nbgrader_grades = self._retrieve_grades_from_db()
         if not nbgrader_grades:
             raise AssignmentWithoutGradesError
 
-        await self._set_access_token_header()
+        await self._ensure_access_token_header()
 
         lineitem_info = await self._get_line_item_info_by_assignment_name()
-        score_maximum = lineitem_info['scoreMaximum']
-        client = AsyncHTTPClient()
-        self.headers.update({'Content-Type': 'application/vnd.ims.lis.v1.score+json'})
+        lms_results = await self._get_results(lineitem_info['id'])
+        score_maximum = float(lineitem_info['scoreMaximum'])
+        lms_scores = {}
+        for result in lms_results:
+            if result.get('resultScore') is None:
+                continue
+            lms_score = float(result['resultScore'])
+            # results may be expressed with a different maximum than the line item's
+            result_maximum = result.get('resultMaximum')
+            if result_maximum:
+                lms_score = lms_score * score_maximum / float(result_maximum)
+            lms_scores[result['userId']] = lms_score
+
+        in_sync, missing_in_lms, differs = [], [], []
         for grade in nbgrader_grades:
-            try:
-                score = float(grade['score'])
-                data = {
-                    'timestamp': datetime.now().isoformat(),
-                    'userId': grade['lms_user_id'],
-                    'scoreGiven': score,
-                    'scoreMaximum': score_maximum,
-                    'gradingProgress': 'FullyGraded',
-                    'activityProgress': 'Completed',
-                    'comment': '',
-                }
-                logger.info(f'data used to sent scores: {data}')
+            lms_score = lms_scores.get(grade['lms_user_id'])
+            if lms_score is None:
+                missing_in_lms.append(grade)
+            elif abs(lms_score - float(grade['score'])) > 1e-6:
+                differs.append((grade, lms_score))
+            else:
+                in_sync.append(grade)
+        nbgrader_user_ids = {grade['lms_user_id'] for grade in nbgrader_grades}
+        only_in_lms = {user_id: score for user_id, score in lms_scores.items() if user_id not in nbgrader_user_ids}
+
+        to_post = missing_in_lms + [grade for grade, _ in differs]
+        self.progress.start(total=len(to_post), skipped=len(in_sync))
+        self.headers.update({'Content-Type': 'application/vnd.ims.lis.v1.score+json'})
+        results = await asyncio.gather(*[self._post_score(lineitem_info, grade) for grade in to_post])
+        posted_grades = [grade for grade, posted in zip(to_post, results) if posted]
+        self.sync_state.record_posted(self.assignment_name, in_sync + posted_grades, max_score)
+
+        report = {
+            'in_sync': len(in_sync),
+            'missing_in_lms': [grade['lms_user_id'] for grade in missing_in_lms],
+            'differs': [
+                {'lms_user_id': grade['lms_user_id'], 'score': grade['score'], 'lms_score': lms_score}
+                for grade, lms_score in differs
+            ],
+            'only_in_lms': [{'lms_user_id': user_id, 'lms_score': score} for user_id, score in only_in_lms.items()],
+            'posted': len(posted_grades),
+            'failed': len(to_post) - len(posted_grades),
+        }
+        logger.info(f'Reconciliation report for assignment {self.assignment_name}: {report}')
+        self.progress.finish()
+        return report
 
-                url = lineitem_info['id'] + '/scores'
-                logger.debug(f'URL for grades submission {url}')
-                await client.fetch(url, body=json.dumps(data), method='POST', headers=self.headers)
-            except Exception as e:
-                logger.error(f"Something went wrong by sending grader for {grade['lms_user_id']}.{e}")
+    async def _get_results(self, lineitem_url: str) -> List[dict]:
+        """
+        Fetches all the results of the line item. When the LMS announces the last page with numbered
+        pages the remaining pages are fetched concurrently, otherwise the next links are followed.
+        """
+        url = self._build_results_url(lineitem_url)
+        headers = dict(self.headers, Accept=RESULT_CONTAINER_MEDIA_TYPE)
+        results, links = await self._fetch_results_page(url, headers)
+        page_urls = self._build_page_urls(links)
+        if page_urls:
+            pages = await asyncio.gather(*[self._fetch_results_page(page_url, headers) for page_url in page_urls])
+            for items, _ in pages:
+                results.extend(items)
+        else:
+            next_url = links.get('next')
+            while next_url:
+                items, links = await self._fetch_results_page(next_url, headers)
+                results.extend(items)
+                next_url = links.get('next')
+        logger.debug(f'Fetched {len(results)} results from lms for assignment {self.assignment_name}')
+        return results
+
+    async def _fetch_results_page(self, url: str, headers: dict) -> Tuple[List[dict], Dict[str, str]]:
+        client = AsyncHTTPClient()
+        async with LMSRateLimiter.for_url(url):
+            with track_outbound_request(UPSTREAM_LMS_AGS):
+                resp = await client.fetch(url, method='GET', headers=headers)
+        items = json.loads(resp.body) or []
+        return items, self._parse_link_header(resp.headers.get('Link', ''))
+
+    @staticmethod
+    def _build_results_url(lineitem_url: str) -> str:
+        """The results service url is the line item url with the /results path (keeping the query string)"""
+        parts = urlparse(lineitem_url)
+        return urlunparse(parts._replace(path=parts.path.rstrip('/') + '/results'))
+
+    @staticmethod
+    def _parse_link_header(link_header: str) -> Dict[str, str]:
+        """Returns the urls in the Link header by their rel value"""
+        links = {}
+        for url, rel in re.findall(r'<([^>]+)>\s*;\s*rel="?([^";,]+)"?', link_header or ''):
+            links[rel] = url
+        return links
+
+    @staticmethod
+    def _build_page_urls(links: Dict[str, str]) -> List[str]:
+        """
+        Builds the urls of the pages between the next and the last links when both of them use a numbered
+        ``page`` argument. Returns an empty list when the pages can't be predicted.
+        """
+        if 'next' not in links or 'last' not in links:
+            return []
+        next_parts = urlparse(links['next'])
+        next_query = dict(parse_qsl(next_parts.query))
+        last_query = dict(parse_qsl(urlparse(links['last']).query))
+        try:
+            first_page = int(next_query['page'])
+            last_page = int(last_query['page'])
+        except (KeyError, ValueError):
+            return []
+        return [
+            urlunparse(next_parts._replace(query=urlencode(dict(next_query, page=page))))
+            for page in range(first_page, last_page + 1)
+        ]
@@ -1,17 +1,17 @@
 import json
 import jwt
 import logging
-import pem
 import os
 import time
 import urllib
 
-from Crypto.PublicKey import RSA
-from jwcrypto.jwk import JWK
 from tornado.httpclient import AsyncHTTPClient
 from tornado.httpclient import HTTPClientError
 import uuid
 
+from illumidesk.metrics import UPSTREAM_LMS_TOKEN
+from illumidesk.metrics import track_outbound_request
+
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
 
@@ -63,7 +63,8 @@ async def get_lms_access_token(token_endpoint: str, private_key_path: str, clien
     client = AsyncHTTPClient()
     body = urllib.parse.urlencode(params)
     try:
-        resp = await client.fetch(token_endpoint, method='POST', body=body, headers=None)
+        with track_outbound_request(UPSTREAM_LMS_TOKEN):
+            resp = await client.fetch(token_endpoint, method='POST', body=body, headers=None)
     except HTTPClientError as e:
         logger.info(f'Error by obtaining a token with lms. Detail: {e.response.body if e.response else e.message}')
         raise
@@ -72,6 +73,9 @@ async def get_lms_access_token(token_endpoint: str, private_key_path: str, clien
 
 
 def get_jwk(public_key):
+    # the crypto packages are imported on first use, they are only needed for the LMS token requests and the jwks
+    from jwcrypto.jwk import JWK
+
     jwk_obj = JWK.from_pem(public_key)
     public_jwk = json.loads(jwk_obj.export_public())
     public_jwk['alg'] = 'RS256'
@@ -87,6 +91,8 @@ def get_headers_to_jwt_encode(private_key_text: str) -> dict:
         private_key_text: The PEM-Encoded content as text
     Returns: A dict if the publickey can be exported or None otherwise
     """
+    from Crypto.PublicKey import RSA
+
     public_key = RSA.importKey(private_key_text).publickey().exportKey()
     headers = None
     if public_key:
@@ -100,6 +106,8 @@ def get_pem_text_from_file(private_key_path: str) -> str:
     """
     Parses the pem file to get its value as unicode text
     """
+    import pem
+
     # check the pem permission
     if not os.access(private_key_path, os.R_OK):
         raise PermissionError()
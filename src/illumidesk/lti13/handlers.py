@@ -1,22 +1,91 @@
+import logging
 import os
 import json
 from pathlib import Path
 
-import pem
-
-from Crypto.PublicKey import RSA
-
 from jupyterhub.handlers import BaseHandler
 
+from illumidesk.apis.setup_course_service import get_grader_ready
+from illumidesk.authenticators.authenticator import get_org_name
 from illumidesk.authenticators.utils import LTIUtils
 from illumidesk.lti13.auth import get_jwk
+from illumidesk.lti13.registry import PlatformRegistry
 
 from tornado import web
 
+from typing import Dict
+from typing import List
+
 from urllib.parse import urlencode
 from urllib.parse import quote
 
 
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+
+def build_file_select_items(course_shared_folder: Path, course_id: str, host: str) -> List[Dict[str, str]]:
+    """
+    Builds the items listed by the file select (deep linking) page: the notebooks found recursively
+    in the course's shared folder, sorted by path, each one with its content items json that points to
+    the gitpuller link of the notebook.
+
+    Args:
+      course_shared_folder: the course's shared folder (/shared/<course_id>)
+      course_id: the normalized course label
+      host: the hub's host used to build the links
+
+    Returns:
+      A list of dicts with the notebook's relative path and the content items json
+    """
+    link_item_files = []
+    notebooks = list(course_shared_folder.glob('**/*.ipynb'))
+    notebooks.sort()
+    for f in notebooks:
+        fpath = str(f.relative_to(course_shared_folder))
+        logger.debug('Getting files fpath %s' % fpath)
+
+        if fpath.startswith('.') or f.name.startswith('.'):
+            logger.debug('Ignoring file %s' % fpath)
+            continue
+        # generate the assignment link that uses gitpuller
+        user_redirect_path = quote('/user-redirect/git-pull', safe='')
+        assignment_link_path = f'?next={user_redirect_path}'
+        urlpath_workspace = f'tree/{course_id}/{fpath}'
+        logger.debug(f'urlpath_workspace:{urlpath_workspace}')
+        query_params_for_git = [
+            ('repo', f'/home/jovyan/shared/{course_id}'),
+            ('branch', 'master'),
+            ('urlpath', urlpath_workspace),
+        ]
+        encoded_query_params_without_safe_chars = quote(urlencode(query_params_for_git), safe='')
+
+        url = f'https://{host}/{assignment_link_path}?{encoded_query_params_without_safe_chars}'
+        logger.debug('URL to fetch files is %s' % url)
+        link_item_files.append(
+            {
+                'path': fpath,
+                'content_items': json.dumps(
+                    {
+                        "@context": "http://purl.imsglobal.org/ctx/lti/v1/ContentItem",
+                        "@graph": [
+                            {
+                                "@type": "LtiLinkItem",
+                                "@id": url,
+                                "url": url,
+                                "title": f.name,
+                                "text": f.name,
+                                "mediaType": "application/vnd.ims.lti.v1.ltilink",
+                                "placementAdvice": {"presentationDocumentTarget": "frame"},
+                            }
+                        ],
+                    }
+                ),
+            }
+        )
+    return link_item_files
+
+
 class LTI13ConfigHandler(BaseHandler):
     """
     Handles JSON configuration file for LTI 1.3
@@ -109,23 +178,30 @@ class LTI13JWKSHandler(BaseHandler):
     def get(self) -> None:
         """
         - This method requires that the LTI13_PRIVATE_KEY environment variable
-        is set with the full path to the RSA private key in PEM format.
+        is set with the full path to the RSA private key in PEM format, or that the platforms registered
+        with ILLUMIDESK_LTI13_REGISTRATIONS have their private keys. The public keys of all of them are served.
         """
-        if not os.environ.get('LTI13_PRIVATE_KEY'):
+        env_key_path = os.environ.get('LTI13_PRIVATE_KEY')
+        key_paths = [env_key_path] if env_key_path else []
+        key_paths += [path for path in PlatformRegistry.instance().private_key_paths() if path not in key_paths]
+        if not key_paths:
             raise EnvironmentError('LTI13_PRIVATE_KEY environment variable not set')
-        key_path = os.environ.get('LTI13_PRIVATE_KEY')
-        # check the pem permission
-        if not os.access(key_path, os.R_OK):
-            self.log.error(f'The pem file {key_path} cannot be load')
-            raise PermissionError()
-        private_key = pem.parse_file(key_path)
-        public_key = RSA.import_key(private_key[0].as_text()).publickey().exportKey()
-        self.log.debug('public_key is %s' % public_key)
-
-        jwk = get_jwk(public_key)
-        self.log.debug('the jwks is %s' % jwk)
+        import pem
+        from Crypto.PublicKey import RSA
+
         keys_obj = {'keys': []}
-        keys_obj['keys'].append(jwk)
+        for key_path in key_paths:
+            # check the pem permission
+            if not os.access(key_path, os.R_OK):
+                self.log.error(f'The pem file {key_path} cannot be load')
+                raise PermissionError()
+            private_key = pem.parse_file(key_path)
+            public_key = RSA.import_key(private_key[0].as_text()).publickey().exportKey()
+            self.log.debug('public_key is %s' % public_key)
+
+            jwk = get_jwk(public_key)
+            self.log.debug('the jwks is %s' % jwk)
+            keys_obj['keys'].append(jwk)
         # we do not need to use json.dumps because tornado is converting our dict automatically and adding the content-type as json
         # https://www.tornadoweb.org/en/stable/web.html#tornado.web.RequestHandler.write
         self.write(keys_obj)
@@ -147,52 +223,7 @@ class FileSelectHandler(BaseHandler):
         )
         self.course_root = self.grader_root / self.course_id
         self.course_shared_folder = Path('/shared', self.course_id)
-        a = ''
-        link_item_files = []
-        notebooks = list(self.course_shared_folder.glob('**/*.ipynb'))
-        notebooks.sort()
-        for f in notebooks:
-            fpath = str(f.relative_to(self.course_shared_folder))
-            self.log.debug('Getting files fpath %s' % fpath)
-
-            if fpath.startswith('.') or f.name.startswith('.'):
-                self.log.debug('Ignoring file %s' % fpath)
-                continue
-            # generate the assignment link that uses gitpuller
-            user_redirect_path = quote('/user-redirect/git-pull', safe='')
-            assignment_link_path = f'?next={user_redirect_path}'
-            urlpath_workspace = f'tree/{self.course_id}/{fpath}'
-            self.log.debug(f'urlpath_workspace:{urlpath_workspace}')
-            query_params_for_git = [
-                ('repo', f'/home/jovyan/shared/{self.course_id}'),
-                ('branch', 'master'),
-                ('urlpath', urlpath_workspace),
-            ]
-            encoded_query_params_without_safe_chars = quote(urlencode(query_params_for_git), safe='')
-
-            url = f'https://{self.request.host}/{assignment_link_path}?{encoded_query_params_without_safe_chars}'
-            self.log.debug('URL to fetch files is %s' % url)
-            link_item_files.append(
-                {
-                    'path': fpath,
-                    'content_items': json.dumps(
-                        {
-                            "@context": "http://purl.imsglobal.org/ctx/lti/v1/ContentItem",
-                            "@graph": [
-                                {
-                                    "@type": "LtiLinkItem",
-                                    "@id": url,
-                                    "url": url,
-                                    "title": f.name,
-                                    "text": f.name,
-                                    "mediaType": "application/vnd.ims.lti.v1.ltilink",
-                                    "placementAdvice": {"presentationDocumentTarget": "frame"},
-                                }
-                            ],
-                        }
-                    ),
-                }
-            )
+        link_item_files = build_file_select_items(self.course_shared_folder, self.course_id, self.request.host)
         self.log.debug('Rendering file-select.html template')
         html = self.render_template(
             'file_select.html',
@@ -200,3 +231,32 @@ class FileSelectHandler(BaseHandler):
             action_url=auth_state['launch_return_url'],
         )
         self.finish(html)
+
+
+class GraderReadyHandler(BaseHandler):
+    """
+    Returns whether the course's grader notebook is ready, used by the pending page shown while the grader
+    starts (the proxy 503 page) to open the grader the moment it serves
+    """
+
+    # maximum seconds a request waits for the grader
+    max_wait = 25
+
+    @web.authenticated
+    async def get(self, course_id: str) -> None:
+        """
+        Responds with `{"ready": true}` when the grader serves requests. With `?wait=<seconds>` the response is
+        sent when the grader is ready or the seconds passed (up to 25 seconds).
+
+        Arguments:
+          course_id: the grader service name, the normalized course name
+        """
+        org_name = get_org_name()
+        try:
+            wait = min(max(float(self.get_argument('wait', '0')), 0), self.max_wait)
+        except ValueError:
+            raise web.HTTPError(400, 'The wait argument must be a number of seconds')
+        ready = await get_grader_ready(org_name, course_id, wait)
+        if ready is None:
+            raise web.HTTPError(404, f'There is not a grader service for the course {course_id}')
+        self.write({'ready': ready})
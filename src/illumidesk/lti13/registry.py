@@ -0,0 +1,313 @@
+import asyncio
+import json
+import jwt
+import logging
+import os
+import time
+
+from tornado.httpclient import AsyncHTTPClient
+
+from typing import Any
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+from illumidesk.lti13.auth import get_lms_access_token
+from illumidesk.metrics import CACHE_LMS_ACCESS_TOKEN
+from illumidesk.metrics import CACHE_LMS_JWKS
+from illumidesk.metrics import UPSTREAM_LMS_JWKS
+from illumidesk.metrics import record_cache_lookup
+from illumidesk.metrics import track_outbound_request
+
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+
+# json file with the registered platforms, see PlatformRegistry.load
+LTI13_REGISTRATIONS_FILE = os.environ.get('ILLUMIDESK_LTI13_REGISTRATIONS')
+# json file where the platform that launched each course is kept, used by the grades senders and the roster sync
+LTI13_COURSE_REGISTRATIONS_FILE = os.environ.get(
+    'ILLUMIDESK_LTI13_COURSE_REGISTRATIONS', '/srv/jupyterhub/illumidesk_lti13_courses.json'
+)
+# seconds the platforms' key sets are cached, an unknown kid fetches the key set again
+JWKS_CACHE_TTL = int(os.environ.get('ILLUMIDESK_LTI13_JWKS_CACHE_TTL') or '3600')
+# minimum seconds between the key set fetches caused by unknown kids
+JWKS_MIN_REFETCH_INTERVAL = int(os.environ.get('ILLUMIDESK_LTI13_JWKS_MIN_REFETCH_INTERVAL') or '60')
+# seconds before the expiration when a cached access token is requested again
+ACCESS_TOKEN_EXPIRY_MARGIN = 60
+
+DEPLOYMENT_ID_CLAIM = 'https://purl.imsglobal.org/spec/lti/claim/deployment_id'
+
+
+class PlatformRegistration:
+    """
+    The tool's registration with a platform (LMS instance), with the platform's key set and the access tokens
+    requested with the registration cached.
+
+    Args:
+        issuer: the platform's issuer (iss claim)
+        client_id: the client id assigned by the platform to the tool
+        deployment_ids: the deployments of the tool accepted for the registration, any deployment if empty
+        auth_login_url: the platform's OIDC authorization url
+        auth_token_url: the platform's OAuth2 token url
+        key_set_url: the platform's JWKS url
+        private_key_path: the tool's private key (pem format) used to sign the access token requests
+    """
+
+    def __init__(
+        self,
+        issuer: str,
+        client_id: str,
+        auth_login_url: str,
+        auth_token_url: str,
+        key_set_url: str,
+        private_key_path: str,
+        deployment_ids: List[str] = None,
+    ):
+        if not issuer:
+            raise ValueError('issuer missing')
+        if not client_id:
+            raise ValueError('client_id missing')
+        self.issuer = issuer
+        self.client_id = client_id
+        self.deployment_ids = list(deployment_ids or [])
+        self.auth_login_url = auth_login_url
+        self.auth_token_url = auth_token_url
+        self.key_set_url = key_set_url
+        self.private_key_path = private_key_path
+        self._jwks: Dict[str, Any] = {}
+        self._jwks_expires_at = 0.0
+        self._jwks_fetched_at = 0.0
+        self._access_tokens: Dict[str, Tuple[Dict[str, Any], float]] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+
+    @property
+    def key(self) -> Tuple[str, str]:
+        return self.issuer, self.client_id
+
+    def _lock(self, name: str) -> asyncio.Lock:
+        # the concurrent launches and senders wait for the same request instead of sending their own
+        if name not in self._locks:
+            self._locks[name] = asyncio.Lock()
+        return self._locks[name]
+
+    async def get_jwk(self, kid: Optional[str]) -> Any:
+        """
+        Returns the platform's public key with the kid, the key set is fetched again when it expired or it
+        doesn't have the kid (the platform rotated its keys). The fetches caused by unknown kids are limited to
+        one every JWKS_MIN_REFETCH_INTERVAL seconds, so the tokens with a made up kid don't reach the platform.
+
+        Args:
+            kid: the kid of the token's header, a token without kid is only accepted when the key set has a
+              single key
+
+        Raises:
+            ValueError if the platform's key set doesn't have the kid
+        """
+        needs_fetch = self._needs_jwks_fetch(kid)
+        record_cache_lookup(CACHE_LMS_JWKS, not needs_fetch)
+        if needs_fetch:
+            async with self._lock('jwks'):
+                if self._needs_jwks_fetch(kid):
+                    await self._fetch_jwks()
+        if kid is None:
+            if len(self._jwks) != 1:
+                raise ValueError(f'The jwt received has no kid and the platform jwks has {len(self._jwks)} keys')
+            return next(iter(self._jwks.values()))
+        if kid not in self._jwks:
+            raise ValueError(f'There is not a key matching in the platform jwks for the jwt received. kid: {kid}')
+        return self._jwks[kid]
+
+    def _needs_jwks_fetch(self, kid: Optional[str]) -> bool:
+        now = time.monotonic()
+        if now >= self._jwks_expires_at:
+            return True
+        if kid is None or kid in self._jwks:
+            return False
+        return now >= self._jwks_fetched_at + JWKS_MIN_REFETCH_INTERVAL
+
+    async def _fetch_jwks(self) -> None:
+        client = AsyncHTTPClient()
+        with track_outbound_request(UPSTREAM_LMS_JWKS):
+            resp = await client.fetch(self.key_set_url)
+        platform_jwks = json.loads(resp.body)
+        if not platform_jwks or 'keys' not in platform_jwks:
+            raise ValueError(f'Platform endpoint {self.key_set_url} returned an empty jwks')
+        # a key without kid is kept for the tokens without kid of a platform with a single key
+        self._jwks = {
+            jwk.get('kid'): jwt.algorithms.RSAAlgorithm.from_jwk(json.dumps(jwk)) for jwk in platform_jwks['keys']
+        }
+        self._jwks_fetched_at = time.monotonic()
+        self._jwks_expires_at = self._jwks_fetched_at + JWKS_CACHE_TTL
+        logger.debug(f'Fetched {len(self._jwks)} keys from {self.key_set_url}')
+
+    async def get_access_token(self, scope: str = None) -> Dict[str, Any]:
+        """
+        Returns an access token for the scope (the AGS scopes by default), cached until it's about to expire
+
+        Returns:
+            The token response with the access_token and token_type keys
+        """
+        cache_key = scope or ''
+        token, expires_at = self._access_tokens.get(cache_key, (None, 0.0))
+        is_cached = token is not None and time.monotonic() < expires_at
+        record_cache_lookup(CACHE_LMS_ACCESS_TOKEN, is_cached)
+        if is_cached:
+            return token
+        async with self._lock(f'token:{cache_key}'):
+            token, expires_at = self._access_tokens.get(cache_key, (None, 0.0))
+            if token is None or time.monotonic() >= expires_at:
+                token = await get_lms_access_token(self.auth_token_url, self.private_key_path, self.client_id, scope)
+                expires_in = int(token.get('expires_in') or 0)
+                if 'access_token' in token and expires_in > ACCESS_TOKEN_EXPIRY_MARGIN:
+                    self._access_tokens[cache_key] = token, time.monotonic() + expires_in - ACCESS_TOKEN_EXPIRY_MARGIN
+        return token
+
+
+class PlatformRegistry:
+    """
+    The platforms registered with the tool, so one hub can serve the launches of several LMS instances.
+
+    The registrations are indexed by (issuer, client_id, deployment_id), (issuer, client_id) and issuer, so
+    the registration of a launch is found with a dict lookup. The platform that launched each course is kept
+    in a json file, so the grades senders and the roster sync use the course's registration after a restart.
+
+    The registry is empty unless the ILLUMIDESK_LTI13_REGISTRATIONS env-var is set, and the hub then uses the
+    LTI13_* env-vars and the LTI13Authenticator settings for a single platform.
+
+    Usage:
+    ```
+    registration = PlatformRegistry.instance().find(issuer, client_id, deployment_id)
+    token = await registration.get_access_token()
+    ```
+
+    Args:
+        registrations: the registered platforms
+        courses_file: json file where the registration of each course is kept
+    """
+
+    _instance = None
+
+    def __init__(self, registrations: List[PlatformRegistration] = None, courses_file: str = None):
+        self.courses_file = courses_file or LTI13_COURSE_REGISTRATIONS_FILE
+        self._by_deployment: Dict[Tuple[str, str, str], PlatformRegistration] = {}
+        self._by_client: Dict[Tuple[str, str], PlatformRegistration] = {}
+        self._by_issuer: Dict[str, PlatformRegistration] = {}
+        self._courses: Dict[str, Tuple[str, str]] = {}
+        for registration in registrations or []:
+            self.add(registration)
+        self._load_courses()
+
+    @classmethod
+    def instance(cls) -> 'PlatformRegistry':
+        """Returns the registry loaded from the ILLUMIDESK_LTI13_REGISTRATIONS file"""
+        if cls._instance is None:
+            cls._instance = cls.load(LTI13_REGISTRATIONS_FILE)
+        return cls._instance
+
+    @classmethod
+    def load(cls, path: Optional[str]) -> 'PlatformRegistry':
+        """
+        Creates the registry with the registrations in a json file, a list of objects with the issuer,
+        client_id, deployment_ids, auth_login_url, auth_token_url, key_set_url and private_key_path keys
+
+        Args:
+            path: the json file, an empty registry is returned without it
+        """
+        if not path:
+            return cls()
+        with open(path, 'r') as f:
+            registrations = [PlatformRegistration(**item) for item in json.load(f)]
+        logger.info(f'Loaded {len(registrations)} LTI 1.3 platform registrations from {path}')
+        return cls(registrations)
+
+    def __len__(self) -> int:
+        return len(self._by_client)
+
+    def add(self, registration: PlatformRegistration) -> None:
+        """Registers a platform"""
+        self._by_client[registration.key] = registration
+        self._by_issuer.setdefault(registration.issuer, registration)
+        for deployment_id in registration.deployment_ids:
+            self._by_deployment[(registration.issuer, registration.client_id, deployment_id)] = registration
+
+    def find(self, issuer: str, client_id: str = None, deployment_id: str = None) -> Optional[PlatformRegistration]:
+        """
+        Returns the registration of a launch or login request
+
+        Args:
+            issuer: the iss claim
+            client_id: the aud claim (or the client_id login argument), when the login request doesn't have it
+              the issuer's first registration is returned
+            deployment_id: the deployment_id claim, registrations with deployment ids only accept those
+
+        Returns:
+            The registration or None when the platform or the deployment isn't registered
+        """
+        if not client_id:
+            return self._by_issuer.get(issuer)
+        registration = self._by_deployment.get((issuer, client_id, deployment_id))
+        if registration is not None:
+            return registration
+        registration = self._by_client.get((issuer, client_id))
+        if registration is not None and deployment_id and registration.deployment_ids:
+            logger.warning(f'The deployment {deployment_id} is not registered for {issuer} {client_id}')
+            return None
+        return registration
+
+    def find_for_claims(self, claims: Dict[str, Any]) -> Optional[PlatformRegistration]:
+        """Returns the registration of the launch with the claims of its id_token"""
+        audience = claims.get('aud')
+        if isinstance(audience, list):
+            audience = claims.get('azp') or (audience[0] if audience else None)
+        return self.find(claims.get('iss'), audience, claims.get(DEPLOYMENT_ID_CLAIM))
+
+    def for_course(self, course_id: str) -> Optional[PlatformRegistration]:
+        """Returns the registration of the platform that launched the course"""
+        key = self._courses.get(course_id)
+        return self._by_client.get(key) if key else None
+
+    def register_course(self, course_id: str, registration: PlatformRegistration) -> bool:
+        """
+        Keeps the platform that launched the course, the courses file is only written when it changes. A course
+        stays with the first registered platform that launched it, a launch of the same course label from
+        another platform doesn't take the course over. The course moves when its platform is no longer
+        registered.
+
+        Args:
+            course_id: the normalized course label
+            registration: the registration of the platform that launched the course
+
+        Returns:
+            False when the course belongs to another registered platform, True otherwise
+        """
+        registered_key = self._courses.get(course_id)
+        if registered_key == registration.key:
+            return True
+        if registered_key in self._by_client:
+            logger.warning(
+                f'The course {course_id} of the platform {registered_key} was launched by the platform {registration.key}, '
+                'the launch is rejected'
+            )
+            return False
+        self._courses[course_id] = registration.key
+        try:
+            tmp_file = f'{self.courses_file}.tmp'
+            with open(tmp_file, 'w') as f:
+                json.dump({course: list(key) for course, key in self._courses.items()}, f)
+            os.replace(tmp_file, self.courses_file)
+        except OSError as e:
+            logger.error(f'Unable to save the course registrations in {self.courses_file}: {e}')
+        return True
+
+    def _load_courses(self) -> None:
+        if not self._by_client or not os.path.exists(self.courses_file):
+            return
+        with open(self.courses_file, 'r') as f:
+            self._courses = {course: tuple(key) for course, key in json.load(f).items()}
+
+    def private_key_paths(self) -> List[str]:
+        """Returns the tool's private keys used with the registered platforms"""
+        return sorted({registration.private_key_path for registration in self._by_client.values()})
@@ -0,0 +1,281 @@
+import asyncio
+import json
+import logging
+import os
+import re
+import time
+
+from tornado.httpclient import AsyncHTTPClient
+from tornado.httpclient import HTTPClientError
+from tornado.ioloop import PeriodicCallback
+
+from typing import Any
+from typing import Dict
+from typing import List
+from typing import Tuple
+
+from illumidesk.apis.jupyterhub_api import JupyterHubAPI
+from illumidesk.authenticators.utils import LTIUtils
+from illumidesk.authenticators.utils import user_is_an_instructor
+from illumidesk.grades.ratelimit import LMSRateLimiter
+from illumidesk.lti13.auth import get_lms_access_token
+from illumidesk.lti13.registry import PlatformRegistration
+from illumidesk.lti13.registry import PlatformRegistry
+from illumidesk.metrics import ROSTER_SYNC_MEMBERS
+from illumidesk.metrics import UPSTREAM_LMS_NRPS
+from illumidesk.metrics import track_outbound_request
+from illumidesk.spawners.hooks import create_user_home_dir
+from illumidesk.tasks.pipeline import BackgroundTaskPipeline
+
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+
+NRPS_CLAIM = 'https://purl.imsglobal.org/spec/lti-nrps/claim/namesroleservice'
+NRPS_SCOPE = 'https://purl.imsglobal.org/spec/lti-nrps/scope/contextmembership.readonly'
+# media type of the NRPS membership service responses
+MEMBERSHIP_CONTAINER_MEDIA_TYPE = 'application/vnd.ims.lti-nrps.v2.membershipcontainer+json'
+
+# the roster is synced with the instructors' launches when it's true
+ROSTER_SYNC_ENABLED = (os.environ.get('ILLUMIDESK_ROSTER_SYNC') or 'true').lower() in ('true', '1')
+# seconds between the syncs of a course, the courses synced by a launch are synced again on this schedule.
+# 0 disables the schedule (the roster is only synced with the instructors' launches)
+ROSTER_SYNC_INTERVAL = int(os.environ.get('ILLUMIDESK_ROSTER_SYNC_INTERVAL') or '3600')
+# directory with the users' home directories, pre-created for the course members
+ROSTER_HOME_ROOT = os.environ.get('ILLUMIDESK_ROSTER_HOME_ROOT') or '/home'
+
+RESULT_PROVISIONED = 'provisioned'
+RESULT_SKIPPED = 'skipped'
+
+
+def username_from_member(member: Dict[str, Any]) -> str:
+    """
+    Returns the username of a NRPS member with the same claims (and precedence) used by the
+    LTI13Authenticator, so the provisioned users match the users created by their launches
+
+    Args:
+        member: a member of the NRPS membership container
+
+    Returns:
+        The normalized username or an empty string if the member doesn't have any of the claims
+    """
+    lti_utils = LTIUtils()
+    username = ''
+    if member.get('email'):
+        username = lti_utils.email_to_username(member['email'])
+    elif member.get('name'):
+        username = member['name']
+    elif member.get('given_name'):
+        username = member['given_name']
+    elif member.get('family_name'):
+        username = member['family_name']
+    elif member.get('lis_person_sourcedid'):
+        username = member['lis_person_sourcedid'].lower()
+    return lti_utils.normalize_string(username) if username else ''
+
+
+def role_from_member(member: Dict[str, Any]) -> str:
+    """Returns the Instructor or Learner role of a NRPS member, like the LTI13Authenticator"""
+    user_role = 'Learner'
+    for role in member.get('roles') or []:
+        if role.find('Instructor') >= 1:
+            user_role = 'Instructor'
+        elif role.find('Learner') >= 1 or role.find('Student') >= 1:
+            user_role = 'Learner'
+    return user_role
+
+
+def parse_link_header(link_header: str) -> Dict[str, str]:
+    """Returns the urls in the Link header by their rel value"""
+    links = {}
+    for url, rel in re.findall(r'<([^>]+)>\s*;\s*rel="?([^";,]+)"?', link_header or ''):
+        links[rel] = url
+    return links
+
+
+class NRPSRosterSync:
+    """
+    Provisions the whole course roster with the LTI 1.3 Names and Role Provisioning Services (NRPS), so the
+    students' first launches find their JupyterHub user, group membership, gradebook entry and home directory
+    already created.
+
+    The sync runs in the BackgroundTaskPipeline after an instructor's launch with the NRPS claim, and again
+    every ILLUMIDESK_ROSTER_SYNC_INTERVAL seconds for the courses synced since the hub started. The membership
+    service is paged and the members are provisioned with a few batched operations: one request to create the
+    users, one request by group and one gradebook session.
+
+    Args:
+        interval: seconds between the syncs of a course, 0 disables the schedule
+        home_root: directory with the users' home directories
+    """
+
+    _instance = None
+
+    def __init__(self, interval: int = None, home_root: str = None):
+        self.interval = ROSTER_SYNC_INTERVAL if interval is None else interval
+        self.home_root = home_root or ROSTER_HOME_ROOT
+        self.private_key_path = os.environ.get('LTI13_PRIVATE_KEY')
+        self.lms_token_url = os.environ.get('LTI13_TOKEN_URL')
+        self.lms_client_id = os.environ.get('LTI13_CLIENT_ID')
+        # membership service url of the synced courses
+        self.courses: Dict[str, str] = {}
+        self._last_sync: Dict[str, float] = {}
+        self._schedule = None
+
+    @classmethod
+    def instance(cls) -> 'NRPSRosterSync':
+        """Returns the roster sync shared by the LTI 1.3 launches"""
+        if cls._instance is None:
+            cls._instance = cls()
+        return cls._instance
+
+    @property
+    def configured(self) -> bool:
+        """Whether the tool's credentials needed to request the LMS access token are set"""
+        return bool(self.private_key_path and self.lms_token_url and self.lms_client_id)
+
+    def sync_on_launch(self, course_id: str, jwt_decoded: Dict[str, Any], user_role: str) -> bool:
+        """
+        Queues the course's roster sync if the launch is an instructor's launch with the NRPS claim and the
+        course wasn't synced within the interval
+
+        Args:
+            course_id: the normalized course label
+            jwt_decoded: the launch's claims
+            user_role: the user's role resolved by the authenticator
+
+        Returns:
+            True if the sync was queued
+        """
+        if not ROSTER_SYNC_ENABLED or not user_is_an_instructor(user_role):
+            return False
+        if not self.configured and PlatformRegistry.instance().for_course(course_id) is None:
+            return False
+        memberships_url = (jwt_decoded.get(NRPS_CLAIM) or {}).get('context_memberships_url')
+        if not memberships_url:
+            return False
+        self.courses[course_id] = memberships_url
+        self._start_schedule()
+        if time.monotonic() - self._last_sync.get(course_id, float('-inf')) < (self.interval or 0):
+            logger.debug(f'The roster of {course_id} was synced less than {self.interval}s ago')
+            return False
+        return BackgroundTaskPipeline.instance().submit(f'roster:{course_id}', self.sync_course, course_id)
+
+    async def sync_course(self, course_id: str) -> Dict[str, int]:
+        """
+        Fetches the course's members from the membership service and provisions them
+
+        Args:
+            course_id: the normalized course label, its membership service url must be known
+
+        Returns:
+            The number of provisioned students and instructors and of skipped members
+        """
+        registration = PlatformRegistry.instance().for_course(course_id)
+        members = await self.fetch_members(self.courses[course_id], registration)
+        students, instructors, skipped = self._resolve_members(members)
+        users = dict(students, **instructors)
+        if users:
+            await self._provision_hub_users(course_id, list(students), list(instructors))
+            loop = asyncio.get_event_loop()
+            await loop.run_in_executor(None, self._provision_gradebook, course_id, users)
+            await loop.run_in_executor(None, self._create_home_dirs, list(users))
+        self._last_sync[course_id] = time.monotonic()
+        ROSTER_SYNC_MEMBERS.labels(result=RESULT_PROVISIONED).inc(len(users))
+        ROSTER_SYNC_MEMBERS.labels(result=RESULT_SKIPPED).inc(skipped)
+        summary = {'students': len(students), 'instructors': len(instructors), 'skipped': skipped}
+        logger.info(f'Synced the roster of {course_id}: {summary}')
+        return summary
+
+    async def fetch_members(
+        self, memberships_url: str, registration: PlatformRegistration = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Pages the membership service following the next links
+
+        Args:
+            memberships_url: the context_memberships_url sent with the NRPS claim
+            registration: the registered platform that launched the course, the LTI13_* env-vars are used
+              without it
+
+        Returns:
+            The members of all the pages
+        """
+        if registration is not None:
+            token = await registration.get_access_token(NRPS_SCOPE)
+        else:
+            token = await get_lms_access_token(
+                self.lms_token_url, self.private_key_path, self.lms_client_id, scope=NRPS_SCOPE
+            )
+        if 'access_token' not in token:
+            raise ValueError(f'The "access_token" key is missing in the response from {self.lms_token_url}')
+        headers = {
+            'Authorization': '{token_type} {access_token}'.format(**token),
+            'Accept': MEMBERSHIP_CONTAINER_MEDIA_TYPE,
+        }
+        members = []
+        next_url = memberships_url
+        while next_url:
+            page, links = await self._fetch_page(next_url, headers)
+            members.extend(page)
+            next_url = links.get('next')
+        logger.debug(f'Fetched {len(members)} members from {memberships_url}')
+        return members
+
+    async def _fetch_page(self, url: str, headers: Dict[str, str]) -> Tuple[List[Dict[str, Any]], Dict[str, str]]:
+        client = AsyncHTTPClient()
+        async with LMSRateLimiter.for_url(url):
+            with track_outbound_request(UPSTREAM_LMS_NRPS):
+                resp = await client.fetch(url, method='GET', headers=headers)
+        container = json.loads(resp.body) or {}
+        return container.get('members') or [], parse_link_header(resp.headers.get('Link', ''))
+
+    def _resolve_members(self, members: List[Dict[str, Any]]) -> Tuple[Dict[str, str], Dict[str, str], int]:
+        """Returns the active students' and instructors' lms_user_id by username and the skipped members"""
+        students, instructors, skipped = {}, {}, 0
+        for member in members:
+            username = username_from_member(member)
+            if not username or not member.get('user_id') or member.get('status', 'Active') != 'Active':
+                skipped += 1
+                continue
+            if user_is_an_instructor(role_from_member(member)):
+                instructors[username] = member['user_id']
+            else:
+                students[username] = member['user_id']
+        return students, instructors, skipped
+
+    async def _provision_hub_users(self, course_id: str, students: List[str], instructors: List[str]) -> None:
+        jupyterhub_api = JupyterHubAPI()
+        try:
+            await jupyterhub_api.create_users(*(students + instructors))
+        except HTTPClientError as e:
+            # 409 when all the users already exist
+            if e.code != 409:
+                raise
+        for group_name, usernames in ((f'nbgrader-{course_id}', students), (f'formgrade-{course_id}', instructors)):
+            if usernames:
+                await jupyterhub_api.create_group(group_name)
+                await jupyterhub_api.add_group_members(group_name, usernames)
+
+    def _provision_gradebook(self, course_id: str, users: Dict[str, str]) -> None:
+        from illumidesk.apis.nbgrader_service import NbGraderServiceHelper
+
+        NbGraderServiceHelper(course_id, True).add_users_to_nbgrader_gradebook(users)
+
+    def _create_home_dirs(self, usernames: List[str]) -> None:
+        for username in usernames:
+            try:
+                create_user_home_dir(username, self.home_root)
+            except OSError as e:
+                logger.warning(f'Unable to create the home directory of {username}: {e}')
+
+    def _start_schedule(self) -> None:
+        if self._schedule is None and self.interval:
+            self._schedule = PeriodicCallback(self._sync_known_courses, self.interval * 1000)
+            self._schedule.start()
+
+    def _sync_known_courses(self) -> None:
+        pipeline = BackgroundTaskPipeline.instance()
+        for course_id in list(self.courses):
+            pipeline.submit(f'roster:{course_id}', self.sync_course, course_id)
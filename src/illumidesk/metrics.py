@@ -0,0 +1,159 @@
+import time
+
+from contextlib import contextmanager
+
+from prometheus_client import Counter
+from prometheus_client import Gauge
+from prometheus_client import Histogram
+
+from tornado.httpclient import HTTPClientError
+
+from typing import Iterator
+
+
+# The metrics are registered in prometheus_client's default registry, the same registry served by
+# JupyterHub's /metrics endpoint, so they are published next to the hub's own metrics.
+
+# launch phases
+PHASE_VALIDATION = 'validation'
+PHASE_JWKS = 'jwks'
+PHASE_GRADEBOOK = 'gradebook'
+PHASE_GROUP_SYNC = 'group_sync'
+PHASE_SETUP_COURSE = 'setup_course'
+
+# upstreams called by the hub
+UPSTREAM_JUPYTERHUB_API = 'jupyterhub_api'
+UPSTREAM_GRADER_SETUP_SERVICE = 'grader_setup_service'
+UPSTREAM_ANNOUNCEMENT = 'announcement'
+UPSTREAM_LMS_JWKS = 'lms_jwks'
+UPSTREAM_LMS_TOKEN = 'lms_token'
+UPSTREAM_LMS_AGS = 'lms_ags'
+UPSTREAM_LMS_OUTCOMES = 'lms_outcomes'
+UPSTREAM_LMS_NRPS = 'lms_nrps'
+
+# caches
+CACHE_GRADES_CONTROL_FILE = 'grades_control_file'
+CACHE_LMS_ACCESS_TOKEN = 'lms_access_token'
+CACHE_LMS_LINEITEMS = 'lms_lineitems'
+CACHE_LMS_JWKS = 'lms_jwks'
+
+# executors and queues
+EXECUTOR_GRADES_OUTBOX = 'grades_outbox'
+EXECUTOR_LMS_RATE_LIMITER = 'lms_rate_limiter'
+EXECUTOR_LAUNCH_ADMISSION = 'launch_admission'
+EXECUTOR_BACKGROUND_TASKS = 'background_tasks'
+
+
+LAUNCH_PHASE_DURATION_SECONDS = Histogram(
+    'illumidesk_launch_phase_duration_seconds',
+    'Time spent in each phase of an LTI launch',
+    ['phase'],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, float('inf')),
+)
+
+OUTBOUND_REQUEST_DURATION_SECONDS = Histogram(
+    'illumidesk_outbound_request_duration_seconds',
+    'Time spent in the requests sent by the hub to other services',
+    ['upstream'],
+)
+
+OUTBOUND_REQUEST_ERRORS = Counter(
+    'illumidesk_outbound_request_errors_total',
+    'Failed requests sent by the hub to other services, by http code (or error when there is no response)',
+    ['upstream', 'code'],
+)
+
+GRADES_SCORES = Counter(
+    'illumidesk_grades_scores_total',
+    'Scores processed by the grade passback, by status (sent, failed or skipped)',
+    ['status'],
+)
+
+GRADES_JOBS = Counter(
+    'illumidesk_grades_jobs_total',
+    'Grades outbox jobs processed by the dispatcher, by result (done, retry, failed or lost)',
+    ['result'],
+)
+
+CACHE_REQUESTS = Counter(
+    'illumidesk_cache_requests_total',
+    'Lookups in the caches kept by the hub, by result (hit or miss)',
+    ['cache', 'result'],
+)
+
+EXECUTOR_QUEUE_DEPTH = Gauge(
+    'illumidesk_executor_queue_depth',
+    'Work waiting in the hub queues: pending grades outbox jobs, requests waiting for an LMS rate limiter slot '
+    'launches waiting for admission and background tasks waiting or running',
+    ['executor'],
+)
+
+LAUNCH_ADMISSIONS = Counter(
+    'illumidesk_launch_admissions_total',
+    'Launches processed by the admission control, by result (admitted, queue_full or timeout)',
+    ['result'],
+)
+
+BACKGROUND_TASKS = Counter(
+    'illumidesk_background_tasks_total',
+    'Tasks processed by the background task pipeline, by result (done, retry, failed or deduplicated)',
+    ['result'],
+)
+
+ROSTER_SYNC_MEMBERS = Counter(
+    'illumidesk_roster_sync_members_total',
+    'Course members processed by the NRPS roster sync, by result (provisioned or skipped)',
+    ['result'],
+)
+
+EVENT_LOOP_STALLS = Counter(
+    'illumidesk_event_loop_stalls_total',
+    'Callbacks that blocked the hub event loop longer than the stall threshold, by call site',
+    ['call_site'],
+)
+
+EVENT_LOOP_STALL_DURATION_SECONDS = Histogram(
+    'illumidesk_event_loop_stall_duration_seconds',
+    'Time the hub event loop was blocked by the callbacks that exceeded the stall threshold',
+    buckets=(0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, float('inf')),
+)
+
+
+def launch_phase(phase: str):
+    """
+    Returns a context manager (also usable as decorator) that observes the duration of a launch phase
+
+    Usage:
+    ```
+    with launch_phase(PHASE_GRADEBOOK):
+        nbgrader_service.add_user_to_nbgrader_gradebook(username, lms_user_id)
+    ```
+    """
+    return LAUNCH_PHASE_DURATION_SECONDS.labels(phase=phase).time()
+
+
+@contextmanager
+def track_outbound_request(upstream: str) -> Iterator[None]:
+    """
+    Observes the duration of a request sent to an upstream service and counts it as an error if it raises.
+    The http code is used as the error label for the HTTPClientErrors.
+
+    Args:
+        upstream: the upstream name, one of the UPSTREAM_* constants
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    except HTTPClientError as e:
+        OUTBOUND_REQUEST_ERRORS.labels(upstream=upstream, code=str(e.code)).inc()
+        raise
+    except Exception:
+        OUTBOUND_REQUEST_ERRORS.labels(upstream=upstream, code='error').inc()
+        raise
+    finally:
+        OUTBOUND_REQUEST_DURATION_SECONDS.labels(upstream=upstream).observe(time.perf_counter() - started)
+
+
+def record_cache_lookup(cache: str, hit: bool) -> None:
+    """Counts a lookup in one of the hub's caches"""
+    CACHE_REQUESTS.labels(cache=cache, result='hit' if hit else 'miss').inc()
@@ -39,6 +39,34 @@ def custom_auth_state_hook(spawner: Spawner, auth_state: dict) -> None:
         spawner.log.debug(f'Volumes to mount {spawner.volumes}')
 
 
+def create_user_home_dir(username: str, home_root: str = '/home') -> bool:
+    """
+    Creates the user's home directory (owned by the NB_NON_GRADER_UID user and the NB_GID group) if it
+    doesn't exist. Used when the user spawns and when the course roster is synced, so the directory is
+    ready before the first launch.
+
+    Args:
+        username: the user's normalized name
+        home_root: the directory with the users' home directories
+
+    Returns:
+        True if the directory was created, False if it already existed
+    """
+    if not username:
+        raise ValueError('username missing')
+    user_path = os.path.join(home_root, username)
+    if os.path.exists(user_path):
+        return False
+    os.mkdir(user_path)
+    shutil.chown(
+        user_path,
+        user=int(os.environ.get('NB_NON_GRADER_UID')),
+        group=int(os.environ.get('NB_GID')),
+    )
+    os.chmod(user_path, 0o755)
+    return True
+
+
 def custom_pre_spawn_hook(spawner: Spawner) -> None:
     """
     Creates the user directory based on information passed from the
@@ -49,13 +77,5 @@ def custom_pre_spawn_hook(spawner: Spawner) -> None:
     if not spawner.user.name:
         raise ValueError('Spawner object does not contain the username')
     username = spawner.user.name
-    user_path = os.path.join('/home', username)
-    if not os.path.exists(user_path):
-        spawner.log.debug(f'Creating workdir {user_path} for the user {username}')
-        os.mkdir(user_path)
-        shutil.chown(
-            user_path,
-            user=int(os.environ.get('NB_NON_GRADER_UID')),
-            group=int(os.environ.get('NB_GID')),
-        )
-        os.chmod(user_path, 0o755)
+    if create_user_home_dir(username):
+        spawner.log.debug(f'Created workdir /home/{username} for the user {username}')
@@ -0,0 +1,231 @@
+import asyncio
+import contextvars
+import functools
+import logging
+import os
+
+from typing import Any
+from typing import Callable
+from typing import Dict
+from typing import List
+from typing import Tuple
+
+from illumidesk.metrics import BACKGROUND_TASKS
+from illumidesk.metrics import EXECUTOR_BACKGROUND_TASKS
+from illumidesk.metrics import EXECUTOR_QUEUE_DEPTH
+
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+
+# the post-launch work runs before the launch response when it's false
+BACKGROUND_TASKS_ENABLED = (os.environ.get('ILLUMIDESK_BACKGROUND_TASKS') or 'true').lower() in ('true', '1')
+# number of tasks processed at the same time
+BACKGROUND_TASKS_WORKERS = int(os.environ.get('ILLUMIDESK_BACKGROUND_TASKS_WORKERS') or '4')
+# number of attempts before a task is dropped
+BACKGROUND_TASKS_MAX_ATTEMPTS = int(os.environ.get('ILLUMIDESK_BACKGROUND_TASKS_MAX_ATTEMPTS') or '3')
+# seconds to wait before retrying a failed task, doubled with every attempt
+BACKGROUND_TASKS_RETRY_DELAY = float(os.environ.get('ILLUMIDESK_BACKGROUND_TASKS_RETRY_DELAY') or '1')
+
+RESULT_DONE = 'done'
+RESULT_RETRY = 'retry'
+RESULT_FAILED = 'failed'
+RESULT_DEDUPLICATED = 'deduplicated'
+
+
+class BackgroundTaskPipeline:
+    """
+    In-process queue for the work done after a launch that the user doesn't need to wait for (gradebook
+    registration, control file updates, assignment creation, course setup), so the launch response is sent
+    right after the authentication.
+
+    The queue is kept in memory, the tasks still queued when the hub stops are lost: the gradebook and
+    control file writes the grades depend on are run in the launch with `run`, and the tasks that restart the
+    hub (a new course setup) are submitted with `submit_last`, they only start once the other tasks are done.
+
+    Tasks are identified by a key: a task isn't queued again while a task with the same key is waiting or
+    running, so a launch storm for the same course sets the course up only once. The coroutine functions run
+    in the event loop and the other functions (the gradebook and file operations) run in the loop's default
+    executor, so they don't block the hub. Failed tasks are retried with an exponential backoff. The tasks run
+    in the context they were submitted from, so their spans are kept in the launch's trace.
+
+    Usage:
+    ```
+    BackgroundTaskPipeline.instance().submit(f'gradebook:{course_id}:{username}', add_user, username, lms_user_id)
+    ```
+
+    Args:
+        workers: number of tasks processed at the same time
+        max_attempts: number of attempts before a task is dropped
+        retry_delay: seconds to wait before the first retry, doubled with every attempt
+        enabled: whether the tasks run in background, when False submit_or_run awaits them
+    """
+
+    _instance = None
+
+    def __init__(
+        self, workers: int = None, max_attempts: int = None, retry_delay: float = None, enabled: bool = None
+    ):
+        self.workers = workers or BACKGROUND_TASKS_WORKERS
+        self.max_attempts = max_attempts or BACKGROUND_TASKS_MAX_ATTEMPTS
+        self.retry_delay = BACKGROUND_TASKS_RETRY_DELAY if retry_delay is None else retry_delay
+        self.enabled = BACKGROUND_TASKS_ENABLED if enabled is None else enabled
+        self._loop = None
+        self._queue = None
+        self._drained = None
+        self._workers: List[asyncio.Future] = []
+        # attempts of the tasks that are waiting, running or waiting for a retry, by key
+        self._pending: Dict[str, int] = {}
+        # the tasks submitted with submit_last that wait for the other tasks to be done, by key
+        self._deferred: Dict[str, Tuple] = {}
+
+    @classmethod
+    def instance(cls) -> 'BackgroundTaskPipeline':
+        """Returns the pipeline shared by the hub's authenticators and hooks"""
+        if cls._instance is None:
+            cls._instance = cls()
+            EXECUTOR_QUEUE_DEPTH.labels(executor=EXECUTOR_BACKGROUND_TASKS).set_function(
+                lambda: len(cls._instance._pending)
+            )
+        return cls._instance
+
+    def submit(self, key: str, func: Callable[..., Any], *args: Any, **kwargs: Any) -> bool:
+        """
+        Queues a task
+
+        Args:
+            key: the task's identifier, used to discard the duplicated tasks
+            func: a coroutine function or a function, called with the args and kwargs
+
+        Returns:
+            False if a task with the same key is already waiting or running
+        """
+        self._start_workers()
+        if key in self._pending:
+            BACKGROUND_TASKS.labels(result=RESULT_DEDUPLICATED).inc()
+            logger.debug(f'Background task {key} is already queued')
+            return False
+        self._pending[key] = 0
+        self._drained.clear()
+        self._queue.put_nowait((key, contextvars.copy_context(), func, args, kwargs))
+        return True
+
+    def submit_last(self, key: str, func: Callable[..., Any], *args: Any, **kwargs: Any) -> bool:
+        """
+        Queues a task that starts when no other task is waiting or running, for the tasks that restart the hub
+        (and discard the queue)
+
+        Returns:
+            False if a task with the same key is already waiting or running
+        """
+        self._start_workers()
+        if key in self._pending:
+            BACKGROUND_TASKS.labels(result=RESULT_DEDUPLICATED).inc()
+            logger.debug(f'Background task {key} is already queued')
+            return False
+        self._pending[key] = 0
+        self._drained.clear()
+        self._deferred[key] = (key, contextvars.copy_context(), func, args, kwargs)
+        self._release_deferred()
+        return True
+
+    async def run(self, func: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        """
+        Runs a task now and waits for it, in the executor if it's not a coroutine function. Used for the work
+        that must not be lost if the hub restarts before the queue is processed
+        """
+        return await self._call(contextvars.copy_context(), func, args, kwargs)
+
+    async def submit_or_run(self, key: str, func: Callable[..., Any], *args: Any, **kwargs: Any) -> None:
+        """
+        Queues the task, or runs it and waits for it when the pipeline is disabled (ILLUMIDESK_BACKGROUND_TASKS)
+        """
+        if self.enabled:
+            self.submit(key, func, *args, **kwargs)
+        else:
+            await self._call(contextvars.copy_context(), func, args, kwargs)
+
+    async def submit_last_or_run(self, key: str, func: Callable[..., Any], *args: Any, **kwargs: Any) -> None:
+        """
+        Queues the task with submit_last, or runs it and waits for it when the pipeline is disabled
+        """
+        if self.enabled:
+            self.submit_last(key, func, *args, **kwargs)
+        else:
+            await self._call(contextvars.copy_context(), func, args, kwargs)
+
+    async def join(self) -> None:
+        """Waits until all the queued tasks (and their retries) are processed"""
+        if self._drained is not None:
+            await self._drained.wait()
+
+    async def stop(self) -> None:
+        """Cancels the workers, the queued tasks are discarded"""
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        self._loop = None
+        self._queue = None
+        self._drained = None
+        self._pending.clear()
+        self._deferred.clear()
+
+    def _start_workers(self) -> None:
+        # the queue and workers are created lazily to bind them with the running loop, they are created again
+        # when the loop changed (the tests run each one with a new loop)
+        loop = asyncio.get_event_loop()
+        if self._loop is loop and self._workers:
+            return
+        self._loop = loop
+        self._queue = asyncio.Queue()
+        self._drained = asyncio.Event()
+        self._drained.set()
+        self._pending.clear()
+        self._deferred.clear()
+        self._workers = [asyncio.ensure_future(self._work()) for _ in range(self.workers)]
+
+    async def _call(
+        self, context: contextvars.Context, func: Callable[..., Any], args: Tuple, kwargs: Dict[str, Any]
+    ) -> Any:
+        if asyncio.iscoroutinefunction(func):
+            # the task created within the context runs with a copy of it
+            return await context.run(asyncio.ensure_future, func(*args, **kwargs))
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(None, context.run, functools.partial(func, *args, **kwargs))
+
+    async def _work(self) -> None:
+        while True:
+            key, context, func, args, kwargs = await self._queue.get()
+            try:
+                await self._call(context, func, args, kwargs)
+                BACKGROUND_TASKS.labels(result=RESULT_DONE).inc()
+                self._finished(key)
+            except Exception as e:
+                self._pending[key] = attempts = self._pending.get(key, 0) + 1
+                if attempts >= self.max_attempts:
+                    BACKGROUND_TASKS.labels(result=RESULT_FAILED).inc()
+                    logger.error(f'Background task {key} failed after {attempts} attempts: {e}')
+                    self._finished(key)
+                else:
+                    BACKGROUND_TASKS.labels(result=RESULT_RETRY).inc()
+                    delay = self.retry_delay * 2 ** (attempts - 1)
+                    logger.warning(f'Background task {key} failed, retrying in {delay}s: {e}')
+                    self._loop.call_later(delay, self._queue.put_nowait, (key, context, func, args, kwargs))
+            finally:
+                self._queue.task_done()
+
+    def _finished(self, key: str) -> None:
+        self._pending.pop(key, None)
+        if not self._pending:
+            self._drained.set()
+        else:
+            self._release_deferred()
+
+    def _release_deferred(self) -> None:
+        # the deferred tasks are queued when all the pending tasks are deferred ones
+        if self._deferred and len(self._pending) == len(self._deferred):
+            for item in self._deferred.values():
+                self._queue.put_nowait(item)
+            self._deferred.clear()
@@ -0,0 +1,145 @@
+import functools
+import logging
+import os
+
+from contextlib import contextmanager
+
+from typing import Any
+from typing import Callable
+from typing import Dict
+from typing import Iterator
+
+try:
+    from opentelemetry import propagate
+    from opentelemetry import trace
+except ImportError:  # tracing is optional
+    propagate = None
+    trace = None
+
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+# span exporter: otlp (sends the spans to the collector set with the standard OTEL_EXPORTER_OTLP_* env vars),
+# file (json lines written to ILLUMIDESK_TRACING_FILE) or console. Tracing is disabled if it's not set.
+TRACING_EXPORTER = os.environ.get('ILLUMIDESK_TRACING_EXPORTER', '').lower()
+TRACING_FILE = os.environ.get('ILLUMIDESK_TRACING_FILE') or '/tmp/illumidesk-traces.jsonl'
+TRACING_SERVICE_NAME = os.environ.get('OTEL_SERVICE_NAME') or 'illumidesk-hub'
+
+_tracer = None
+_tracer_provider = None
+
+
+def configure_tracing(exporter: str = None, span_exporter: Any = None) -> bool:
+    """
+    Configures the tracer used by the illumidesk spans. It's called with the ILLUMIDESK_TRACING_EXPORTER
+    value the first time a span is created, so the hub only needs the env var and the opentelemetry-sdk
+    package (plus opentelemetry-exporter-otlp-proto-http for the otlp exporter) to send traces.
+
+    Args:
+        exporter: otlp, file or console
+        span_exporter: an opentelemetry SpanExporter instance to use instead of the named exporter,
+          its spans are exported as soon as they end
+
+    Returns:
+        True if tracing is enabled
+    """
+    global _tracer, _tracer_provider
+    if trace is None:
+        logger.warning('Tracing is not available, the opentelemetry-sdk package is not installed')
+        return False
+    try:
+        from opentelemetry.sdk.resources import Resource
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import BatchSpanProcessor
+        from opentelemetry.sdk.trace.export import ConsoleSpanExporter
+        from opentelemetry.sdk.trace.export import SimpleSpanProcessor
+
+        if span_exporter is not None:
+            processor = SimpleSpanProcessor(span_exporter)
+        elif exporter == 'otlp':
+            from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+
+            processor = BatchSpanProcessor(OTLPSpanExporter())
+        elif exporter == 'file':
+            traces_file = open(TRACING_FILE, 'a')
+            processor = BatchSpanProcessor(
+                ConsoleSpanExporter(out=traces_file, formatter=lambda span: span.to_json(indent=None) + os.linesep)
+            )
+        elif exporter == 'console':
+            processor = BatchSpanProcessor(ConsoleSpanExporter())
+        else:
+            logger.error(f'Unknown tracing exporter: {exporter}')
+            return False
+    except ImportError as e:
+        logger.error(f'Tracing is disabled, the exporter {exporter} is not available: {e}')
+        return False
+    # the provider is kept by this module instead of being set as the global provider, which can
+    # only be set once per process
+    _tracer_provider = TracerProvider(resource=Resource.create({'service.name': TRACING_SERVICE_NAME}))
+    _tracer_provider.add_span_processor(processor)
+    _tracer = _tracer_provider.get_tracer('illumidesk')
+    logger.info(f'Tracing enabled with the {exporter or type(span_exporter).__name__} exporter')
+    return True
+
+
+def reset_tracing() -> None:
+    """Flushes the pending spans and disables tracing"""
+    global _tracer, _tracer_provider
+    if _tracer_provider is not None:
+        _tracer_provider.shutdown()
+    _tracer = None
+    _tracer_provider = None
+
+
+def get_tracer() -> Any:
+    """Returns the tracer or None if tracing is disabled"""
+    if _tracer is None and TRACING_EXPORTER and trace is not None:
+        configure_tracing(TRACING_EXPORTER)
+    return _tracer
+
+
+@contextmanager
+def start_span(name: str, **attributes: Any) -> Iterator[Any]:
+    """
+    Starts a span as a child of the current span. The exceptions raised within the span are recorded
+    in the span. Yields None when tracing is disabled.
+
+    Args:
+        name: the span name
+        attributes: span attributes, the None values are ignored
+    """
+    tracer = get_tracer()
+    if tracer is None:
+        yield None
+        return
+    attributes = {key.replace('__', '.'): value for key, value in attributes.items() if value is not None}
+    with tracer.start_as_current_span(name, attributes=attributes) as span:
+        yield span
+
+
+def traced(name: str) -> Callable:
+    """Decorator that runs a coroutine function within a span"""
+
+    def decorator(func: Callable) -> Callable:
+        @functools.wraps(func)
+        async def wrapper(*args: Any, **kwargs: Any) -> Any:
+            with start_span(name):
+                return await func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def inject_trace_headers(headers: Dict[str, str]) -> Dict[str, str]:
+    """
+    Adds the W3C trace context headers (traceparent) of the current span to the headers, so the services
+    called by the hub continue the trace.
+
+    Returns:
+        The same headers dict
+    """
+    if get_tracer() is not None:
+        propagate.inject(headers)
+    return headers
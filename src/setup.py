@@ -34,7 +34,7 @@ setup(
     author='The IllumiDesk Team',
     author_email='hello@illumidesk.com',
     license='MIT',
-    packages=find_packages(exclude='./tests'),
+    packages=find_packages(exclude=['tests', 'tests.*', 'benchmarks', 'benchmarks.*', 'simulators', 'simulators.*']),
     install_requires=[
         'dockerspawner==0.11.1',
         'filelock==3.0.12',
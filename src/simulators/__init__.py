@@ -0,0 +1,4 @@
+"""
+Simulators of the external systems shared by the load tests (``tests.loadtest``) and the micro-benchmarks
+(``benchmarks``). They are development tools and are not installed with the illumidesk package.
+"""
@@ -0,0 +1,192 @@
+import json
+import time
+import uuid
+
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+import jwt
+
+from oauthlib.oauth1.rfc5849 import signature
+
+from typing import Any
+from typing import Dict
+
+
+class SimulatedStudent:
+    """
+    A user launching the tool from the simulated LMS
+
+    Args:
+        index: unique number used to build the user's identifiers
+        course_id: the course label
+        role: the LTI role sent with the launch (Learner or Instructor)
+    """
+
+    def __init__(self, index: int, course_id: str, role: str = 'Learner'):
+        self.index = index
+        self.course_id = course_id
+        self.role = role
+        self.lms_user_id = f'lms-user-{index}'
+        self.email = f'student{index}@loadtest.example.com'
+        self.given_name = f'Student{index}'
+        self.family_name = 'Loadtest'
+
+
+class LMSSimulator:
+    """
+    Local stand-in for the LMS (tool consumer / platform). It signs LTI 1.1 launches with OAuth1 (HMAC-SHA1)
+    and issues LTI 1.3 id_tokens signed with a local RSA key published as a JWKS.
+
+    Args:
+        base_url: url where the simulated LMS endpoints are served (jwks, authorize, token, AGS)
+        consumer_key: LTI 1.1 consumer key
+        shared_secret: LTI 1.1 shared secret
+        client_id: LTI 1.3 client id
+        deployment_id: LTI 1.3 deployment id
+    """
+
+    def __init__(
+        self,
+        base_url: str,
+        consumer_key: str = 'loadtest-consumer-key',
+        shared_secret: str = 'loadtest-shared-secret',
+        client_id: str = 'loadtest-client-id',
+        deployment_id: str = '1:loadtest',
+    ):
+        self.base_url = base_url.rstrip('/')
+        self.issuer = self.base_url
+        self.consumer_key = consumer_key
+        self.shared_secret = shared_secret
+        self.client_id = client_id
+        self.deployment_id = deployment_id
+        self.kid = uuid.uuid4().hex
+        self.private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048, backend=default_backend())
+        self.private_key_pem = self.private_key.private_bytes(
+            encoding=serialization.Encoding.PEM,
+            format=serialization.PrivateFormat.PKCS8,
+            encryption_algorithm=serialization.NoEncryption(),
+        )
+
+    @property
+    def consumers(self) -> Dict[str, str]:
+        """The consumers dict used by the LTI11Authenticator"""
+        return {self.consumer_key: self.shared_secret}
+
+    @property
+    def jwks(self) -> Dict[str, Any]:
+        """The public key set published in the jwks endpoint"""
+        jwk = json.loads(jwt.algorithms.RSAAlgorithm.to_jwk(self.private_key.public_key()))
+        jwk.update({'kid': self.kid, 'alg': 'RS256', 'use': 'sig'})
+        return {'keys': [jwk]}
+
+    def lineitems_url(self, course_id: str) -> str:
+        return f'{self.base_url}/api/lti/courses/{course_id}/line_items'
+
+    def lti11_launch_args(self, student: SimulatedStudent, launch_url: str, assignment_name: str) -> Dict[str, str]:
+        """
+        Builds the body of a signed LTI 1.1 basic launch request
+
+        Args:
+            student: the user launching the tool
+            launch_url: the tool's launch url, it's part of the oauth1 signature
+            assignment_name: the resource link title
+
+        Returns:
+            The launch arguments including the oauth_signature
+        """
+        args = {
+            'context_id': f'ctx-{student.course_id}',
+            'context_label': student.course_id,
+            'context_title': f'Load test {student.course_id}',
+            'lis_outcome_service_url': f'{self.base_url}/api/lti/v1/tools/1/grade_passback',
+            'lis_person_contact_email_primary': student.email,
+            'lis_person_name_family': student.family_name,
+            'lis_person_name_given': student.given_name,
+            'lis_result_sourcedid': f'{student.course_id}-{assignment_name}-{student.lms_user_id}',
+            'lti_message_type': 'basic-lti-launch-request',
+            'lti_version': 'LTI-1p0',
+            'oauth_callback': 'about:blank',
+            'oauth_consumer_key': self.consumer_key,
+            'oauth_nonce': uuid.uuid4().hex,
+            'oauth_signature_method': 'HMAC-SHA1',
+            'oauth_timestamp': str(int(time.time())),
+            'oauth_version': '1.0',
+            'resource_link_id': f'rl-{assignment_name}',
+            'resource_link_title': assignment_name,
+            'roles': student.role,
+            'tool_consumer_info_product_family_code': 'loadtest',
+            'user_id': student.lms_user_id,
+        }
+        base_string = signature.signature_base_string(
+            'POST',
+            signature.base_string_uri(launch_url),
+            signature.normalize_parameters(signature.collect_parameters(body=list(args.items()))),
+        )
+        args['oauth_signature'] = signature.sign_hmac_sha1(base_string, self.shared_secret, None)
+        return args
+
+    def lti13_id_token(self, student: SimulatedStudent, assignment_name: str, nonce: str) -> str:
+        """
+        Issues a signed id_token for an LtiResourceLinkRequest
+
+        Args:
+            student: the user launching the tool
+            assignment_name: the resource link title
+            nonce: the nonce received with the OIDC authentication request
+        """
+        now = int(time.time())
+        role = (
+            'http://purl.imsglobal.org/vocab/lis/v2/membership#Instructor'
+            if student.role == 'Instructor'
+            else 'http://purl.imsglobal.org/vocab/lis/v2/membership#Learner'
+        )
+        claims = {
+            'iss': self.issuer,
+            'aud': self.client_id,
+            'azp': self.client_id,
+            'sub': student.lms_user_id,
+            'iat': now,
+            'exp': now + 300,
+            'nonce': nonce,
+            'email': student.email,
+            'given_name': student.given_name,
+            'family_name': student.family_name,
+            'name': f'{student.given_name} {student.family_name}',
+            'https://purl.imsglobal.org/spec/lti/claim/message_type': 'LtiResourceLinkRequest',
+            'https://purl.imsglobal.org/spec/lti/claim/version': '1.3.0',
+            'https://purl.imsglobal.org/spec/lti/claim/deployment_id': self.deployment_id,
+            'https://purl.imsglobal.org/spec/lti/claim/target_link_uri': 'https://hub.loadtest/hub/oauth_callback',
+            'https://purl.imsglobal.org/spec/lti/claim/roles': [role],
+            'https://purl.imsglobal.org/spec/lti/claim/context': {
+                'id': f'ctx-{student.course_id}',
+                'label': student.course_id,
+                'title': f'Load test {student.course_id}',
+                'type': ['http://purl.imsglobal.org/vocab/lis/v2/course#CourseOffering'],
+            },
+            'https://purl.imsglobal.org/spec/lti/claim/resource_link': {
+                'id': f'rl-{assignment_name}',
+                'title': assignment_name,
+            },
+            'https://purl.imsglobal.org/spec/lti/claim/tool_platform': {
+                'guid': 'loadtest-lms',
+                'name': 'Load test LMS',
+                'version': '1.0',
+                'product_family_code': 'loadtest',
+            },
+            'https://purl.imsglobal.org/spec/lti/claim/lis': {'person_sourcedid': student.lms_user_id},
+            'https://purl.imsglobal.org/spec/lti/claim/custom': {'lms_user_id': student.lms_user_id},
+            'https://purl.imsglobal.org/spec/lti/claim/launch_presentation': {
+                'return_url': f'{self.base_url}/courses/{student.course_id}',
+            },
+            'https://purl.imsglobal.org/spec/lti-ags/claim/endpoint': {
+                'scope': [
+                    'https://purl.imsglobal.org/spec/lti-ags/scope/lineitem',
+                    'https://purl.imsglobal.org/spec/lti-ags/scope/score',
+                    'https://purl.imsglobal.org/spec/lti-ags/scope/result.readonly',
+                ],
+                'lineitems': self.lineitems_url(student.course_id),
+            },
+        }
+        return jwt.encode(claims, self.private_key_pem, algorithm='RS256', headers={'kid': self.kid}).decode()
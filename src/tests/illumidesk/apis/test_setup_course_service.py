@@ -0,0 +1,67 @@
+import asyncio
+import json
+import pytest
+
+from illumidesk.apis import setup_course_service
+from illumidesk.apis.setup_course_service import create_assignment_source_dir
+from illumidesk.apis.setup_course_service import create_assignment_source_dirs
+from illumidesk.apis.setup_course_service import get_grader_ready
+
+from tornado.httpclient import HTTPClientError
+
+from unittest.mock import AsyncMock
+from unittest.mock import Mock
+from unittest.mock import patch
+
+
+@pytest.fixture(autouse=True)
+def created_assignment_dirs(monkeypatch):
+    monkeypatch.setattr(setup_course_service, '_created_assignment_dirs', set())
+
+
+@pytest.mark.asyncio
+async def test_create_assignment_source_dirs_sends_the_missing_assignments_in_one_request():
+    """
+    Are the assignment names sent in a single request, and the directories already created skipped?
+    """
+    response = Mock(body=json.dumps({'success': True}).encode())
+    with patch('tornado.httpclient.AsyncHTTPClient.fetch', new_callable=AsyncMock, return_value=response) as mock_fetch:
+        assert await create_assignment_source_dirs('test-org', 'intro101', ['lab1', 'lab2', 'lab1']) is True
+        assert await create_assignment_source_dir('test-org', 'intro101', 'lab2') is True
+        assert await create_assignment_source_dirs('test-org', 'intro101', ['lab2', 'lab3']) is True
+
+    assert mock_fetch.call_count == 2
+    first, second = mock_fetch.call_args_list
+    assert first.args[0].endswith('/courses/test-org/intro101')
+    assert json.loads(first.kwargs['body']) == {'assignments': ['lab1', 'lab2']}
+    assert json.loads(second.kwargs['body']) == {'assignments': ['lab3']}
+
+
+@pytest.mark.asyncio
+async def test_create_assignment_source_dir_calls_the_service_again_after_an_error():
+    """
+    Is an assignment whose directory couldn't be created requested again in the next launch?
+    """
+    with patch(
+        'tornado.httpclient.AsyncHTTPClient.fetch', new_callable=AsyncMock, side_effect=HTTPClientError(500)
+    ):
+        assert await create_assignment_source_dir('test-org', 'intro101', 'lab1') is False
+
+    response = Mock(body=json.dumps({'success': True}).encode())
+    with patch('tornado.httpclient.AsyncHTTPClient.fetch', new_callable=AsyncMock, return_value=response) as mock_fetch:
+        assert await create_assignment_source_dir('test-org', 'intro101', 'lab1') is True
+    mock_fetch.assert_called_once()
+
+
+@pytest.mark.asyncio
+async def test_get_grader_ready_sends_a_single_wait_per_course():
+    """
+    Do the pending pages of a course share the wait sent to the service?
+    """
+    response = Mock(body=json.dumps({'success': True, 'ready': True}).encode())
+    with patch('tornado.httpclient.AsyncHTTPClient.fetch', new_callable=AsyncMock, return_value=response) as mock_fetch:
+        results = await asyncio.gather(*[get_grader_ready('test-org', 'intro101', 10) for _ in range(5)])
+        assert await get_grader_ready('test-org', 'intro101', 10) is True
+
+    assert results == [True] * 5
+    assert mock_fetch.await_count == 2
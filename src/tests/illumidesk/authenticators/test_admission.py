@@ -0,0 +1,155 @@
+import asyncio
+import pytest
+
+from unittest.mock import patch
+
+from illumidesk.authenticators.admission import AdmissionController
+from illumidesk.authenticators.admission import LaunchRejectedError
+from illumidesk.authenticators.handlers import LTI11AuthenticateHandler
+
+
+async def wait_for_slot(controller: AdmissionController, course_id: str, admitted: list, priority: bool = False):
+    await controller.acquire(course_id, priority=priority)
+    admitted.append(course_id)
+
+
+@pytest.mark.asyncio
+async def test_disabled_controller_admits_every_launch():
+    """
+    Are the launches admitted without limit when the max concurrency is 0?
+    """
+    controller = AdmissionController(max_concurrency=0)
+
+    for _ in range(10):
+        await controller.acquire('intro101')
+
+    assert not controller.enabled
+    assert controller.active == 0
+
+
+@pytest.mark.asyncio
+async def test_launches_over_the_limit_wait_for_a_released_slot():
+    """
+    Does a launch over the concurrency limit wait until a slot is released?
+    """
+    controller = AdmissionController(max_concurrency=2, queue_timeout=5)
+    admitted = []
+    await controller.acquire('intro101')
+    await controller.acquire('intro101')
+
+    waiting = asyncio.ensure_future(wait_for_slot(controller, 'intro101', admitted))
+    await asyncio.sleep(0)
+    assert admitted == []
+    assert controller.queued == 1
+
+    controller.release()
+    await waiting
+
+    assert admitted == ['intro101']
+    assert controller.active == 2
+    assert controller.queued == 0
+
+
+@pytest.mark.asyncio
+async def test_launches_are_rejected_when_the_queue_is_full():
+    """
+    Is a LaunchRejectedError with the retry delay raised when the queue is full?
+    """
+    controller = AdmissionController(max_concurrency=1, max_queue=1, queue_timeout=5, retry_after=7)
+    await controller.acquire('intro101')
+    waiting = asyncio.ensure_future(controller.acquire('intro101'))
+    await asyncio.sleep(0)
+
+    with pytest.raises(LaunchRejectedError) as excinfo:
+        await controller.acquire('intro101')
+
+    assert excinfo.value.reason == 'queue_full'
+    assert excinfo.value.retry_after == 7
+    waiting.cancel()
+
+
+@pytest.mark.asyncio
+async def test_launches_are_rejected_after_the_queue_timeout():
+    """
+    Is a waiting launch rejected (and removed from the queue) when it waits longer than the queue timeout?
+    """
+    controller = AdmissionController(max_concurrency=1, queue_timeout=0.05)
+    await controller.acquire('intro101')
+
+    with pytest.raises(LaunchRejectedError) as excinfo:
+        await controller.acquire('intro101')
+
+    assert excinfo.value.reason == 'timeout'
+    assert controller.queued == 0
+    controller.release()
+    assert controller.active == 0
+
+
+@pytest.mark.asyncio
+async def test_slots_are_handed_out_round_robin_between_courses():
+    """
+    Is a course with fewer waiting launches served before the queued launches of a larger course?
+    """
+    controller = AdmissionController(max_concurrency=1, queue_timeout=5)
+    admitted = []
+    await controller.acquire('large')
+    waiting = [asyncio.ensure_future(wait_for_slot(controller, 'large', admitted)) for _ in range(3)]
+    await asyncio.sleep(0)
+    waiting.append(asyncio.ensure_future(wait_for_slot(controller, 'small', admitted)))
+    await asyncio.sleep(0)
+
+    for _ in range(4):
+        controller.release()
+        await asyncio.sleep(0)
+        await asyncio.sleep(0)
+    await asyncio.gather(*waiting)
+
+    assert admitted == ['large', 'small', 'large', 'large']
+
+
+@pytest.mark.asyncio
+async def test_instructors_are_served_first():
+    """
+    Is a waiting instructor launch admitted before the learner launches queued earlier?
+    """
+    controller = AdmissionController(max_concurrency=1, queue_timeout=5)
+    admitted = []
+    await controller.acquire('intro101')
+    learner = asyncio.ensure_future(wait_for_slot(controller, 'intro101', admitted))
+    await asyncio.sleep(0)
+    instructor = asyncio.ensure_future(wait_for_slot(controller, 'instructor', admitted, priority=True))
+    await asyncio.sleep(0)
+
+    controller.release()
+    await instructor
+    controller.release()
+    await learner
+
+    assert admitted == ['instructor', 'intro101']
+
+
+@pytest.mark.asyncio
+async def test_lti11_handler_responds_with_the_waiting_page_when_the_launch_is_rejected(make_mock_request_handler):
+    """
+    Does the LTI11AuthenticateHandler respond with a 503, the Retry-After header and the waiting page
+    that posts the launch arguments again?
+    """
+    local_handler = make_mock_request_handler(LTI11AuthenticateHandler, method='POST')
+    local_handler.request.body_arguments = {'context_label': [b'intro101'], 'roles': [b'Learner']}
+    handler = LTI11AuthenticateHandler(local_handler.application, local_handler.request)
+    controller = AdmissionController(max_concurrency=1, max_queue=0)
+    await controller.acquire('intro101')
+
+    with patch.object(AdmissionController, '_instance', controller), patch.object(
+        LTI11AuthenticateHandler, 'login_user'
+    ) as mock_login_user, patch.object(
+        LTI11AuthenticateHandler, 'render_template', return_value='waiting'
+    ) as mock_render_template, patch.object(
+        LTI11AuthenticateHandler, 'finish'
+    ):
+        await handler.post()
+
+    assert not mock_login_user.called
+    assert handler.get_status() == 503
+    assert handler._headers['Retry-After'] == str(controller.retry_after)
+    assert mock_render_template.call_args.kwargs['arguments'] == {'context_label': 'intro101', 'roles': 'Learner'}
@@ -11,6 +11,7 @@ from illumidesk.authenticators.validator import LTI11LaunchValidator
 from illumidesk.authenticators.authenticator import LTI11Authenticator
 from illumidesk.authenticators.authenticator import LTIUtils
 from illumidesk.grades.senders import LTIGradesSenderControlFile
+from illumidesk.tasks.pipeline import BackgroundTaskPipeline
 
 
 @pytest.fixture(scope='function')
@@ -172,6 +173,7 @@ async def test_authenticator_uses_lti_grades_sender_control_file_with_student_ro
                 )[x][0].decode()
 
                 _ = await authenticator.authenticate(handler, None)
+                await BackgroundTaskPipeline.instance().join()
                 assert mock_register_data.called
 
 
@@ -209,6 +211,7 @@ async def test_authenticator_uses_lti_grades_sender_control_file_with_learner_ro
                 )[x][0].decode()
 
                 _ = await authenticator.authenticate(handler, None)
+                await BackgroundTaskPipeline.instance().join()
                 assert mock_register_data.called
 
 
@@ -246,6 +249,7 @@ async def test_authenticator_uses_lti_grades_sender_control_file_with_instructor
                 )[x][0].decode()
 
                 _ = await authenticator.authenticate(handler, None)
+                await BackgroundTaskPipeline.instance().join()
                 assert mock_register_data.called
 
 
@@ -1,5 +1,7 @@
+import jwt
 import pytest
 
+from tornado.web import HTTPError
 from tornado.web import RequestHandler
 
 from unittest.mock import patch
@@ -9,6 +11,31 @@ from illumidesk.authenticators.authenticator import LTI13Authenticator
 from illumidesk.authenticators.authenticator import LTIUtils
 
 
+@pytest.fixture(autouse=True)
+def platform_jwks(mock_lti13_platform_jwks):
+    """
+    The launches are verified with the key of the test platform
+    """
+    yield mock_lti13_platform_jwks
+
+
+@pytest.mark.asyncio
+async def test_authenticator_rejects_a_launch_signed_with_another_key(
+    make_lti13_resource_link_request, make_mock_request_handler
+):
+    """
+    Does the authenticator respond with a 401 to a launch that wasn't signed with the platform's key?
+    """
+    authenticator = LTI13Authenticator()
+    request_handler = make_mock_request_handler(RequestHandler, authenticator=authenticator)
+    forged_token = jwt.encode(make_lti13_resource_link_request, 'secret', algorithm='HS256')
+    with patch.object(RequestHandler, 'get_argument', return_value=forged_token):
+        with pytest.raises(HTTPError) as excinfo:
+            await authenticator.authenticate(request_handler, None)
+
+    assert excinfo.value.status_code == 401
+
+
 @pytest.mark.asyncio
 async def test_authenticator_invokes_lti13validator_handler_get_argument(
     build_lti13_jwt_id_token, make_lti13_resource_link_request, make_mock_request_handler, mock_nbhelper
@@ -1,27 +1,60 @@
+import jwt
 import pytest
 
-from tornado.web import HTTPError
+from Crypto.PublicKey import RSA
 
-from unittest.mock import patch
+from tornado.web import HTTPError
 
 from illumidesk.authenticators.validator import LTI13LaunchValidator
 
 
 @pytest.mark.asyncio
 async def test_validator_jwt_verify_and_decode_invokes_retrieve_matching_jwk(
-    make_lti13_resource_link_request, build_lti13_jwt_id_token
+    make_lti13_resource_link_request, build_lti13_jwt_id_token, mock_lti13_platform_jwks
 ):
     """
     Does the validator jwt_verify_and_decode method invoke the retrieve_matching_jwk method?
     """
     validator = LTI13LaunchValidator()
     jwks_endoint = 'https://my.platform.domain/api/lti/security/jwks'
-    with patch.object(validator, '_retrieve_matching_jwk', return_value=None) as mock_retrieve_matching_jwks:
-        _ = await validator.jwt_verify_and_decode(
-            build_lti13_jwt_id_token(make_lti13_resource_link_request), jwks_endoint, True
-        )
+    _ = await validator.jwt_verify_and_decode(
+        build_lti13_jwt_id_token(make_lti13_resource_link_request), jwks_endoint, True
+    )
+
+    assert mock_lti13_platform_jwks.called
+
 
-        assert mock_retrieve_matching_jwks.called
+@pytest.mark.asyncio
+async def test_validator_jwt_verify_and_decode_retrieves_the_jwk_matching_the_token_kid(
+    make_lti13_resource_link_request, build_lti13_jwt_id_token, mock_lti13_platform_jwks
+):
+    """
+    Does the validator jwt_verify_and_decode method look up the platform key with the kid received in the
+    id_token's header?
+    """
+    validator = LTI13LaunchValidator()
+    jwks_endoint = 'https://my.platform.domain/api/lti/security/jwks'
+    id_token = build_lti13_jwt_id_token(make_lti13_resource_link_request)
+    _ = await validator.jwt_verify_and_decode(id_token.decode(), jwks_endoint, True)
+
+    mock_lti13_platform_jwks.assert_called_once_with(jwks_endoint, 'platform-kid', True)
+
+
+@pytest.mark.asyncio
+async def test_validator_jwt_verify_and_decode_rejects_a_token_signed_with_another_key(
+    make_lti13_resource_link_request, mock_lti13_platform_jwks
+):
+    """
+    Is a token that wasn't signed with the platform's key rejected?
+    """
+    validator = LTI13LaunchValidator()
+    jwks_endoint = 'https://my.platform.domain/api/lti/security/jwks'
+    other_key = RSA.generate(2048).exportKey('PEM')
+    forged_token = jwt.encode(
+        make_lti13_resource_link_request, other_key, algorithm='RS256', headers={'kid': 'platform-kid'}
+    )
+    with pytest.raises(jwt.exceptions.InvalidSignatureError):
+        await validator.jwt_verify_and_decode(forged_token.decode(), jwks_endoint, True)
 
 
 @pytest.mark.asyncio
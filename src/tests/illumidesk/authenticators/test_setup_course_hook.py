@@ -20,6 +20,7 @@ from illumidesk.authenticators.authenticator import LTI11Authenticator
 from illumidesk.authenticators.authenticator import LTI13Authenticator
 from illumidesk.authenticators.authenticator import setup_course_hook
 from illumidesk.authenticators.utils import LTIUtils
+from illumidesk.tasks.pipeline import BackgroundTaskPipeline
 
 
 @pytest.mark.asyncio
@@ -163,6 +164,7 @@ async def test_setup_course_hook_calls_add_user_to_nbgrader_gradebook_when_role_
                 AsyncHTTPClient, 'fetch', return_value=make_http_response(handler=local_handler.request)
             ):
                 await setup_course_hook(local_authenticator, local_handler, local_authentication)
+                await BackgroundTaskPipeline.instance().join()
                 assert mock_add_user_to_nbgrader_gradebook.called
 
 
@@ -338,6 +340,7 @@ async def test_setup_course_hook_calls_announcement_service_when_is_new_setup(
             AnnouncementService.add_announcement = AsyncMock(return_value=None)
 
             await setup_course_hook(local_authenticator, local_handler, local_authentication)
+            await BackgroundTaskPipeline.instance().join()
             assert AnnouncementService.add_announcement.called
 
 
@@ -370,6 +373,7 @@ async def test_is_new_course_initiates_rolling_update(
             AnnouncementService.add_announcement = AsyncMock(return_value=None)
 
             await setup_course_hook(local_authenticator, local_handler, local_authentication)
+            await BackgroundTaskPipeline.instance().join()
             assert mock_client.called
 
             mock_client.assert_any_call(
@@ -10,6 +10,8 @@ import uuid
 
 from Crypto.PublicKey import RSA
 
+from illumidesk.grades.outbox import GradesOutbox
+from illumidesk.grades.outbox import GradesOutboxDispatcher
 from illumidesk.grades.sender_controlfile import LTIGradesSenderControlFile
 from illumidesk.authenticators.utils import LTIUtils
 
@@ -286,6 +288,18 @@ def grades_controlfile_reset_file_loaded():
     LTIGradesSenderControlFile.FILE_LOADED = False
 
 
+@pytest.fixture(scope='function')
+def grades_outbox(tmp_path):
+    """
+    Creates a grades outbox with a sqlite database in a temporary directory and uses it as the shared instance
+    """
+    outbox = GradesOutbox(f'sqlite:///{tmp_path}/grades_outbox.sqlite', max_attempts=2, retry_delay=0)
+    GradesOutbox._instance = outbox
+    yield outbox
+    GradesOutbox._instance = None
+    GradesOutboxDispatcher._instance = None
+
+
 @pytest.fixture(scope='function')
 def setup_jupyterhub_db(monkeypatch):
     """
@@ -805,15 +819,38 @@ def make_lti13_platform_jwks() -> Dict[str, List[Dict[str, str]]]:
     return _make_lti13_platform_jwks
 
 
+@pytest.fixture(scope='session')
+def lti13_platform_key():
+    """
+    The platform's private key used to sign the test id tokens
+    """
+    return RSA.generate(2048).exportKey('PEM')
+
+
 @pytest.fixture(scope='function')
-def build_lti13_jwt_id_token() -> str:
+def build_lti13_jwt_id_token(lti13_platform_key) -> str:
     def _make_lti13_jwt_id_token(json_lti13_launch_request: Dict[str, str]):
         """
-        Returns a valid jwt lti13 id token from a json
+        Returns a valid jwt lti13 id token from a json signed with the platform's key
         We can use the `make_lti13_resource_link_request` or `make_lti13_resource_link_request_privacy_enabled`
         fixture to create the json then call this method.
         """
-        encoded_jwt = jwt.encode(json_lti13_launch_request, 'secret', algorithm='HS256')
+        # the launch requests were recorded, the token is issued now
+        claims = dict(json_lti13_launch_request, iat=int(time.time()), exp=int(time.time()) + 3600)
+        encoded_jwt = jwt.encode(claims, lti13_platform_key, algorithm='RS256', headers={'kid': 'platform-kid'})
         return encoded_jwt
 
     return _make_lti13_jwt_id_token
+
+
+@pytest.fixture(scope='function')
+def mock_lti13_platform_jwks(lti13_platform_key):
+    """
+    Returns the platform's public key as the key matching the kid of the id tokens, without fetching the
+    platform's key set
+    """
+    public_key = RSA.import_key(lti13_platform_key).publickey().exportKey('PEM')
+    with patch(
+        'illumidesk.authenticators.validator.LTI13LaunchValidator._retrieve_matching_jwk', return_value=public_key
+    ) as mock_retrieve_matching_jwk:
+        yield mock_retrieve_matching_jwk
@@ -0,0 +1,140 @@
+import pytest
+
+from unittest.mock import AsyncMock
+from unittest.mock import Mock
+from unittest.mock import patch
+
+from illumidesk.grades.course_sender import ALL_ASSIGNMENTS
+from illumidesk.grades.course_sender import CourseGradesSender
+from illumidesk.grades.course_sender import RESULT_NO_GRADES
+from illumidesk.grades.course_sender import RESULT_SENT
+from illumidesk.grades.exceptions import AssignmentWithoutGradesError
+from illumidesk.grades.exceptions import GradesSenderCriticalError
+from illumidesk.grades.exceptions import GradesSenderMissingInfoError
+from illumidesk.grades.outbox import LTI11
+from illumidesk.grades.outbox import LTI13
+from illumidesk.grades.outbox import create_grades_sender
+from illumidesk.grades.senders import LTI13GradeSender
+from illumidesk.grades.senders import LTIGradeSender
+
+
+@pytest.fixture()
+def mock_gradebook():
+    gradebook = Mock()
+    gradebook.assignments = [Mock(), Mock()]
+    gradebook.assignments[0].name = 'lab1'
+    gradebook.assignments[1].name = 'lab2'
+    gradebook.check_course.return_value = Mock(lms_lineitems_endpoint='https://canvas.example.com/line_items')
+    with patch('illumidesk.grades.course_sender.Gradebook') as mock_gradebook_class:
+        mock_gradebook_class.return_value.__enter__.return_value = gradebook
+        yield gradebook
+
+
+@pytest.mark.asyncio
+async def test_course_sender_sends_the_grades_of_all_the_assignments(mock_gradebook):
+    """
+    Does the course sender publish every assignment found in the gradebook?
+    """
+    sut = CourseGradesSender('course1', LTI11)
+    with patch.object(LTIGradeSender, 'send_grades', new_callable=AsyncMock, return_value=None) as mock_send_grades:
+        summary = await sut.send_grades()
+    assert summary == {'lab1': RESULT_SENT, 'lab2': RESULT_SENT}
+    assert mock_send_grades.call_count == 2
+
+
+@pytest.mark.asyncio
+async def test_course_sender_sends_only_the_selected_assignments(mock_gradebook):
+    """
+    Does the course sender publish only the assignments received as argument?
+    """
+    sut = CourseGradesSender('course1', LTI11)
+    with patch.object(LTIGradeSender, 'send_grades', new_callable=AsyncMock, return_value=None) as mock_send_grades:
+        summary = await sut.send_grades(assignments=['lab2'])
+    assert summary == {'lab2': RESULT_SENT}
+    assert mock_send_grades.call_count == 1
+
+
+@pytest.mark.asyncio
+async def test_course_sender_shares_the_gradebook_session_with_the_senders(mock_gradebook):
+    """
+    Do the assignment senders use the gradebook session opened by the course sender?
+    """
+    sut = CourseGradesSender('course1', LTI11)
+    senders = sut._create_senders(['lab1', 'lab2'], mock_gradebook)
+    assert all(sender.gradebook is mock_gradebook for sender in senders)
+
+
+@pytest.mark.asyncio
+async def test_course_sender_reports_assignments_without_grades(mock_gradebook):
+    """
+    Are the assignments without grades reported in the summary without failing the job?
+    """
+    sut = CourseGradesSender('course1', LTI11)
+    with patch.object(
+        LTIGradeSender, 'send_grades', new_callable=AsyncMock, side_effect=[None, AssignmentWithoutGradesError]
+    ):
+        summary = await sut.send_grades()
+    assert summary == {'lab1': RESULT_SENT, 'lab2': RESULT_NO_GRADES}
+
+
+@pytest.mark.asyncio
+async def test_course_sender_does_not_fail_with_missing_info(mock_gradebook):
+    """
+    Are the assignments with missing info reported in the summary without failing the job?
+    """
+    sut = CourseGradesSender('course1', LTI11)
+    with patch.object(
+        LTIGradeSender, 'send_grades', new_callable=AsyncMock, side_effect=[GradesSenderMissingInfoError, None]
+    ):
+        summary = await sut.send_grades()
+    assert summary['lab1'].startswith('missing-info')
+    assert summary['lab2'] == RESULT_SENT
+
+
+@pytest.mark.asyncio
+async def test_course_sender_raises_a_critical_error_after_processing_all_the_assignments(mock_gradebook):
+    """
+    Does the course sender process the rest of the assignments before raising the error?
+    """
+    sut = CourseGradesSender('course1', LTI11)
+    with patch.object(
+        LTIGradeSender, 'send_grades', new_callable=AsyncMock, side_effect=[Exception('boom'), None]
+    ) as mock_send_grades:
+        with pytest.raises(GradesSenderCriticalError):
+            await sut.send_grades()
+    assert mock_send_grades.call_count == 2
+
+
+@pytest.mark.asyncio
+async def test_course_sender_gets_the_lti13_token_and_lineitems_once(mock_gradebook):
+    """
+    Do the LTI 1.3 senders share one access token and one line items index?
+    """
+    sut = CourseGradesSender('course1', LTI13)
+    lineitems = [{'label': 'lab1'}, {'label': 'lab2'}]
+
+    async def set_token(self):
+        self.headers['Authorization'] = 'Bearer token'
+
+    async def get_lineitems(self, url):
+        self.all_lineitems = lineitems
+
+    with patch.object(LTI13GradeSender, '_set_access_token_header', autospec=True, side_effect=set_token) as mock_token:
+        with patch.object(
+            LTI13GradeSender, '_get_lineitems_from_url', autospec=True, side_effect=get_lineitems
+        ) as mock_lineitems:
+            with patch.object(LTI13GradeSender, 'send_grades', new_callable=AsyncMock):
+                senders = sut._create_senders(['lab1', 'lab2'], mock_gradebook)
+                await sut._share_lms_session(senders)
+    assert mock_token.call_count == 1
+    assert mock_lineitems.call_count == 1
+    assert mock_gradebook.check_course.call_count == 1
+    assert all(sender.headers['Authorization'] == 'Bearer token' for sender in senders)
+    assert all(sender.all_lineitems is lineitems for sender in senders)
+
+
+def test_create_grades_sender_returns_the_course_sender_for_all_the_assignments():
+    """
+    Do the outbox jobs registered for all the assignments use the course sender?
+    """
+    assert isinstance(create_grades_sender(LTI11, 'course1', ALL_ASSIGNMENTS), CourseGradesSender)
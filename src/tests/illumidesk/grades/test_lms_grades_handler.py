@@ -1,5 +1,8 @@
+import asyncio
+import json
 import pytest
 
+from tornado.web import HTTPError
 from tornado.web import RequestHandler
 
 from unittest.mock import AsyncMock
@@ -8,8 +11,25 @@ from unittest.mock import patch
 
 from illumidesk.authenticators.authenticator import LTI11Authenticator
 from illumidesk.authenticators.authenticator import LTI13Authenticator
-from illumidesk.grades.senders import LTIGradeSender
+from illumidesk.grades.course_sender import ALL_ASSIGNMENTS
+from illumidesk.grades.exceptions import GradesSenderCriticalError
+from illumidesk.grades.handlers import GradesOutboxStatusHandler
+from illumidesk.grades.handlers import SendCourseGradesHandler
 from illumidesk.grades.handlers import SendGradesHandler
+from illumidesk.grades.handlers import StreamGradesHandler
+from illumidesk.grades.senders import LTIGradeSender
+from illumidesk.grades.outbox import GradesOutboxDispatcher
+from illumidesk.grades.outbox import LTI11
+from illumidesk.grades.outbox import LTI13
+from illumidesk.grades.outbox import STATUS_DONE
+from illumidesk.grades.outbox import STATUS_LEASED
+from illumidesk.grades.outbox import STATUS_PENDING
+
+
+@pytest.fixture()
+def mock_dispatcher():
+    with patch.object(GradesOutboxDispatcher, 'instance') as mock_instance:
+        yield mock_instance.return_value
 
 
 @pytest.fixture()
@@ -41,25 +61,44 @@ def send_grades_handler_lti13(make_mock_request_handler):
     return send_grades_handler
 
 
-@pytest.mark.asyncio
-@patch('tornado.web.RequestHandler.write')
-async def test_SendGradesHandler_calls_authenticator_class_property(
-    mock_write, send_grades_handler_lti13, send_grades_handler_lti11
-):
-    """
-    Does the SendGradesHandler uses authenticator_class property to get what authenticator was set?
-    """
-    with patch('illumidesk.grades.handlers.LTI13GradeSender') as mock_sender:
-        instance = mock_sender.return_value
-        instance.send_grades = AsyncMock()
-        await send_grades_handler_lti13.post('course_example', 'assignment_test')
-        assert mock_sender.called
+@pytest.fixture()
+def send_course_grades_handler(make_mock_request_handler):
+    def _make(body=b'', admin=False, groups=('formgrade-course_example',)):
+        handler = make_user_handler(
+            make_mock_request_handler, SendCourseGradesHandler, LTI13Authenticator, admin, groups
+        )
+        handler.request.body = body
+        return handler
+
+    return _make
+
+
+def make_user_handler(make_mock_request_handler, handler_class, authenticator, admin=False, groups=()):
+    request_handler = make_mock_request_handler(RequestHandler, authenticator=authenticator)
+    handler = handler_class(request_handler.application, request_handler.request)
+    user = Mock(admin=admin, groups=[Mock() for _ in groups])
+    for group, name in zip(user.groups, groups):
+        group.name = name
+    setattr(handler, '_jupyterhub_user', user)
+    return handler
+
 
-        with patch('illumidesk.grades.handlers.LTIGradeSender') as mocklti11_sender:
-            instance = mocklti11_sender.return_value
-            instance.send_grades = AsyncMock()
-            await send_grades_handler_lti11.post('course_example', 'assignment_test')
-            mocklti11_sender.called
+@pytest.fixture()
+def make_status_handler(make_mock_request_handler):
+    def _make(admin=False, groups=()):
+        return make_user_handler(
+            make_mock_request_handler, GradesOutboxStatusHandler, LTI13Authenticator, admin, groups
+        )
+
+    return _make
+
+
+@pytest.fixture()
+def make_stream_handler(make_mock_request_handler):
+    def _make(admin=False, groups=()):
+        return make_user_handler(make_mock_request_handler, StreamGradesHandler, LTI11Authenticator, admin, groups)
+
+    return _make
 
 
 @pytest.mark.asyncio
@@ -76,40 +115,304 @@ async def test_SendGradesHandler_authenticator_class_gets_its_value_from_setting
 
 @pytest.mark.asyncio
 @patch('tornado.web.RequestHandler.write')
-async def test_SendGradesHandler_creates_a_LTIGradeSender_instance_when_LTI11Authenticator_was_set(
-    mock_write, send_grades_handler_lti11
+async def test_SendGradesHandler_enqueues_a_lti11_job_when_LTI11Authenticator_was_set(
+    mock_write, send_grades_handler_lti11, grades_outbox, mock_dispatcher
 ):
     """
-    Does the SendGradesHandler create a LTIGradeSender instance for lti11?
+    Does the SendGradesHandler register a job with the LTI 1.1 version for lti11?
     """
-    with patch.object(LTIGradeSender, 'send_grades', return_value=None) as mock_lti_grades_sender:
-        await send_grades_handler_lti11.post('course_example', 'assignment_test')
-        assert mock_lti_grades_sender.called
+    await send_grades_handler_lti11.post('course_example', 'assignment_test')
+    job = grades_outbox.lease('test-owner')
+    assert job['lti_version'] == LTI11
+    assert job['course_id'] == 'course_example'
+    assert job['assignment_name'] == 'assignment_test'
 
 
 @pytest.mark.asyncio
 @patch('tornado.web.RequestHandler.write')
-async def test_SendGradesHandler_creates_a_LTI13GradeSender_instance_when_LTI13Authenticator_was_set(
-    mock_write, send_grades_handler_lti13
+async def test_SendGradesHandler_enqueues_a_lti13_job_when_LTI13Authenticator_was_set(
+    mock_write, send_grades_handler_lti13, grades_outbox, mock_dispatcher
 ):
     """
-    Does the SendGradesHandler create a LTI13GradeSender instance for lti13?
+    Does the SendGradesHandler register a job with the LTI 1.3 version for lti13?
     """
-    with patch('illumidesk.grades.handlers.LTI13GradeSender') as mock_sender:
-        instance = mock_sender.return_value
-        instance.send_grades = AsyncMock()
-        await send_grades_handler_lti13.post('course_example', 'assignment_test')
-        assert mock_sender.called
+    await send_grades_handler_lti13.post('course_example', 'assignment_test')
+    job = grades_outbox.lease('test-owner')
+    assert job['lti_version'] == LTI13
+    assert job['options'] == {'force': False}
+
+
+@pytest.mark.asyncio
+@patch('tornado.web.RequestHandler.write')
+async def test_SendGradesHandler_starts_and_notifies_the_dispatcher(
+    mock_write, send_grades_handler_lti13, grades_outbox, mock_dispatcher
+):
+    """
+    Does the SendGradesHandler make sure the dispatcher is running and notify it?
+    """
+    await send_grades_handler_lti13.post('course_example', 'assignment_test')
+    assert mock_dispatcher.start.called
+    assert mock_dispatcher.notify.called
 
 
 @pytest.mark.asyncio
 @patch('tornado.web.RequestHandler.write')
-async def test_SendGradesHandler_calls_write_method(mock_write, send_grades_handler_lti13):
+async def test_SendGradesHandler_returns_the_job_id_without_sending_grades(
+    mock_write, send_grades_handler_lti13, grades_outbox, mock_dispatcher
+):
     """
-    Does the SendGradesHandler call write base method?
+    Does the SendGradesHandler return immediately with the job id?
     """
-    with patch('illumidesk.grades.handlers.LTI13GradeSender') as mock_sender:
-        instance = mock_sender.return_value
-        instance.send_grades = AsyncMock()
+    with patch('illumidesk.grades.senders.LTI13GradeSender.send_grades') as mock_send_grades:
         await send_grades_handler_lti13.post('course_example', 'assignment_test')
-        assert mock_write.called
+        assert not mock_send_grades.called
+    assert send_grades_handler_lti13.get_status() == 202
+    assert json.loads(mock_write.call_args[0][0]) == {'success': True, 'job_id': 1}
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('arguments', [{'force': [b'true']}, {'mode': [b'reconcile']}])
+async def test_SendGradesHandler_raises_403_for_the_course_options_without_an_instructor(
+    arguments, make_mock_request_handler, grades_outbox, mock_dispatcher
+):
+    """
+    Are the forced and reconcile submissions rejected for the users that are not instructors of the course?
+    """
+    handler = make_user_handler(make_mock_request_handler, SendGradesHandler, LTI13Authenticator, groups=['other'])
+    handler.request.arguments = arguments
+    with pytest.raises(HTTPError) as excinfo:
+        await handler.post('course_example', 'assignment_test')
+    assert excinfo.value.status_code == 403
+    assert grades_outbox.lease('test-owner') is None
+
+
+@pytest.mark.asyncio
+@patch('tornado.web.RequestHandler.write')
+async def test_SendGradesHandler_accepts_the_force_option_from_an_instructor(
+    mock_write, make_mock_request_handler, grades_outbox, mock_dispatcher
+):
+    """
+    Is a forced submission registered for an instructor of the course?
+    """
+    handler = make_user_handler(
+        make_mock_request_handler, SendGradesHandler, LTI13Authenticator, groups=['formgrade-course_example']
+    )
+    handler.request.arguments = {'force': [b'true']}
+    await handler.post('course_example', 'assignment_test')
+    assert grades_outbox.lease('test-owner')['options'] == {'force': True}
+
+
+@pytest.mark.asyncio
+async def test_SendCourseGradesHandler_raises_403_for_a_user_that_is_not_an_instructor(
+    send_course_grades_handler, grades_outbox, mock_dispatcher
+):
+    """
+    Is the course publication rejected for the users that are not instructors of the course?
+    """
+    handler = send_course_grades_handler(groups=['formgrade-other_course'])
+    with pytest.raises(HTTPError) as excinfo:
+        await handler.post('course_example')
+    assert excinfo.value.status_code == 403
+    assert grades_outbox.lease('test-owner') is None
+
+
+@pytest.mark.asyncio
+@patch('tornado.web.RequestHandler.write')
+async def test_SendCourseGradesHandler_enqueues_a_job_for_all_the_assignments(
+    mock_write, send_course_grades_handler, grades_outbox, mock_dispatcher
+):
+    """
+    Does the SendCourseGradesHandler register a single job for all the course's assignments?
+    """
+    handler = send_course_grades_handler()
+    await handler.post('course_example')
+    job = grades_outbox.lease('test-owner')
+    assert job['assignment_name'] == ALL_ASSIGNMENTS
+    assert job['options'] == {'force': False, 'assignments': None}
+    assert handler.get_status() == 202
+
+
+@pytest.mark.asyncio
+@patch('tornado.web.RequestHandler.write')
+async def test_SendCourseGradesHandler_enqueues_the_selected_assignments(
+    mock_write, send_course_grades_handler, grades_outbox, mock_dispatcher
+):
+    """
+    Does the SendCourseGradesHandler pass the selected assignments and the force flag to the job?
+    """
+    handler = send_course_grades_handler(json.dumps({'assignments': ['lab1', 'lab2'], 'force': True}).encode())
+    await handler.post('course_example')
+    job = grades_outbox.lease('test-owner')
+    assert job['options'] == {'force': True, 'assignments': ['lab1', 'lab2']}
+
+
+@pytest.mark.asyncio
+async def test_SendCourseGradesHandler_raises_400_with_an_invalid_body(
+    send_course_grades_handler, grades_outbox, mock_dispatcher
+):
+    """
+    Does the SendCourseGradesHandler reject an assignments value that is not a list?
+    """
+    handler = send_course_grades_handler(json.dumps({'assignments': 'lab1'}).encode())
+    with pytest.raises(HTTPError):
+        await handler.post('course_example')
+
+
+@pytest.mark.asyncio
+@patch('tornado.web.RequestHandler.flush', new_callable=AsyncMock)
+@patch('tornado.web.RequestHandler.write')
+async def test_StreamGradesHandler_writes_the_progress_events_as_json_lines(
+    mock_write, mock_flush, make_stream_handler, grades_outbox
+):
+    """
+    Does the StreamGradesHandler write and flush every progress event and the final result?
+    """
+    handler = make_stream_handler(groups=['formgrade-course_example'])
+
+    async def send_grades(self, force=False):
+        self.progress.start(total=2)
+        self.progress.score_sent('user1')
+        await asyncio.sleep(0)
+        self.progress.score_failed('user2', 'error')
+        self.progress.finish()
+
+    with patch.object(LTIGradeSender, 'send_grades', autospec=True, side_effect=send_grades):
+        await handler.post('course_example', 'assignment_test')
+    lines = [call[0][0] for call in mock_write.call_args_list]
+    assert all(line.endswith('\n') for line in lines)
+    events = [json.loads(line) for line in lines]
+    assert [event['event'] for event in events] == ['start', 'score', 'score', 'done', 'result']
+    assert events[-2]['sent'] == 1 and events[-2]['failed'] == 1
+    assert mock_flush.call_count == len(lines)
+    assert handler._headers['Content-Type'] == 'application/x-ndjson'
+    assert grades_outbox.get_job(events[-1]['job_id'])['status'] == STATUS_DONE
+
+
+@pytest.mark.asyncio
+@patch('tornado.web.RequestHandler.flush', new_callable=AsyncMock)
+@patch('tornado.web.RequestHandler.write')
+async def test_StreamGradesHandler_writes_an_error_event_when_the_sender_fails(
+    mock_write, mock_flush, make_stream_handler, grades_outbox
+):
+    """
+    Does the StreamGradesHandler finish the stream with an error event and leave the job to be retried?
+    """
+    handler = make_stream_handler(admin=True)
+    with patch.object(
+        LTIGradeSender, 'send_grades', new_callable=AsyncMock, side_effect=GradesSenderCriticalError('LMS error')
+    ):
+        await handler.post('course_example', 'assignment_test')
+    last_event = json.loads(mock_write.call_args[0][0])
+    assert last_event['event'] == 'error'
+    assert last_event['success'] is False
+    assert grades_outbox.get_job(last_event['job_id'])['status'] == STATUS_PENDING
+
+
+@pytest.mark.asyncio
+@patch('tornado.web.RequestHandler.flush', new_callable=AsyncMock)
+@patch('tornado.web.RequestHandler.write')
+async def test_StreamGradesHandler_leaves_the_job_to_its_new_owner_when_the_lease_is_lost(
+    mock_write, mock_flush, make_stream_handler, grades_outbox
+):
+    """
+    Does the StreamGradesHandler finish the stream with an error event without acknowledging the job when
+    another hub leased it?
+    """
+    handler = make_stream_handler(admin=True)
+
+    async def send_grades(self, force=False):
+        await asyncio.sleep(10)
+
+    # the heartbeat ends when the lease is lost
+    with patch.object(LTIGradeSender, 'send_grades', autospec=True, side_effect=send_grades), patch(
+        'illumidesk.grades.outbox.keep_lease', new_callable=AsyncMock
+    ):
+        await handler.post('course_example', 'assignment_test')
+    last_event = json.loads(mock_write.call_args[0][0])
+    assert last_event['event'] == 'error'
+    assert 'lease' in last_event['error']
+    assert grades_outbox.get_job(last_event['job_id'])['status'] == STATUS_LEASED
+
+
+@pytest.mark.asyncio
+@patch('tornado.web.RequestHandler.write')
+async def test_GradesOutboxStatusHandler_returns_the_jobs_of_the_course_to_its_instructors(
+    mock_write, make_status_handler, grades_outbox
+):
+    """
+    Can an instructor (a member of the formgrade-<course_id> group) read the jobs of the course?
+    """
+    job_id = grades_outbox.enqueue('course1', 'lab1', LTI13)
+    await make_status_handler(groups=['formgrade-course1']).get(str(job_id))
+    assert json.loads(mock_write.call_args[0][0])['id'] == job_id
+
+
+@pytest.mark.asyncio
+@patch('tornado.web.RequestHandler.write')
+async def test_GradesOutboxStatusHandler_raises_403_for_the_users_of_other_courses(
+    mock_write, make_status_handler, grades_outbox, mock_dispatcher
+):
+    """
+    Are the jobs and the summary of a course hidden from the students and the instructors of other courses?
+    """
+    job_id = grades_outbox.enqueue('course1', 'lab1', LTI13)
+    for groups in (['nbgrader-course1'], ['formgrade-course2']):
+        handler = make_status_handler(groups=groups)
+        with pytest.raises(HTTPError) as e:
+            await handler.get(str(job_id))
+        assert e.value.status_code == 403
+        with pytest.raises(HTTPError) as e:
+            await handler.post(str(job_id))
+        assert e.value.status_code == 403
+    # only the admins read the summary of all the courses
+    with pytest.raises(HTTPError) as e:
+        handler = make_status_handler(groups=['formgrade-course1'])
+        handler.request.arguments = {}
+        await handler.get()
+    assert e.value.status_code == 403
+    mock_dispatcher.start.assert_not_called()
+
+
+@pytest.mark.asyncio
+@patch('tornado.web.RequestHandler.write')
+async def test_GradesOutboxStatusHandler_returns_the_summary_to_the_admins(
+    mock_write, make_status_handler, grades_outbox
+):
+    """
+    Can an admin read the summary of all the courses?
+    """
+    grades_outbox.enqueue('course1', 'lab1', LTI13)
+    grades_outbox.enqueue('course2', 'lab1', LTI13)
+    handler = make_status_handler(admin=True)
+    handler.request.arguments = {}
+    await handler.get()
+    assert json.loads(mock_write.call_args[0][0])['counts']['pending'] == 2
+
+
+@pytest.mark.asyncio
+async def test_StreamGradesHandler_raises_403_for_the_students(make_stream_handler, grades_outbox):
+    """
+    Are the grades of a course only streamed to the admins and the course's instructors?
+    """
+    handler = make_stream_handler(groups=['nbgrader-course_example'])
+    with pytest.raises(HTTPError) as e:
+        await handler.post('course_example', 'assignment_test')
+    assert e.value.status_code == 403
+    assert grades_outbox.status()['counts'][STATUS_PENDING] == 0
+
+
+@pytest.mark.asyncio
+async def test_StreamGradesHandler_raises_409_while_the_assignment_is_sent_by_a_job(
+    make_stream_handler, grades_outbox
+):
+    """
+    Is the streamed submission refused while the dispatcher sends the grades of the same assignment?
+    """
+    grades_outbox.enqueue('course_example', 'assignment_test', LTI11)
+    grades_outbox.lease('dispatcher')
+    handler = make_stream_handler(admin=True)
+    with patch.object(LTIGradeSender, 'send_grades', new_callable=AsyncMock) as mock_send_grades:
+        with pytest.raises(HTTPError) as e:
+            await handler.post('course_example', 'assignment_test')
+    assert e.value.status_code == 409
+    mock_send_grades.assert_not_called()
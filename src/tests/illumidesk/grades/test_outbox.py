@@ -0,0 +1,273 @@
+import asyncio
+import pytest
+
+from datetime import datetime
+from datetime import timedelta
+
+from sqlalchemy.exc import OperationalError
+
+from unittest.mock import AsyncMock
+from unittest.mock import patch
+
+from illumidesk.grades.exceptions import GradesSenderCriticalError
+from illumidesk.grades.exceptions import GradesSenderMissingInfoError
+from illumidesk.grades.outbox import ALL_ASSIGNMENTS
+from illumidesk.grades.outbox import GradesOutboxDispatcher
+from illumidesk.grades.outbox import GradesOutboxJob
+from illumidesk.grades.outbox import LTI11
+from illumidesk.grades.outbox import LTI13
+from illumidesk.grades.outbox import STATUS_DONE
+from illumidesk.grades.outbox import STATUS_FAILED
+from illumidesk.grades.outbox import STATUS_LEASED
+from illumidesk.grades.outbox import STATUS_PENDING
+from illumidesk.grades.outbox import keep_lease
+from illumidesk.grades.outbox import start_grades_dispatcher
+
+
+def expire_lease(grades_outbox, job_id):
+    session = grades_outbox.Session()
+    session.query(GradesOutboxJob).filter_by(id=job_id).update(
+        {'lease_expires_at': datetime.utcnow() - timedelta(seconds=1)}
+    )
+    session.commit()
+    session.close()
+
+
+class TestGradesOutbox:
+    def test_enqueue_returns_the_same_job_for_a_pending_submission(self, grades_outbox):
+        """
+        Does the outbox avoid duplicated jobs when the same submission is already pending?
+        """
+        job_id = grades_outbox.enqueue('course1', 'lab1', LTI13, force=False)
+        assert grades_outbox.enqueue('course1', 'lab1', LTI13, force=False) == job_id
+        assert grades_outbox.enqueue('course1', 'lab1', LTI13, force=True) != job_id
+
+    def test_lease_returns_none_when_the_outbox_is_empty(self, grades_outbox):
+        """
+        Does the lease method return None without jobs?
+        """
+        assert grades_outbox.lease('owner') is None
+
+    def test_leased_job_is_not_leased_twice(self, grades_outbox):
+        """
+        Is a leased job hidden from other dispatchers?
+        """
+        grades_outbox.enqueue('course1', 'lab1', LTI11)
+        assert grades_outbox.lease('owner1') is not None
+        assert grades_outbox.lease('owner2') is None
+
+    def test_job_with_an_expired_lease_is_leased_again(self, grades_outbox):
+        """
+        Is a job leased by a crashed hub processed again after its lease expired?
+        """
+        job_id = grades_outbox.enqueue('course1', 'lab1', LTI11)
+        grades_outbox.lease('crashed-hub')
+        expire_lease(grades_outbox, job_id)
+        job = grades_outbox.lease('new-hub')
+        assert job['id'] == job_id
+        assert job['attempts'] == 2
+
+    def test_job_with_an_expired_lease_fails_after_max_attempts(self, grades_outbox):
+        """
+        Is a job whose leases expired max_attempts times moved to the failed jobs instead of leased again?
+        """
+        job_id = grades_outbox.enqueue('course1', 'lab1', LTI11)
+        for owner in ('crashed-hub1', 'crashed-hub2'):
+            grades_outbox.lease(owner)
+            expire_lease(grades_outbox, job_id)
+        assert grades_outbox.lease('new-hub') is None
+        job = grades_outbox.get_job(job_id)
+        assert job['status'] == STATUS_FAILED
+        assert job['attempts'] == 2
+
+    def test_jobs_of_an_assignment_being_sent_are_not_leased(self, grades_outbox):
+        """
+        Does the dispatcher skip the jobs of an assignment (or course) whose grades are sent by a leased job?
+        """
+        streamed = grades_outbox.enqueue_leased('course1', 'lab1', LTI13, 'stream-owner', force=False)
+        assert grades_outbox.enqueue_leased('course1', ALL_ASSIGNMENTS, LTI13, 'other-stream') is None
+        grades_outbox.enqueue('course1', 'lab1', LTI13)
+        grades_outbox.enqueue('course1', ALL_ASSIGNMENTS, LTI13)
+        lab2_job_id = grades_outbox.enqueue('course1', 'lab2', LTI13)
+        assert grades_outbox.lease('dispatcher')['id'] == lab2_job_id
+        assert grades_outbox.lease('dispatcher') is None
+        grades_outbox.ack(streamed['id'], 'stream-owner')
+        grades_outbox.ack(lab2_job_id, 'dispatcher')
+        assert grades_outbox.lease('dispatcher')['assignment_name'] == 'lab1'
+
+    def test_ack_marks_the_job_as_done(self, grades_outbox):
+        """
+        Does the ack method mark the job as done?
+        """
+        job_id = grades_outbox.enqueue('course1', 'lab1', LTI11)
+        grades_outbox.lease('owner')
+        assert grades_outbox.ack(job_id, 'owner') is True
+        assert grades_outbox.get_job(job_id)['status'] == STATUS_DONE
+
+    def test_nack_moves_the_job_to_failed_jobs_after_max_attempts(self, grades_outbox):
+        """
+        Is a job moved to the failed jobs when it reached the maximum number of attempts?
+        """
+        job_id = grades_outbox.enqueue('course1', 'lab1', LTI11)
+        grades_outbox.lease('owner')
+        assert grades_outbox.nack(job_id, 'owner', 'timeout') == STATUS_PENDING
+        grades_outbox.lease('owner')
+        assert grades_outbox.nack(job_id, 'owner', 'timeout') == STATUS_FAILED
+        status = grades_outbox.status()
+        assert status['counts'][STATUS_FAILED] == 1
+        assert status['failed'][0]['last_error'] == 'timeout'
+
+    def test_nack_with_non_retriable_error_fails_the_job(self, grades_outbox):
+        """
+        Is a job with a non retriable error moved to the failed jobs immediately?
+        """
+        job_id = grades_outbox.enqueue('course1', 'lab1', LTI11)
+        grades_outbox.lease('owner')
+        assert grades_outbox.nack(job_id, 'owner', 'missing info', retriable=False) == STATUS_FAILED
+
+    def test_ack_and_nack_ignore_a_job_leased_by_another_owner(self, grades_outbox):
+        """
+        Is a job whose lease expired and was leased by another hub left to its new owner?
+        """
+        job_id = grades_outbox.enqueue('course1', 'lab1', LTI11)
+        grades_outbox.lease('stale-hub')
+        expire_lease(grades_outbox, job_id)
+        grades_outbox.lease('new-hub')
+        assert grades_outbox.ack(job_id, 'stale-hub') is False
+        assert grades_outbox.nack(job_id, 'stale-hub', 'timeout') is None
+        assert grades_outbox.renew(job_id, 'stale-hub') is False
+        job = grades_outbox.get_job(job_id)
+        assert job['status'] == STATUS_LEASED
+        assert job['last_error'] is None
+        assert grades_outbox.ack(job_id, 'new-hub') is True
+
+    def test_retry_moves_a_failed_job_to_pending_jobs(self, grades_outbox):
+        """
+        Does the retry method move a failed job back to the pending jobs?
+        """
+        job_id = grades_outbox.enqueue('course1', 'lab1', LTI11)
+        grades_outbox.lease('owner')
+        grades_outbox.nack(job_id, 'owner', 'missing info', retriable=False)
+        grades_outbox.retry(job_id)
+        assert grades_outbox.lease('owner')['id'] == job_id
+
+    def test_status_filters_by_course_id(self, grades_outbox):
+        """
+        Does the status method count only the jobs of the course?
+        """
+        grades_outbox.enqueue('course1', 'lab1', LTI11)
+        grades_outbox.enqueue('course2', 'lab1', LTI11)
+        assert grades_outbox.status(course_id='course1')['counts'][STATUS_PENDING] == 1
+
+
+class TestGradesOutboxDispatcher:
+    @pytest.mark.asyncio
+    async def test_process_next_sends_grades_and_acks_the_job(self, grades_outbox):
+        """
+        Does the dispatcher call the sender with the job options and acknowledge the job?
+        """
+        job_id = grades_outbox.enqueue('course1', 'lab1', LTI13, force=True)
+        dispatcher = GradesOutboxDispatcher(grades_outbox)
+        with patch('illumidesk.grades.outbox.create_grades_sender') as mock_create_sender:
+            mock_create_sender.return_value.send_grades = AsyncMock()
+            assert await dispatcher.process_next() is True
+            mock_create_sender.assert_called_with(LTI13, 'course1', 'lab1')
+            mock_create_sender.return_value.send_grades.assert_called_with(force=True)
+        assert grades_outbox.get_job(job_id)['status'] == STATUS_DONE
+
+    @pytest.mark.asyncio
+    async def test_process_next_returns_false_without_jobs(self, grades_outbox):
+        """
+        Does the dispatcher report when there is nothing to process?
+        """
+        assert await GradesOutboxDispatcher(grades_outbox).process_next() is False
+
+    @pytest.mark.asyncio
+    async def test_process_next_retries_jobs_with_critical_errors(self, grades_outbox):
+        """
+        Is a job with a critical error kept in the outbox to be retried?
+        """
+        job_id = grades_outbox.enqueue('course1', 'lab1', LTI11)
+        dispatcher = GradesOutboxDispatcher(grades_outbox)
+        with patch('illumidesk.grades.outbox.create_grades_sender') as mock_create_sender:
+            mock_create_sender.return_value.send_grades = AsyncMock(side_effect=GradesSenderCriticalError)
+            await dispatcher.process_next()
+        assert grades_outbox.get_job(job_id)['status'] == STATUS_PENDING
+
+    @pytest.mark.asyncio
+    async def test_process_next_fails_jobs_with_missing_info(self, grades_outbox):
+        """
+        Is a job with missing information moved to the failed jobs?
+        """
+        job_id = grades_outbox.enqueue('course1', 'lab1', LTI11)
+        dispatcher = GradesOutboxDispatcher(grades_outbox)
+        with patch('illumidesk.grades.outbox.create_grades_sender') as mock_create_sender:
+            mock_create_sender.return_value.send_grades = AsyncMock(side_effect=GradesSenderMissingInfoError)
+            await dispatcher.process_next()
+        assert grades_outbox.get_job(job_id)['status'] == STATUS_FAILED
+
+    @pytest.mark.asyncio
+    async def test_process_next_stops_sending_when_the_lease_is_lost(self, grades_outbox):
+        """
+        Is the sending cancelled, and the job left to its new owner, when another hub leased the job?
+        """
+        job_id = grades_outbox.enqueue('course1', 'lab1', LTI11)
+        dispatcher = GradesOutboxDispatcher(grades_outbox, lease_seconds=0.03)
+        sending = asyncio.Event()
+
+        async def send_grades():
+            sending.set()
+            await asyncio.sleep(10)
+
+        async def lease_again():
+            await sending.wait()
+            expire_lease(grades_outbox, job_id)
+            grades_outbox.lease('new-hub')
+
+        with patch('illumidesk.grades.outbox.create_grades_sender') as mock_create_sender:
+            mock_create_sender.return_value.send_grades = send_grades
+            assert (await asyncio.gather(dispatcher.process_next(), lease_again()))[0] is True
+        job = grades_outbox.get_job(job_id)
+        assert job['status'] == STATUS_LEASED
+        assert job['attempts'] == 2
+
+    @pytest.mark.asyncio
+    async def test_keep_lease_retries_the_renewal_errors(self, grades_outbox):
+        """
+        Is the lease renewed again after a renewal error, and the heartbeat ended once the lease is lost?
+        """
+        job_id = grades_outbox.enqueue('course1', 'lab1', LTI11)
+        grades_outbox.lease('owner')
+        with patch.object(
+            grades_outbox, 'renew', side_effect=[OperationalError('update', {}, 'database is locked'), True, False]
+        ) as mock_renew:
+            await asyncio.wait_for(keep_lease(grades_outbox, job_id, 'owner', lease_seconds=0.03), timeout=1)
+        assert mock_renew.call_count == 3
+
+    @pytest.mark.asyncio
+    async def test_start_processes_the_pending_jobs(self, grades_outbox):
+        """
+        Does the dispatcher process the pending jobs in background once started?
+        """
+        job_id = grades_outbox.enqueue('course1', 'lab1', LTI11)
+        dispatcher = GradesOutboxDispatcher(grades_outbox, poll_interval=0.01)
+        with patch('illumidesk.grades.outbox.create_grades_sender') as mock_create_sender:
+            mock_create_sender.return_value.send_grades = AsyncMock()
+            dispatcher.start()
+            for _ in range(100):
+                if grades_outbox.get_job(job_id)['status'] == STATUS_DONE:
+                    break
+                await asyncio.sleep(0.01)
+            await dispatcher.stop()
+        assert grades_outbox.get_job(job_id)['status'] == STATUS_DONE
+
+    @pytest.mark.asyncio
+    async def test_start_grades_dispatcher_starts_the_shared_dispatcher_in_the_event_loop(self, grades_outbox):
+        """
+        Is the hub's dispatcher started once the event loop runs, without waiting for a new job?
+        """
+        start_grades_dispatcher()
+        await asyncio.sleep(0)
+        dispatcher = GradesOutboxDispatcher.instance()
+        assert dispatcher.running
+        await dispatcher.stop()
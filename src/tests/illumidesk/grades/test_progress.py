@@ -0,0 +1,52 @@
+from illumidesk.grades.progress import EVENT_DONE
+from illumidesk.grades.progress import EVENT_SCORE
+from illumidesk.grades.progress import EVENT_START
+from illumidesk.grades.progress import GradesSendProgress
+
+
+class TestGradesSendProgress:
+    def test_progress_emits_the_events_with_the_counters(self):
+        """
+        Do the listeners receive the start, score and done events with the current counters?
+        """
+        events = []
+        progress = GradesSendProgress('lab')
+        progress.add_listener(events.append)
+        progress.start(total=2, skipped=1)
+        progress.score_sent('user1')
+        progress.score_failed('user2', 'timeout')
+        progress.finish()
+        assert [event['event'] for event in events] == [EVENT_START, EVENT_SCORE, EVENT_SCORE, EVENT_DONE]
+        assert events[1]['lms_user_id'] == 'user1'
+        assert events[1]['status'] == 'sent'
+        assert events[2]['error'] == 'timeout'
+        assert events[-1]['total'] == 2
+        assert events[-1]['sent'] == 1
+        assert events[-1]['failed'] == 1
+        assert events[-1]['skipped'] == 1
+        assert events[-1]['assignment'] == 'lab'
+
+    def test_progress_ignores_errors_raised_by_listeners(self):
+        """
+        Does a broken listener not stop the submission nor the other listeners?
+        """
+        events = []
+
+        def broken_listener(event):
+            raise ValueError()
+
+        progress = GradesSendProgress('lab')
+        progress.add_listener(broken_listener)
+        progress.add_listener(events.append)
+        progress.start(total=1)
+        progress.score_sent('user1')
+        assert len(events) == 2
+
+    def test_progress_skipped_scores_are_counted(self):
+        """
+        Are the skipped scores included in the counters?
+        """
+        progress = GradesSendProgress('lab')
+        progress.start(total=1)
+        progress.score_skipped('user1', 'student not found')
+        assert progress.snapshot()['skipped'] == 1
@@ -0,0 +1,68 @@
+import asyncio
+import pytest
+
+from illumidesk.grades.ratelimit import LMSRateLimiter
+
+
+@pytest.fixture(autouse=True)
+def reset_limiters():
+    LMSRateLimiter._limiters = {}
+    yield
+    LMSRateLimiter._limiters = {}
+
+
+def test_for_url_returns_the_same_limiter_for_the_same_host():
+    """
+    Do the requests sent to the same LMS share the limiter?
+    """
+    first = LMSRateLimiter.for_url('https://canvas.example.com/api/lti/courses/1/line_items/1/scores')
+    second = LMSRateLimiter.for_url('https://canvas.example.com/api/lti/courses/2/line_items')
+    assert first is second
+
+
+def test_for_url_returns_different_limiters_for_different_hosts():
+    """
+    Does each LMS get its own limiter?
+    """
+    first = LMSRateLimiter.for_url('https://canvas.example.com/api/lti/courses/1/line_items')
+    second = LMSRateLimiter.for_url('https://moodle.example.com/mod/lti/services.php/2/lineitems')
+    assert first is not second
+
+
+@pytest.mark.asyncio
+async def test_limiter_keeps_the_number_of_requests_in_flight_below_the_max_concurrency():
+    """
+    Does the limiter allow only max_concurrency requests at the same time?
+    """
+    limiter = LMSRateLimiter(max_concurrency=2, max_per_second=1000)
+    in_flight = 0
+    max_in_flight = 0
+
+    async def request():
+        nonlocal in_flight, max_in_flight
+        async with limiter:
+            in_flight += 1
+            max_in_flight = max(max_in_flight, in_flight)
+            await asyncio.sleep(0.01)
+            in_flight -= 1
+
+    await asyncio.gather(*[request() for _ in range(6)])
+    assert max_in_flight == 2
+
+
+@pytest.mark.asyncio
+async def test_limiter_spaces_the_requests_with_the_max_per_second_rate():
+    """
+    Are the requests started at most max_per_second times per second?
+    """
+    limiter = LMSRateLimiter(max_concurrency=10, max_per_second=20)
+    loop = asyncio.get_event_loop()
+    started = []
+
+    async def request():
+        async with limiter:
+            started.append(loop.time())
+
+    await asyncio.gather(*[request() for _ in range(5)])
+    # 5 requests at 20 per second need at least 4 intervals of 50ms
+    assert started[-1] - started[0] >= 0.19
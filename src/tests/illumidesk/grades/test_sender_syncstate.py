@@ -0,0 +1,74 @@
+import json
+
+from pathlib import Path
+
+from illumidesk.grades.sender_syncstate import LTIGradesSenderSyncState
+
+
+class TestLTIGradesSenderSyncState:
+    def test_sync_state_is_empty_if_file_does_not_exist(self, tmp_path):
+        """
+        Does the LTIGradesSenderSyncState class start with an empty state when the file does not exist?
+        """
+        sync_state = LTIGradesSenderSyncState(tmp_path)
+        assert sync_state.state == {}
+        assert not Path(sync_state.config_fullname).exists()
+
+    def test_sync_state_ignores_a_file_with_wrong_format(self, tmp_path):
+        """
+        Does the LTIGradesSenderSyncState class ignore a broken file?
+        """
+        Path(tmp_path, LTIGradesSenderSyncState.FILE_NAME).write_text('{not-json')
+        sync_state = LTIGradesSenderSyncState(tmp_path)
+        assert sync_state.state == {}
+
+    def test_record_posted_saves_score_max_score_and_timestamp(self, tmp_path):
+        """
+        Does the record_posted method save the last posted values by assignment and lms_user_id?
+        """
+        sync_state = LTIGradesSenderSyncState(tmp_path)
+        sync_state.record_posted('lab1', [{'score': 8, 'lms_user_id': 'user1'}], 10)
+        with Path(sync_state.config_fullname).open('r') as file:
+            content = json.load(file)
+        assert content['lab1']['user1']['score'] == 8.0
+        assert content['lab1']['user1']['max_score'] == 10.0
+        assert 'timestamp' in content['lab1']['user1']
+
+    def test_record_posted_creates_the_course_dir_if_not_exists(self, tmp_path):
+        """
+        Does the record_posted method create the course directory?
+        """
+        sync_state = LTIGradesSenderSyncState(Path(tmp_path, 'my-course'))
+        sync_state.record_posted('lab1', [{'score': 8, 'lms_user_id': 'user1'}], 10)
+        assert Path(sync_state.config_fullname).exists()
+
+    def test_filter_changed_returns_only_new_or_changed_scores(self, tmp_path):
+        """
+        Does the filter_changed method skip the scores already posted with the same values?
+        """
+        sync_state = LTIGradesSenderSyncState(tmp_path)
+        sync_state.record_posted(
+            'lab1', [{'score': 8, 'lms_user_id': 'user1'}, {'score': 5, 'lms_user_id': 'user2'}], 10
+        )
+        grades = [
+            {'score': 8, 'lms_user_id': 'user1'},
+            {'score': 6, 'lms_user_id': 'user2'},
+            {'score': 9, 'lms_user_id': 'user3'},
+        ]
+        changed = sync_state.filter_changed('lab1', 10, grades)
+        assert [grade['lms_user_id'] for grade in changed] == ['user2', 'user3']
+
+    def test_filter_changed_returns_all_scores_when_max_score_changed(self, tmp_path):
+        """
+        Does the filter_changed method return the scores again when the maximum score changed?
+        """
+        sync_state = LTIGradesSenderSyncState(tmp_path)
+        sync_state.record_posted('lab1', [{'score': 8, 'lms_user_id': 'user1'}], 10)
+        assert len(sync_state.filter_changed('lab1', 20, [{'score': 8, 'lms_user_id': 'user1'}])) == 1
+
+    def test_sync_state_is_loaded_from_file(self, tmp_path):
+        """
+        Does a new instance read the values recorded by another instance?
+        """
+        LTIGradesSenderSyncState(tmp_path).record_posted('lab1', [{'score': 8, 'lms_user_id': 'user1'}], 10)
+        assert LTIGradesSenderSyncState(tmp_path).is_synced('lab1', 'user1', 8.0, 10.0)
@@ -1,14 +1,17 @@
 import pytest
 
+from unittest.mock import Mock
 from unittest.mock import patch
 
 from tornado.httputil import HTTPHeaders
 
 from illumidesk.grades.senders import LTIGradeSender
 from illumidesk.grades.senders import LTI13GradeSender
+from illumidesk.grades.senders import RESULT_CONTAINER_MEDIA_TYPE
 from illumidesk.grades.exceptions import AssignmentWithoutGradesError
 from illumidesk.grades.exceptions import GradesSenderMissingInfoError
 from illumidesk.grades.sender_controlfile import LTIGradesSenderControlFile
+from illumidesk.grades.sender_syncstate import LTIGradesSenderSyncState
 
 from tornado.httpclient import AsyncHTTPClient
 from tornado.web import RequestHandler
@@ -40,6 +43,36 @@ class TestLTI11GradesSender:
             with pytest.raises(GradesSenderMissingInfoError):
                 await sender_controlfile.send_grades()
 
+    @pytest.mark.asyncio
+    async def test_grades_sender_does_not_send_unchanged_scores(self, tmp_path):
+        """
+        Does the sender skip the scores that were already posted with the same values?
+        """
+        sender = LTIGradeSender('course1', 'problem1')
+        sync_state = LTIGradesSenderSyncState(tmp_path)
+        grades_nbgrader = [{'score': 10, 'lms_user_id': 'user1'}]
+        sync_state.record_posted('problem1', grades_nbgrader, 10)
+        with patch.object(LTIGradeSender, 'sync_state', sync_state):
+            with patch.object(LTIGradeSender, '_retrieve_grades_from_db', return_value=(10, grades_nbgrader)):
+                with patch.object(LTIGradesSenderControlFile, 'get_assignment_by_name') as mock_get_assignment:
+                    await sender.send_grades()
+                    assert not mock_get_assignment.called
+
+    @pytest.mark.asyncio
+    async def test_grades_sender_resends_unchanged_scores_with_force(self, tmp_path):
+        """
+        Does the sender process all the scores when a full resend is forced?
+        """
+        sender = LTIGradeSender('course1', 'problem1')
+        sync_state = LTIGradesSenderSyncState(tmp_path)
+        grades_nbgrader = [{'score': 10, 'lms_user_id': 'user1'}]
+        sync_state.record_posted('problem1', grades_nbgrader, 10)
+        with patch.object(LTIGradeSender, 'sync_state', sync_state):
+            with patch.object(LTIGradeSender, '_retrieve_grades_from_db', return_value=(10, grades_nbgrader)):
+                with patch.object(LTIGradesSenderControlFile, 'get_assignment_by_name', return_value=None):
+                    with pytest.raises(GradesSenderMissingInfoError):
+                        await sender.send_grades(force=True)
+
 
 class TestLTI13GradesSender:
     def test_sender_sets_lineitems_url_with_the_value_in_auth_state_dict(self, lti13_config_environ, mock_nbhelper):
@@ -157,3 +190,105 @@ class TestLTI13GradesSender:
             assert len(sut.all_lineitems) == 2
             # assert the number of calls
             assert mock_fetch.call_count == 2
+
+
+class TestLTI13GradesSenderReconciliation:
+    @pytest.fixture()
+    def sut(self, lti13_config_environ, tmp_path):
+        sender = LTI13GradeSender('course-id', 'lab', course=Mock(lms_lineitems_endpoint='https://lms/line_items'))
+        sender.headers = {'Authorization': 'Bearer token'}
+        with patch.object(LTI13GradeSender, 'sync_state', LTIGradesSenderSyncState(str(tmp_path))):
+            yield sender
+
+    @pytest.mark.asyncio
+    async def test_reconcile_posts_only_the_scores_that_differ_from_the_lms(self, sut):
+        """
+        Does the reconciliation post only the missing and different scores?
+        """
+        grades_nbgrader = [
+            {'score': 10, 'lms_user_id': 'user1'},
+            {'score': 8, 'lms_user_id': 'user2'},
+            {'score': 5, 'lms_user_id': 'user3'},
+        ]
+        lms_results = [
+            {'userId': 'user1', 'resultScore': 10, 'resultMaximum': 10},
+            {'userId': 'user2', 'resultScore': 4, 'resultMaximum': 10},
+            {'userId': 'user4', 'resultScore': 7, 'resultMaximum': 10},
+        ]
+        lineitem_info = {'id': 'https://lms/line_items/1', 'scoreMaximum': 10}
+        with patch.object(LTI13GradeSender, '_retrieve_grades_from_db', return_value=(10, grades_nbgrader)):
+            with patch.object(LTI13GradeSender, '_get_line_item_info_by_assignment_name', return_value=lineitem_info):
+                with patch.object(LTI13GradeSender, '_get_results', return_value=lms_results):
+                    with patch.object(LTI13GradeSender, '_post_score', return_value=True) as mock_post_score:
+                        report = await sut.send_grades(reconcile=True)
+        posted_users = sorted(call[0][1]['lms_user_id'] for call in mock_post_score.call_args_list)
+        assert posted_users == ['user2', 'user3']
+        assert report['in_sync'] == 1
+        assert report['missing_in_lms'] == ['user3']
+        assert report['differs'] == [{'lms_user_id': 'user2', 'score': 8, 'lms_score': 4.0}]
+        assert report['only_in_lms'] == [{'lms_user_id': 'user4', 'lms_score': 7.0}]
+        assert report['posted'] == 2
+        # the reconciled scores are recorded in the sync state
+        assert sut.sync_state.is_synced('lab', 'user1', 10, 10)
+        assert sut.sync_state.is_synced('lab', 'user2', 8, 10)
+
+    @pytest.mark.asyncio
+    async def test_reconcile_scales_the_lms_results_to_the_lineitem_maximum(self, sut):
+        """
+        Are the results expressed with a different maximum compared with the line item's maximum?
+        """
+        grades_nbgrader = [{'score': 5, 'lms_user_id': 'user1'}]
+        lms_results = [{'userId': 'user1', 'resultScore': 50, 'resultMaximum': 100}]
+        lineitem_info = {'id': 'https://lms/line_items/1', 'scoreMaximum': 10}
+        with patch.object(LTI13GradeSender, '_retrieve_grades_from_db', return_value=(10, grades_nbgrader)):
+            with patch.object(LTI13GradeSender, '_get_line_item_info_by_assignment_name', return_value=lineitem_info):
+                with patch.object(LTI13GradeSender, '_get_results', return_value=lms_results):
+                    with patch.object(LTI13GradeSender, '_post_score', return_value=True) as mock_post_score:
+                        report = await sut.send_grades(reconcile=True)
+        assert not mock_post_score.called
+        assert report['in_sync'] == 1
+
+    @pytest.mark.asyncio
+    async def test_get_results_fetches_the_numbered_pages_concurrently(
+        self, sut, make_http_response, make_mock_request_handler
+    ):
+        """
+        Are all the result pages fetched when the LMS announces the last page?
+        """
+        local_handler = make_mock_request_handler(RequestHandler)
+        first_page_headers = HTTPHeaders(
+            {
+                'content-type': RESULT_CONTAINER_MEDIA_TYPE,
+                'link': '<https://lms/line_items/1/results?page=2&per_page=1>; rel="next", '
+                '<https://lms/line_items/1/results?page=3&per_page=1>; rel="last"',
+            }
+        )
+        with patch.object(
+            AsyncHTTPClient,
+            'fetch',
+            side_effect=[
+                make_http_response(handler=local_handler.request, headers=first_page_headers, body=[{'userId': 'a'}]),
+                make_http_response(handler=local_handler.request, body=[{'userId': 'b'}]),
+                make_http_response(handler=local_handler.request, body=[{'userId': 'c'}]),
+            ],
+        ) as mock_fetch:
+            results = await sut._get_results('https://lms/line_items/1')
+        assert sorted(result['userId'] for result in results) == ['a', 'b', 'c']
+        fetched_urls = [call[0][0] for call in mock_fetch.call_args_list]
+        assert fetched_urls[0] == 'https://lms/line_items/1/results'
+        assert 'page=2' in fetched_urls[1] and 'page=3' in fetched_urls[2]
+
+    def test_build_results_url_keeps_the_query_string(self):
+        """
+        Is the results path added before the line item's query string?
+        """
+        url = LTI13GradeSender._build_results_url('https://lms/mod/lti/services.php/2/lineitems/1/lineitem?type_id=1')
+        assert url == 'https://lms/mod/lti/services.php/2/lineitems/1/lineitem/results?type_id=1'
+
+    def test_build_page_urls_returns_an_empty_list_without_numbered_pages(self):
+        """
+        Are the next links followed when the pages can't be predicted?
+        """
+        links = LTI13GradeSender._parse_link_header('<https://lms/results?cursor=abc>; rel="next"')
+        assert links == {'next': 'https://lms/results?cursor=abc'}
+        assert LTI13GradeSender._build_page_urls(links) == []
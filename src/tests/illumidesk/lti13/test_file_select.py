@@ -0,0 +1,50 @@
+import json
+
+from illumidesk.lti13.handlers import build_file_select_items
+
+
+def test_build_file_select_items_returns_the_notebooks_sorted_by_path(tmp_path):
+    """
+    Does the file select catalog include the notebooks found recursively in the shared folder sorted by path?
+    """
+    course_shared_folder = tmp_path / 'intro101'
+    (course_shared_folder / 'week2').mkdir(parents=True)
+    (course_shared_folder / 'week1').mkdir()
+    (course_shared_folder / 'week2' / 'lab.ipynb').touch()
+    (course_shared_folder / 'week1' / 'lab.ipynb').touch()
+    (course_shared_folder / 'week1' / 'notes.md').touch()
+
+    items = build_file_select_items(course_shared_folder, 'intro101', 'hub.example.com')
+
+    assert [item['path'] for item in items] == ['week1/lab.ipynb', 'week2/lab.ipynb']
+
+
+def test_build_file_select_items_ignores_hidden_notebooks(tmp_path):
+    """
+    Are the hidden notebooks and the notebooks in hidden folders excluded from the file select catalog?
+    """
+    course_shared_folder = tmp_path / 'intro101'
+    (course_shared_folder / '.ipynb_checkpoints').mkdir(parents=True)
+    (course_shared_folder / '.ipynb_checkpoints' / 'lab-checkpoint.ipynb').touch()
+    (course_shared_folder / '.hidden.ipynb').touch()
+    (course_shared_folder / 'lab.ipynb').touch()
+
+    items = build_file_select_items(course_shared_folder, 'intro101', 'hub.example.com')
+
+    assert [item['path'] for item in items] == ['lab.ipynb']
+
+
+def test_build_file_select_items_links_the_notebook_with_gitpuller(tmp_path):
+    """
+    Does the content item of a notebook point to the gitpuller link of the notebook in the course repo?
+    """
+    course_shared_folder = tmp_path / 'intro101'
+    course_shared_folder.mkdir()
+    (course_shared_folder / 'lab.ipynb').touch()
+
+    items = build_file_select_items(course_shared_folder, 'intro101', 'hub.example.com')
+
+    link_item = json.loads(items[0]['content_items'])['@graph'][0]
+    assert link_item['title'] == 'lab.ipynb'
+    assert link_item['url'].startswith('https://hub.example.com/?next=%2Fuser-redirect%2Fgit-pull?')
+    assert 'tree%252Fintro101%252Flab.ipynb' in link_item['url']
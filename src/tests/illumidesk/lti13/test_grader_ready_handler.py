@@ -0,0 +1,62 @@
+import json
+import pytest
+
+from illumidesk.apis.setup_course_service import get_grader_ready
+from illumidesk.lti13.handlers import GraderReadyHandler
+
+from tornado.httpclient import HTTPClientError
+from tornado.web import HTTPError
+from tornado.web import RequestHandler
+
+from unittest.mock import AsyncMock
+from unittest.mock import Mock
+from unittest.mock import patch
+
+
+@pytest.fixture
+def grader_ready_handler(monkeypatch, make_mock_request_handler):
+    monkeypatch.setenv('ORGANIZATION_NAME', 'test-org')
+    handler = make_mock_request_handler(
+        RequestHandler, uri='https://hub.example.com/hub/graders/intro101/ready?wait=60'
+    )
+    return GraderReadyHandler(handler.application, handler.request)
+
+
+@pytest.mark.asyncio
+async def test_grader_ready_handler_waits_for_the_grader_up_to_the_max_wait(grader_ready_handler):
+    """
+    Does the handler ask the setup-course service for the grader readiness with the wait capped and write it?
+    """
+    with patch(
+        'illumidesk.lti13.handlers.get_grader_ready', new_callable=AsyncMock, return_value=True
+    ) as mock_get_grader_ready, patch.object(GraderReadyHandler, 'write') as mock_write:
+        await GraderReadyHandler.get.__wrapped__(grader_ready_handler, 'intro101')
+
+    mock_get_grader_ready.assert_called_once_with('test-org', 'intro101', GraderReadyHandler.max_wait)
+    mock_write.assert_called_once_with({'ready': True})
+
+
+@pytest.mark.asyncio
+async def test_grader_ready_handler_responds_404_without_grader_service(grader_ready_handler):
+    """
+    Is a 404 returned for the services without a grader deployment (e.g. the announcement service)?
+    """
+    with patch('illumidesk.lti13.handlers.get_grader_ready', new_callable=AsyncMock, return_value=None):
+        with pytest.raises(HTTPError) as e:
+            await GraderReadyHandler.get.__wrapped__(grader_ready_handler, 'announcement')
+
+    assert e.value.status_code == 404
+
+
+@pytest.mark.asyncio
+async def test_get_grader_ready_returns_the_service_readiness():
+    """
+    Does get_grader_ready return the ready value sent by the service, and None when the course has no grader?
+    """
+    response = Mock(body=json.dumps({'success': True, 'ready': True}).encode())
+    with patch('tornado.httpclient.AsyncHTTPClient.fetch', new_callable=AsyncMock, return_value=response) as mock_fetch:
+        assert await get_grader_ready('test-org', 'intro101', wait=10) is True
+    assert mock_fetch.call_args.args[0].endswith('/services/test-org/intro101/ready?wait=10')
+
+    with patch('tornado.httpclient.AsyncHTTPClient.fetch', new_callable=AsyncMock, side_effect=HTTPClientError(404)):
+        assert await get_grader_ready('test-org', 'intro101') is None
@@ -0,0 +1,291 @@
+import asyncio
+import json
+import jwt
+import pytest
+import time
+
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+from tornado.web import HTTPError
+
+from unittest.mock import AsyncMock
+from unittest.mock import Mock
+from unittest.mock import patch
+
+from illumidesk.authenticators.authenticator import LTI13Authenticator
+from illumidesk.authenticators.validator import LTI13LaunchValidator
+from illumidesk.lti13 import registry
+from illumidesk.lti13.registry import PlatformRegistration
+from illumidesk.lti13.registry import PlatformRegistry
+
+
+CANVAS = {
+    'issuer': 'https://canvas.instructure.com',
+    'client_id': '125900000000000001',
+    'deployment_ids': ['1:deployment'],
+    'auth_login_url': 'https://canvas.example.com/api/lti/authorize_redirect',
+    'auth_token_url': 'https://canvas.example.com/login/oauth2/token',
+    'key_set_url': 'https://canvas.example.com/api/lti/security/jwks',
+    'private_key_path': '/secrets/keys/canvas.pem',
+}
+MOODLE = {
+    'issuer': 'https://moodle.example.com',
+    'client_id': 'moodle-client',
+    'auth_login_url': 'https://moodle.example.com/mod/lti/auth.php',
+    'auth_token_url': 'https://moodle.example.com/mod/lti/token.php',
+    'key_set_url': 'https://moodle.example.com/mod/lti/certs.php',
+    'private_key_path': '/secrets/keys/moodle.pem',
+}
+
+
+@pytest.fixture(scope='function')
+def platform_registry(tmp_path) -> PlatformRegistry:
+    registrations_file = tmp_path / 'registrations.json'
+    registrations_file.write_text(json.dumps([CANVAS, MOODLE]))
+    with patch.object(registry, 'LTI13_COURSE_REGISTRATIONS_FILE', str(tmp_path / 'courses.json')):
+        yield PlatformRegistry.load(str(registrations_file))
+
+
+def make_signing_key():
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048, backend=default_backend())
+    jwk = json.loads(jwt.algorithms.RSAAlgorithm.to_jwk(private_key.public_key()))
+    return private_key, dict(jwk, kid='key-1')
+
+
+def test_find_returns_the_registration_of_the_issuer_client_and_deployment(platform_registry):
+    """
+    Are the registrations found by issuer, client and deployment, and are the unregistered deployments rejected?
+    """
+    canvas = platform_registry.find(CANVAS['issuer'], CANVAS['client_id'], '1:deployment')
+    assert canvas.auth_token_url == CANVAS['auth_token_url']
+    # the login requests may not have the client_id
+    assert platform_registry.find(CANVAS['issuer']) is canvas
+    assert platform_registry.find(CANVAS['issuer'], CANVAS['client_id'], '2:deployment') is None
+    # any deployment is accepted for the registrations without deployment ids
+    assert platform_registry.find(MOODLE['issuer'], MOODLE['client_id'], '7').key_set_url == MOODLE['key_set_url']
+    assert platform_registry.find('https://other.lms.com', 'client') is None
+    assert len(platform_registry) == 2
+
+
+def test_find_for_claims_uses_the_azp_claim_with_multiple_audiences(platform_registry):
+    """
+    Is the registration of a launch found with its iss, aud (or azp) and deployment_id claims?
+    """
+    claims = {
+        'iss': CANVAS['issuer'],
+        'aud': [CANVAS['client_id'], 'another-audience'],
+        'azp': CANVAS['client_id'],
+        registry.DEPLOYMENT_ID_CLAIM: '1:deployment',
+    }
+    assert platform_registry.find_for_claims(claims).client_id == CANVAS['client_id']
+
+
+def test_course_registrations_are_kept_across_restarts(platform_registry, tmp_path):
+    """
+    Is the platform that launched a course found again by a new registry (after a hub restart)?
+    """
+    moodle = platform_registry.find(MOODLE['issuer'], MOODLE['client_id'])
+    platform_registry.register_course('intro101', moodle)
+
+    with patch.object(registry, 'LTI13_COURSE_REGISTRATIONS_FILE', str(tmp_path / 'courses.json')):
+        restarted = PlatformRegistry([PlatformRegistration(**CANVAS), PlatformRegistration(**MOODLE)])
+
+    assert restarted.for_course('intro101').issuer == MOODLE['issuer']
+    assert restarted.for_course('other-course') is None
+
+
+def test_course_registration_is_not_taken_over_by_another_platform(platform_registry, tmp_path):
+    """
+    Is a course kept with the platform that launched it first when another registered platform launches the
+    same course label?
+    """
+    canvas = platform_registry.find(CANVAS['issuer'], CANVAS['client_id'])
+    moodle = platform_registry.find(MOODLE['issuer'], MOODLE['client_id'])
+
+    assert platform_registry.register_course('intro101', canvas)
+    assert not platform_registry.register_course('intro101', moodle)
+    assert platform_registry.register_course('intro101', canvas)
+    assert platform_registry.for_course('intro101') is canvas
+
+    # the course moves when its platform is no longer registered
+    with patch.object(registry, 'LTI13_COURSE_REGISTRATIONS_FILE', str(tmp_path / 'courses.json')):
+        restarted = PlatformRegistry([PlatformRegistration(**MOODLE)])
+    assert restarted.register_course('intro101', restarted.find(MOODLE['issuer'], MOODLE['client_id']))
+    assert restarted.for_course('intro101').issuer == MOODLE['issuer']
+
+
+@pytest.mark.asyncio
+async def test_access_tokens_are_cached_by_platform_and_scope():
+    """
+    Is a single access token requested for concurrent requests of the same platform and scope?
+    """
+    canvas = PlatformRegistration(**CANVAS)
+    moodle = PlatformRegistration(**MOODLE)
+    token = {'access_token': 'token', 'token_type': 'Bearer', 'expires_in': 3600}
+
+    with patch.object(registry, 'get_lms_access_token', new_callable=AsyncMock, return_value=token) as mock_token:
+        await asyncio.gather(*[canvas.get_access_token() for _ in range(5)])
+        await canvas.get_access_token()
+        await canvas.get_access_token('https://purl.imsglobal.org/spec/lti-nrps/scope/contextmembership.readonly')
+        await moodle.get_access_token()
+
+    assert mock_token.await_count == 3
+    assert mock_token.call_args_list[0].args[0] == CANVAS['auth_token_url']
+
+
+@pytest.mark.asyncio
+async def test_key_set_is_cached_and_fetched_again_for_an_unknown_kid():
+    """
+    Is the platform's key set fetched once, and again when a token is signed with a rotated key?
+    """
+    canvas = PlatformRegistration(**CANVAS)
+    _, jwk = make_signing_key()
+    _, rotated_jwk = make_signing_key()
+    rotated_jwk['kid'] = 'key-2'
+    responses = [
+        Mock(body=json.dumps({'keys': [jwk]}).encode()),
+        Mock(body=json.dumps({'keys': [jwk, rotated_jwk]}).encode()),
+    ]
+
+    with patch(
+        'tornado.httpclient.AsyncHTTPClient.fetch', new_callable=AsyncMock, side_effect=responses
+    ) as mock_fetch:
+        await canvas.get_jwk('key-1')
+        await canvas.get_jwk('key-1')
+        # the platform rotated its keys after the refetch interval
+        canvas._jwks_fetched_at -= registry.JWKS_MIN_REFETCH_INTERVAL
+        await canvas.get_jwk('key-2')
+
+    assert mock_fetch.await_count == 2
+
+
+@pytest.mark.asyncio
+async def test_key_set_is_fetched_once_per_interval_for_unknown_kids():
+    """
+    Are the tokens with unknown kids rejected without fetching the key set again within the refetch interval?
+    """
+    canvas = PlatformRegistration(**CANVAS)
+    _, jwk = make_signing_key()
+    response = Mock(body=json.dumps({'keys': [jwk]}).encode())
+
+    with patch(
+        'tornado.httpclient.AsyncHTTPClient.fetch', new_callable=AsyncMock, return_value=response
+    ) as mock_fetch:
+        for kid in ('unknown-1', 'unknown-2', 'unknown-1'):
+            with pytest.raises(ValueError):
+                await canvas.get_jwk(kid)
+        assert mock_fetch.await_count == 1
+        canvas._jwks_fetched_at -= registry.JWKS_MIN_REFETCH_INTERVAL
+        with pytest.raises(ValueError):
+            await canvas.get_jwk('unknown-1')
+
+    assert mock_fetch.await_count == 2
+
+
+@pytest.mark.asyncio
+async def test_token_without_kid_is_only_accepted_with_a_single_key():
+    """
+    Is the key of a single key set used for a token without kid, and the token rejected with several keys?
+    """
+    _, jwk = make_signing_key()
+    _, other_jwk = make_signing_key()
+    other_jwk['kid'] = 'key-2'
+    single = PlatformRegistration(**CANVAS)
+    several = PlatformRegistration(**CANVAS)
+    responses = [
+        Mock(body=json.dumps({'keys': [jwk]}).encode()),
+        Mock(body=json.dumps({'keys': [jwk, other_jwk]}).encode()),
+    ]
+
+    with patch('tornado.httpclient.AsyncHTTPClient.fetch', new_callable=AsyncMock, side_effect=responses):
+        assert await single.get_jwk(None) is await single.get_jwk('key-1')
+        with pytest.raises(ValueError):
+            await several.get_jwk(None)
+
+
+@pytest.mark.asyncio
+async def test_jwt_verify_and_decode_with_registration_verifies_the_signature():
+    """
+    Is the id_token decoded with the registered platform's key and rejected when signed with another key?
+    """
+    canvas = PlatformRegistration(**CANVAS)
+    private_key, jwk = make_signing_key()
+    other_key, _ = make_signing_key()
+    claims = {'iss': CANVAS['issuer'], 'aud': CANVAS['client_id'], 'exp': int(time.time()) + 60, 'sub': 'user1'}
+    id_token = jwt.encode(claims, private_key, algorithm='RS256', headers={'kid': 'key-1'}).decode()
+    forged_token = jwt.encode(claims, other_key, algorithm='RS256', headers={'kid': 'key-1'}).decode()
+    validator = LTI13LaunchValidator()
+
+    with patch(
+        'tornado.httpclient.AsyncHTTPClient.fetch',
+        new_callable=AsyncMock,
+        return_value=Mock(body=json.dumps({'keys': [jwk]}).encode()),
+    ):
+        assert (await validator.jwt_verify_and_decode_with_registration(id_token, canvas))['sub'] == 'user1'
+        with pytest.raises(jwt.exceptions.InvalidSignatureError):
+            await validator.jwt_verify_and_decode_with_registration(forged_token, canvas)
+
+
+@pytest.mark.asyncio
+async def test_lti13_authenticator_rejects_the_launches_from_unregistered_platforms(platform_registry):
+    """
+    Does the LTI13Authenticator respond with a 401 to a launch from an unregistered platform when the
+    platforms are registered?
+    """
+    authenticator = LTI13Authenticator()
+    id_token = jwt.encode({'iss': 'https://other.lms.com', 'aud': 'client'}, 'secret').decode()
+    handler = Mock(get_argument=Mock(return_value=id_token))
+
+    with patch.object(PlatformRegistry, '_instance', platform_registry):
+        with pytest.raises(HTTPError) as excinfo:
+            await authenticator.authenticate(handler, None)
+
+    assert excinfo.value.status_code == 401
+
+
+@pytest.mark.asyncio
+async def test_lti13_authenticator_rejects_unregistered_platforms_with_a_client_id_setting(platform_registry):
+    """
+    Is a launch from an unregistered platform rejected when the platforms are registered, even with the
+    LTI13Authenticator's client_id and endpoint settings?
+    """
+    authenticator = LTI13Authenticator(client_id='client', endpoint='https://other.lms.com/jwks')
+    id_token = jwt.encode({'iss': 'https://other.lms.com', 'aud': 'client'}, 'secret').decode()
+    handler = Mock(get_argument=Mock(return_value=id_token))
+
+    with patch.object(PlatformRegistry, '_instance', platform_registry):
+        with patch.object(LTI13LaunchValidator, 'jwt_verify_and_decode') as mock_verify_and_decode:
+            with pytest.raises(HTTPError) as excinfo:
+                await authenticator.authenticate(handler, None)
+
+    assert excinfo.value.status_code == 401
+    assert not mock_verify_and_decode.called
+
+
+@pytest.mark.asyncio
+async def test_lti13_authenticator_rejects_a_course_launched_by_another_platform(platform_registry):
+    """
+    Does the LTI13Authenticator respond with a 403 to a launch of a course registered with another platform?
+    """
+    authenticator = LTI13Authenticator()
+    canvas = platform_registry.find(CANVAS['issuer'], CANVAS['client_id'])
+    platform_registry.register_course('intro101', canvas)
+    claims = {
+        'iss': MOODLE['issuer'],
+        'aud': MOODLE['client_id'],
+        'https://purl.imsglobal.org/spec/lti/claim/context': {'label': 'intro101'},
+    }
+    id_token = jwt.encode(claims, 'secret').decode()
+    handler = Mock(get_argument=Mock(return_value=id_token))
+
+    with patch.object(PlatformRegistry, '_instance', platform_registry):
+        with patch.object(
+            LTI13LaunchValidator, 'jwt_verify_and_decode_with_registration', new_callable=AsyncMock, return_value=claims
+        ):
+            with patch.object(LTI13LaunchValidator, 'validate_launch_request', return_value=True):
+                with pytest.raises(HTTPError) as excinfo:
+                    await authenticator.authenticate(handler, None)
+
+    assert excinfo.value.status_code == 403
+    assert platform_registry.for_course('intro101') is canvas
@@ -0,0 +1,126 @@
+import json
+import os
+import pytest
+
+from unittest.mock import AsyncMock
+from unittest.mock import Mock
+from unittest.mock import patch
+
+from illumidesk.apis.jupyterhub_api import JupyterHubAPI
+from illumidesk.apis.nbgrader_service import NbGraderServiceHelper
+from illumidesk.lti13 import roster
+from illumidesk.lti13.roster import NRPS_CLAIM
+from illumidesk.lti13.roster import NRPSRosterSync
+from illumidesk.lti13.roster import username_from_member
+from illumidesk.tasks.pipeline import BackgroundTaskPipeline
+
+
+MEMBERSHIPS_URL = 'https://lms.example.com/api/lti/courses/1/names_and_roles'
+
+
+def make_members_page(members: list, next_url: str = None) -> Mock:
+    headers = {'Link': f'<{next_url}>; rel="next"'} if next_url else {}
+    return Mock(body=json.dumps({'id': MEMBERSHIPS_URL, 'members': members}).encode(), headers=headers)
+
+
+def make_roster_sync(tmp_path) -> NRPSRosterSync:
+    roster_sync = NRPSRosterSync(interval=0, home_root=str(tmp_path))
+    roster_sync.private_key_path = '/secrets/keys/rsa_private.pem'
+    roster_sync.lms_token_url = 'https://lms.example.com/login/oauth2/token'
+    roster_sync.lms_client_id = '125900000000000001'
+    return roster_sync
+
+
+STUDENT = {
+    'user_id': 'lms-1',
+    'email': 'student1@example.com',
+    'roles': ['http://purl.imsglobal.org/vocab/lis/v2/membership#Learner'],
+}
+INSTRUCTOR = {
+    'user_id': 'lms-2',
+    'name': 'Ada Lovelace',
+    'roles': ['http://purl.imsglobal.org/vocab/lis/v2/membership#Instructor'],
+}
+
+
+def test_username_from_member_uses_the_authenticator_claims_precedence():
+    """
+    Is the username resolved from the email first and then from the name claims, like in the launches?
+    """
+    assert username_from_member({'email': 'Student1@example.com', 'name': 'Student One'}) == 'student1'
+    assert username_from_member({'given_name': 'Ada'}) == 'ada'
+    assert username_from_member({'user_id': 'lms-1'}) == ''
+
+
+@pytest.mark.asyncio
+async def test_fetch_members_follows_the_next_links():
+    """
+    Are all the pages of the membership service fetched with the NRPS scope and media type?
+    """
+    roster_sync = make_roster_sync('/tmp')
+    pages = [make_members_page([STUDENT], f'{MEMBERSHIPS_URL}?page=2'), make_members_page([INSTRUCTOR])]
+
+    token = {'token_type': 'Bearer', 'access_token': 'x'}
+
+    with patch.object(roster, 'get_lms_access_token', new_callable=AsyncMock, return_value=token) as mock_token, patch(
+        'tornado.httpclient.AsyncHTTPClient.fetch', new_callable=AsyncMock, side_effect=pages
+    ) as mock_fetch:
+        members = await roster_sync.fetch_members(MEMBERSHIPS_URL)
+
+    assert members == [STUDENT, INSTRUCTOR]
+    assert mock_token.call_args.kwargs['scope'] == roster.NRPS_SCOPE
+    assert mock_fetch.call_args_list[1].args[0] == f'{MEMBERSHIPS_URL}?page=2'
+    assert mock_fetch.call_args.kwargs['headers']['Accept'] == roster.MEMBERSHIP_CONTAINER_MEDIA_TYPE
+
+
+@pytest.mark.asyncio
+async def test_sync_course_provisions_the_roster_with_batched_operations(
+    tmp_path, monkeypatch, setup_course_hook_environ
+):
+    """
+    Are the active members created with one users request, one request by group, one gradebook session and
+    their home directories?
+    """
+    monkeypatch.setenv('NB_NON_GRADER_UID', str(os.getuid()))
+    monkeypatch.setenv('NB_GID', str(os.getgid()))
+    roster_sync = make_roster_sync(tmp_path)
+    roster_sync.courses['intro101'] = MEMBERSHIPS_URL
+    inactive = dict(STUDENT, user_id='lms-3', email='student3@example.com', status='Inactive')
+
+    with patch.object(
+        NRPSRosterSync, 'fetch_members', new_callable=AsyncMock, return_value=[STUDENT, INSTRUCTOR, inactive]
+    ), patch.object(JupyterHubAPI, 'create_users', new_callable=AsyncMock) as mock_create_users, patch.object(
+        JupyterHubAPI, 'create_group', new_callable=AsyncMock
+    ), patch.object(
+        JupyterHubAPI, 'add_group_members', new_callable=AsyncMock
+    ) as mock_add_group_members, patch.object(
+        NbGraderServiceHelper, '__init__', return_value=None
+    ), patch.object(
+        NbGraderServiceHelper, 'add_users_to_nbgrader_gradebook'
+    ) as mock_add_users:
+        summary = await roster_sync.sync_course('intro101')
+
+    assert summary == {'students': 1, 'instructors': 1, 'skipped': 1}
+    mock_create_users.assert_awaited_once_with('student1', 'adalovelace')
+    mock_add_group_members.assert_any_await('nbgrader-intro101', ['student1'])
+    mock_add_group_members.assert_any_await('formgrade-intro101', ['adalovelace'])
+    mock_add_users.assert_called_once_with({'student1': 'lms-1', 'adalovelace': 'lms-2'})
+    assert sorted(path.name for path in tmp_path.iterdir()) == ['adalovelace', 'student1']
+
+
+@pytest.mark.asyncio
+async def test_sync_on_launch_only_queues_the_instructor_launches_with_the_nrps_claim(tmp_path):
+    """
+    Is the roster sync queued for the instructors' launches with the NRPS claim only?
+    """
+    roster_sync = make_roster_sync(tmp_path)
+    claims = {NRPS_CLAIM: {'context_memberships_url': MEMBERSHIPS_URL}}
+
+    with patch.object(NRPSRosterSync, 'sync_course', new_callable=AsyncMock) as mock_sync_course:
+        assert not roster_sync.sync_on_launch('intro101', claims, 'Learner')
+        assert not roster_sync.sync_on_launch('intro101', {}, 'Instructor')
+        assert roster_sync.sync_on_launch('intro101', claims, 'Instructor')
+        await BackgroundTaskPipeline.instance().join()
+
+    mock_sync_course.assert_awaited_once_with('intro101')
+    assert roster_sync.courses == {'intro101': MEMBERSHIPS_URL}
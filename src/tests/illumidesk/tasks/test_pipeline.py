@@ -0,0 +1,118 @@
+import asyncio
+import pytest
+import threading
+
+from unittest.mock import AsyncMock
+from unittest.mock import Mock
+
+from illumidesk.tasks.pipeline import BackgroundTaskPipeline
+
+
+@pytest.mark.asyncio
+async def test_submit_runs_coroutine_functions_and_functions():
+    """
+    Are the coroutine functions awaited in the loop and the other functions run in the executor?
+    """
+    pipeline = BackgroundTaskPipeline(workers=2)
+    coroutine_function = AsyncMock(return_value=None)
+    threads = []
+
+    def function(value):
+        threads.append((threading.current_thread(), value))
+
+    assert pipeline.submit('coroutine', coroutine_function, 'intro101', setup=True)
+    assert pipeline.submit('function', function, 'intro101')
+    await pipeline.join()
+
+    coroutine_function.assert_awaited_once_with('intro101', setup=True)
+    assert threads[0][0] is not threading.main_thread()
+    assert threads[0][1] == 'intro101'
+    await pipeline.stop()
+
+
+@pytest.mark.asyncio
+async def test_submit_discards_the_tasks_with_a_pending_key():
+    """
+    Is a task discarded while a task with the same key is waiting or running, and accepted again after it's done?
+    """
+    pipeline = BackgroundTaskPipeline(workers=1)
+    release = asyncio.Event()
+    calls = []
+
+    async def setup_course(course_id):
+        calls.append(course_id)
+        await release.wait()
+
+    assert pipeline.submit('setup-course:intro101', setup_course, 'intro101')
+    await asyncio.sleep(0)
+    assert not pipeline.submit('setup-course:intro101', setup_course, 'intro101')
+    release.set()
+    await pipeline.join()
+    assert pipeline.submit('setup-course:intro101', setup_course, 'intro101')
+    await pipeline.join()
+
+    assert calls == ['intro101', 'intro101']
+    await pipeline.stop()
+
+
+@pytest.mark.asyncio
+async def test_failed_tasks_are_retried_until_the_max_attempts():
+    """
+    Is a failed task retried with backoff and dropped after the max attempts? Does join wait for the retries?
+    """
+    pipeline = BackgroundTaskPipeline(workers=1, max_attempts=3, retry_delay=0.01)
+    flaky = AsyncMock(side_effect=[ValueError('gradebook is locked'), None])
+    failing = Mock(side_effect=ValueError('grader setup service is down'))
+
+    pipeline.submit('flaky', flaky)
+    pipeline.submit('failing', failing)
+    await pipeline.join()
+
+    assert flaky.await_count == 2
+    assert failing.call_count == 3
+    # the dropped task doesn't block a new submit
+    assert pipeline.submit('failing', failing)
+    await pipeline.stop()
+
+
+@pytest.mark.asyncio
+async def test_submit_or_run_awaits_the_task_when_the_pipeline_is_disabled():
+    """
+    Is the task run before submit_or_run returns when the background tasks are disabled?
+    """
+    pipeline = BackgroundTaskPipeline(enabled=False)
+    coroutine_function = AsyncMock(return_value=None)
+
+    await pipeline.submit_or_run('setup-course:intro101', coroutine_function, 'intro101')
+
+    coroutine_function.assert_awaited_once_with('intro101')
+    assert pipeline._queue is None
+
+
+@pytest.mark.asyncio
+async def test_submit_last_waits_for_the_other_tasks():
+    """
+    Does a task submitted with submit_last start only after the tasks queued before and during its wait are done?
+    """
+    pipeline = BackgroundTaskPipeline(workers=4)
+    release = asyncio.Event()
+    calls = []
+
+    async def register(name):
+        await release.wait()
+        calls.append(name)
+
+    async def setup_course(course_id):
+        calls.append(f'setup:{course_id}')
+
+    pipeline.submit('control-file', register, 'control-file')
+    assert pipeline.submit_last('setup-course:intro101', setup_course, 'intro101')
+    pipeline.submit('gradebook', register, 'gradebook')
+    assert not pipeline.submit_last('setup-course:intro101', setup_course, 'intro101')
+    await asyncio.sleep(0.01)
+    assert calls == []
+    release.set()
+    await pipeline.join()
+
+    assert calls == ['control-file', 'gradebook', 'setup:intro101']
+    await pipeline.stop()
@@ -0,0 +1,93 @@
+import asyncio
+import os
+import pytest
+import time
+import traceback
+
+from prometheus_client import REGISTRY
+
+from unittest.mock import patch
+
+from illumidesk import diagnostics
+from illumidesk.diagnostics import LoopStallDetector
+from illumidesk.diagnostics import find_call_site
+from illumidesk.diagnostics import start_loop_stall_detector
+
+
+def blocking_callback():
+    time.sleep(0.3)
+
+
+def test_find_call_site_returns_the_innermost_illumidesk_frame():
+    """
+    Is the innermost illumidesk frame used as call site when the stack continues in other packages?
+    """
+    module = os.path.join(diagnostics.PACKAGE_DIR, 'apis', 'nbgrader_service.py')
+    stack = [
+        traceback.FrameSummary('/usr/lib/python3/asyncio/events.py', 80, '_run'),
+        traceback.FrameSummary(module, 97, 'add_user_to_nbgrader_gradebook'),
+        traceback.FrameSummary('/usr/lib/python3/site-packages/nbgrader/api.py', 1200, '__init__'),
+    ]
+
+    assert find_call_site(stack) == 'illumidesk/apis/nbgrader_service.py:97 add_user_to_nbgrader_gradebook'
+
+
+def test_find_call_site_returns_the_innermost_frame_without_illumidesk_frames():
+    """
+    Is the innermost frame used as call site when the stack doesn't pass through illumidesk?
+    """
+    stack = [
+        traceback.FrameSummary('/usr/lib/python3/asyncio/events.py', 80, '_run'),
+        traceback.FrameSummary('/usr/lib/python3/site-packages/filelock.py', 270, 'acquire'),
+    ]
+
+    assert find_call_site(stack) == '/usr/lib/python3/site-packages/filelock.py:270 acquire'
+    assert find_call_site([]) == 'unknown'
+
+
+@pytest.mark.asyncio
+async def test_loop_stall_detector_counts_the_blocking_callbacks_by_call_site():
+    """
+    Is a callback that blocks the loop longer than the threshold counted with its call site and in the metrics?
+    """
+    detector = LoopStallDetector(threshold=0.05, loop=asyncio.get_event_loop())
+    detector.start()
+    try:
+        # let the first heartbeat run
+        await asyncio.sleep(0.1)
+        blocking_callback()
+        await asyncio.sleep(0.2)
+    finally:
+        detector.stop()
+
+    (call_site,) = detector.stats()
+    assert call_site.endswith(' blocking_callback')
+    assert detector.stats()[call_site] == 1
+    assert REGISTRY.get_sample_value('illumidesk_event_loop_stalls_total', {'call_site': call_site}) >= 1
+
+
+@pytest.mark.asyncio
+async def test_loop_stall_detector_does_not_report_short_callbacks():
+    """
+    Are the callbacks shorter than the threshold left out of the stats?
+    """
+    detector = LoopStallDetector(threshold=0.2, loop=asyncio.get_event_loop())
+    detector.start()
+    try:
+        for _ in range(5):
+            time.sleep(0.01)
+            await asyncio.sleep(0.01)
+    finally:
+        detector.stop()
+
+    assert detector.stats() == {}
+
+
+def test_start_loop_stall_detector_is_disabled_without_the_threshold():
+    """
+    Is the detector only started when the ILLUMIDESK_LOOP_STALL_THRESHOLD env-var is set?
+    """
+    with patch.object(diagnostics, 'LOOP_STALL_THRESHOLD', None):
+        assert start_loop_stall_detector() is None
+    with patch.object(diagnostics, 'LOOP_STALL_THRESHOLD', 'not-a-number'):
+        assert start_loop_stall_detector() is None
@@ -0,0 +1,33 @@
+import os
+import subprocess
+import sys
+
+from benchmarks.importtime import ILLUMIDESK_MODULES
+from benchmarks.importtime import measure
+
+
+def test_hub_modules_do_not_import_the_heavy_dependencies():
+    """
+    Are nbgrader, lti, the crypto packages and sqlalchemy_utils left out of the imports done at hub startup?
+    """
+    timings, loaded = measure()
+
+    assert sorted(timings) == sorted(ILLUMIDESK_MODULES)
+    assert loaded == []
+
+
+def test_hub_modules_are_imported_without_the_organization_name():
+    """
+    Is the ORGANIZATION_NAME env-var only required by the launches and not when the modules are imported?
+    """
+    env = {key: value for key, value in os.environ.items() if key != 'ORGANIZATION_NAME'}
+
+    result = subprocess.run(
+        [sys.executable, '-c', f'import {", ".join(ILLUMIDESK_MODULES)}'],
+        cwd=os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+        env=env,
+        capture_output=True,
+        text=True,
+    )
+
+    assert result.returncode == 0, result.stderr
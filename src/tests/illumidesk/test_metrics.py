@@ -0,0 +1,133 @@
+import pytest
+
+from prometheus_client import REGISTRY
+
+from tornado.httpclient import HTTPClientError
+from tornado.web import RequestHandler
+
+from unittest.mock import AsyncMock
+from unittest.mock import patch
+
+from illumidesk.apis.jupyterhub_api import JupyterHubAPI
+from illumidesk.apis.nbgrader_service import NbGraderServiceHelper
+from illumidesk.authenticators.authenticator import setup_course_hook
+from illumidesk.grades.progress import GradesSendProgress
+from illumidesk.grades.ratelimit import LMSRateLimiter
+from illumidesk.metrics import record_cache_lookup
+from illumidesk.metrics import track_outbound_request
+from illumidesk.tasks.pipeline import BackgroundTaskPipeline
+
+
+def sample(name: str, **labels: str) -> float:
+    return REGISTRY.get_sample_value(name, labels) or 0.0
+
+
+def test_track_outbound_request_observes_the_request_duration():
+    """
+    Is the duration of a request observed in the histogram of its upstream?
+    """
+    before = sample('illumidesk_outbound_request_duration_seconds_count', upstream='test_upstream')
+
+    with track_outbound_request('test_upstream'):
+        pass
+
+    assert sample('illumidesk_outbound_request_duration_seconds_count', upstream='test_upstream') == before + 1
+
+
+def test_track_outbound_request_counts_the_http_errors_by_code():
+    """
+    Are the failed requests counted with the response's http code?
+    """
+    before = sample('illumidesk_outbound_request_errors_total', upstream='test_upstream', code='503')
+
+    with pytest.raises(HTTPClientError):
+        with track_outbound_request('test_upstream'):
+            raise HTTPClientError(503)
+
+    assert sample('illumidesk_outbound_request_errors_total', upstream='test_upstream', code='503') == before + 1
+
+
+def test_track_outbound_request_counts_the_connection_errors():
+    """
+    Are the requests that fail without a response counted as errors?
+    """
+    before = sample('illumidesk_outbound_request_errors_total', upstream='test_upstream', code='error')
+
+    with pytest.raises(ConnectionRefusedError):
+        with track_outbound_request('test_upstream'):
+            raise ConnectionRefusedError()
+
+    assert sample('illumidesk_outbound_request_errors_total', upstream='test_upstream', code='error') == before + 1
+
+
+def test_record_cache_lookup_counts_hits_and_misses():
+    """
+    Are the cache lookups counted by result?
+    """
+    hits = sample('illumidesk_cache_requests_total', cache='test_cache', result='hit')
+    misses = sample('illumidesk_cache_requests_total', cache='test_cache', result='miss')
+
+    record_cache_lookup('test_cache', True)
+    record_cache_lookup('test_cache', True)
+    record_cache_lookup('test_cache', False)
+
+    assert sample('illumidesk_cache_requests_total', cache='test_cache', result='hit') == hits + 2
+    assert sample('illumidesk_cache_requests_total', cache='test_cache', result='miss') == misses + 1
+
+
+def test_grades_progress_counts_the_scores_by_status():
+    """
+    Are the scores sent, failed and skipped (including the unchanged ones) counted?
+    """
+    sent = sample('illumidesk_grades_scores_total', status='sent')
+    failed = sample('illumidesk_grades_scores_total', status='failed')
+    skipped = sample('illumidesk_grades_scores_total', status='skipped')
+    progress = GradesSendProgress('assignment1')
+
+    progress.start(total=3, skipped=5)
+    progress.score_sent('user1')
+    progress.score_sent('user2')
+    progress.score_failed('user3', 'error')
+
+    assert sample('illumidesk_grades_scores_total', status='sent') == sent + 2
+    assert sample('illumidesk_grades_scores_total', status='failed') == failed + 1
+    assert sample('illumidesk_grades_scores_total', status='skipped') == skipped + 5
+
+
+@pytest.mark.asyncio
+async def test_rate_limiter_queue_depth_is_back_to_zero_after_the_requests():
+    """
+    Is the number of requests waiting for an LMS rate limiter slot back to zero after the requests?
+    """
+    limiter = LMSRateLimiter(max_concurrency=1, max_per_second=1000)
+    before = sample('illumidesk_executor_queue_depth', executor='lms_rate_limiter')
+
+    async with limiter:
+        pass
+
+    assert sample('illumidesk_executor_queue_depth', executor='lms_rate_limiter') == before
+
+
+@pytest.mark.asyncio
+async def test_setup_course_hook_observes_the_launch_phases(
+    setup_course_hook_environ, make_auth_state_dict, make_mock_request_handler
+):
+    """
+    Does the setup_course_hook observe the duration of the gradebook, group sync and setup course phases?
+    """
+    phases = ('gradebook', 'group_sync', 'setup_course')
+    before = {
+        phase: sample('illumidesk_launch_phase_duration_seconds_count', phase=phase) for phase in phases
+    }
+    handler = make_mock_request_handler(RequestHandler)
+
+    with patch.object(NbGraderServiceHelper, '__init__', return_value=None), patch.object(
+        NbGraderServiceHelper, 'add_user_to_nbgrader_gradebook', return_value=None
+    ), patch.object(JupyterHubAPI, 'add_student_to_jupyterhub_group', new_callable=AsyncMock), patch(
+        'illumidesk.authenticators.authenticator.register_new_service', new_callable=AsyncMock, return_value=False
+    ):
+        await setup_course_hook(None, handler, make_auth_state_dict())
+        await BackgroundTaskPipeline.instance().join()
+
+    for phase in phases:
+        assert sample('illumidesk_launch_phase_duration_seconds_count', phase=phase) == before[phase] + 1
@@ -0,0 +1,131 @@
+import pytest
+
+from tornado.web import RequestHandler
+
+from unittest.mock import AsyncMock
+from unittest.mock import Mock
+from unittest.mock import patch
+
+from illumidesk import tracing
+from illumidesk.apis.jupyterhub_api import JupyterHubAPI
+from illumidesk.apis.nbgrader_service import NbGraderServiceHelper
+from illumidesk.apis.setup_course_service import SERVICE_COMMON_HEADERS
+from illumidesk.apis.setup_course_service import register_new_service
+from illumidesk.authenticators.authenticator import setup_course_hook
+from illumidesk.tasks.pipeline import BackgroundTaskPipeline
+
+
+pytest.importorskip('opentelemetry.sdk')
+
+from opentelemetry.sdk.trace.export.in_memory_span_exporter import InMemorySpanExporter  # noqa: E402
+
+
+@pytest.fixture
+def spans():
+    """
+    Enables tracing with an in-memory exporter and returns it
+    """
+    exporter = InMemorySpanExporter()
+    tracing.configure_tracing(span_exporter=exporter)
+    yield exporter
+    tracing.reset_tracing()
+
+
+def test_start_span_yields_none_when_tracing_is_disabled():
+    """
+    Does start_span run the block without a span when tracing is not enabled?
+    """
+    with patch.object(tracing, 'TRACING_EXPORTER', ''):
+        with tracing.start_span('test') as span:
+            assert span is None
+
+
+def test_inject_trace_headers_does_not_change_the_headers_when_tracing_is_disabled():
+    """
+    Are the headers left unchanged when tracing is not enabled?
+    """
+    with patch.object(tracing, 'TRACING_EXPORTER', ''):
+        assert tracing.inject_trace_headers({'Content-Type': 'application/json'}) == {
+            'Content-Type': 'application/json'
+        }
+
+
+def test_start_span_records_the_exceptions(spans):
+    """
+    Is the exception raised within a span recorded with an error status?
+    """
+    with pytest.raises(ValueError):
+        with tracing.start_span('test', course_id='intro101'):
+            raise ValueError('error')
+
+    (span,) = spans.get_finished_spans()
+    assert span.name == 'test'
+    assert span.attributes['course_id'] == 'intro101'
+    assert not span.status.is_ok
+    assert span.events[0].name == 'exception'
+
+
+def test_inject_trace_headers_adds_the_traceparent_of_the_current_span(spans):
+    """
+    Is the traceparent header sent with the trace and span ids of the current span?
+    """
+    with tracing.start_span('parent') as span:
+        headers = tracing.inject_trace_headers({})
+
+    context = span.get_span_context()
+    assert headers['traceparent'].startswith(f'00-{context.trace_id:032x}-{context.span_id:016x}-')
+
+
+@pytest.mark.asyncio
+async def test_register_new_service_propagates_the_trace_to_the_grader_setup_service(spans):
+    """
+    Does the request sent to the grader setup service carry the context of the register_new_service span?
+    """
+    with patch('tornado.httpclient.AsyncHTTPClient.fetch', new_callable=AsyncMock) as mock_fetch:
+        await register_new_service(org_name='test-org', course_id='intro101')
+
+    (span,) = spans.get_finished_spans()
+    assert span.name == 'register_new_service'
+    headers = mock_fetch.call_args.kwargs['headers']
+    assert headers['traceparent'].split('-')[2] == f'{span.get_span_context().span_id:016x}'
+    assert 'traceparent' not in SERVICE_COMMON_HEADERS
+
+
+@pytest.mark.asyncio
+async def test_setup_course_hook_spans_are_children_of_the_hook_span(
+    spans, setup_course_hook_environ, make_auth_state_dict, make_mock_request_handler
+):
+    """
+    Are the JupyterHub API and grader setup service calls made by the setup_course_hook traced within its span?
+    """
+    handler = make_mock_request_handler(RequestHandler)
+
+    with patch.object(NbGraderServiceHelper, '__init__', return_value=None), patch.object(
+        NbGraderServiceHelper, 'add_user_to_nbgrader_gradebook', return_value=None
+    ), patch(
+        'tornado.httpclient.AsyncHTTPClient.fetch', new_callable=AsyncMock, return_value=Mock(body=b'{"users": []}')
+    ):
+        await setup_course_hook(None, handler, make_auth_state_dict())
+        await BackgroundTaskPipeline.instance().join()
+
+    finished = {span.name: span for span in spans.get_finished_spans()}
+    hook_span = finished['setup_course_hook']
+    children = [span for span in finished.values() if span.parent is not None]
+    assert 'register_new_service' in finished
+    assert any(name.startswith('JupyterHubAPI POST') for name in finished)
+    assert all(span.context.trace_id == hook_span.context.trace_id for span in children)
+
+
+@pytest.mark.asyncio
+async def test_jupyterhub_api_request_sends_the_traceparent_header(spans, setup_course_hook_environ):
+    """
+    Do the JupyterHub API requests carry the trace context and keep the default headers?
+    """
+    with patch('tornado.httpclient.AsyncHTTPClient.fetch', new_callable=AsyncMock) as mock_fetch:
+        await JupyterHubAPI()._request('groups/test', method='POST', body='')
+
+    (span,) = spans.get_finished_spans()
+    assert span.name == 'JupyterHubAPI POST groups/test'
+    headers = mock_fetch.call_args.kwargs['headers']
+    assert 'traceparent' in headers
+    assert headers['Content-Type'] == 'application/json'
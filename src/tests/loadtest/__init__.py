@@ -0,0 +1,9 @@
+"""
+Launch load-test harness.
+
+Drives concurrent simulated students through the LTI authenticators and the setup_course_hook against
+a local LMS simulator and stubs of the JupyterHub API, grader-setup-service, announcement service and
+AGS endpoints. Run it from the ``src`` directory:
+
+    python -m tests.loadtest --students 500 --lti 1.3 --courses 4
+"""
@@ -0,0 +1,42 @@
+import argparse
+import asyncio
+import json
+import logging
+
+from tests.loadtest.harness import LTI11
+from tests.loadtest.harness import LTI13
+from tests.loadtest.harness import LaunchLoadTest
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Launch load test for the illumidesk authenticators')
+    parser.add_argument('--students', type=int, default=100, help='number of simulated launches')
+    parser.add_argument('--lti', choices=[LTI11, LTI13], default=LTI13, help='LTI version of the launches')
+    parser.add_argument('--courses', type=int, default=1, help='number of courses')
+    parser.add_argument('--concurrency', type=int, default=None, help='maximum launches in flight')
+    parser.add_argument('--instructors-ratio', type=float, default=0.05, help='fraction of instructor launches')
+    parser.add_argument('--stub-latency', type=float, default=0.005, help='seconds added to the stub responses')
+    parser.add_argument('--gradebook-latency', type=float, default=0.002, help='seconds per gradebook operation')
+    parser.add_argument('--max-clients', type=int, default=None, help="max_clients of the hub's AsyncHTTPClient")
+    parser.add_argument('--json', action='store_true', help='print the report as json')
+    args = parser.parse_args()
+
+    # the launch logs are too verbose for a load test and the expected 409 responses are logged as errors,
+    # the failed launches are included in the report
+    logging.disable(logging.ERROR)
+    load_test = LaunchLoadTest(
+        students=args.students,
+        lti_version=args.lti,
+        courses=args.courses,
+        concurrency=args.concurrency,
+        instructors_ratio=args.instructors_ratio,
+        stub_latency=args.stub_latency,
+        gradebook_latency=args.gradebook_latency,
+        max_clients=args.max_clients,
+    )
+    report = asyncio.get_event_loop().run_until_complete(load_test.run())
+    print(json.dumps(report.as_dict(), indent=2) if args.json else report.format())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+import threading
+import time
+
+from collections import Counter
+
+from contextlib import contextmanager
+
+from unittest.mock import patch
+
+from typing import Dict
+from typing import Iterator
+from typing import Set
+
+
+# upstream name used in the call counters
+GRADEBOOK = 'gradebook'
+
+
+class GradebookSimulator:
+    """
+    In-memory replacement of the nbgrader gradebook (postgres) used by the NbGraderServiceHelper. Every
+    operation blocks the calling thread for ``latency`` seconds, like the synchronous sqlalchemy sessions
+    opened by the helper do in the hub.
+
+    Args:
+        latency: seconds spent in every gradebook operation
+    """
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.calls = Counter()
+        self.databases: Set[str] = set()
+        self.students: Dict[str, Dict[str, str]] = {}
+        self.assignments: Dict[str, Set[str]] = {}
+        self.courses: Dict[str, dict] = {}
+        self._lock = threading.Lock()
+
+    def _operation(self) -> None:
+        with self._lock:
+            self.calls[GRADEBOOK] += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    @contextmanager
+    def patch(self) -> Iterator['GradebookSimulator']:
+        """Replaces the gradebook operations of the NbGraderServiceHelper with the simulator"""
+        simulator = self
+
+        def create_database_if_not_exists(helper) -> None:
+            simulator._operation()
+            simulator.databases.add(helper.database_name)
+
+        def add_user_to_nbgrader_gradebook(helper, username: str, lms_user_id: str) -> None:
+            simulator._operation()
+            simulator.students.setdefault(helper.course_id, {})[username] = lms_user_id
+
+        def update_course(helper, **kwargs) -> None:
+            simulator._operation()
+            simulator.courses.setdefault(helper.course_id, {}).update(kwargs)
+
+        def register_assignment(helper, assignment_name: str, **kwargs) -> None:
+            simulator._operation()
+            simulator.assignments.setdefault(helper.course_id, set()).add(assignment_name)
+
+        with patch.multiple(
+            'illumidesk.apis.nbgrader_service.NbGraderServiceHelper',
+            create_database_if_not_exists=create_database_if_not_exists,
+            add_user_to_nbgrader_gradebook=add_user_to_nbgrader_gradebook,
+            update_course=update_course,
+            register_assignment=register_assignment,
+        ):
+            # the LTI 1.1 flow registers the assignments with create_assignment_in_nbgrader
+            with patch(
+                'illumidesk.apis.nbgrader_service.NbGraderServiceHelper.create_assignment_in_nbgrader',
+                register_assignment,
+                create=True,
+            ):
+                yield self
@@ -0,0 +1,291 @@
+import asyncio
+import json
+import math
+import os
+import tempfile
+import time
+import uuid
+
+from contextlib import ExitStack
+
+from tornado.httpclient import AsyncHTTPClient
+from tornado.httputil import HTTPHeaders
+from tornado.httputil import HTTPServerRequest
+from tornado.httputil import url_concat
+from tornado.web import Application
+from tornado.web import RequestHandler
+
+from typing import Any
+from typing import Dict
+from typing import List
+
+from unittest.mock import Mock
+from unittest.mock import patch
+
+from simulators.lms import SimulatedStudent
+
+from tests.loadtest.gradebook import GradebookSimulator
+from tests.loadtest.stubs import LMS_OIDC
+from tests.loadtest.stubs import StubServices
+
+
+LTI11 = '1.1'
+LTI13 = '1.3'
+
+HUB_HOST = 'hub.loadtest'
+LTI11_LAUNCH_PATH = '/hub/lti/launch'
+LTI13_CALLBACK_PATH = '/hub/oauth_callback'
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """Returns the nearest-rank percentile of the values"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, int(math.ceil(pct / 100.0 * len(ordered))))
+    return ordered[rank - 1]
+
+
+class LoadTestReport:
+    """
+    Results of a load test run
+
+    Args:
+        lti_version: the LTI version used by the launches
+        latencies: hub-side latency of the successful launches in seconds
+        errors: error messages of the failed launches
+        calls: number of calls received by each stub upstream (including the simulated gradebook)
+        duration: wall time of the run in seconds
+    """
+
+    def __init__(
+        self, lti_version: str, latencies: List[float], errors: List[str], calls: Dict[str, int], duration: float
+    ):
+        self.lti_version = lti_version
+        self.latencies = latencies
+        self.errors = errors
+        self.calls = calls
+        self.duration = duration
+
+    @property
+    def launches(self) -> int:
+        return len(self.latencies) + len(self.errors)
+
+    @property
+    def outbound_calls(self) -> int:
+        """Calls sent by the hub, the OIDC authorization requests are sent by the browser to the LMS"""
+        return sum(count for upstream, count in self.calls.items() if upstream != LMS_OIDC)
+
+    def as_dict(self) -> Dict[str, Any]:
+        launches = self.launches or 1
+        return {
+            'lti_version': self.lti_version,
+            'launches': self.launches,
+            'errors': len(self.errors),
+            'duration': round(self.duration, 3),
+            'launches_per_second': round(self.launches / self.duration, 2) if self.duration else 0.0,
+            'latency': {
+                'p50': round(percentile(self.latencies, 50), 4),
+                'p95': round(percentile(self.latencies, 95), 4),
+                'p99': round(percentile(self.latencies, 99), 4),
+                'max': round(max(self.latencies), 4) if self.latencies else 0.0,
+            },
+            'outbound_calls_per_launch': round(self.outbound_calls / launches, 2),
+            'calls_per_launch': {upstream: round(count / launches, 2) for upstream, count in sorted(self.calls.items())},
+        }
+
+    def format(self) -> str:
+        data = self.as_dict()
+        lines = [
+            f"LTI {data['lti_version']}: {data['launches']} launches, {data['errors']} errors "
+            f"in {data['duration']}s ({data['launches_per_second']} launches/s)",
+            'latency p50={p50}s p95={p95}s p99={p99}s max={max}s'.format(**data['latency']),
+            f"outbound calls per launch: {data['outbound_calls_per_launch']}",
+        ]
+        for upstream, count in data['calls_per_launch'].items():
+            lines.append(f'  {upstream}: {count}')
+        for error in self.errors[:10]:
+            lines.append(f'  error: {error}')
+        return '\n'.join(lines)
+
+
+class LaunchLoadTest:
+    """
+    Drives concurrent simulated students through the LTI authenticators and the setup_course_hook
+    (the work done by the hub for every launch) against local stubs of the upstream services.
+
+    Args:
+        students: number of simulated launches
+        lti_version: LTI version of the launches (1.1 or 1.3)
+        courses: number of courses the students are distributed into
+        concurrency: maximum number of launches in flight, all the launches start at once by default
+        instructors_ratio: fraction of the users that launch as instructors
+        stub_latency: seconds added to every stub response
+        gradebook_latency: seconds spent in every gradebook operation
+        assignment_name: the resource link title sent with the launches
+        max_clients: max_clients of the hub's shared AsyncHTTPClient, like c.AsyncHTTPClient settings in
+            jupyterhub_config.py. The tornado default (10) is used if it's not set.
+    """
+
+    def __init__(
+        self,
+        students: int = 50,
+        lti_version: str = LTI13,
+        courses: int = 1,
+        concurrency: int = None,
+        instructors_ratio: float = 0.05,
+        stub_latency: float = 0.005,
+        gradebook_latency: float = 0.002,
+        assignment_name: str = 'assignment1',
+        max_clients: int = None,
+    ):
+        if lti_version not in (LTI11, LTI13):
+            raise ValueError(f'Unknown LTI version: {lti_version}')
+        self.students = students
+        self.lti_version = lti_version
+        self.courses = max(1, courses)
+        self.concurrency = concurrency or students
+        self.instructors_ratio = instructors_ratio
+        self.stubs = StubServices(latency=stub_latency)
+        self.gradebook = GradebookSimulator(latency=gradebook_latency)
+        self.assignment_name = assignment_name
+        self.max_clients = max_clients
+        self._browser = None
+
+    def _make_students(self) -> List[SimulatedStudent]:
+        instructors_every = int(1 / self.instructors_ratio) if self.instructors_ratio else 0
+        students = []
+        for index in range(self.students):
+            role = 'Instructor' if instructors_every and index % instructors_every == 0 else 'Learner'
+            students.append(SimulatedStudent(index, f'loadtest{index % self.courses}', role))
+        return students
+
+    def _make_handler(self, uri: str, arguments: Dict[str, str]) -> RequestHandler:
+        """Builds the request handler received by the authenticator, as created by the hub for the launch"""
+        application = Application(
+            hub=Mock(base_url='/hub/', server=Mock(base_url='/hub/')),
+            cookie_secret=os.urandom(32),
+            db=Mock(rollback=Mock(return_value=None)),
+        )
+        request = HTTPServerRequest(
+            method='POST',
+            uri=uri,
+            host=HUB_HOST,
+            headers=HTTPHeaders({'Host': HUB_HOST, 'X-Forwarded-Proto': 'https'}),
+            connection=Mock(),
+        )
+        request.body_arguments = {key: [value.encode()] for key, value in arguments.items()}
+        request.arguments = dict(request.body_arguments)
+        handler = RequestHandler(application=application, request=request)
+        handler._transforms = []
+        return handler
+
+    async def _lti13_id_token(self, student: SimulatedStudent) -> str:
+        """Runs the OIDC authorization request against the simulated platform and returns the id_token"""
+        url = url_concat(
+            f'{self.stubs.lms.base_url}/authorize',
+            {
+                'login_hint': f'{student.index}:{student.course_id}:{student.role}:{self.assignment_name}',
+                'nonce': uuid.uuid4().hex,
+                'state': uuid.uuid4().hex,
+                'client_id': self.stubs.lms.client_id,
+                'response_type': 'id_token',
+                'scope': 'openid',
+            },
+        )
+        # the browser's requests to the platform don't share the hub's client (and its request queue)
+        if self._browser is None:
+            self._browser = AsyncHTTPClient(force_instance=True, max_clients=self.concurrency)
+        response = await self._browser.fetch(url)
+        return json.loads(response.body)['id_token']
+
+    async def _launch_arguments(self, student: SimulatedStudent) -> Dict[str, str]:
+        """Returns the arguments the browser posts to the hub for the student's launch"""
+        if self.lti_version == LTI11:
+            launch_url = f'https://{HUB_HOST}{LTI11_LAUNCH_PATH}'
+            return self.stubs.lms.lti11_launch_args(student, launch_url, self.assignment_name)
+        return {'id_token': await self._lti13_id_token(student)}
+
+    async def _launch(self, authenticator: Any, arguments: Dict[str, str]) -> float:
+        from illumidesk.authenticators.authenticator import setup_course_hook
+
+        path = LTI11_LAUNCH_PATH if self.lti_version == LTI11 else LTI13_CALLBACK_PATH
+        handler = self._make_handler(path, arguments)
+        started = time.perf_counter()
+        authentication = await authenticator.authenticate(handler, None)
+        await setup_course_hook(authenticator, handler, authentication)
+        return time.perf_counter() - started
+
+    def _create_authenticator(self) -> Any:
+        from illumidesk.authenticators.authenticator import LTI11Authenticator
+        from illumidesk.authenticators.authenticator import LTI13Authenticator
+
+        if self.lti_version == LTI11:
+            return LTI11Authenticator(consumers=self.stubs.lms.consumers)
+        return LTI13Authenticator(client_id=self.stubs.lms.client_id, endpoint=f'{self.stubs.lms.base_url}/jwks')
+
+    def _patch_environment(self, stack: ExitStack, workdir: str) -> None:
+        """Points the hub's upstream urls to the stubs and keeps the files written by the launches in workdir"""
+        base_url = self.stubs.base_url
+        stack.enter_context(
+            patch.dict(
+                os.environ,
+                {
+                    'ORGANIZATION_NAME': os.environ.get('ORGANIZATION_NAME') or 'loadtest',
+                    'JUPYTERHUB_API_TOKEN': uuid.uuid4().hex,
+                    'JUPYTERHUB_API_URL': f'{base_url}/hub/api',
+                },
+            )
+        )
+        from illumidesk.grades.sender_controlfile import LTIGradesSenderControlFile
+
+        def control_file(course_dir: str) -> LTIGradesSenderControlFile:
+            return LTIGradesSenderControlFile(os.path.join(workdir, course_dir.lstrip('/')))
+
+        stack.enter_context(patch('illumidesk.apis.setup_course_service.SERVICE_BASE_URL', base_url))
+        stack.enter_context(
+            patch('illumidesk.apis.announcement_service.ANNOUNCEMENT_INTERNAL_URL', f'{base_url}/services/announcement')
+        )
+        stack.enter_context(patch('illumidesk.authenticators.authenticator.LTIGradesSenderControlFile', control_file))
+        stack.enter_context(
+            patch.object(LTIGradesSenderControlFile, 'lock_file', os.path.join(workdir, 'grades-sender.lock'))
+        )
+        stack.enter_context(self.gradebook.patch())
+
+    async def run(self) -> LoadTestReport:
+        """Runs the launches and returns the report"""
+        from illumidesk.tasks.pipeline import BackgroundTaskPipeline
+
+        if self.max_clients:
+            AsyncHTTPClient.configure(None, max_clients=self.max_clients)
+        self.stubs.start()
+        latencies, errors = [], []
+        try:
+            with tempfile.TemporaryDirectory() as workdir, ExitStack() as stack:
+                self._patch_environment(stack, workdir)
+                authenticator = self._create_authenticator()
+                # the launch requests are prepared before the run (for LTI 1.3 the OIDC login with the
+                # platform) so the work done by the simulated LMS doesn't compete with the hub's
+                launches = await asyncio.gather(*[self._launch_arguments(s) for s in self._make_students()])
+                semaphore = asyncio.Semaphore(self.concurrency)
+
+                async def launch(arguments: Dict[str, str]) -> None:
+                    async with semaphore:
+                        try:
+                            latencies.append(await self._launch(authenticator, arguments))
+                        except Exception as e:
+                            errors.append(f'{type(e).__name__}: {e}')
+
+                started = time.perf_counter()
+                await asyncio.gather(*[launch(arguments) for arguments in launches])
+                duration = time.perf_counter() - started
+                # the work deferred by the launches runs against the stubs too
+                await BackgroundTaskPipeline.instance().join()
+        finally:
+            self.stubs.stop()
+            if self._browser is not None:
+                self._browser.close()
+                self._browser = None
+        calls = dict(self.stubs.state.calls)
+        calls.update(self.gradebook.calls)
+        return LoadTestReport(self.lti_version, latencies, errors, calls, duration)
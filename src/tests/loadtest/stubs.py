@@ -0,0 +1,244 @@
+import asyncio
+import json
+import uuid
+
+from collections import Counter
+
+from tornado.httpserver import HTTPServer
+from tornado.testing import bind_unused_port
+from tornado.web import Application
+from tornado.web import RequestHandler
+
+from typing import Dict
+from typing import Set
+
+from simulators.lms import LMSSimulator
+from simulators.lms import SimulatedStudent
+
+
+# upstream names used in the call counters
+JUPYTERHUB_API = 'jupyterhub-api'
+GRADER_SETUP_SERVICE = 'grader-setup-service'
+ANNOUNCEMENT = 'announcement'
+LMS_JWKS = 'lms-jwks'
+LMS_OIDC = 'lms-oidc'
+LMS_TOKEN = 'lms-token'
+LMS_AGS = 'lms-ags'
+
+
+class StubState:
+    """
+    State shared by the stub handlers: the call counters by upstream, the simulated latency and the
+    objects created by the hub (jupyterhub users and groups, grader services).
+
+    Args:
+        latency: seconds added to every stub response to simulate the network and the upstream work
+    """
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.calls = Counter()
+        self.users: Set[str] = set()
+        self.groups: Dict[str, Set[str]] = {}
+        self.grader_services: Set[str] = set()
+        self.assignment_dirs: Set[str] = set()
+        self.announcements = []
+        self.scores = []
+
+
+class StubHandler(RequestHandler):
+    upstream = None
+
+    def initialize(self, state: StubState, lms: LMSSimulator = None) -> None:
+        self.state = state
+        self.lms = lms
+
+    async def prepare(self) -> None:
+        self.state.calls[self.upstream] += 1
+        if self.state.latency:
+            await asyncio.sleep(self.state.latency)
+
+    def write_json(self, data: dict, status: int = 200) -> None:
+        self.set_status(status)
+        self.set_header('Content-Type', 'application/json')
+        self.finish(json.dumps(data))
+
+    def check_xsrf_cookie(self) -> None:
+        pass
+
+
+class JupyterHubUsersHandler(StubHandler):
+    upstream = JUPYTERHUB_API
+
+    def post(self, username: str = None) -> None:
+        if username is None:
+            # bulk users creation
+            usernames = json.loads(self.request.body or '{}').get('usernames', [])
+            created = [name for name in usernames if name not in self.state.users]
+            self.state.users.update(created)
+            return self.write_json([{'name': name} for name in created], 201)
+        if username in self.state.users:
+            return self.write_json({'status': 409, 'message': f'User {username} already exists'}, 409)
+        self.state.users.add(username)
+        self.write_json({'name': username}, 201)
+
+
+class JupyterHubGroupHandler(StubHandler):
+    upstream = JUPYTERHUB_API
+
+    def get(self, group_name: str) -> None:
+        if group_name not in self.state.groups:
+            return self.write_json({'status': 404, 'message': 'No such group'}, 404)
+        self.write_json({'name': group_name, 'users': sorted(self.state.groups[group_name])})
+
+    def post(self, group_name: str) -> None:
+        if group_name in self.state.groups:
+            return self.write_json({'status': 409, 'message': f'Group {group_name} already exists'}, 409)
+        self.state.groups[group_name] = set()
+        self.write_json({'name': group_name, 'users': []}, 201)
+
+
+class JupyterHubGroupUsersHandler(StubHandler):
+    upstream = JUPYTERHUB_API
+
+    def post(self, group_name: str) -> None:
+        users = json.loads(self.request.body or '{}').get('users', [])
+        self.state.groups.setdefault(group_name, set()).update(users)
+        self.write_json({'name': group_name, 'users': sorted(self.state.groups[group_name])})
+
+
+class GraderServicesHandler(StubHandler):
+    """Mimics the grader-setup-service: 200 when a new grader service is launched, 409 if it exists"""
+
+    upstream = GRADER_SETUP_SERVICE
+
+    def post(self, org_name: str, course_id: str) -> None:
+        if course_id in self.state.grader_services:
+            return self.write_json(
+                {'success': False, 'message': f'A grader service already exists for this course_id:{course_id}'}, 409
+            )
+        self.state.grader_services.add(course_id)
+        self.write_json({'success': True})
+
+
+class AssignmentDirHandler(StubHandler):
+    upstream = GRADER_SETUP_SERVICE
+
+    def post(self, org_name: str, course_id: str, assignment_name: str) -> None:
+        self.state.assignment_dirs.add(f'{course_id}/{assignment_name}')
+        self.write_json({'success': True})
+
+
+class AssignmentDirsHandler(StubHandler):
+    upstream = GRADER_SETUP_SERVICE
+
+    def post(self, org_name: str, course_id: str) -> None:
+        assignment_names = json.loads(self.request.body or '{}').get('assignments') or []
+        self.state.assignment_dirs.update(f'{course_id}/{assignment_name}' for assignment_name in assignment_names)
+        self.write_json({'success': True, 'created': assignment_names})
+
+
+class AnnouncementHandler(StubHandler):
+    upstream = ANNOUNCEMENT
+
+    def post(self) -> None:
+        self.state.announcements.append(json.loads(self.request.body or '{}').get('announcement'))
+        self.write_json({'success': True})
+
+
+class JWKSHandler(StubHandler):
+    upstream = LMS_JWKS
+
+    def get(self) -> None:
+        self.write_json(self.lms.jwks)
+
+
+class OIDCAuthorizeHandler(StubHandler):
+    """
+    The platform's OIDC authorization endpoint. Instead of the auto-submitted form sent by a real
+    platform it returns the id_token and the state as json.
+    """
+
+    upstream = LMS_OIDC
+
+    def get(self) -> None:
+        # the simulated users are encoded in the login_hint as <index>:<course_id>:<role>:<assignment>
+        index, course_id, role, assignment_name = self.get_argument('login_hint').split(':', 3)
+        student = SimulatedStudent(int(index), course_id, role)
+        id_token = self.lms.lti13_id_token(student, assignment_name, self.get_argument('nonce'))
+        self.write_json({'id_token': id_token, 'state': self.get_argument('state')})
+
+
+class TokenHandler(StubHandler):
+    upstream = LMS_TOKEN
+
+    def post(self) -> None:
+        self.write_json({'access_token': uuid.uuid4().hex, 'token_type': 'Bearer', 'expires_in': 3600})
+
+
+class LineItemsHandler(StubHandler):
+    upstream = LMS_AGS
+
+    def get(self, course_id: str) -> None:
+        self.write_json([])
+
+
+class ScoresHandler(StubHandler):
+    upstream = LMS_AGS
+
+    def post(self, course_id: str, lineitem_id: str) -> None:
+        self.state.scores.append(json.loads(self.request.body or '{}'))
+        self.write_json({})
+
+
+class StubServices:
+    """
+    Serves the stubs of the services called by the hub during a launch in a local port:
+
+    - JupyterHub REST API at ``/hub/api``
+    - grader-setup-service at ``/services`` and ``/courses``
+    - announcement service at ``/services/announcement``
+    - LMS endpoints at ``/lms``: jwks, OIDC authorization, token and AGS line items/scores
+
+    Args:
+        latency: seconds added to every stub response
+    """
+
+    def __init__(self, latency: float = 0.0):
+        self.state = StubState(latency=latency)
+        self.server = None
+        self.port = None
+        self.lms = None
+
+    @property
+    def base_url(self) -> str:
+        return f'http://127.0.0.1:{self.port}'
+
+    def start(self) -> None:
+        sock, self.port = bind_unused_port()
+        self.lms = LMSSimulator(f'{self.base_url}/lms')
+        args = {'state': self.state, 'lms': self.lms}
+        app = Application(
+            [
+                (r'/hub/api/users', JupyterHubUsersHandler, args),
+                (r'/hub/api/users/([^/]+)', JupyterHubUsersHandler, args),
+                (r'/hub/api/groups/([^/]+)/users', JupyterHubGroupUsersHandler, args),
+                (r'/hub/api/groups/([^/]+)', JupyterHubGroupHandler, args),
+                (r'/services/announcement/?', AnnouncementHandler, args),
+                (r'/services/([^/]+)/([^/]+)', GraderServicesHandler, args),
+                (r'/courses/([^/]+)/([^/]+)/([^/]+)', AssignmentDirHandler, args),
+                (r'/courses/([^/]+)/([^/]+)', AssignmentDirsHandler, args),
+                (r'/lms/jwks', JWKSHandler, args),
+                (r'/lms/authorize', OIDCAuthorizeHandler, args),
+                (r'/lms/token', TokenHandler, args),
+                (r'/lms/api/lti/courses/([^/]+)/line_items', LineItemsHandler, args),
+                (r'/lms/api/lti/courses/([^/]+)/line_items/([^/]+)/scores', ScoresHandler, args),
+            ]
+        )
+        self.server = HTTPServer(app)
+        self.server.add_sockets([sock])
+
+    def stop(self) -> None:
+        if self.server is not None:
+            self.server.stop()
+            self.server = None
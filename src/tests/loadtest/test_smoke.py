@@ -0,0 +1,37 @@
+import pytest
+
+from tests.loadtest.harness import LTI11
+from tests.loadtest.harness import LTI13
+from tests.loadtest.harness import LaunchLoadTest
+from tests.loadtest.harness import percentile
+from tests.loadtest.stubs import GRADER_SETUP_SERVICE
+
+
+def test_percentile_uses_the_nearest_rank():
+    """
+    Does the percentile helper return the nearest-rank value?
+    """
+    values = [float(value) for value in range(1, 101)]
+    assert percentile(values, 50) == 50.0
+    assert percentile(values, 99) == 99.0
+    assert percentile([], 50) == 0.0
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('lti_version', [LTI11, LTI13])
+async def test_load_test_runs_the_launches_against_the_stubs(lti_version):
+    """
+    Do the simulated launches go through the authenticator and the setup course hook without errors?
+    """
+    load_test = LaunchLoadTest(students=8, lti_version=lti_version, courses=2, stub_latency=0, gradebook_latency=0)
+    report = await load_test.run()
+    assert report.errors == []
+    assert report.launches == 8
+    data = report.as_dict()
+    assert data['latency']['p50'] <= data['latency']['p95'] <= data['latency']['p99']
+    assert data['outbound_calls_per_launch'] > 0
+    # one grader service is created by course
+    assert load_test.stubs.state.grader_services == {'loadtest0', 'loadtest1'}
+    # the course setup is deduplicated by the background task pipeline while it's queued
+    assert len(load_test.stubs.state.grader_services) <= report.calls[GRADER_SETUP_SERVICE] < report.launches
+    assert sum(len(users) for users in load_test.stubs.state.groups.values()) == 8